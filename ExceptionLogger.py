@@ -92,7 +92,13 @@ def getLogDestDir():
 
 
 
-def startLogger(versionstring):
+def startLogger(versionstring, replaceStdStreams=True):
+    """
+    replaceStdStreams -- if True, sys.stdout and sys.stderr are replaced
+            by objects which also write the output to the log file.
+            Batch mode keeps them as they are because standard output
+            carries the result there.
+    """
     global EL
     import ExceptionLogger as EL2
     
@@ -108,10 +114,11 @@ def startLogger(versionstring):
     
     
     EL._previousStdErr = sys.stderr
-    sys.stderr = StdErrReplacement()
-
     EL._previousStdOut = sys.stdout
-    sys.stdout = StdErrReplacement()
+
+    if replaceStdStreams:
+        sys.stderr = StdErrReplacement()
+        sys.stdout = StdErrReplacement()
 
     EL._previousExcepthook = sys.excepthook
     sys.excepthook = onException
@@ -0,0 +1,30 @@
+#!/bin/python
+"""
+Run maintenance operations (rebuild, export, search, ...) on a wiki without
+GUI, e.g. from scripts or scheduled jobs. Call with --help for usage.
+"""
+
+import sys, os, os.path
+os.stat_float_times(True)
+
+if not hasattr(sys, 'frozen'):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(
+            sys.argv[0])), "lib"))
+
+from Consts import VERSION_STRING
+
+from pwiki import Localization
+Localization.installI18nDummies()
+
+
+import ExceptionLogger
+ExceptionLogger.startLogger(VERSION_STRING, replaceStdStreams=False)
+
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])),
+        "gadfly.zip"))
+
+
+from pwiki import BatchCmd
+
+sys.exit(BatchCmd.main(sys.argv[1:]))
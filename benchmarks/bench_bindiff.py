@@ -0,0 +1,114 @@
+#!/bin/python
+"""
+Compare the diff engines of StringOps.getBinCompactForDiff() in speed and
+size of the created diff.
+
+Usage:
+    python benchmarks/bench_bindiff.py [PATH ...]
+
+Each PATH is a directory containing successive versions of a page, one
+file per version, ordered by file name (e.g. exported by a script from
+the version history of a wiki). Diffs are created between each pair of
+neighbouring versions in both directions, as the versioning does.
+Without PATH synthetic histories of journal-like pages are used.
+"""
+
+import sys, os, os.path, time, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        "..", "lib"))
+
+from pwiki.StringOps import COMPACT_DIFF_ENGINES, getBinCompactForDiff, \
+        applyBinCompact
+
+
+def loadHistory(dirPath):
+    names = sorted(fn for fn in os.listdir(dirPath)
+            if os.path.isfile(os.path.join(dirPath, fn)))
+    result = []
+    for fn in names:
+        f = open(os.path.join(dirPath, fn), "rb")
+        try:
+            result.append(f.read())
+        finally:
+            f.close()
+
+    return result
+
+
+def _randomLine(rnd):
+    words = ["wiki", "page", "journal", "meeting", "todo:", "[link]",
+            "WikiWord", "done", "the", "a", "of", "notes", "CamelCase",
+            "2011-03-05", "*bold*", "_italic_", "+ Heading", "    *"]
+    return " ".join(rnd.choice(words) for i in xrange(rnd.randint(0, 14))) \
+            + "\n"
+
+
+def makeSyntheticHistory(rnd, lineCount, versionCount):
+    """
+    Create versions of a journal page which mostly grows at the end and
+    is sometimes edited in the middle.
+    """
+    lines = [_randomLine(rnd) for i in xrange(lineCount)]
+    result = ["".join(lines)]
+    for v in xrange(versionCount - 1):
+        action = rnd.random()
+        if action < 0.6:
+            lines.extend(_randomLine(rnd) for i in xrange(rnd.randint(1, 30)))
+        elif action < 0.8:
+            pos = rnd.randrange(len(lines))
+            lines[pos] = lines[pos].rstrip("\n") + " edited\n"
+        elif action < 0.9:
+            pos = rnd.randrange(len(lines))
+            del lines[pos:pos + rnd.randint(1, 10)]
+        else:
+            pos = rnd.randrange(len(lines))
+            lines[pos:pos] = [_randomLine(rnd)
+                    for i in xrange(rnd.randint(1, 10))]
+        result.append("".join(lines))
+
+    return result
+
+
+def benchmark(histories, engines):
+    totals = dict((e, [0.0, 0]) for e in engines)
+    for history in histories:
+        for i in xrange(len(history) - 1):
+            for a, b in ((history[i], history[i + 1]),
+                    (history[i + 1], history[i])):
+                for engine in engines:
+                    start = time.time()
+                    bops = getBinCompactForDiff(a, b, engine)
+                    totals[engine][0] += time.time() - start
+                    totals[engine][1] += len(bops)
+
+                    if applyBinCompact(a, bops) != b:
+                        print "ERROR: engine %s created a wrong diff" % engine
+                        sys.exit(1)
+
+    return totals
+
+
+def main(args):
+    engines = sorted(COMPACT_DIFF_ENGINES.keys())
+
+    if args:
+        histories = [loadHistory(p) for p in args]
+        descr = "%i page histories" % len(histories)
+    else:
+        rnd = random.Random(42)
+        histories = [makeSyntheticHistory(rnd, lineCount, 6)
+                for lineCount in (50, 300, 1000)]
+        descr = "synthetic page histories of 50 to 1000 lines"
+
+    versions = sum(len(h) for h in histories)
+    print "Diffing %s (%i versions)" % (descr, versions)
+    totals = benchmark(histories, engines)
+    print "%-10s %12s %14s" % ("engine", "time [s]", "diff size [B]")
+    for engine in engines:
+        print "%-10s %12.3f %14i" % (engine, totals[engine][0],
+                totals[engine][1])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
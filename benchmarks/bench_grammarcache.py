@@ -0,0 +1,72 @@
+#!/bin/python
+"""
+Measure the time to import (and so to build the grammar of) the wiki
+language parsers with and without the grammar cache.
+
+Usage:
+    python benchmarks/bench_grammarcache.py [RUNS]
+
+Each import runs in a fresh Python process, RUNS times (default 5) without
+cache file and RUNS times with the cache file written by the first run.
+The modules the parsers depend on are imported before the clock starts.
+The cache files are placed in a temporary directory which a stand-in
+application object reports as configuration directory.
+"""
+
+import sys, os, os.path, time, subprocess, tempfile, shutil, glob
+
+
+_BASEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+_CHILD_SCRIPT = r"""
+import sys, time, __builtin__
+__builtin__._ = lambda s: s
+__builtin__.N_ = lambda s: s
+sys.path[:0] = %r
+import pwiki.WikiDocument, pwiki.OptionsDialog, pwiki.WikiPyparsing
+from pwiki import AppAccess
+
+class _ConfigDirApp(object):
+    def getGlobalConfigSubDir(self):
+        return %r
+
+AppAccess.setApp(_ConfigDirApp())
+start = time.time()
+__import__(%r)
+sys.stdout.write("%%f\n" %% (time.time() - start))
+"""
+
+
+def timeImport(moduleName, tempDir):
+    paths = [os.path.join(_BASEDIR, "lib"), os.path.join(_BASEDIR, "extensions"),
+            os.path.join(_BASEDIR, "extensions", "wikidPadParser"),
+            os.path.join(_BASEDIR, "extensions", "mediaWikiParser")]
+    output = subprocess.check_output([sys.executable, "-c",
+            _CHILD_SCRIPT % (paths, tempDir, moduleName)])
+    return float(output.strip().split("\n")[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    tempDir = tempfile.mkdtemp()
+    try:
+        for moduleName in ("WikidPadParser", "MediaWikiParser"):
+            coldTimes = []
+            for i in xrange(runs):
+                for path in glob.glob(os.path.join(tempDir,
+                        "grammarCache_*.dat")):
+                    os.remove(path)
+                coldTimes.append(timeImport(moduleName, tempDir))
+
+            warmTimes = [timeImport(moduleName, tempDir)
+                    for i in xrange(runs)]
+
+            print "%-16s without cache: %.3fs  with cache: %.3fs  " \
+                    "(best of %i)" % (moduleName, min(coldTimes),
+                    min(warmTimes), runs)
+    finally:
+        shutil.rmtree(tempDir, True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/bin/python
+"""
+Compare storing whole-wiki versions in the snapshot tables of the
+Compact Sqlite backend with the former changelog tables ("headversion",
+"changelog", "versions") in creation time and database size.
+
+Usage:
+    python benchmarks/bench_snapshots.py [PAGES [VERSIONS [CHANGED]]]
+
+A synthetic wiki with PAGES pages (default 2000) is created, then VERSIONS
+versions (default 20) are stored with CHANGED pages (default 20) modified
+between two versions. The wx-dependent parts of WikiData are not needed,
+only its versioning methods are called.
+"""
+
+import sys, os, os.path, time, random, tempfile, shutil, new
+
+_BASEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, _BASEDIR)
+sys.path.insert(0, os.path.join(_BASEDIR, "lib"))
+
+import pwiki.sqlite3api as sqlite
+from pwiki.wikidata.compact_sqlite import DbStructure
+from pwiki.wikidata.compact_sqlite.WikiData import WikiData
+from pwiki.StringOps import getBinCompactForDiff
+
+
+def _randomText(rnd, lineCount):
+    words = ["wiki", "page", "journal", "meeting", "todo:", "[link]",
+            "WikiWord", "done", "the", "a", "of", "notes", "CamelCase"]
+    return "".join(" ".join(rnd.choice(words)
+            for i in xrange(rnd.randint(0, 14))) + "\n"
+            for l in xrange(lineCount))
+
+
+def openDb(path):
+    connWrap = DbStructure.ConnectWrapSyncCommit(sqlite.connect(path))
+    DbStructure.changeTableSchema(connWrap, "wikiwordcontent",
+            DbStructure.TABLE_DEFINITIONS["wikiwordcontent"])
+    connWrap.execSql("create unique index wikiwordcontent_pkey on "
+            "wikiwordcontent(word)")
+    connWrap.commit()
+    return connWrap
+
+
+def createPages(connWrap, rnd, pageCount):
+    for i in xrange(pageCount):
+        connWrap.execSql("insert into wikiwordcontent(word, content, "
+                "modified, created) values (?, ?, 1, 1)",
+                ("Page%i" % i, sqlite.Binary(_randomText(rnd,
+                rnd.randint(5, 100)))))
+    connWrap.commit()
+
+
+def modifyPages(connWrap, rnd, pageCount, changedCount, modTime):
+    for i in rnd.sample(xrange(pageCount), changedCount):
+        word = "Page%i" % i
+        content = str(connWrap.execSqlQuerySingleItem("select content from "
+                "wikiwordcontent where word = ?", (word,)))
+        content += _randomText(rnd, rnd.randint(1, 5))
+        connWrap.execSql("update wikiwordcontent set content = ?, "
+                "modified = ? where word = ?",
+                (sqlite.Binary(content), modTime, word))
+    connWrap.commit()
+
+
+def storeVersionChangelog(connWrap, description):
+    """
+    Former implementation of WikiData.storeVersion()
+    """
+    if not DbStructure.hasLegacyVersioningData(connWrap):
+        for tn in ("changelog", "headversion", "versions"):
+            DbStructure.changeTableSchema(connWrap, tn,
+                    DbStructure.TABLE_DEFINITIONS[tn])
+        connWrap.execSql("create unique index headversion_pkey on "
+                "headversion(word)")
+
+    headversion = connWrap.execSqlQuery("select description, "
+            "created from versions where id=0")
+    if len(headversion) == 1:
+        firstchangeid = connWrap.execSqlQuerySingleItem("select id from "
+                "changelog order by id desc limit 1 ", default=-1) + 1
+
+        modwords = connWrap.execSqlQuerySingleColumn("select headversion.word "
+                "from headversion inner join wikiwordcontent on "
+                "headversion.word = wikiwordcontent.word where "
+                "headversion.modified != wikiwordcontent.modified")
+
+        for w in modwords:
+            content = str(connWrap.execSqlQuerySingleItem("select content "
+                    "from wikiwordcontent where word=?", (w,)))
+            headcontent, headmoddate = connWrap.execSqlQuery("select content, "
+                    "modified from headversion where word=?", (w,))[0]
+            bindiff = getBinCompactForDiff(content, str(headcontent))
+            connWrap.execSql("insert into changelog (word, op, content, "
+                    "moddate) values (?, ?, ?, ?)",
+                    (w, 1, sqlite.Binary(bindiff), headmoddate))
+
+        connWrap.execSql("insert into changelog (word, op, content, moddate) "
+                "select word, 2, content, modified from headversion where "
+                "word not in (select word from wikiwordcontent)")
+        connWrap.execSql("insert into changelog (word, op, content, moddate) "
+                "select word, 3, x'', modified from wikiwordcontent where "
+                "word not in (select word from headversion)")
+
+        headversion = headversion[0]
+        connWrap.execSql("insert into versions(description, firstchangeid, "
+                "created) values(?, ?, ?)",
+                (headversion[0], firstchangeid, headversion[1]))
+
+    connWrap.execSql("insert or replace into versions(id, description, "
+            "firstchangeid, created) values(?, ?, ?, ?)",
+            (0, description, -1, time.time()))
+
+    connWrap.execSql("delete from headversion")
+    connWrap.execSql("insert into headversion(word, content, compression, "
+            "encryption, modified, created) select word, content, "
+            "compression, encryption, modified, created from wikiwordcontent")
+
+    connWrap.commit()
+
+
+def benchmark(scheme, dbPath, pageCount, versionCount, changedCount):
+    rnd = random.Random(42)
+    connWrap = openDb(dbPath)
+    createPages(connWrap, rnd, pageCount)
+    baseSize = os.path.getsize(dbPath)
+
+    if scheme == "snapshot":
+        wikiData = new.instance(WikiData)
+        wikiData.connWrap = connWrap
+        wikiData.cachedWikiPageLinkTermDict = None
+        storeVersion = wikiData.storeVersion
+    else:
+        storeVersion = lambda descr: storeVersionChangelog(connWrap, descr)
+
+    # Time for first version (all pages) and for all following ones
+    firstTime = 0.0
+    restTime = 0.0
+    for v in xrange(versionCount):
+        if v > 0:
+            modifyPages(connWrap, rnd, pageCount, changedCount, v + 1)
+
+        start = time.time()
+        storeVersion(u"Version %i" % v)
+        if v == 0:
+            firstTime = time.time() - start
+        else:
+            restTime += time.time() - start
+
+    connWrap.close()
+    return firstTime, restTime, os.path.getsize(dbPath) - baseSize
+
+
+def main(args):
+    pageCount = int(args[0]) if len(args) > 0 else 2000
+    versionCount = int(args[1]) if len(args) > 1 else 20
+    changedCount = int(args[2]) if len(args) > 2 else 20
+
+    print "%i pages, %i versions, %i pages changed per version" % (
+            pageCount, versionCount, changedCount)
+    print "%-10s %14s %16s %18s" % ("scheme", "first [s]",
+            "following [s]", "versioning [KiB]")
+
+    tempDir = tempfile.mkdtemp()
+    try:
+        for scheme in ("changelog", "snapshot"):
+            firstTime, restTime, size = benchmark(scheme,
+                    os.path.join(tempDir, scheme + ".sli"), pageCount,
+                    versionCount, changedCount)
+            print "%-10s %14.3f %16.3f %18i" % (scheme, firstTime, restTime,
+                    size // 1024)
+    finally:
+        shutil.rmtree(tempDir, True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
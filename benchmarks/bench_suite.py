@@ -0,0 +1,659 @@
+#!/bin/python
+"""
+Measure the main operations of WikidPad on a synthetic wiki (see wikigen.py)
+for each database backend and compare the results with a stored baseline.
+
+Usage:
+    python benchmarks/bench_suite.py [options]
+
+Options:
+    --pages N: number of normal pages of the synthetic wiki (default 1000)
+    --seed N: seed of the wiki generator (default 1)
+    --runs N: repetitions of each operation (default 3), the best time
+            is compared
+    --backends LIST: comma separated database types
+            (default "compact_sqlite,original_sqlite")
+    --ops LIST: comma separated operations (default: all of OPERATIONS)
+    --output PATH: write JSON results to PATH instead of standard output
+    --baseline PATH: compare results with a result file written before
+    --save-baseline PATH: write results also to PATH to use it as baseline
+    --tolerance F: relative slowdown which counts as regression
+            (default 0.25)
+    --keep: keep the temporary directory with the wikis
+
+The wikis and the global configuration are created in a temporary
+directory. The wx module must be importable but no display is needed
+(the application object is a HeadlessApp). Operations needing parts of
+the GUI code which can't be imported are reported as skipped.
+
+The comparison with the baseline is written to standard error, the exit
+code is 1 if an operation is slower than baseline by more than the
+tolerance (and at least 5 ms).
+"""
+
+import sys, os, os.path, getopt, json, tempfile, shutil, random, platform, \
+        time
+
+_BASEDIR = os.path.normpath(os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(_BASEDIR, "lib"))
+sys.path.insert(0, _BASEDIR)
+sys.path.append(os.path.join(_BASEDIR, "gadfly.zip"))
+
+import __builtin__
+__builtin__._ = lambda s: s
+__builtin__.N_ = lambda s: s
+
+from Consts import VERSION_STRING
+
+import ExceptionLogger
+ExceptionLogger.startLogger(VERSION_STRING, replaceStdStreams=False)
+
+import wikigen
+
+
+OPERATIONS = ("open", "rebuild", "rebuild_index", "incremental", "parse",
+        "styling", "search_regex", "search_boolean", "search_index", "tree",
+        "export_html", "export_mpt", "import_mpt", "versions")
+
+DEFAULT_BACKENDS = ("compact_sqlite", "original_sqlite")
+
+# Search strings for the search operations
+SEARCH_STRINGS = {
+    "regex": u"budget\\s+(report|summary)",
+    "boolean": u"budget\\s+report and not customer\\s+review",
+    "index": u"\"budget report\" -customer",
+}
+
+# Maximum number of pages used for the parse and styling operations
+SAMPLE_PAGES = 200
+
+# Number of versions stored for the version reconstruction
+VERSION_COUNT = 30
+
+# Minimal slowdown in seconds to report a regression
+MIN_REGRESSION_DELTA = 0.005
+
+
+class SkipOperation(Exception):
+    """
+    Raised if an operation can't be measured in this environment.
+    """
+
+
+
+class SuiteRunner(object):
+    """
+    Creates the synthetic wiki for one backend after the other and measures
+    the operations on it.
+    """
+    def __init__(self, app, tempDir, params, runs):
+        from pwiki.HeadlessApp import StreamProgressHandler
+
+        self.app = app
+        self.tempDir = tempDir
+        self.params = params
+        self.runs = runs
+        self.progress = StreamProgressHandler()
+
+        self.wiki = wikigen.SyntheticWiki(params)
+        self.pages = list(self.wiki.iterPages())
+
+        self.dbType = None
+        self.configPath = None
+        self.wikiDocument = None
+        self.mptPath = None
+
+
+    def _openWiki(self, configPath):
+        from pwiki.wikidata import WikiDataManager
+
+        wikiDocument = WikiDataManager.openWikiDocument(configPath, None, None,
+                True, False)
+        wikiDocument.connect()
+        return wikiDocument
+
+
+    def _settle(self, wikiDocument=None):
+        """
+        Wait until the update executor has processed all queued meta-data
+        updates so they don't disturb the next measurement.
+        """
+        from pwiki.HeadlessApp import waitForBackgroundJobs
+
+        if wikiDocument is None:
+            wikiDocument = self.wikiDocument
+        waitForBackgroundJobs(wikiDocument)
+        wikiDocument.getUpdateExecutor().start()
+
+
+    def _getMainControl(self, wikiDocument=None):
+        from pwiki.HeadlessApp import HeadlessMainControl
+
+        return HeadlessMainControl(self.app, wikiDocument or self.wikiDocument)
+
+
+    def _measure(self, fct, runs=None, setup=None):
+        """
+        Call fct runs times (setup before each call, not measured) and
+        return list of durations.
+        """
+        from pwiki.Instrumentation import getTime
+
+        times = []
+        for i in xrange(runs or self.runs):
+            if setup is not None:
+                setup(i)
+            start = getTime()
+            fct(i)
+            times.append(getTime() - start)
+
+        return times
+
+
+    @staticmethod
+    def _entry(times, **extra):
+        result = {"seconds": min(times),
+                "median": sorted(times)[len(times) // 2],
+                "runs": [round(t, 6) for t in times]}
+        result.update(extra)
+        return result
+
+
+    def _samplePages(self):
+        """
+        Return up to SAMPLE_PAGES wiki page objects, including all
+        journal pages.
+        """
+        names = list(self.wiki.journalPages)
+        normal = [name for name, camel in self.wiki.pages]
+        step = max(1, len(normal) // max(1, SAMPLE_PAGES - len(names)))
+        names += normal[::step]
+        names = names[:SAMPLE_PAGES]
+
+        return [self.wikiDocument.getWikiPage(name) for name in names]
+
+
+    def runBackend(self, dbType, operations):
+        """
+        Create wiki with database type dbType, measure operations and
+        return dictionary {operation: result}.
+        """
+        from pwiki.Instrumentation import getTime
+
+        self.dbType = dbType
+        self.configPath = wikigen.createWiki(self.app, self.tempDir,
+                u"Bench_" + dbType, dbType, indexSearch=True)
+        self.wikiDocument = self._openWiki(self.configPath)
+        self.mptPath = None
+
+        results = {}
+        try:
+            start = getTime()
+            wikigen.fillWiki(self.wikiDocument, self.pages)
+            results["generate"] = {"seconds": getTime() - start,
+                    "pages": len(self.pages),
+                    "kb": sum(len(text) for name, text in self.pages) // 1024}
+
+            # All other operations need the meta-data
+            if "rebuild" not in operations:
+                self.wikiDocument.rebuildWiki(self.progress, False)
+                self._settle()
+
+            for op in operations:
+                try:
+                    results[op] = getattr(self, "bench_" + op)()
+                except SkipOperation, e:
+                    results[op] = {"skipped": unicode(e)}
+                self._settle()
+        finally:
+            self.wikiDocument.release()
+            self.wikiDocument = None
+
+        return results
+
+
+    def bench_open(self):
+        def setup(i):
+            self._settle()
+            self.wikiDocument.release()
+
+        def fct(i):
+            self.wikiDocument = self._openWiki(self.configPath)
+
+        return self._entry(self._measure(fct, setup=setup))
+
+
+    def bench_rebuild(self):
+        def fct(i):
+            self.wikiDocument.rebuildWiki(self.progress, False)
+
+        return self._entry(self._measure(fct, setup=lambda i: self._settle()))
+
+
+    def bench_rebuild_index(self):
+        def fct(i):
+            self.wikiDocument.rebuildSearchIndex(self.progress)
+
+        return self._entry(self._measure(fct, setup=lambda i: self._settle()))
+
+
+    def bench_incremental(self):
+        """
+        Modify one percent of the pages, save them and update the meta-data.
+        """
+        normal = [name for name, camel in self.wiki.pages]
+        count = max(1, len(normal) // 100)
+
+        def fct(i):
+            rnd = random.Random(i)
+            for name in rnd.sample(normal, min(count, len(normal))):
+                page = self.wikiDocument.getWikiPage(name)
+                page.replaceLiveText(self.wiki.modifyText(page.getLiveText(),
+                        rnd))
+                page.writeToDatabase()
+            self.wikiDocument.rebuildWiki(self.progress, True)
+
+        return self._entry(self._measure(fct, setup=lambda i: self._settle()),
+                pagesPerRun=count)
+
+
+    def bench_parse(self):
+        """
+        Build the page AST (getLivePageAst()) of the sample pages.
+        """
+        pages = self._samplePages()
+        kb = sum(len(page.getLiveText()) for page in pages) / 1024.0
+
+        def setup(i):
+            for page in pages:
+                page.livePageAst = None
+
+        def fct(i):
+            for page in pages:
+                page.getLivePageAst()
+
+        times = self._measure(fct, setup=setup)
+        return self._entry(times, pages=len(pages), kb=round(kb, 1),
+                msPerKB=round(min(times) * 1000 / kb, 4))
+
+
+    def bench_styling(self):
+        """
+        Compute the style bytes of the editor (WikiTxtCtrl.processTokens())
+        for the sample pages.
+        """
+        try:
+            from pwiki.WikiTxtCtrl import WikiTxtCtrl
+            from pwiki.EnhancedScintillaControl import bytelenSct_utf8
+        except ImportError, e:
+            raise SkipOperation(u"Editor can't be imported: %s" % e)
+
+        from pwiki.Utilities import DUMBTHREADSTOP
+
+        # Stand-in for the editor with the attributes processTokens() needs
+        editorClass = type("StylingEditor", (object,), dict(
+                (name, WikiTxtCtrl.__dict__[name]) for name in
+                ("processTokens", "getByteOffsetTable", "_findFragmentSearch")))
+        editor = editorClass()
+        editor.presenter = self._getMainControl()
+        editor.bytelenSct = bytelenSct_utf8
+        editor.styledTextOffsetTable = (None, None)
+        editor.optionColorizeSearchFragments = False
+        editor.wikiLanguageHelper = self.app.createWikiLanguageHelper(
+                self.wikiDocument.getWikiDefaultWikiLanguage())
+
+        pages = [(page.getLiveText(), page.getLivePageAst())
+                for page in self._samplePages()]
+        kb = sum(len(text) for text, pageAst in pages) / 1024.0
+
+        def setup(i):
+            editor.styledTextOffsetTable = (None, None)
+
+        def fct(i):
+            for text, pageAst in pages:
+                editor.processTokens(text, pageAst, DUMBTHREADSTOP)
+
+        times = self._measure(fct, setup=setup)
+        return self._entry(times, pages=len(pages), kb=round(kb, 1),
+                msPerKB=round(min(times) * 1000 / kb, 4))
+
+
+    def _benchSearch(self, searchType):
+        from pwiki.BatchCmd import buildSearchOperation
+
+        sarOp = buildSearchOperation(SEARCH_STRINGS[searchType], searchType)
+        found = []
+
+        def fct(i):
+            found[:] = self.wikiDocument.searchWiki(sarOp.clone(), True)
+
+        return self._entry(self._measure(fct), matches=len(found))
+
+
+    def bench_search_regex(self):
+        return self._benchSearch("regex")
+
+    def bench_search_boolean(self):
+        return self._benchSearch("boolean")
+
+    def bench_search_index(self):
+        if not self.wikiDocument.isSearchIndexEnabled():
+            raise SkipOperation(u"Search index not enabled")
+        return self._benchSearch("index")
+
+
+    def bench_tree(self):
+        """
+        Expand each page once in the tree, starting from the root page,
+        as WikiWordNode.listChildren() does.
+        """
+        try:
+            from pwiki.WikiTreeCtrl import WikiTreeDataProvider
+        except ImportError, e:
+            raise SkipOperation(u"Tree can't be imported: %s" % e)
+
+        class TreeCtrl(object):
+            pass
+
+        wikiDocument = self.wikiDocument
+        treeCtrl = TreeCtrl()
+        treeCtrl.pWiki = self._getMainControl()
+        expanded = set()
+
+        def fct(i):
+            dataProvider = WikiTreeDataProvider(treeCtrl)
+            expanded.clear()
+            queue = [(wikigen.ROOT_PAGE, frozenset())]
+            while queue:
+                word, ancestors = queue.pop(0)
+                expanded.add(word)
+                wikiPage = wikiDocument.getWikiPageNoError(word)
+                children = wikiPage.getChildRelationshipsTreeOrder(
+                        existingonly=False, excludeSet=ancestors)
+                dataProvider.prefetchChildrenOf(
+                        wikiPage.getNonAliasPage().getWikiWord(), children)
+
+                childAncestors = ancestors | frozenset((word,))
+                for child in children:
+                    target = wikiDocument.getWikiPageNameForLinkTerm(child)
+                    if target is None or target in expanded:
+                        continue
+                    if dataProvider.hasValidChildren(target,
+                            excludeSet=childAncestors):
+                        expanded.add(target)
+                        queue.append((target, childAncestors))
+
+        return self._entry(self._measure(fct), nodes=len(expanded))
+
+
+    def _getExporter(self, exportType):
+        from pwiki import PluginManager
+
+        exportTypes = PluginManager.getSupportedExportTypes(
+                self._getMainControl(), None)
+        if exportType not in exportTypes:
+            raise SkipOperation(u"Export type %s not available" % exportType)
+
+        return exportTypes[exportType][0]
+
+
+    def _export(self, exporter, exportType, dest):
+        wordList = self.wikiDocument.getWikiData().getAllDefinedWikiPageNames()
+        exporter.export(self.wikiDocument, wordList, exportType, dest, False,
+                exporter.getAddOpt(None), self.progress)
+
+
+    def bench_export_html(self):
+        exporter = self._getExporter(u"html_single")
+
+        def setup(i):
+            self.exportDir = os.path.join(self.tempDir,
+                    u"html_%s_%i" % (self.dbType, i))
+            os.mkdir(self.exportDir)
+
+        def fct(i):
+            self._export(exporter, u"html_single", self.exportDir)
+
+        return self._entry(self._measure(fct, setup=setup))
+
+
+    def bench_export_mpt(self):
+        exporter = self._getExporter(u"multipage_text")
+        path = os.path.join(self.tempDir, u"export_%s.mpt" % self.dbType)
+
+        def fct(i):
+            self._export(exporter, u"multipage_text", path)
+
+        result = self._entry(self._measure(fct))
+        self.mptPath = path
+        result["kb"] = os.path.getsize(path) // 1024
+        return result
+
+
+    def bench_import_mpt(self):
+        """
+        Import the multipage text file written by export_mpt into an empty
+        wiki.
+        """
+        from pwiki.Importers import MultiPageTextImporter
+
+        if self.mptPath is None:
+            self.bench_export_mpt()
+
+        state = {}
+
+        def setup(i):
+            configPath = wikigen.createWiki(self.app, self.tempDir,
+                    u"Import_%s_%i" % (self.dbType, i), self.dbType)
+            state["wikiDocument"] = self._openWiki(configPath)
+
+        def fct(i):
+            wikiDocument = state.pop("wikiDocument")
+            try:
+                importer = MultiPageTextImporter(
+                        self._getMainControl(wikiDocument))
+                importer.doImport(wikiDocument, u"multipage_text",
+                        self.mptPath, False, importer.getAddOpt(None),
+                        progressHandler=self.progress)
+            finally:
+                self._settle(wikiDocument)
+                wikiDocument.release()
+
+        return self._entry(self._measure(fct, setup=setup))
+
+
+    def bench_versions(self):
+        """
+        Store VERSION_COUNT versions of a journal page, then reconstruct
+        all of them (reverse diffs) with an empty version cache.
+        """
+        from pwiki.Instrumentation import getTime
+        from pwiki.timeView.Versioning import VersionEntry
+
+        if self.wiki.journalPages:
+            page = self.wikiDocument.getWikiPage(self.wiki.journalPages[0])
+        else:
+            page = self.wikiDocument.getWikiPage(wikigen.ROOT_PAGE)
+
+        versionOverview = page.getVersionOverview()
+        text = page.getLiveText()
+        rnd = random.Random(0)
+
+        start = getTime()
+        for i in xrange(VERSION_COUNT):
+            text = self.wiki.modifyText(text, rnd)
+            versionOverview.addVersion(text, VersionEntry(u"", u"", "revdiff"))
+        versionOverview.writeOverview()
+        addSeconds = getTime() - start
+
+        def setup(i):
+            versionOverview.versionCache.clear()
+
+        def fct(i):
+            for entry in versionOverview.getVersionEntries():
+                versionOverview.getVersionContent(entry.versionNumber)
+
+        return self._entry(self._measure(fct, setup=setup),
+                versions=VERSION_COUNT, addSeconds=round(addSeconds, 6))
+
+
+
+def compareResults(current, baseline, tolerance):
+    """
+    Compare the "seconds" of the operations in the result dictionaries
+    current and baseline. Returns tuple (lines, regressions) with the lines
+    of a comparison table and a list of (backend, operation) which are
+    slower than baseline by more than tolerance.
+    """
+    lines = []
+    regressions = []
+
+    if current.get("params") != baseline.get("params"):
+        lines.append(u"Warning: baseline was created with other wiki "
+                u"parameters")
+
+    lines.append(u"%-16s %-16s %10s %10s %8s" % (u"Backend", u"Operation",
+            u"Base ms", u"Now ms", u"Ratio"))
+
+    for backend, ops in sorted(current["results"].iteritems()):
+        baseOps = baseline.get("results", {}).get(backend, {})
+        for op, entry in sorted(ops.iteritems()):
+            # Only operations measured in multiple runs are compared
+            baseEntry = baseOps.get(op)
+            if baseEntry is None or "runs" not in entry or \
+                    "runs" not in baseEntry:
+                continue
+
+            now = entry["seconds"]
+            base = baseEntry["seconds"]
+            ratio = now / base if base > 0 else float("inf")
+            mark = u""
+            if ratio > 1 + tolerance and now - base >= MIN_REGRESSION_DELTA:
+                mark = u"  REGRESSION"
+                regressions.append((backend, op))
+            elif ratio < 1 / (1 + tolerance):
+                mark = u"  faster"
+
+            lines.append(u"%-16s %-16s %10.1f %10.1f %8.2f%s" % (backend, op,
+                    base * 1000, now * 1000, ratio, mark))
+
+    return lines, regressions
+
+
+def _writeJson(data, path):
+    f = open(path, "wb")
+    try:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+    finally:
+        f.close()
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "pages=",
+                "seed=", "runs=", "backends=", "ops=", "output=", "baseline=",
+                "save-baseline=", "tolerance=", "keep"])
+    except getopt.GetoptError, e:
+        sys.stderr.write("%s\n\n%s" % (e, __doc__))
+        return 2
+
+    genParams = {}
+    runs = 3
+    backends = DEFAULT_BACKENDS
+    operations = OPERATIONS
+    outputPath = None
+    baselinePath = None
+    saveBaselinePath = None
+    tolerance = 0.25
+    keep = False
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print __doc__
+            return 0
+        elif o == "--pages":
+            genParams["pages"] = int(a)
+        elif o == "--seed":
+            genParams["seed"] = int(a)
+        elif o == "--runs":
+            runs = max(1, int(a))
+        elif o == "--backends":
+            backends = a.split(",")
+        elif o == "--ops":
+            operations = a.split(",")
+            unknown = set(operations) - set(OPERATIONS)
+            if unknown:
+                sys.stderr.write("Unknown operations: %s\n" %
+                        ", ".join(sorted(unknown)))
+                return 2
+        elif o == "--output":
+            outputPath = a
+        elif o == "--baseline":
+            baselinePath = a
+        elif o == "--save-baseline":
+            saveBaselinePath = a
+        elif o == "--tolerance":
+            tolerance = float(a)
+        elif o == "--keep":
+            keep = True
+
+    # Keep order of OPERATIONS, some operations use results of former ones
+    operations = [op for op in OPERATIONS if op in operations]
+    params = wikigen.getParams(**genParams)
+
+    baseline = None
+    if baselinePath is not None:
+        f = open(baselinePath, "rb")
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+
+    from pwiki.HeadlessApp import HeadlessApp
+
+    tempDir = tempfile.mkdtemp(prefix="wikidpad_bench_")
+    app = None
+    try:
+        app = HeadlessApp(_BASEDIR, tempDir)
+        runner = SuiteRunner(app, tempDir, params, runs)
+
+        results = {}
+        for dbType in backends:
+            sys.stderr.write("Running %s ...\n" % dbType)
+            results[dbType] = runner.runBackend(dbType, operations)
+    finally:
+        if app is not None:
+            app.close()
+        if keep:
+            sys.stderr.write("Wikis kept in %s\n" % tempDir)
+        else:
+            shutil.rmtree(tempDir, True)
+
+    data = {"params": params, "runs": runs,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": results}
+
+    if outputPath is not None:
+        _writeJson(data, outputPath)
+    else:
+        json.dump(data, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+    if saveBaselinePath is not None:
+        _writeJson(data, saveBaselinePath)
+
+    if baseline is None:
+        return 0
+
+    lines, regressions = compareResults(data, baseline, tolerance)
+    sys.stderr.write("\n".join(lines).encode("utf-8") + "\n")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+#!/bin/python
+"""
+Deterministic generator of synthetic wikis for the benchmarks.
+
+The pages form a tree (each page links to "branching" child pages, so all
+pages are reachable from the root page) with additional random links between
+pages, some of them to undefined pages. Page names are CamelCase words or
+names with spaces which are only reachable by bracketed links. Pages contain
+attributes, todos and (some of them) tables, the journal pages contain many
+dated entries and are much longer than the others.
+
+Used as module by bench_suite.py. Run as script to write the pages of a
+synthetic wiki as multipage text file which can be imported into WikidPad:
+
+    python benchmarks/wikigen.py PATH [PAGES [SEED]]
+"""
+
+import sys, os, os.path, random, datetime
+
+
+# Parameters for generatePages(), can be overwritten by keyword arguments
+DEFAULT_PARAMS = {
+    "seed": 1,
+    "pages": 1000,   # Number of normal pages (without root and journal)
+    "branching": 4,   # Number of child pages in the tree
+    "extraLinks": 5,   # Number of additional links to random pages
+    "deadLinkFraction": 0.1,   # Fraction of extra links to undefined pages
+    "camelCaseFraction": 0.5,   # Fraction of pages with CamelCase names
+    "attributes": 2,   # Number of attributes per page
+    "todos": 2,   # Number of todos per page
+    "paragraphs": 5,   # Number of text paragraphs per page
+    "tableFraction": 0.2,   # Fraction of pages containing a table
+    "tableRows": 10,
+    "journalPages": 20,
+    "journalEntries": 100,   # Number of entries per journal page
+}
+
+ROOT_PAGE = u"BenchWiki"
+
+
+_WORDS = (u"wiki", u"page", u"journal", u"meeting", u"project", u"notes",
+        u"the", u"a", u"of", u"and", u"to", u"release", u"review", u"plan",
+        u"draft", u"idea", u"customer", u"budget", u"report", u"summary",
+        u"*important*", u"_underlined_", u"http://example.com/doc")
+
+_ATTRIBUTE_VALUES = {
+    u"tag": (u"work", u"home", u"research", u"archive", u"draft"),
+    u"priority": (u"1", u"2", u"3", u"4", u"5"),
+    u"status": (u"open", u"closed", u"waiting"),
+    u"author": (u"alice", u"bob", u"carol"),
+}
+
+
+def getParams(**kwargs):
+    """
+    Return dictionary of DEFAULT_PARAMS updated with kwargs.
+    """
+    unknown = set(kwargs) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError("Unknown parameters: %s" % ", ".join(sorted(unknown)))
+
+    params = dict(DEFAULT_PARAMS)
+    params.update(kwargs)
+    return params
+
+
+def _letters(n):
+    """
+    Return lowercase letters representing n (bijective base 26), so page
+    names don't contain digits.
+    """
+    result = []
+    n += 1
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        result.append(chr(ord("a") + r))
+
+    return u"".join(reversed(result))
+
+
+class SyntheticWiki(object):
+    """
+    Names and link forms of the pages of a synthetic wiki.
+    """
+    def __init__(self, params):
+        self.params = params
+        rnd = random.Random(params["seed"])
+
+        # List of (name, isCamelCase) of the normal pages
+        self.pages = []
+        for i in xrange(params["pages"]):
+            if rnd.random() < params["camelCaseFraction"]:
+                self.pages.append((u"Topic%sPage" % _letters(i).capitalize(),
+                        True))
+            else:
+                self.pages.append((u"topic %s notes" % _letters(i), False))
+
+        startDate = datetime.date(2015, 1, 1)
+        self.journalPages = [u"Journal %s" %
+                (startDate + datetime.timedelta(days=i)).isoformat()
+                for i in xrange(params["journalPages"])]
+
+
+    def getPageNames(self):
+        return [ROOT_PAGE] + [name for name, camel in self.pages] + \
+                self.journalPages
+
+
+    def link(self, idx):
+        """
+        Return link to normal page number idx.
+        """
+        name, camel = self.pages[idx]
+        if camel:
+            return name
+        else:
+            return u"[%s]" % name
+
+
+    def deadLink(self, rnd):
+        return u"[missing page %s]" % _letters(rnd.randrange(1000000))
+
+
+    def _text(self, rnd, wordCount):
+        return u" ".join(rnd.choice(_WORDS) for i in xrange(wordCount))
+
+
+    def _paragraph(self, rnd, linkCount):
+        """
+        Return paragraph of random text with linkCount links.
+        """
+        params = self.params
+        parts = [self._text(rnd, rnd.randint(10, 40))]
+        for i in xrange(linkCount):
+            if self.pages and rnd.random() >= params["deadLinkFraction"]:
+                parts.append(self.link(rnd.randrange(len(self.pages))))
+            else:
+                parts.append(self.deadLink(rnd))
+            parts.append(self._text(rnd, rnd.randint(3, 15)))
+
+        return u" ".join(parts) + u"\n\n"
+
+
+    def _todos(self, rnd, count):
+        return u"".join(u"%s: %s\n" % (rnd.choice((u"todo", u"done",
+                u"action")), self._text(rnd, rnd.randint(2, 8)))
+                for i in xrange(count))
+
+
+    def _attributes(self, rnd, count):
+        keys = sorted(_ATTRIBUTE_VALUES)
+        return u"".join(u"[%s: %s]\n" % (key,
+                rnd.choice(_ATTRIBUTE_VALUES[key]))
+                for key in rnd.sample(keys, min(count, len(keys))))
+
+
+    def _table(self, rnd, rows):
+        lines = [u"<<|"]
+        for r in xrange(rows):
+            cells = [self._text(rnd, rnd.randint(1, 3)) for c in xrange(4)]
+            if self.pages and rnd.random() < 0.3:
+                cells[0] = self.link(rnd.randrange(len(self.pages)))
+            lines.append(u" | ".join(cells))
+        lines.append(u">>")
+        return u"\n".join(lines) + u"\n\n"
+
+
+    def _pageText(self, idx, rnd):
+        params = self.params
+        name, camel = self.pages[idx]
+
+        parts = [u"+ %s\n\n" % name, self._attributes(rnd,
+                params["attributes"])]
+
+        extraLinks = params["extraLinks"]
+        paragraphs = max(1, params["paragraphs"])
+        for p in xrange(paragraphs):
+            linkCount = extraLinks // paragraphs + \
+                    (1 if p < extraLinks % paragraphs else 0)
+            parts.append(self._paragraph(rnd, linkCount))
+            if p == 0:
+                parts.append(u"\n" + self._todos(rnd, params["todos"]) + u"\n")
+
+        if rnd.random() < params["tableFraction"]:
+            parts.append(u"++ Table\n\n")
+            parts.append(self._table(rnd, params["tableRows"]))
+
+        # The root page has the first "branching" pages as children
+        children = range((idx + 1) * params["branching"],
+                min((idx + 2) * params["branching"], len(self.pages)))
+        if children:
+            parts.append(u"++ Subpages\n\n")
+            parts.extend(u"    * %s\n" % self.link(c) for c in children)
+
+        return u"".join(parts)
+
+
+    def _journalText(self, name, rnd):
+        parts = [u"+ %s\n\n" % name, u"[tag: journal]\n\n"]
+        for i in xrange(self.params["journalEntries"]):
+            parts.append(u"++ %02i:%02i %s\n\n" % (8 + i * 10 // 60 % 12,
+                    i * 10 % 60, self._text(rnd, 3)))
+            parts.append(self._paragraph(rnd, rnd.randint(0, 2)))
+            if rnd.random() < 0.3:
+                parts.append(self._todos(rnd, 1) + u"\n")
+
+        return u"".join(parts)
+
+
+    def _rootText(self):
+        parts = [u"+ %s\n\nRoot page of the synthetic benchmark wiki.\n\n" %
+                ROOT_PAGE]
+        parts.extend(u"    * %s\n" % self.link(c)
+                for c in xrange(min(self.params["branching"], len(self.pages))))
+        if self.journalPages:
+            parts.append(u"\n++ Journal\n\n")
+            parts.extend(u"    * [%s]\n" % name for name in self.journalPages)
+
+        return u"".join(parts)
+
+
+    def _pageSeed(self, n):
+        return self.params["seed"] * 1000003 + n
+
+
+    def iterPages(self):
+        """
+        Iterate over tuples (name, text) of all pages. The text of a page
+        only depends on the parameters, not on the order of iteration.
+        """
+        yield ROOT_PAGE, self._rootText()
+
+        for idx in xrange(len(self.pages)):
+            rnd = random.Random(self._pageSeed(idx * 2))
+            yield self.pages[idx][0], self._pageText(idx, rnd)
+
+        for idx, name in enumerate(self.journalPages):
+            rnd = random.Random(self._pageSeed(idx * 2 + 1))
+            yield name, self._journalText(name, rnd)
+
+
+    def modifyText(self, text, rnd):
+        """
+        Return text with an appended paragraph containing a link, a todo
+        and an attribute, as done by an incremental edit.
+        """
+        return text + u"\n" + self._paragraph(rnd, 2) + \
+                self._todos(rnd, 1) + self._attributes(rnd, 1)
+
+
+
+def generatePages(**kwargs):
+    """
+    Return list of tuples (name, text) for a wiki built with the parameters
+    (see DEFAULT_PARAMS) in kwargs.
+    """
+    return list(SyntheticWiki(getParams(**kwargs)).iterPages())
+
+
+# Fixed time stamp for the generated pages (2015-01-01)
+PAGE_TIMESTAMP = 1420070400.0
+
+
+def createWiki(app, parentDir, wikiName, dbType,
+        wikiLang="wikidpad_default_2_0", indexSearch=False):
+    """
+    Create an empty wiki named wikiName in directory parentDir/wikiName
+    as PersonalWikiFrame.newWiki() does. Returns path of the wiki
+    configuration file.
+    app -- MainApp.App or HeadlessApp.HeadlessApp object
+    """
+    from pwiki.wikidata import WikiDataManager
+
+    wikiDir = os.path.join(parentDir, wikiName)
+    os.mkdir(wikiDir)
+    dataDir = os.path.join(wikiDir, u"data")
+
+    WikiDataManager.createWikiDb(None, dbType, wikiName, dataDir, False)
+
+    configPath = os.path.join(wikiDir, u"%s.wiki" % wikiName)
+    wikiConfig = app.createWikiConfiguration()
+    wikiConfig.createEmptyConfig(configPath)
+    wikiConfig.fillWithDefaults()
+    wikiConfig.set("main", "wiki_name", wikiName)
+    wikiConfig.set("main", "last_wiki_word", ROOT_PAGE)
+    wikiConfig.set("main", "wiki_database_type", dbType)
+    wikiConfig.set("main", "wiki_wikiLanguage", wikiLang)
+    wikiConfig.set("main", "wikiPageTitle_headingLevel", "2")
+    wikiConfig.set("main", "indexSearch_enabled", indexSearch)
+    wikiConfig.set("wiki_db", "data_dir", "data")
+    wikiConfig.save()
+
+    return configPath
+
+
+def fillWiki(wikiDocument, pages):
+    """
+    Store the pages (sequence of tuples (name, text)) in the database of
+    wikiDocument without updating the meta-data (links, attributes, ...).
+    """
+    wikiData = wikiDocument.getWikiData()
+    for name, text in pages:
+        wikiData.setContent(name, text, PAGE_TIMESTAMP, PAGE_TIMESTAMP)
+    wikiData.commit()
+
+
+def writeMultiPageText(path, pages):
+    """
+    Write pages as multipage text file (format version 0) to path.
+    """
+    separator = u"-----8ZTGBJQXVHNKRFDSW5UCMPLE3Y-----"
+    f = open(path, "wb")
+    try:
+        f.write("\xef\xbb\xbf")   # UTF-8 BOM
+        f.write((u"Multipage text format 0\nSeparator: %s\n" % separator)
+                .encode("utf-8"))
+        first = True
+        for name, text in pages:
+            if not first:
+                f.write((u"\n%s\n" % separator).encode("utf-8"))
+            first = False
+            f.write((u"%s\n%s" % (name, text)).encode("utf-8"))
+    finally:
+        f.close()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(2)
+
+    kwargs = {}
+    if len(sys.argv) > 2:
+        kwargs["pages"] = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        kwargs["seed"] = int(sys.argv[3])
+
+    pages = generatePages(**kwargs)
+    writeMultiPageText(sys.argv[1], pages)
+    print "%i pages, %i KB" % (len(pages),
+            sum(len(text) for name, text in pages) // 1024)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import os, os.path
+import os, os.path, functools
 import subprocess
 
 import wx
@@ -63,6 +63,87 @@ class GptHandler:
         pass
 
 
+    def _render(self, value, noerror, dstFullPath):
+        """
+        Run Gnuplot to create PNG file dstFullPath out of script value.
+        Returns the error response (bytestring, empty if no error).
+        """
+        # Prepend source code with appropriate settings for PNG output
+        srcCode = ("set terminal png\nset output '%s'\n" % dstFullPath) + \
+                value
+
+        # Retrieve quoted content of the insertion
+        bstr = lineendToOs(mbcsEnc(srcCode, "replace")[0])
+
+        # Store token content in a temporary file
+        srcfilepath = createTempFile(bstr, ".gpt")
+        try:
+            cmdline = subprocess.list2cmdline((self.extAppExe, srcfilepath))
+            
+            # Run external application
+#             childIn, childOut, childErr = os.popen3(cmdline, "b")
+            popenObject = subprocess.Popen(cmdline, shell=True,
+                    stderr=subprocess.PIPE, stdout=subprocess.PIPE,
+                    stdin=subprocess.PIPE)
+            childErr = popenObject.stderr
+            
+            # See http://bytes.com/topic/python/answers/634409-subprocess-handle-invalid-error
+            # why this is necessary
+            popenObject.stdin.close()
+            popenObject.stdout.close()
+
+            if noerror:
+                childErr.read()
+                errResponse = ""
+            else:
+                errResponse = childErr.read()
+            
+            childErr.close()
+            popenObject.wait()
+        finally:
+            os.unlink(srcfilepath)
+
+        return errResponse
+
+
+    def _prepareRendering(self, exporter, insToken):
+        """
+        Returns tuple (renderCache, cacheKey, renderFct) for insToken or None
+        if there is nothing to render.
+        """
+        if not insToken.value or not self.extAppExe:
+            return None
+
+        appendices = [a.strip() for a in insToken.appendices]
+        noerror = u"noerror" in appendices
+        renderCache = exporter.getMainControl().getWikiDocument()\
+                .getInsertionRenderCache()
+        if u"nocache" in appendices:
+            # Result depends on other files (e.g. data to plot)
+            cacheKey = None
+        else:
+            # The output path is not part of the key, it differs on each call
+            cacheKey = renderCache.makeKey("Gnuplot", self.extAppExe, "png",
+                    noerror, insToken.value)
+
+        return renderCache, cacheKey, functools.partial(self._render,
+                insToken.value, noerror)
+
+
+    def prefetchContent(self, exporter, exportType, insToken):
+        """
+        Render the image for insToken into the render cache so that a
+        following createContent() only has to copy it. Called from
+        a worker thread.
+        """
+        rendering = self._prepareRendering(exporter, insToken)
+        if rendering is None:
+            return
+
+        renderCache, cacheKey, renderFct = rendering
+        renderCache.prefetch(cacheKey, ".png", renderFct)
+
+
     def createContent(self, exporter, exportType, insToken):
         """
         Handle an insertion and create the appropriate content.
@@ -91,6 +172,9 @@ class GptHandler:
             return u'<pre>' + _(u'[Please set path to Gnuplot executable]') +\
                     u'</pre>'
 
+        renderCache, cacheKey, renderFct = self._prepareRendering(exporter,
+                insToken)
+
         # Get exporters temporary file set (manages creation and deletion of
         # temporary files)
         tfs = exporter.getTempFileSet()
@@ -98,43 +182,10 @@ class GptHandler:
         pythonUrl = (exportType != "html_previewWX")
         dstFullPath = tfs.createTempFile("", ".png", relativeTo="")
         url = tfs.getRelativeUrl(None, dstFullPath, pythonUrl=pythonUrl)
-        
-        baseDir = os.path.dirname(exporter.getMainControl().getWikiConfigPath())
-
-        # Prepend source code with appropriate settings for PNG output
-        srcCode = ("set terminal png\nset output '%s'\n" % dstFullPath) + \
-                insToken.value
-
-        # Retrieve quoted content of the insertion
-        bstr = lineendToOs(mbcsEnc(srcCode, "replace")[0])
 
-        # Store token content in a temporary file
-        srcfilepath = createTempFile(bstr, ".gpt")
-        try:
-            cmdline = subprocess.list2cmdline((self.extAppExe, srcfilepath))
-            
-            # Run external application
-#             childIn, childOut, childErr = os.popen3(cmdline, "b")
-            popenObject = subprocess.Popen(cmdline, shell=True,
-                    stderr=subprocess.PIPE, stdout=subprocess.PIPE,
-                    stdin=subprocess.PIPE)
-            childErr = popenObject.stderr
-            
-            # See http://bytes.com/topic/python/answers/634409-subprocess-handle-invalid-error
-            # why this is necessary
-            popenObject.stdin.close()
-            popenObject.stdout.close()
+        # Copy from render cache, run external application only if needed
+        errResponse = renderCache.provide(cacheKey, dstFullPath, renderFct)
 
-            if u"noerror" in [a.strip() for a in insToken.appendices]:
-                childErr.read()
-                errResponse = ""
-            else:
-                errResponse = childErr.read()
-            
-            childErr.close()
-        finally:
-            os.unlink(srcfilepath)
-            
         if errResponse != "":
             errResponse = mbcsDec(errResponse, "replace")[0]
             return u'<pre>' + _(u'[Gnuplot error: %s]') % errResponse +\
@@ -155,7 +206,7 @@ class GptHandler:
         Returns a list of bytestrings describing additional features supported
         by the plugin. Currently not specified further.
         """
-        return ()
+        return ("prefetchContent",)
         
 
 def registerOptions(ver, app):
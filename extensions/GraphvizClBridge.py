@@ -1,4 +1,4 @@
-import os, os.path, traceback
+import os, os.path, traceback, functools
 import subprocess
 
 import wx
@@ -75,6 +75,83 @@ class GraphVizBaseHandler:
         pass
 
 
+    def _render(self, bstr, noerror, dstFullPath):
+        """
+        Run the external application to create PNG file dstFullPath out of
+        source bstr. Returns the error response (bytestring, empty if no
+        error).
+        """
+        # Store token content in a temporary file
+        srcfilepath = createTempFile(bstr, ".dot")
+        try:
+            cmdline = subprocess.list2cmdline((self.extAppExe, "-Tpng", "-o" + dstFullPath,
+                    srcfilepath))
+
+            # Run external application
+#             childIn, childOut, childErr = os.popen3(cmdline, "b")
+            popenObject = subprocess.Popen(cmdline, shell=True,
+                    stderr=subprocess.PIPE, stdout=subprocess.PIPE,
+                    stdin=subprocess.PIPE)
+            childErr = popenObject.stderr
+
+            # See http://bytes.com/topic/python/answers/634409-subprocess-handle-invalid-error
+            # why this is necessary
+            popenObject.stdin.close()
+            popenObject.stdout.close()
+
+            if noerror:
+                childErr.read()
+                errResponse = ""
+            else:
+                errResponse = childErr.read()
+            
+            childErr.close()
+            popenObject.wait()
+        finally:
+            os.unlink(srcfilepath)
+
+        return errResponse
+
+
+    def _prepareRendering(self, exporter, insToken):
+        """
+        Returns tuple (renderCache, cacheKey, renderFct) for insToken or None
+        if there is nothing to render.
+        """
+        # Retrieve quoted content of the insertion
+        bstr = lineendToOs(utf8Enc(insToken.value, "replace")[0])   # mbcsEnc
+
+        if not bstr or not self.extAppExe:
+            return None
+
+        appendices = [a.strip() for a in insToken.appendices]
+        noerror = u"noerror" in appendices
+        renderCache = exporter.getMainControl().getWikiDocument()\
+                .getInsertionRenderCache()
+        if u"nocache" in appendices:
+            cacheKey = None
+        else:
+            cacheKey = renderCache.makeKey(self.EXAPPNAME, self.extAppExe,
+                    "-Tpng", noerror, bstr)
+
+        return renderCache, cacheKey, functools.partial(self._render, bstr,
+                noerror)
+
+
+    def prefetchContent(self, exporter, exportType, insToken):
+        """
+        Render the image for insToken into the render cache so that a
+        following createContent() only has to copy it. Called from
+        a worker thread.
+        """
+        rendering = self._prepareRendering(exporter, insToken)
+        if rendering is None:
+            return
+
+        renderCache, cacheKey, renderFct = rendering
+        renderCache.prefetch(cacheKey, ".png", renderFct)
+
+
     def createContent(self, exporter, exportType, insToken):
         """
         Handle an insertion and create the appropriate content.
@@ -94,10 +171,7 @@ class GraphVizBaseHandler:
         For HtmlExporter a unistring is returned with the HTML code
         to insert instead of the insertion.        
         """
-        # Retrieve quoted content of the insertion
-        bstr = lineendToOs(utf8Enc(insToken.value, "replace")[0])   # mbcsEnc
-
-        if not bstr:
+        if not insToken.value:
             # Nothing in, nothing out
             return u""
         
@@ -106,6 +180,12 @@ class GraphVizBaseHandler:
             return u'<pre>' + _(u'[Please set path to GraphViz executables]') + \
                     '</pre>'
 
+        rendering = self._prepareRendering(exporter, insToken)
+        if rendering is None:
+            return u""
+
+        renderCache, cacheKey, renderFct = rendering
+
         # Get exporters temporary file set (manages creation and deletion of
         # temporary files)
         tfs = exporter.getTempFileSet()
@@ -114,34 +194,9 @@ class GraphVizBaseHandler:
         dstFullPath = tfs.createTempFile("", ".png", relativeTo="")
         url = tfs.getRelativeUrl(None, dstFullPath, pythonUrl=pythonUrl)
 
-        # Store token content in a temporary file
-        srcfilepath = createTempFile(bstr, ".dot")
-        try:
-            cmdline = subprocess.list2cmdline((self.extAppExe, "-Tpng", "-o" + dstFullPath,
-                    srcfilepath))
+        # Copy from render cache, run external application only if needed
+        errResponse = renderCache.provide(cacheKey, dstFullPath, renderFct)
 
-            # Run external application
-#             childIn, childOut, childErr = os.popen3(cmdline, "b")
-            popenObject = subprocess.Popen(cmdline, shell=True,
-                    stderr=subprocess.PIPE, stdout=subprocess.PIPE,
-                    stdin=subprocess.PIPE)
-            childErr = popenObject.stderr
-
-            # See http://bytes.com/topic/python/answers/634409-subprocess-handle-invalid-error
-            # why this is necessary
-            popenObject.stdin.close()
-            popenObject.stdout.close()
-
-            if u"noerror" in [a.strip() for a in insToken.appendices]:
-                childErr.read()
-                errResponse = ""
-            else:
-                errResponse = childErr.read()
-            
-            childErr.close()
-        finally:
-            os.unlink(srcfilepath)
-            
         if errResponse != "":
             appname = mbcsDec(self.EXAPPNAME, "replace")[0]
             errResponse = mbcsDec(errResponse, "replace")[0]
@@ -164,7 +219,7 @@ class GraphVizBaseHandler:
         Returns a list of bytestrings describing additional features supported
         by the plugin. Currently not specified further.
         """
-        return ()
+        return ("prefetchContent",)
         
 
 
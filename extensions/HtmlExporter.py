@@ -3,7 +3,8 @@ from __future__ import with_statement
 ## profile = profilehooks.profile(filename="profile.prf", immediate=False)
 
 # from Enum import Enumeration
-import sys, os, os.path, string, re, traceback, locale, time, urllib
+import sys, os, os.path, string, re, traceback, locale, time, urllib, hashlib, \
+        struct, multiprocessing
 from os.path import join, exists
 from cStringIO import StringIO
 import shutil
@@ -17,18 +18,21 @@ from pwiki.wxHelper import XrcControls, GUI_ID, wxKeyFunctionSink
 
 import Consts
 from pwiki.WikiExceptions import WikiWordNotFoundException, ExportException, \
-        InternalError
+        InternalError, SerializationException
 from pwiki.ParseUtilities import getFootnoteAnchorDict
 from pwiki.Utilities import calcResizeArIntoBoundingBox
 from pwiki.StringOps import *
-from pwiki import StringOps, Serialization
+from pwiki import StringOps, Serialization, ImageDimensions
+from pwiki.Serialization import SerializeStream
 from pwiki.WikiPyparsing import StackedCopyDict, SyntaxNode, buildSyntaxNode
 from pwiki.TempFileSet import TempFileSet
 
 from pwiki.SearchAndReplace import SearchReplaceOperation, ListWikiPagesOperation, \
         ListItemWithSubtreeWikiPagesNode
 
-from pwiki import SystemInfo, PluginManager, OsAbstract, DocPages
+from pwiki import SystemInfo, PluginManager, OsAbstract, DocPages, \
+        Instrumentation
+from pwiki.AppAccess import getApp
 
 
 from pwiki.Exporters import AbstractExporter
@@ -87,6 +91,7 @@ class BasicLinkConverter(object):
 
 class LinkConverterForHtmlSingleFilesExport(BasicLinkConverter):
     def getLinkForWikiWord(self, word, default = None):
+        self.htmlExporter.addDependency(u"linkterm", word)
         relUnAlias = self.wikiDocument.getWikiPageNameForLinkTerm(word)
         if relUnAlias is None:
             return default
@@ -99,12 +104,14 @@ class LinkConverterForHtmlSingleFilesExport(BasicLinkConverter):
 
 class LinkConverterForHtmlMultiPageExport(BasicLinkConverter):
     def getLinkForWikiWord(self, word, default = None):
+        self.htmlExporter.addDependency(u"linkterm", word)
         relUnAlias = self.wikiDocument.getWikiPageNameForLinkTerm(word)
         if relUnAlias is None:
             return default
         if not self.htmlExporter.shouldExport(word):
             return default
 
+        self.htmlExporter.addDependency(u"wordlist")
         if relUnAlias not in self.htmlExporter.wordList:
             return default
 
@@ -133,6 +140,314 @@ class FilenameConverter(object):
 
 
 
+# Tuple (<HtmlExporter>, <render function>) used by the worker processes of
+# a parallel export. It is set while the processes are forked so they
+# inherit it. A worker sets it to None if it can't access the wiki.
+_workerExporter = None
+
+def _initExportWorker():
+    global _workerExporter
+
+    # An exception would end the worker and the pool would start
+    # a new one again and again
+    try:
+        _workerExporter[0].wikiDocument.reconnectInChildProcess()
+    except Exception:
+        traceback.print_exc()
+        _workerExporter = None
+
+
+def _renderInExportWorker(word):
+    """
+    Render page word in a worker process. Returns tuple (result,
+    dependencies, tempFiles, storageFiles) with the storage files referenced
+    since the previous call as last item or None if the worker can't
+    render.
+    """
+    if _workerExporter is None:
+        return None
+
+    exporter, renderPageFct = _workerExporter
+    result, dependencies, tempFiles = exporter._renderPageRecording(
+            renderPageFct, word)
+
+    storageFiles = exporter.referencedStorageFiles
+    if storageFiles is None:
+        storageFiles = set()
+    else:
+        exporter.referencedStorageFiles = set()
+
+    return result, dependencies, tempFiles, storageFiles
+
+
+
+# Kinds of dependencies whose second item is the wiki word or link term
+# they are read for. They are indexed by this item so that only those of
+# changed words, relations and terms must be checked. The others
+# (e.g. the list of parentless pages) may change with any page.
+_KEYED_DEPENDENCY_KINDS = frozenset((u"page", u"attr", u"tree", u"parents",
+        u"children", u"linkterm"))
+
+
+class ExportOutputRecord(object):
+    """
+    Manifest entry of an output file of an incremental HTML export
+    """
+    __slots__ = ("source", "contentHash", "dependencies", "volatileFiles")
+
+    def __init__(self, source, contentHash, dependencies, volatileFiles):
+        # What is rendered into the file: u"wikipage/" + wiki word,
+        # u"index" or u"multipage"
+        self.source = source
+        # SHA-1 digest of the written bytes
+        self.contentHash = contentHash
+        # Dictionary {dependency: fingerprint} or None if unknown
+        self.dependencies = dependencies
+        # Paths of volatile files created for the output, relative to
+        # export destination
+        self.volatileFiles = volatileFiles
+
+
+class ExportDependencyGraph(object):
+    """
+    Dependency graph and manifest of an incremental HTML export.
+
+    For each output file (name relative to the export destination) an
+    ExportOutputRecord stores what the file was rendered from, the hash of
+    its content and the dependencies read while rendering it.
+    A dependency is a tuple of unistrings, the first item is the kind of
+    data read (see HtmlExporter._getDependencyFingerprint()), for kinds in
+    _KEYED_DEPENDENCY_KINDS the second item is the wiki word. Each dependency
+    is stored with a fingerprint of the data at rendering time, an output is
+    out of date if a fingerprint differs from the current one.
+
+    The manifest is stored in the export destination so incremental exports
+    also work across sessions.
+    """
+    MANIFEST_NAME = u".wikidpad_export_manifest"
+    MANIFEST_MAGIC = "WDHtmlExpManifest"
+    FORMAT_VERSION = 0
+
+    def __init__(self, exportDest):
+        self.exportDest = exportDest
+        self.settingsFingerprint = ""
+        # Dictionary {outputName: ExportOutputRecord}
+        self.outputs = {}
+        # Dictionary {dependency: set of outputNames}
+        self.dependents = {}
+        # Dictionary {key: set of dependencies}, key is the word or term
+        # of keyed dependencies, None for the others
+        self.keyedDependencies = {}
+        # Dictionary {kind: number of dependencies}
+        self.kindCounts = {}
+
+
+    @staticmethod
+    def _getDependencyKey(dep):
+        if dep[0] in _KEYED_DEPENDENCY_KINDS:
+            return dep[1]
+        return None
+
+
+    def _addToIndex(self, outputName, record):
+        if record.dependencies is None:
+            return
+        for dep in record.dependencies:
+            names = self.dependents.get(dep)
+            if names is None:
+                names = set()
+                self.dependents[dep] = names
+                self.keyedDependencies.setdefault(
+                        self._getDependencyKey(dep), set()).add(dep)
+                self.kindCounts[dep[0]] = self.kindCounts.get(dep[0], 0) + 1
+            names.add(outputName)
+
+
+    def _removeFromIndex(self, outputName, record):
+        if record.dependencies is None:
+            return
+        for dep in record.dependencies:
+            names = self.dependents.get(dep)
+            if names is None:
+                continue
+            names.discard(outputName)
+            if not names:
+                del self.dependents[dep]
+
+                key = self._getDependencyKey(dep)
+                deps = self.keyedDependencies[key]
+                deps.discard(dep)
+                if not deps:
+                    del self.keyedDependencies[key]
+
+                self.kindCounts[dep[0]] -= 1
+                if self.kindCounts[dep[0]] == 0:
+                    del self.kindCounts[dep[0]]
+
+
+    def isEmpty(self):
+        return len(self.outputs) == 0
+
+
+    def getRecord(self, outputName):
+        return self.outputs.get(outputName)
+
+
+    def setRecord(self, outputName, record):
+        self.removeRecord(outputName)
+        self.outputs[outputName] = record
+        self._addToIndex(outputName, record)
+
+
+    def removeRecord(self, outputName):
+        record = self.outputs.pop(outputName, None)
+        if record is not None:
+            self._removeFromIndex(outputName, record)
+
+        return record
+
+
+    def getOutputNames(self):
+        return self.outputs.keys()
+
+
+    def iterDependencies(self):
+        return self.dependents.iterkeys()
+
+
+    def getDependentOutputs(self, dependency):
+        return self.dependents.get(dependency, ())
+
+
+    def getDependenciesForKey(self, key):
+        """
+        Return the keyed dependencies on data of word or term key or,
+        if key is None, all dependencies which aren't keyed.
+        """
+        return self.keyedDependencies.get(key, ())
+
+
+    def hasDependencyKind(self, kind):
+        return kind in self.kindCounts
+
+
+    def _getManifestPath(self):
+        return join(self.exportDest, self.MANIFEST_NAME)
+
+
+    def load(self, settingsFingerprint):
+        """
+        Read manifest from export destination. If it doesn't exist or
+        can't be read, the graph is empty. If it was written with other
+        export settings, the records are kept but the dependencies are
+        unknown so all outputs are rendered again (but not rewritten if
+        unchanged).
+        """
+        self.outputs = {}
+        self.dependents = {}
+        self.keyedDependencies = {}
+        self.kindCounts = {}
+        self.settingsFingerprint = settingsFingerprint
+
+        try:
+            f = open(pathEnc(self._getManifestPath()), "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except IOError:
+            return
+
+        try:
+            oldSettings, outputs = self._readManifest(SerializeStream(
+                    stringBuf=data, readMode=True))
+        except (SerializationException, struct.error):
+            traceback.print_exc()
+            return
+
+        if oldSettings != settingsFingerprint:
+            for record in outputs.itervalues():
+                record.dependencies = None
+
+        for outputName, record in outputs.iteritems():
+            self.setRecord(outputName, record)
+
+
+    def save(self):
+        """
+        Write manifest to export destination
+        """
+        stream = SerializeStream(stringBuf="", readMode=False)
+        self._writeManifest(stream)
+        try:
+            f = open(pathEnc(self._getManifestPath()), "wb")
+            try:
+                f.write(stream.getBytes())
+            finally:
+                f.close()
+        except IOError, e:
+            raise ExportException(unicode(e))
+
+
+    def _readManifest(self, stream):
+        if stream.readBytes(len(self.MANIFEST_MAGIC)) != self.MANIFEST_MAGIC:
+            raise SerializationException(u"Not an export manifest")
+        if stream.serUint8(0) != self.FORMAT_VERSION:
+            raise SerializationException(u"Unknown export manifest version")
+
+        settingsFingerprint = stream.serString("")
+        outputs = {}
+        for i in xrange(stream.serUint32(0)):
+            outputName = stream.serUniUtf8(u"")
+            source = stream.serUniUtf8(u"")
+            contentHash = stream.serString("")
+
+            if stream.serBool(False):
+                dependencies = {}
+                for j in xrange(stream.serUint32(0)):
+                    dep = tuple(stream.serUniUtf8(u"")
+                            for k in xrange(stream.serUint8(0)))
+                    fingerprint = stream.serString("")
+                    if fingerprint == "":
+                        fingerprint = None
+                    dependencies[dep] = fingerprint
+            else:
+                dependencies = None
+
+            volatileFiles = [stream.serUniUtf8(u"")
+                    for j in xrange(stream.serUint32(0))]
+
+            outputs[outputName] = ExportOutputRecord(source, contentHash,
+                    dependencies, volatileFiles)
+
+        return settingsFingerprint, outputs
+
+
+    def _writeManifest(self, stream):
+        stream.writeBytes(self.MANIFEST_MAGIC)
+        stream.serUint8(self.FORMAT_VERSION)
+        stream.serString(self.settingsFingerprint)
+        stream.serUint32(len(self.outputs))
+        for outputName, record in self.outputs.iteritems():
+            stream.serUniUtf8(outputName)
+            stream.serUniUtf8(record.source)
+            stream.serString(record.contentHash)
+
+            stream.serBool(record.dependencies is not None)
+            if record.dependencies is not None:
+                stream.serUint32(len(record.dependencies))
+                for dep, fingerprint in record.dependencies.iteritems():
+                    stream.serUint8(len(dep))
+                    for part in dep:
+                        stream.serUniUtf8(part)
+                    stream.serString(fingerprint or "")
+
+            stream.serUint32(len(record.volatileFiles))
+            for path in record.volatileFiles:
+                stream.serUniUtf8(path)
+
+
+
 class SizeValue(object):
     """
     Represents a single size value, either a pixel or percent size.
@@ -419,6 +734,12 @@ class TableCell(object):
 # TODO UTF-8 support for HTML? Other encodings?
 
 class HtmlExporter(AbstractExporter):
+    # Parallel export uses at most one worker process per this number of
+    # pages to render
+    PARALLEL_MIN_PAGES_PER_PROCESS = 20
+    # Number of pages a worker process renders in one batch
+    PARALLEL_PAGES_PER_BATCH = 10
+
     def __init__(self, mainControl):
         """
         mainControl -- PersonalWikiFrame object. Part of "Exporters" plugin API
@@ -447,6 +768,16 @@ class HtmlExporter(AbstractExporter):
         self.filenameConverter = FilenameConverter(False)
 #         self.convertFilename = removeBracketsFilename   # lambda s: mbcsEnc(s, "replace")[0]
 
+        # ExportDependencyGraph if export is incremental, None otherwise
+        self.dependencyGraph = None
+        # Set of dependencies of the output currently rendered or None
+        self.recordedDependencies = None
+        # Dictionary {dependency: fingerprint} valid during one update run
+        self.fingerprintCache = None
+        # Dictionary {word: (children, aliases)} with the relations and
+        # aliases of all wiki pages during continuous export, else None
+        self.relationState = None
+
         self.result = None
         
         # Flag to control how to push output into self.result
@@ -632,8 +963,10 @@ class HtmlExporter(AbstractExporter):
         return True
 
 
+    @Instrumentation.instrumented("export.html")
     def export(self, wikiDocument, wordList, exportType, exportDest,
-            compatFilenames, addOpt, progressHandler, tempFileSetReset=True):
+            compatFilenames, addOpt, progressHandler, tempFileSetReset=True,
+            incremental=None):
         """
         Part of "Exporters" plugin API.
         Run export operation. This is only called for real exports,
@@ -646,19 +979,37 @@ class HtmlExporter(AbstractExporter):
         compatFilenames -- Should the filenames be encoded to be lowest
                            level compatible (ascii only)?
         addOpt -- additional options as returned by getAddOpt()
+        incremental -- If True, only outputs whose dependencies changed
+                since the last export to exportDest are rendered again
+                (see ExportDependencyGraph). None: take from option
+                "html_export_incremental"
         """
         if not self.setJobData(wikiDocument, wordList, exportType, exportDest,
                 compatFilenames, addOpt, progressHandler):
             return
-            
+
+        if incremental is None:
+            incremental = self.mainControl.getConfig().getboolean("main",
+                    "html_export_incremental", False)
+
         if exportType in (u"html_single", u"html_multi"):
             volatileDir = self.addOpt[3]
 
             volatileDir = join(self.exportDest, volatileDir)
 
+            if incremental:
+                self.dependencyGraph = ExportDependencyGraph(self.exportDest)
+                self.dependencyGraph.load(
+                        self._getExportSettingsFingerprint())
+            else:
+                self.dependencyGraph = None
+
             # Check if volatileDir is really a subdirectory of exportDest
             clearVolatile = testContainedInDir(self.exportDest, volatileDir)
-            if clearVolatile:
+            # Volatile files of outputs which are not rendered again
+            # must be kept in incremental mode
+            if clearVolatile and (self.dependencyGraph is None or
+                    self.dependencyGraph.isEmpty()):
                 # Warning!!! rmtree() is very dangerous, don't make a mistake here!
                 shutil.rmtree(volatileDir, True)
 
@@ -670,16 +1021,26 @@ class HtmlExporter(AbstractExporter):
             self.referencedStorageFiles = set()
 
 
-        if exportType == u"html_multi":
-            browserFile = self.exportHtmlMultiFile()
-        elif exportType == u"html_single":
-            browserFile = self._exportHtmlSingleFiles(self.wordList)
+        self.fingerprintCache = {}
+        try:
+            if exportType == u"html_multi":
+                browserFile = self.exportHtmlMultiFile()
+            elif exportType == u"html_single":
+                self._removeStaleOutputs()
+                browserFile = self._exportHtmlSingleFiles(self.wordList)
+        finally:
+            self.fingerprintCache = None
+
+        if self.dependencyGraph is not None:
+            self.dependencyGraph.save()
+
+        self.wikiDocument.getImageDimensionCache().save()
 
         # Other supported types: html_previewWX, html_previewIE, html_previewMOZ,
         #   html_previewWK
         # are not handled in this function
 
-        wx.GetApp().getInsertionPluginManager().taskEnd()
+        getApp().getInsertionPluginManager().taskEnd()
 
         if self.referencedStorageFiles is not None:
             # Some files must be available
@@ -703,6 +1064,7 @@ class HtmlExporter(AbstractExporter):
             self.tempFileSet.reset()
             self.tempFileSet = None
             self.copiedTempFileCache = None
+            self.dependencyGraph = None
 
 
     def startContinuousExport(self, wikiDocument, listPagesOperation,
@@ -717,18 +1079,24 @@ class HtmlExporter(AbstractExporter):
         
         self.listPagesOperation.beginWikiSearch(wikiDocument)
 
-        # Initially static export
+        # Initially static export, the recorded dependencies decide later
+        # which outputs must be updated
         self.export(wikiDocument, wordList, exportType, exportDest,
-            compatFilenames, addOpt, progressHandler, tempFileSetReset=False)
+            compatFilenames, addOpt, progressHandler, tempFileSetReset=False,
+            incremental=True)
             
         self.progressHandler = None
+        self.relationState = self._readRelationState(
+                wikiDocument.getWikiData().getAllDefinedWikiPageNames())
 
+        # Pages changed by bulk operations are exported together once.
+        # Renaming is coalesced as well to keep the order of the events.
         self.__sinkWikiDocument = wxKeyFunctionSink((
                 ("deleted wiki page", self.onDeletedWikiPage),
                 ("renamed wiki page", self.onRenamedWikiPage),
                 ("updated wiki page", self.onUpdatedWikiPage)
 #                 ("saving new wiki page", self.onSavingNewWikiPage)
-        ), self.wikiDocument.getMiscEvent())
+        ), self.wikiDocument.getMiscEvent(), coalesced=True)
 
 
     def stopContinuousExport(self):
@@ -740,33 +1108,29 @@ class HtmlExporter(AbstractExporter):
         self.tempFileSet.reset()
         self.tempFileSet = None
         self.copiedTempFileCache = None
+        self.dependencyGraph = None
+        self.relationState = None
 
 
     def onDeletedWikiPage(self, miscEvt):
-        wikiWord = miscEvt.get("wikiPage").getWikiWord()
+        changedWords = miscEvt.getAffectedPages().keys()
 
-        if wikiWord not in self.wordList:
-            return
-            
-        self.wordList.remove(wikiWord)
-        
-        if self.exportType == u"html_multi":
-            self.exportHtmlMultiFile()
+        for wikiWord in changedWords:
+            if wikiWord in self.wordList:
+                self.wordList.remove(wikiWord)
 
-        elif self.exportType == u"html_single":
-            self._exportHtmlSingleFiles([])
+        self._updateContinuousExport(changedWords)
 
 
     def onRenamedWikiPage(self, miscEvt):
         oldWord = miscEvt.get("wikiPage").getWikiWord()
         newWord = miscEvt.get("newWord")
-        newPage = self.wikiDocument.getWikiPage(newWord)
+        # None if the page was deleted or renamed again in the meantime
+        newPage = miscEvt.getAffectedPages().get(newWord)
         
         oldInList = oldWord in self.wordList
-        newInList = self.listPagesOperation.testWikiPageByDocPage(newPage)
-
-        if not oldInList and not newInList:
-            return
+        newInList = newPage is not None and \
+                self.listPagesOperation.testWikiPageByDocPage(newPage)
 
         if oldInList:
             self.wordList.remove(oldWord)
@@ -774,52 +1138,584 @@ class HtmlExporter(AbstractExporter):
         if newInList:
             self.wordList.append(newWord)
 
-
-        if self.exportType == u"html_multi":
-            self.exportHtmlMultiFile()
-
-        elif self.exportType == u"html_single":
-            if newInList:
-                updList = [newWord]
-            else:
-                updList = []
-
-            self._exportHtmlSingleFiles(updList)
+        self._updateContinuousExport((oldWord, newWord))
 
 
     def onUpdatedWikiPage(self, miscEvt):
-        wikiPage = miscEvt.get("wikiPage")
-        wikiWord = wikiPage.getWikiWord()
+        changedWords = []
 
-        oldInList = wikiWord in self.wordList
-        newInList = self.listPagesOperation.testWikiPageByDocPage(wikiPage)
+        for wikiWord, wikiPage in miscEvt.getAffectedPages().iteritems():
+            # wikiPage is None if page was renamed or deleted in the meantime
+            oldInList = wikiWord in self.wordList
+            newInList = wikiPage is not None and \
+                    self.listPagesOperation.testWikiPageByDocPage(wikiPage)
 
-        if not oldInList:
-            if not newInList:
-                # Current set not affected
-                return
-            else:
+            if not oldInList and newInList:
                 self.wordList.append(wikiWord)
-                updList = [wikiWord]
-        else:
-            if not newInList:
+            elif oldInList and not newInList:
                 self.wordList.remove(wikiWord)
-                updList = []
-            else:
-                updList = [wikiWord]
-        
-        if not wikiWord in self.wordList:
+
+            changedWords.append(wikiWord)
+
+        try:
+            self._updateContinuousExport(changedWords)
+        except WikiWordNotFoundException:
+            pass
+
+
+    def _updateContinuousExport(self, changedWords):
+        """
+        Render again all outputs which depend on data of the wiki pages
+        changedWords or on wiki-wide data and are out of date now.
+        Exported pages not existing yet are rendered as well.
+        """
+        graph = self.dependencyGraph
+        if graph is None:
             return
 
+        self.fingerprintCache = {}
         try:
+            outdated = self._findOutdatedOutputs(changedWords)
+
             if self.exportType == u"html_multi":
-                self.exportHtmlMultiFile()
-    
+                if len(outdated) > 0:
+                    self.exportHtmlMultiFile()
+
             elif self.exportType == u"html_single":
+                self._removeStaleOutputs()
+
+                wordSet = set(self.wordList)
+                updList = []
+                for outputName in outdated:
+                    record = graph.getRecord(outputName)
+                    if record is None or \
+                            not record.source.startswith(u"wikipage/"):
+                        continue
+                    word = record.source[9:]
+                    if word in wordSet and word not in changedWords:
+                        updList.append(word)
+
+                updList += [word for word in changedWords if word in wordSet]
+
                 self._exportHtmlSingleFiles(updList)
-        except WikiWordNotFoundException:
-            pass
+        finally:
+            self.fingerprintCache = None
+
+        graph.save()
+
+
+    def _readRelationState(self, words):
+        """
+        Return dictionary {word: (children, aliases)} for the existing wiki
+        pages of words. children is the set of the relations of the page and
+        the page names they resolve to, aliases the set of its aliases.
+        """
+        wikiData = self.wikiDocument.getWikiData()
+        words = [word for word in words
+                if wikiData.isDefinedWikiPageName(word)]
+        if len(words) == 0:
+            return {}
+
+        aliases = {}
+        if len(words) == 1:
+            triples = wikiData.getAttributeTriples(words[0], u"alias", None)
+        else:
+            triples = wikiData.getAttributeTriples(None, u"alias", None)
+        for word, key, value in triples:
+            aliases.setdefault(word, set()).add(value)
+
+        result = {}
+        for word, targets in wikiData.getChildRelationshipTargetsForWords(
+                words).iteritems():
+            children = set()
+            for relation, pageName in targets:
+                children.add(relation)
+                if pageName is not None:
+                    children.add(pageName)
+
+            result[word] = (frozenset(children),
+                    frozenset(aliases.get(word, ())))
+
+        return result
+
+
+    def _findOutdatedOutputs(self, changedWords):
+        """
+        Return set of names of outputs in the dependency graph for which
+        a dependency on data of the wiki pages changedWords or on
+        wiki-wide data has a different fingerprint now.
+
+        Only the dependencies keyed by the changed words, by the words
+        whose parents changed and by the changed link terms are checked
+        (see ExportDependencyGraph.getDependenciesForKey()), so the cost
+        doesn't grow with the size of the export.
+        """
+        graph = self.dependencyGraph
+        wikiData = self.wikiDocument.getWikiData()
+        changedWords = set(changedWords)
+        keys = set(changedWords)
+        relationsChanged = False
+        treeWords = set()
+
+        newState = self._readRelationState(changedWords)
+        emptyState = (frozenset(), frozenset())
+        for word in changedWords:
+            oldChildren, oldAliases = self.relationState.get(word, emptyState)
+            children, aliases = newState.get(word, emptyState)
+
+            # Parents of added or removed children changed
+            changedChildren = oldChildren ^ children
+            keys.update(changedChildren)
+            # Resolution of old and new link terms may change
+            keys.update(oldAliases | aliases)
+
+            existenceChanged = (word in self.relationState) != \
+                    (word in newState)
+            if existenceChanged:
+                # Children lists of pages linking to it changed
+                keys.update(wikiData.getParentRelationships(word))
+
+            if changedChildren or oldAliases != aliases or existenceChanged:
+                relationsChanged = True
+                treeWords.add(word)
+
+            if word in newState:
+                self.relationState[word] = newState[word]
+            else:
+                self.relationState.pop(word, None)
+
+        if treeWords and graph.hasDependencyKind(u"tree"):
+            # Trees of all ancestors contain the changed relations
+            todo = list(treeWords)
+            while todo:
+                for parent in wikiData.getParentRelationships(todo.pop()):
+                    if parent not in treeWords:
+                        treeWords.add(parent)
+                        todo.append(parent)
+            keys.update(treeWords)
+
+        deps = set()
+        for key in keys:
+            deps.update(graph.getDependenciesForKey(key))
+
+        for dep in graph.getDependenciesForKey(None):
+            if not relationsChanged and dep[0] in (u"parentless",
+                    u"undefined"):
+                continue
+            deps.add(dep)
+
+        result = set()
+        for dep in deps:
+            fingerprint = self._getCachedFingerprint(dep)
+            for outputName in graph.getDependentOutputs(dep):
+                if outputName in result:
+                    continue
+                if fingerprint is None or fingerprint != \
+                        graph.getRecord(outputName).dependencies.get(dep):
+                    result.add(outputName)
+
+        return result
+
+
+    def _removeStaleOutputs(self):
+        """
+        Remove the records of pages which are no longer exported from
+        the dependency graph and delete their volatile files. The HTML files
+        itself are left alone.
+        """
+        graph = self.dependencyGraph
+        if graph is None:
+            return
+
+        wordSet = set(self.wordList)
+        for outputName in graph.getOutputNames():
+            source = graph.getRecord(outputName).source
+            if source.startswith(u"wikipage/") and \
+                    source[9:] not in wordSet:
+                record = graph.removeRecord(outputName)
+                self._deleteVolatileFiles(record.volatileFiles)
+
+
+    def _deleteVolatileFiles(self, volatileFiles):
+        for path in volatileFiles:
+            try:
+                os.remove(pathEnc(join(self.exportDest, path)))
+            except OSError:
+                pass
+
+
+    def addDependency(self, *dependency):
+        """
+        Record that the output currently rendered reads the data
+        described by dependency (see ExportDependencyGraph and
+        _getDependencyFingerprint()). Does nothing if export isn't
+        incremental.
+        """
+        if self.recordedDependencies is not None:
+            self.recordedDependencies.add(dependency)
+
+
+    @staticmethod
+    def _makeFingerprint(value):
+        if isinstance(value, unicode):
+            value = utf8Enc(value, "replace")[0]
+        elif not isinstance(value, str):
+            value = repr(value)
+
+        return hashlib.sha1(value).digest()
+
+
+    def _getDependencyFingerprint(self, dependency):
+        """
+        Return fingerprint (bytestring) of the current state of the data
+        described by dependency or None if it can't be determined so the
+        depending output must always be rendered again.
+        """
+        kind = dependency[0]
+        wikiDocument = self.wikiDocument
+        wikiData = wikiDocument.getWikiData()
+
+        if kind in (u"page", u"attr", u"tree"):
+            word = dependency[1]
+            if not wikiDocument.isDefinedWikiPageName(word):
+                # All data of a non-existing page is missing
+                value = None
+            elif kind == u"page":
+                value = wikiDocument.getWikiPage(word).getLiveText()
+            elif kind == u"attr":
+                value = wikiDocument.getWikiPage(word).getAttributes().get(
+                        dependency[2])
+            else:  # kind == u"tree"
+                value = wikiDocument.getWikiPage(word).getFlatTree()
+
+        # Word lists are sorted before rendering, so the order in which the
+        # database returns them doesn't matter
+        elif kind == u"parents":
+            value = sorted(wikiData.getParentRelationships(dependency[1]))
+        elif kind == u"children":
+            value = sorted(wikiData.getChildRelationships(dependency[1],
+                    existingonly=(dependency[2] == u"existingonly"),
+                    selfreference=False))
+        elif kind == u"globalattr":
+            value = wikiData.getGlobalAttributes().get(
+                    u"global." + dependency[1])
+        elif kind == u"datablock":
+            value = wikiData.retrieveDataBlock(dependency[1])
+        elif kind == u"linkterm":
+            value = wikiDocument.getWikiPageNameForLinkTerm(dependency[1])
+        elif kind == u"wordlist":
+            value = self.wordList
+        elif kind == u"parentless":
+            value = sorted(wikiData.getParentlessWikiWords())
+        elif kind == u"undefined":
+            value = sorted(wikiData.getUndefinedWords())
+        else:
+            # u"volatile" or unknown, e.g. search results or evaluated
+            # expressions
+            return None
+
+        return self._makeFingerprint(value)
+
+
+    def _getCachedFingerprint(self, dependency):
+        if self.fingerprintCache is None:
+            return self._getDependencyFingerprint(dependency)
+
+        try:
+            return self.fingerprintCache[dependency]
+        except KeyError:
+            fingerprint = self._getDependencyFingerprint(dependency)
+            self.fingerprintCache[dependency] = fingerprint
+            return fingerprint
+
+
+    def _getExportSettingsFingerprint(self):
+        """
+        Return fingerprint of all settings influencing the exported files.
+        If they changed since the last incremental export, all outputs
+        must be rendered again.
+        """
+        config = self.mainControl.getConfig()
+        settings = [self.exportType, tuple(self.addOpt),
+                bool(self.compatFilenames), self.avoidDeadWikiLinks,
+                [dst for src, dst in self.styleSheetList]]
+        settings += [config.get("main", option, u"")
+                for option in self._INCREMENTAL_SETTINGS_OPTIONS]
+
+        return self._makeFingerprint(settings)
+
+    _INCREMENTAL_SETTINGS_OPTIONS = ("html_header_doctype",
+            "html_body_link", "html_body_alink", "html_body_vlink",
+            "html_body_text", "html_body_bgcolor", "html_body_background",
+            "html_export_proppattern", "html_export_proppattern_is_excluding",
+            "html_export_singlePage_sepLineCount", "insertions_allow_eval")
+
+
+    def getPreviewSettingsFingerprint(self):
+        """
+        Return fingerprint of all settings influencing an HTML preview
+        created by exportWikiPageToHtmlString().
+        """
+        config = self.mainControl.getConfig()
+        settings = [self.exportType,
+                [dst for src, dst in self.styleSheetList]]
+        settings += [config.get("main", option, u"")
+                for option in self._PREVIEW_SETTINGS_OPTIONS]
+
+        return self._makeFingerprint(settings)
+
+    _PREVIEW_SETTINGS_OPTIONS = ("html_header_doctype",
+            "html_body_link", "html_body_alink", "html_body_vlink",
+            "html_body_text", "html_body_bgcolor", "html_body_background",
+            "html_preview_proppattern", "html_preview_proppattern_is_excluding",
+            "facename_html_preview", "html_preview_pics_as_links",
+            "insertions_allow_eval")
+
+
+    def _isOutputUpToDate(self, outputName, source):
+        """
+        Test if output file outputName exists and was rendered from source
+        with the current state of all its dependencies.
+        """
+        record = self.dependencyGraph.getRecord(outputName)
+        if record is None or record.source != source or \
+                record.dependencies is None:
+            return False
+
+        if not exists(pathEnc(join(self.exportDest, outputName))):
+            return False
+
+        for dep, fingerprint in record.dependencies.iteritems():
+            if fingerprint is None or \
+                    self._getCachedFingerprint(dep) != fingerprint:
+                return False
+
+        return True
+
+
+    def _renderRecording(self, renderFct, record=False):
+        """
+        Call renderFct() and return tuple (result, dependencies, tempFiles)
+        with the return value of renderFct, the set of dependencies it
+        recorded (empty if export isn't incremental and record is False)
+        and the set of temporary files it created.
+        Calls may be nested, the dependencies are also recorded for the
+        outer call.
+        """
+        if self.tempFileSet is not None:
+            prevTempFiles = self.tempFileSet.getFileSet()
+        else:
+            prevTempFiles = set()
+
+        outerDependencies = self.recordedDependencies
+        if record or self.dependencyGraph is not None:
+            self.recordedDependencies = set()
+        try:
+            result = renderFct()
+            dependencies = self.recordedDependencies or set()
+        finally:
+            self.recordedDependencies = outerDependencies
+
+        if outerDependencies is not None:
+            outerDependencies.update(dependencies)
+
+        if self.tempFileSet is not None:
+            tempFiles = self.tempFileSet.getFileSet() - prevTempFiles
+        else:
+            tempFiles = set()
+
+        return result, dependencies, tempFiles
+
+
+    def _writeOutputFile(self, dir, outputName, source, renderFct):
+        """
+        Write the unistring returned by renderFct() into file outputName
+        in directory dir and return full path of the file.
+
+        During an incremental export to dir, nothing is done if the output
+        is up to date. Otherwise the dependencies read by renderFct are
+        recorded for the output and the file is only rewritten if its
+        content changed.
+        """
+        if self.dependencyGraph is not None and dir == self.exportDest and \
+                self._isOutputUpToDate(outputName, source):
+            return join(dir, outputName)
+
+        content, dependencies, tempFiles = self._renderRecording(renderFct)
+
+        return self._storeOutputFile(dir, outputName, source, content,
+                dependencies, tempFiles)
+
+
+    def _storeOutputFile(self, dir, outputName, source, content, dependencies,
+            tempFiles):
+        """
+        Write unistring content rendered from source into file outputName
+        in directory dir and return full path of the file. The other
+        parameters are as returned by _renderRecording().
+        """
+        outputFile = join(dir, outputName)
+        data = utf8Enc(content, "replace")[0]
+        graph = self.dependencyGraph
+
+        if graph is None or dir != self.exportDest:
+            if exists(pathEnc(outputFile)):
+                os.unlink(pathEnc(outputFile))
+
+            realfp = open(pathEnc(outputFile), "w")
+            try:
+                realfp.write(data)
+            finally:
+                realfp.close()
+
+            return outputFile
+
+        dependencies = dict((dep, self._getCachedFingerprint(dep))
+                for dep in dependencies)
+
+        volatileFiles = []
+        for path in tempFiles:
+            relPath = relativeFilePath(os.path.abspath(self.exportDest),
+                    os.path.abspath(path))
+            if relPath is not None:
+                volatileFiles.append(relPath)
+
+        contentHash = hashlib.sha1(data).digest()
+        oldRecord = graph.getRecord(outputName)
+
+        if oldRecord is not None and oldRecord.contentHash == contentHash \
+                and exists(pathEnc(outputFile)):
+            # Content unchanged, so the new volatile files aren't referenced
+            self._deleteVolatileFiles(volatileFiles)
+            volatileFiles = oldRecord.volatileFiles
+        else:
+            realfp = open(pathEnc(outputFile), "w")
+            try:
+                realfp.write(data)
+            finally:
+                realfp.close()
+
+            if oldRecord is not None:
+                self._deleteVolatileFiles(set(oldRecord.volatileFiles) -
+                        set(volatileFiles))
+
+        graph.setRecord(outputName, ExportOutputRecord(source, contentHash,
+                dependencies, volatileFiles))
+
+        return outputFile
+
+
+    def _getExportProcessCount(self, pageCount):
+        """
+        Return number of worker processes to render pageCount pages with,
+        0 if pages should be rendered in this process.
+        """
+        if not hasattr(os, "fork"):
+            # Workers must inherit the application state, so parallel
+            # export is only possible if processes can be forked
+            return 0
+
+        if not self.wikiDocument.canReconnectInChildProcess():
+            return 0
+
+        processCount = self.mainControl.getConfig().getint("main",
+                "html_export_processCount", 0)
+        cpuCount = multiprocessing.cpu_count()
+        if processCount < 0:
+            processCount = cpuCount
 
+        # More processes than processors would only add overhead
+        processCount = min(processCount, cpuCount,
+                pageCount // self.PARALLEL_MIN_PAGES_PER_PROCESS)
+        if processCount < 2:
+            return 0
+
+        return processCount
+
+
+    def _renderPageRecording(self, renderPageFct, word):
+        """
+        Call renderPageFct(word) through _renderRecording(). If it fails,
+        the error is printed and result is None.
+        """
+        try:
+            return self._renderRecording(lambda: renderPageFct(word))
+        except Exception, e:
+            sys.stderr.write("Error while exporting word %s" % repr(word))
+            traceback.print_exc()
+            return None, set(), set()
+
+
+    def _iterRenderedPages(self, words, renderPageFct):
+        """
+        Call renderPageFct(word) for each of words and iterate over
+        the results in order of words as returned by _renderPageRecording().
+
+        If configured, the pages are rendered in batches by worker
+        processes forked from this one. Temporary and referenced storage
+        files they create are added to those of this exporter. If a worker
+        fails to access the wiki, the remaining pages are rendered in this
+        process.
+        """
+        global _workerExporter
+
+        processCount = self._getExportProcessCount(len(words))
+        if processCount == 0:
+            for word in words:
+                yield self._renderPageRecording(renderPageFct, word)
+            return
+
+        # Workers inherit the exporter with the current configuration.
+        # Only the forking thread exists in a child process, so the other
+        # threads must not hold any locks or be in the middle of a database
+        # operation while forking
+        _workerExporter = (self, renderPageFct)
+        threadState = self.wikiDocument.pauseBackgroundThreads()
+        try:
+            # Workers open own database connections which only see
+            # committed data
+            self.wikiDocument.getWikiData().commit()
+            pool = multiprocessing.Pool(processCount, _initExportWorker)
+        except:
+            _workerExporter = None
+            raise
+        finally:
+            self.wikiDocument.resumeBackgroundThreads(threadState)
+
+        serialStart = len(words)
+        try:
+            for i, workerResult in enumerate(pool.imap(
+                    _renderInExportWorker, words,
+                    self.PARALLEL_PAGES_PER_BATCH)):
+                if workerResult is None:
+                    serialStart = i
+                    break
+
+                result, dependencies, tempFiles, storageFiles = workerResult
+
+                if self.tempFileSet is not None:
+                    for path in tempFiles:
+                        self.tempFileSet.addFile(path)
+                if self.referencedStorageFiles is not None:
+                    self.referencedStorageFiles.update(storageFiles)
+                if self.recordedDependencies is not None:
+                    self.recordedDependencies.update(dependencies)
+
+                yield result, dependencies, tempFiles
+
+            if serialStart < len(words):
+                pool.terminate()
+            else:
+                pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _workerExporter = None
+
+        for word in words[serialStart:]:
+            yield self._renderPageRecording(renderPageFct, word)
 
 
     def getTempFileSet(self):
@@ -864,98 +1760,111 @@ class HtmlExporter(AbstractExporter):
 
         self.buildStyleSheetList()
 
+        if tocMode is None:
+            tocMode = self.addOpt[1]
+
         if realfp is None:
-            outputFile = join(self.exportDest, 
+            outputFile = self._writeOutputFile(self.exportDest,
                     self.filenameConverter.getFilenameForWikiWord(
-                    self.mainControl.wikiName) + ".html")
-
-            if exists(pathEnc(outputFile)):
-                os.unlink(pathEnc(outputFile))
-
-            realfp = open(pathEnc(outputFile), "w")
+                    self.mainControl.wikiName) + ".html", u"multipage",
+                    lambda: u"".join(self._iterMultiFileParts(tocMode,
+                    sepLineCount)))
         else:
             outputFile = None
 
-        filePointer = utf8Writer(realfp, "replace")
+            filePointer = utf8Writer(realfp, "replace")
+            for part in self._iterMultiFileParts(tocMode, sepLineCount):
+                filePointer.write(part)
+            filePointer.reset()
+
+        self.copyCssFiles(self.exportDest)
+        return outputFile
+
 
-        filePointer.write(self.getFileHeaderMultiPage(self.mainControl.wikiName))
+    def _iterMultiFileParts(self, tocMode, sepLineCount):
+        """
+        Iterate over the unistrings forming the HTML file of a multi page
+        export.
+        """
+        yield self.getFileHeaderMultiPage(self.mainControl.wikiName)
 
         tocTitle = self.addOpt[2]
-        
-        if tocMode is None:
-            tocMode = self.addOpt[1]
 
         if tocMode == 1:
             # Write a content tree at beginning
             rootPage = self.mainControl.getWikiDocument().getWikiPage(
                         self.mainControl.getWikiDocument().getWikiName())
+            self.addDependency(u"tree", rootPage.getWikiWord())
             flatTree = rootPage.getFlatTree()
 
-            filePointer.write((u'<h2 class="wikidpad">%s</h2>\n'
-                    '%s%s<hr class="wikidpad" />') %
+            yield (u'<h2 class="wikidpad">%s</h2>\n'
+                    '%s%s<hr class="wikidpad" />') % \
                     (tocTitle, # = "Table of Contents"
                     self.getContentTreeBody(flatTree, linkAsFragments=True),
-                    u'<br class="wikidpad" />\n' * sepLineCount))
+                    u'<br class="wikidpad" />\n' * sepLineCount)
 
         elif tocMode == 2:
             # Write a content list at beginning
-            filePointer.write((u'<h2 class="wikidpad">%s</h2>\n'
-                    '%s%s<hr class="wikidpad" />') %
+            yield (u'<h2 class="wikidpad">%s</h2>\n'
+                    '%s%s<hr class="wikidpad" />') % \
                     (tocTitle, # = "Table of Contents"
                     self.getContentListBody(linkAsFragments=True),
-                    u'<br class="wikidpad" />\n' * sepLineCount))
+                    u'<br class="wikidpad" />\n' * sepLineCount)
 
 
         if self.progressHandler is not None:
             self.progressHandler.open(len(self.wordList))
             step = 0
 
+        self.addDependency(u"wordlist")
+
         # Then create the big page word by word
+        renderedParts = self._iterRenderedPages(self.wordList,
+                lambda word: self._getMultiFilePart(word, sepLineCount))
+
         for word in self.wordList:
+            part, dependencies, tempFiles = renderedParts.next()
+
             if self.progressHandler is not None:
                 step += 1
                 self.progressHandler.update(step, _(u"Exporting %s") % word)
 
-            wikiPage = self.wikiDocument.getWikiPage(word)
-            if not self.shouldExport(word, wikiPage):
-                continue
-                
-            try:
-                content = wikiPage.getLiveText()
-#                 formatDetails = wikiPage.getFormatDetails()
-                    
-                self.wordAnchor = _escapeAnchor(word)
-                formattedContent = self.formatContent(wikiPage)
-                
-                if self.avoidDeadWikiLinks:
-                    parentLinks = self.getParentLinks(wikiPage, False,
-                            self.wordList)
-                else:
-                    parentLinks = self.getParentLinks(wikiPage, False)
-
-                filePointer.write((u'<span class="wikidpad wiki-name-ref">'
-                        u'[<a name="%s" class="wikidpad">%s</a>]<br class="wikidpad" />'
-                        u'<br class="wikidpad" /></span>'
-                        u'<span class="wikidpad parent-nodes">parent nodes: %s'
-                        u'<br class="wikidpad" /></span>%s%s<hr class="wikidpad" />') %
-                        (self.wordAnchor, word,
-                        parentLinks,
-                        formattedContent,
-                        u'<br class="wikidpad" />\n' * sepLineCount))
-            except Exception, e:
-                traceback.print_exc()
+            if part is not None:
+                yield part
 
-        self.wordAnchor = None
+        yield self.getFileFooter()
 
-        filePointer.write(self.getFileFooter())
-        
-        filePointer.reset()
 
-        if outputFile is not None:
-            realfp.close()
+    def _getMultiFilePart(self, word, sepLineCount):
+        """
+        Return part of the HTML file of a multi page export for wiki
+        word word or None if it isn't exported.
+        """
+        wikiPage = self.wikiDocument.getWikiPage(word)
+        if not self.shouldExport(word, wikiPage):
+            return None
 
-        self.copyCssFiles(self.exportDest)
-        return outputFile
+        try:
+            self.wordAnchor = _escapeAnchor(word)
+            formattedContent = self.formatContent(wikiPage)
+
+            if self.avoidDeadWikiLinks:
+                parentLinks = self.getParentLinks(wikiPage, False,
+                        self.wordList)
+            else:
+                parentLinks = self.getParentLinks(wikiPage, False)
+
+            return (u'<span class="wikidpad wiki-name-ref">'
+                    u'[<a name="%s" class="wikidpad">%s</a>]<br class="wikidpad" />'
+                    u'<br class="wikidpad" /></span>'
+                    u'<span class="wikidpad parent-nodes">parent nodes: %s'
+                    u'<br class="wikidpad" /></span>%s%s<hr class="wikidpad" />') % \
+                    (self.wordAnchor, word,
+                    parentLinks,
+                    formattedContent,
+                    u'<br class="wikidpad" />\n' * sepLineCount)
+        finally:
+            self.wordAnchor = None
 
 
     def _exportHtmlSingleFiles(self, wordListToUpdate):
@@ -963,61 +1872,65 @@ class HtmlExporter(AbstractExporter):
                 self.wikiDocument, self))
         self.buildStyleSheetList()
 
+        # Assign file names in a fixed order, so they don't depend on the
+        # order in which pages and the links in them are rendered
+        for word in self.wordList:
+            self.filenameConverter.getFilenameForWikiWord(word)
+        for word in sorted(self.wikiDocument.getAllDefinedWikiPageNames()):
+            self.filenameConverter.getFilenameForWikiWord(word)
 
         if self.addOpt[1] in (1, 2):
-            # TODO Configurable name
-            outputFile = join(self.exportDest, pathEnc(u"index.html"))
             try:
-                if exists(pathEnc(outputFile)):
-                    os.unlink(pathEnc(outputFile))
-    
-                realfp = open(pathEnc(outputFile), "w")
-                fp = utf8Writer(realfp, "replace")
-
-                # TODO Factor out HTML header generation                
-                fp.write(self._getGenericHtmlHeader(self.addOpt[2]) + 
-                        u'    <body class="wikidpad">\n')
-                if self.addOpt[1] == 1:
-                    # Write a content tree
-                    rootPage = self.mainControl.getWikiDocument().getWikiPage(
-                                self.mainControl.getWikiDocument().getWikiName())
-                    flatTree = rootPage.getFlatTree()
-    
-                    fp.write((u'<h2 class="wikidpad">%s</h2>\n'
-                            '%s') %
-                            (self.addOpt[2],  # = "Table of Contents"
-                            self.getContentTreeBody(flatTree, linkAsFragments=False)
-                            ))
-                elif self.addOpt[1] == 2:
-                    # Write a content list
-                    fp.write((u'<h2 class="wikidpad">%s</h2>\n'
-                            '%s') %
-                            (self.addOpt[2],  # = "Table of Contents"
-                            self.getContentListBody(linkAsFragments=False)
-                            ))
-
-                fp.write(self.getFileFooter())
-
-                fp.reset()        
-                realfp.close()
+                # TODO Configurable name
+                self._writeOutputFile(self.exportDest, u"index.html",
+                        u"index", self._getIndexFileContent)
             except Exception, e:
                 traceback.print_exc()
 
+        wordsToRender = []
+        for word in wordListToUpdate:
+            wikiPage = self.wikiDocument.getWikiPage(word)
+            if not self.shouldExport(word, wikiPage):
+                continue
+
+            if self.dependencyGraph is not None and self._isOutputUpToDate(
+                    self.filenameConverter.getFilenameForWikiWord(word) +
+                    ".html", u"wikipage/" + word):
+                continue
+
+            wordsToRender.append(word)
+
+        renderedPages = self._iterRenderedPages(wordsToRender,
+                self._getSingleFilePage)
 
         if self.progressHandler is not None:
             self.progressHandler.open(len(self.wordList))
             step = 0
 
+        renderPos = 0
         for word in wordListToUpdate:
             if self.progressHandler is not None:
                 step += 1
                 self.progressHandler.update(step, _(u"Exporting %s") % word)
 
-            wikiPage = self.wikiDocument.getWikiPage(word)
-            if not self.shouldExport(word, wikiPage):
+            if renderPos == len(wordsToRender) or \
+                    wordsToRender[renderPos] != word:
+                # Not exported or up to date
                 continue
 
-            self.exportWordToHtmlPage(self.exportDest, word, False)
+            renderPos += 1
+            content, dependencies, tempFiles = renderedPages.next()
+            if content is None:
+                continue
+
+            try:
+                self._storeOutputFile(self.exportDest,
+                        self.filenameConverter.getFilenameForWikiWord(word) +
+                        ".html", u"wikipage/" + word, content, dependencies,
+                        tempFiles)
+            except Exception, e:
+                sys.stderr.write("Error while exporting word %s" % repr(word))
+                traceback.print_exc()
 
         self.copyCssFiles(self.exportDest)
         rootFile = join(self.exportDest,
@@ -1026,31 +1939,70 @@ class HtmlExporter(AbstractExporter):
         return rootFile
 
 
+    def _getSingleFilePage(self, word):
+        """
+        Return content of the HTML file for wiki word word in an export
+        of a set of HTML pages.
+        """
+        return self.exportWikiPageToHtmlString(
+                self.wikiDocument.getWikiPage(word), False)
+
+
+    def _getIndexFileContent(self):
+        """
+        Return content of index file with table of contents of a set of
+        HTML pages.
+        """
+        # TODO Factor out HTML header generation                
+        result = [self._getGenericHtmlHeader(self.addOpt[2]) + 
+                u'    <body class="wikidpad">\n']
+
+        if self.addOpt[1] == 1:
+            # Write a content tree
+            rootPage = self.mainControl.getWikiDocument().getWikiPage(
+                        self.mainControl.getWikiDocument().getWikiName())
+            self.addDependency(u"tree", rootPage.getWikiWord())
+            flatTree = rootPage.getFlatTree()
+
+            result.append((u'<h2 class="wikidpad">%s</h2>\n'
+                    '%s') %
+                    (self.addOpt[2],  # = "Table of Contents"
+                    self.getContentTreeBody(flatTree, linkAsFragments=False)
+                    ))
+        elif self.addOpt[1] == 2:
+            # Write a content list
+            result.append((u'<h2 class="wikidpad">%s</h2>\n'
+                    '%s') %
+                    (self.addOpt[2],  # = "Table of Contents"
+                    self.getContentListBody(linkAsFragments=False)
+                    ))
+
+        result.append(self.getFileFooter())
+
+        return u"".join(result)
+
+
     def exportWordToHtmlPage(self, dir, word, startFile=True,
             onlyInclude=None):
-            
-        outputFile = join(dir,
-                self.filenameConverter.getFilenameForWikiWord(word) + ".html")
 
-        try:
-            if exists(pathEnc(outputFile)):
-                os.unlink(pathEnc(outputFile))
+        outputName = self.filenameConverter.getFilenameForWikiWord(word) + \
+                ".html"
 
-            realfp = open(pathEnc(outputFile), "w")
-            fp = utf8Writer(realfp, "replace")
-            
-            wikiPage = self.wikiDocument.getWikiPage(word)
-            fp.write(self.exportWikiPageToHtmlString(wikiPage,
-                    startFile, onlyInclude))
-            fp.reset()        
-            realfp.close()
+        try:
+            outputFile = self._writeOutputFile(dir, outputName,
+                    u"wikipage/" + word,
+                    lambda: self.exportWikiPageToHtmlString(
+                    self.wikiDocument.getWikiPage(word), startFile,
+                    onlyInclude))
         except Exception, e:
             sys.stderr.write("Error while exporting word %s" % repr(word))
             traceback.print_exc()
+            outputFile = join(dir, outputName)
 
         return outputFile
 
 
+    @Instrumentation.instrumented("export.htmlPage")
     def exportWikiPageToHtmlString(self, wikiPage,
             startFile=True, onlyInclude=None):
         """
@@ -1076,6 +2028,45 @@ class HtmlExporter(AbstractExporter):
         return u"".join(result)
 
 
+    def exportWikiPageToHtmlStringRecording(self, wikiPage,
+            startFile=True, onlyInclude=None):
+        """
+        Like exportWikiPageToHtmlString() but return tuple (html,
+        dependencies) where dependencies is a dictionary
+        {dependency: fingerprint} of the data the HTML was created from.
+        dependencies is None if the HTML may differ even if this data is
+        unchanged, e.g. if it contains search results or refers to
+        temporary files.
+        """
+        html, dependencies, tempFiles = self._renderRecording(
+                lambda: self.exportWikiPageToHtmlString(wikiPage, startFile,
+                onlyInclude), record=True)
+
+        if tempFiles:
+            return html, None
+
+        fingerprints = {}
+        for dep in dependencies:
+            fingerprint = self._getDependencyFingerprint(dep)
+            if fingerprint is None:
+                return html, None
+            fingerprints[dep] = fingerprint
+
+        return html, fingerprints
+
+
+    def areDependenciesUpToDate(self, dependencies):
+        """
+        Test if the fingerprints in dictionary dependencies as returned
+        by exportWikiPageToHtmlStringRecording() match the current data.
+        """
+        for dep, fingerprint in dependencies.iteritems():
+            if self._getDependencyFingerprint(dep) != fingerprint:
+                return False
+
+        return True
+
+
     def _getGenericHtmlHeader(self, title, charSet=u'; charset=UTF-8'):
         styleSheets = []
         for dummy, url in self.styleSheetList:
@@ -1118,6 +2109,12 @@ class HtmlExporter(AbstractExporter):
         bgcol = config.get("main", "html_body_bgcolor")
         bgimg = config.get("main", "html_body_background")
 
+        for attrKey in (u"html.linkcolor", u"html.alinkcolor",
+                u"html.vlinkcolor", u"html.textcolor", u"html.bgcolor",
+                u"html.bgimage"):
+            self.addDependency(u"attr", wikiPage.getWikiWord(), attrKey)
+            self.addDependency(u"globalattr", attrKey)
+
         # Get attribute settings
         linkcol = wikiPage.getAttributeOrGlobal(u"html.linkcolor", linkcol)
         alinkcol = wikiPage.getAttributeOrGlobal(u"html.alinkcolor", alinkcol)
@@ -1189,6 +2186,10 @@ class HtmlExporter(AbstractExporter):
 """
 
     def getParentLinks(self, wikiPage, asHref=True, wordsToInclude=None):
+        self.addDependency(u"parents", wikiPage.getWikiWord())
+        if wordsToInclude is self.wordList:
+            self.addDependency(u"wordlist")
+
         parents = u""
         parentRelations = wikiPage.getParentRelationships()[:]
         self.mainControl.getCollator().sort(parentRelations)
@@ -1236,7 +2237,7 @@ class HtmlExporter(AbstractExporter):
                         "wikistyle.css"),
 
                     # User modified file
-                    join(wx.GetApp().globalConfigSubDir, "wikistyle.css")
+                    join(getApp().globalConfigSubDir, "wikistyle.css")
                 ]
 
             # Wiki specific file
@@ -1252,7 +2253,7 @@ class HtmlExporter(AbstractExporter):
                     join(self.mainControl.wikiAppDir, "export",
                             "wikipreview.css"),
                     # User modified file
-                    join(wx.GetApp().globalConfigSubDir, "wikipreview.css")
+                    join(getApp().globalConfigSubDir, "wikipreview.css")
                 ]
 
             # Wiki specific file
@@ -1278,7 +2279,7 @@ class HtmlExporter(AbstractExporter):
                     (join(self.mainControl.wikiAppDir, "export", "wikistyle.css"),
                         "admbase.css"),
                     # User modified file
-                    (join(wx.GetApp().globalConfigSubDir, "wikistyle.css"),
+                    (join(getApp().globalConfigSubDir, "wikistyle.css"),
                         "userbase.css")
                 ]
 
@@ -1309,10 +2310,13 @@ class HtmlExporter(AbstractExporter):
             if not wikiWord:
                 return False
 
+            self.addDependency(u"attr", wikiWord, u"export")
             try:
                 wikiPage = self.wikiDocument.getWikiPage(wikiWord)
             except WikiWordNotFoundException:
                 return False
+        else:
+            self.addDependency(u"attr", wikiPage.getWikiWord(), u"export")
 
         return strToBool(wikiPage.getAttributes().get("export", ("True",))[-1])
 
@@ -1329,6 +2333,7 @@ class HtmlExporter(AbstractExporter):
 #                 # TODO Use self.convertFilename here?
 #                 return self.linkConverter.getLinkForWikiWord(relUnAlias)
 
+        self.addDependency(u"wordlist")
         result = []
         wordToLink = self.linkConverter.getLinkForWikiWord
         
@@ -1359,6 +2364,7 @@ class HtmlExporter(AbstractExporter):
 #                 # TODO Use self.convertFilename here?
 #                 return self.linkConverter.getLinkForWikiWord(relUnAlias)
 
+        self.addDependency(u"wordlist")
         wordSet = set(self.wordList)
         deepStack = [-1]
         result = []
@@ -1415,6 +2421,7 @@ class HtmlExporter(AbstractExporter):
     def formatContent(self, wikiPage, content=None):
         word = wikiPage.getWikiWord()
         formatDetails = wikiPage.getFormatDetails()
+        self.addDependency(u"page", word)
         if content is None:
             content = wikiPage.getLiveText()
             self.basePageAst = wikiPage.getLivePageAst()
@@ -1462,6 +2469,12 @@ class HtmlExporter(AbstractExporter):
             if facename:
                 self.outAppend('<font face="%s" class="wikidpad">' % facename)
 
+        # Let insertion handlers calling external applications render all
+        # insertions of the page in parallel before they are processed
+        getApp().getInsertionPluginManager().prefetchContents(self,
+                self.exportType, self.basePageAst.iterDeepByName("insertion"),
+                "html_preview" if self.asHtmlPreview else None)
+
         with self.optsStack:
             self.optsStack["innermostFullPageAst"] = self.basePageAst
             self.optsStack["innermostPageUnifName"] = u"wikipage/" + word
@@ -1477,29 +2490,64 @@ class HtmlExporter(AbstractExporter):
     def _getImageDims(self, absUrl):
         """
         Return tuple (width, height) of image absUrl or (None, None) if it
-        couldn't be determined.
+        couldn't be determined. Results are cached by the wiki document.
         """
+        cache = self.wikiDocument.getImageDimensionCache()
         try:
             if absUrl.startswith(u"file:"):
-                absLink = pathnameFromUrl(absUrl)
-                imgFile = file(absLink, "rb")
+                return cache.getFileDims(pathnameFromUrl(absUrl),
+                        self._probeImageFileDims)
             else:
-                imgFile = urllib.urlopen(absUrl)
-                imgData = imgFile.read()
-                imgFile.close()
-                imgFile = StringIO(imgData)
+                return cache.getUrlDims(absUrl, self._probeImageUrlDims)
+        except (IOError, OSError):
+            return None, None
 
-            img = wx.EmptyImage(0, 0)
-            img.LoadStream(imgFile)
+
+    @staticmethod
+    def _probeImageFileDims(path):
+        dims = ImageDimensions.getImageDimsFromFile(path)
+        if dims[0] is not None:
+            return dims
+
+        # Unknown format, let wxPython try it
+        imgFile = open(pathEnc(path), "rb")
+        try:
+            return HtmlExporter._getImageDimsFromWxStream(imgFile)
+        finally:
             imgFile.close()
-            
-            if img.Ok():
-                return img.GetWidth(), img.GetHeight()
 
-            return None, None
 
-        except IOError:
-            return None, None
+    @staticmethod
+    def _probeImageUrlDims(absUrl):
+        imgFile = urllib.urlopen(absUrl)
+        try:
+            imgData = imgFile.read()
+        finally:
+            imgFile.close()
+
+        try:
+            dims = ImageDimensions.getImageDimsFromStream(StringIO(imgData))
+        except (struct.error, ValueError):
+            dims = (None, None)
+
+        if dims[0] is not None:
+            return dims
+
+        return HtmlExporter._getImageDimsFromWxStream(StringIO(imgData))
+
+
+    @staticmethod
+    def _getImageDimsFromWxStream(imgFile):
+        """
+        Decode image from imgFile completely to get its dimensions.
+        """
+        img = wx.EmptyImage(0, 0)
+        img.LoadStream(imgFile)
+
+        if img.Ok():
+            return img.GetWidth(), img.GetHeight()
+
+        return None, None
 
 
     @staticmethod
@@ -1867,7 +2915,7 @@ class HtmlExporter(AbstractExporter):
 
             containingPage = self.optsStack["innermostDocPage"]
             
-            langHelper = wx.GetApp().createWikiLanguageHelper(
+            langHelper = getApp().createWikiLanguageHelper(
                     containingPage.getWikiLanguageName())
                     
             if langHelper.checkForInvalidWikiLink(value,
@@ -1876,6 +2924,7 @@ class HtmlExporter(AbstractExporter):
 
             value = langHelper.resolveWikiWordLink(value, containingPage)
 
+            self.addDependency(u"page", value)
             docpage = self.wikiDocument.getWikiPageNoError(value)
             pageAst = docpage.getLivePageAst()
             
@@ -1936,17 +2985,22 @@ class HtmlExporter(AbstractExporter):
         elif key == u"rel":
             # List relatives (children, parents)
             if value == u"parents":
+                self.addDependency(u"parents", self.wikiWord)
                 wordList = self.wikiDocument.getWikiData().getParentRelationships(
                         self.wikiWord)
             elif value == u"children":
                 existingonly = (u"existingonly" in appendices) # or \
                         # (u"existingonly +" in insertionAstNode.appendices)
+                self.addDependency(u"children", self.wikiWord,
+                        u"existingonly" if existingonly else u"")
                 wordList = self.wikiDocument.getWikiData().getChildRelationships(
                         self.wikiWord, existingonly=existingonly,
                         selfreference=False)
             elif value == u"parentless":
+                self.addDependency(u"parentless")
                 wordList = self.wikiDocument.getWikiData().getParentlessWikiWords()
             elif value == u"undefined":
+                self.addDependency(u"undefined")
                 wordList = self.wikiDocument.getWikiData().getUndefinedWords()
             elif value == u"top":
                 htmlContent = u'<a href="#" class="wikidpad">Top</a>'
@@ -1963,6 +3017,7 @@ class HtmlExporter(AbstractExporter):
             htmlContent = escapeHtml(self.getCurrentWikiWord())
 
         elif key == u"savedsearch":
+            self.addDependency(u"datablock", u"savedsearch/" + value)
             datablock = self.wikiDocument.getWikiData().retrieveDataBlock(
                     u"savedsearch/" + value)
             if datablock is not None:
@@ -2057,6 +3112,8 @@ class HtmlExporter(AbstractExporter):
 #             htmlContent = u"".join(htmlContent)
 
         elif key == u"eval":
+            # Result may depend on anything
+            self.addDependency(u"volatile")
             if not self.mainControl.getConfig().getboolean("main",
                     "insertions_allow_eval", False):
                 # Evaluation of such insertions not allowed
@@ -2078,7 +3135,7 @@ class HtmlExporter(AbstractExporter):
                             escapeHtmlNoBreaks(s.getvalue()) + u'\n</pre>\n'
         elif key == u"iconimage":
             imgName = astNode.value
-            icPath = wx.GetApp().getIconCache().lookupIconPath(imgName)
+            icPath = getApp().getIconCache().lookupIconPath(imgName)
             if icPath is None:
                 htmlContent = _(u'<pre class="wikidpad">[Icon "%s" not found]</pre>' % imgName)
             else:
@@ -2097,13 +3154,13 @@ class HtmlExporter(AbstractExporter):
         else:
             # Call external plugins
             exportType = self.exportType
-            handler = wx.GetApp().getInsertionPluginManager().getHandler(self,
+            handler = getApp().getInsertionPluginManager().getHandler(self,
                     exportType, key)
 
             if handler is None and self.asHtmlPreview:
                 # No handler found -> try to find generic HTML preview handler
                 exportType = "html_preview"
-                handler = wx.GetApp().getInsertionPluginManager().getHandler(self,
+                handler = getApp().getInsertionPluginManager().getHandler(self,
                         exportType, key)
 
             if handler is not None:
@@ -2120,7 +3177,7 @@ class HtmlExporter(AbstractExporter):
             else:
                 # Try to find a generic handler for export type
                 # "wikidpad_language"
-                handler = wx.GetApp().getInsertionPluginManager().getHandler(self,
+                handler = getApp().getInsertionPluginManager().getHandler(self,
                         "wikidpad_language", key)
                 if handler is not None:
                     try:
@@ -2134,6 +3191,8 @@ class HtmlExporter(AbstractExporter):
                         htmlContent = u'<pre class="wikidpad">' + mbcsDec(s.getvalue(), 'replace')[0] + u'</pre>'
 
         if searchOp is not None:
+            # Search result may change with any page
+            self.addDependency(u"volatile")
             wordList = self.wikiDocument.searchWiki(searchOp)
             
             if ("removeself" in appendices) or ("removethis" in appendices):
@@ -2214,6 +3273,7 @@ class HtmlExporter(AbstractExporter):
             anchorLink = None
             titleNode = None
             
+        self.addDependency(u"linkterm", wikiWord)
         if self.avoidDeadWikiLinks and not self.shouldExport(
                 self.wikiDocument.getWikiPageNameForLinkTerm(wikiWord)):
             link = None
@@ -2243,6 +3303,7 @@ class HtmlExporter(AbstractExporter):
 
             title = None
             if linkTo is not None:
+                self.addDependency(u"attr", linkTo, u"short_hint")
                 propList = self.wikiDocument.getAttributeTriples(linkTo,
                         u"short_hint", None)
                 if len(propList) > 0:
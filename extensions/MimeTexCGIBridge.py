@@ -1,4 +1,6 @@
-import os, urllib, os.path
+from __future__ import with_statement
+
+import os, urllib, os.path, functools
 import subprocess
 
 import wx
@@ -62,39 +64,16 @@ class EqnHandler:
         pass
 
 
-    def createContent(self, exporter, exportType, insToken):
+    def _render(self, bstr, dstFullPath):
         """
-        Handle an insertion and create the appropriate content.
-
-        exporter -- Exporter object calling the handler
-        exportType -- string describing the export type
-        insToken -- insertion token to create content for
-
-        An insertion token has the following member variables:
-            key: insertion key (unistring)
-            value: value of an insertion (unistring)
-            appendices: sequence of strings with the appendices
-
-        Meaning and type of return value is solely defined by the type
-        of the calling exporter.
-        
-        For HtmlExporter a unistring is returned with the HTML code
-        to insert instead of the insertion.        
+        Run MimeTeX to create GIF file dstFullPath out of quoted formula bstr.
+        Returns an error message or empty string if no error.
         """
-        bstr = urllib.quote(mbcsEnc(insToken.value, "replace")[0])
-
-        if not bstr:
-            # Nothing in, nothing out
-            return u""
-        
-        if self.extAppExe == "":
-            # No path to MimeTeX executable -> show message
-            return u'<pre>' + _(u'[Please set path to MimeTeX executable]') + \
-                    '</pre>'
-
         # Prepare CGI environment. MimeTeX needs only "QUERY_STRING" environment
-        # variable
-        os.environ["QUERY_STRING"] = bstr
+        # variable. The environment of this process is not modified as
+        # multiple formulas may be rendered in parallel.
+        env = dict(os.environ)
+        env["QUERY_STRING"] = bstr
 
         cmdline = subprocess.list2cmdline((self.extAppExe,))
 
@@ -103,7 +82,7 @@ class EqnHandler:
         # Run MimeTeX process
         popenObject = subprocess.Popen(cmdline, shell=True,
                  stdout=subprocess.PIPE, stdin=subprocess.PIPE,
-                 stderr=subprocess.PIPE)
+                 stderr=subprocess.PIPE, env=env)
 
         childOut = popenObject.stdout
         
@@ -116,21 +95,85 @@ class EqnHandler:
         response = childOut.read()
         
         childOut.close()
+        popenObject.wait()
         
         # Cut off HTTP header (may need changes for non-Windows OS)
         try:
             response = response[(response.index("\n\n") + 2):]
         except ValueError:
-            return u'<pre>' + _(u'[Invalid response from MimeTeX]') + \
+            return _(u'[Invalid response from MimeTeX]')
+
+        with open(dstFullPath, "wb") as f:
+            f.write(response)
+
+        return u""
+
+
+    def prefetchContent(self, exporter, exportType, insToken):
+        """
+        Render the image for insToken into the render cache so that a
+        following createContent() only has to copy it. Called from
+        a worker thread.
+        """
+        bstr = urllib.quote(mbcsEnc(insToken.value, "replace")[0])
+
+        if not bstr or not self.extAppExe:
+            return
+
+        renderCache = exporter.getMainControl().getWikiDocument()\
+                .getInsertionRenderCache()
+        renderCache.prefetch(renderCache.makeKey("MimeTeX", self.extAppExe,
+                bstr), ".gif", functools.partial(self._render, bstr))
+
+
+    def createContent(self, exporter, exportType, insToken):
+        """
+        Handle an insertion and create the appropriate content.
+
+        exporter -- Exporter object calling the handler
+        exportType -- string describing the export type
+        insToken -- insertion token to create content for
+
+        An insertion token has the following member variables:
+            key: insertion key (unistring)
+            value: value of an insertion (unistring)
+            appendices: sequence of strings with the appendices
+
+        Meaning and type of return value is solely defined by the type
+        of the calling exporter.
+        
+        For HtmlExporter a unistring is returned with the HTML code
+        to insert instead of the insertion.        
+        """
+        bstr = urllib.quote(mbcsEnc(insToken.value, "replace")[0])
+
+        if not bstr:
+            # Nothing in, nothing out
+            return u""
+        
+        if self.extAppExe == "":
+            # No path to MimeTeX executable -> show message
+            return u'<pre>' + _(u'[Please set path to MimeTeX executable]') + \
                     '</pre>'
 
         # Get exporters temporary file set (manages creation and deletion of
         # temporary files)
         tfs = exporter.getTempFileSet()
         
-        # Create .gif file out of returned data and retrieve URL for the file
+        # Create .gif file and retrieve URL for the file
         pythonUrl = (exportType != "html_previewWX")
-        url = tfs.createTempUrl(response, ".gif", pythonUrl=pythonUrl)
+        dstFullPath = tfs.createTempFile("", ".gif", relativeTo="")
+        url = tfs.getRelativeUrl(None, dstFullPath, pythonUrl=pythonUrl)
+
+        # Copy from render cache, run MimeTeX only if needed
+        renderCache = exporter.getMainControl().getWikiDocument()\
+                .getInsertionRenderCache()
+        errResponse = renderCache.provide(renderCache.makeKey("MimeTeX",
+                self.extAppExe, bstr), dstFullPath,
+                functools.partial(self._render, bstr))
+
+        if errResponse:
+            return u'<pre>' + errResponse + '</pre>'
 
         # Return appropriate HTML code for the image
         if exportType == "html_previewWX":
@@ -147,7 +190,7 @@ class EqnHandler:
         Returns a list of bytestrings describing additional features supported
         by the plugin. Currently not specified further.
         """
-        return ()
+        return ("prefetchContent",)
 
 
 
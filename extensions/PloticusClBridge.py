@@ -1,4 +1,4 @@
-import os, os.path
+import os, os.path, functools
 import subprocess
 
 import wx
@@ -77,6 +77,84 @@ class PltHandler:
         pass
 
 
+    def _render(self, bstr, baseDir, noerror, dstFullPath):
+        """
+        Run Ploticus to create image file dstFullPath out of script bstr.
+        Returns the error response (bytestring, empty if no error).
+        """
+        # Store token content in a temporary file
+        srcfilepath = createTempFile(bstr, ".plt")
+        try:
+            cmdline = subprocess.list2cmdline((self.extAppExe, "-dir", baseDir,
+                    srcfilepath, self.outputParameter, "-o", dstFullPath))
+
+            # Run external application
+#             childIn, childOut, childErr = os.popen3(cmdline, "b")
+            popenObject = subprocess.Popen(cmdline, shell=True,
+                    stderr=subprocess.PIPE, stdout=subprocess.PIPE,
+                    stdin=subprocess.PIPE)
+            childErr = popenObject.stderr
+
+            # See http://bytes.com/topic/python/answers/634409-subprocess-handle-invalid-error
+            # why this is necessary
+            popenObject.stdin.close()
+            popenObject.stdout.close()
+
+            if noerror:
+                childErr.read()
+                errResponse = ""
+            else:
+                errResponse = childErr.read()
+            
+            childErr.close()
+            popenObject.wait()
+        finally:
+            os.unlink(srcfilepath)
+
+        return errResponse
+
+
+    def _prepareRendering(self, exporter, insToken):
+        """
+        Returns tuple (renderCache, cacheKey, renderFct) for insToken or None
+        if there is nothing to render.
+        """
+        # Retrieve quoted content of the insertion
+        bstr = lineendToOs(mbcsEnc(insToken.value, "replace")[0])
+
+        if not bstr or not self.extAppExe:
+            return None
+
+        baseDir = os.path.dirname(exporter.getMainControl().getWikiConfigPath())
+        appendices = [a.strip() for a in insToken.appendices]
+        noerror = u"noerror" in appendices
+        renderCache = exporter.getMainControl().getWikiDocument()\
+                .getInsertionRenderCache()
+        if u"nocache" in appendices:
+            # Result depends on other files (e.g. data files in baseDir)
+            cacheKey = None
+        else:
+            cacheKey = renderCache.makeKey("Ploticus", self.extAppExe, baseDir,
+                    self.outputParameter, noerror, bstr)
+
+        return renderCache, cacheKey, functools.partial(self._render, bstr,
+                baseDir, noerror)
+
+
+    def prefetchContent(self, exporter, exportType, insToken):
+        """
+        Render the image for insToken into the render cache so that a
+        following createContent() only has to copy it. Called from
+        a worker thread.
+        """
+        rendering = self._prepareRendering(exporter, insToken)
+        if rendering is None:
+            return
+
+        renderCache, cacheKey, renderFct = rendering
+        renderCache.prefetch(cacheKey, self.outputSuffix, renderFct)
+
+
     def createContent(self, exporter, exportType, insToken):
         """
         Handle an insertion and create the appropriate content.
@@ -96,10 +174,7 @@ class PltHandler:
         For HtmlExporter a unistring is returned with the HTML code
         to insert instead of the insertion.        
         """
-        # Retrieve quoted content of the insertion
-        bstr = lineendToOs(mbcsEnc(insToken.value, "replace")[0])
-
-        if not bstr:
+        if not insToken.value:
             # Nothing in, nothing out
             return u""
         
@@ -107,6 +182,13 @@ class PltHandler:
             # No path to MimeTeX executable -> show message
             return u'<pre>' + _(u'[Please set path to Ploticus executable]') +\
                     u'</pre>'
+
+        rendering = self._prepareRendering(exporter, insToken)
+        if rendering is None:
+            return u""
+
+        renderCache, cacheKey, renderFct = rendering
+
         # Get exporters temporary file set (manages creation and deletion of
         # temporary files)
         tfs = exporter.getTempFileSet()
@@ -115,37 +197,10 @@ class PltHandler:
         
         dstFullPath = tfs.createTempFile("", self.outputSuffix, relativeTo="")
         url = tfs.getRelativeUrl(None, dstFullPath, pythonUrl=pythonUrl)
-        
-        baseDir = os.path.dirname(exporter.getMainControl().getWikiConfigPath())
 
-        # Store token content in a temporary file
-        srcfilepath = createTempFile(bstr, ".plt")
-        try:
-            cmdline = subprocess.list2cmdline((self.extAppExe, "-dir", baseDir,
-                    srcfilepath, self.outputParameter, "-o", dstFullPath))
+        # Copy from render cache, run external application only if needed
+        errResponse = renderCache.provide(cacheKey, dstFullPath, renderFct)
 
-            # Run external application
-#             childIn, childOut, childErr = os.popen3(cmdline, "b")
-            popenObject = subprocess.Popen(cmdline, shell=True,
-                    stderr=subprocess.PIPE, stdout=subprocess.PIPE,
-                    stdin=subprocess.PIPE)
-            childErr = popenObject.stderr
-
-            # See http://bytes.com/topic/python/answers/634409-subprocess-handle-invalid-error
-            # why this is necessary
-            popenObject.stdin.close()
-            popenObject.stdout.close()
-
-            if u"noerror" in [a.strip() for a in insToken.appendices]:
-                childErr.read()
-                errResponse = ""
-            else:
-                errResponse = childErr.read()
-            
-            childErr.close()
-        finally:
-            os.unlink(srcfilepath)
-            
         if errResponse != "":
             errResponse = mbcsDec(errResponse, "replace")[0]
             return u'<pre>' + _(u'[Ploticus error: %s]') % errResponse + \
@@ -166,7 +221,7 @@ class PltHandler:
         Returns a list of bytestrings describing additional features supported
         by the plugin. Currently not specified further.
         """
-        return ()
+        return ("prefetchContent",)
 
 
 
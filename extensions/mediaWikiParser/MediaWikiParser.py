@@ -24,6 +24,10 @@ sys.stderr = sys.stdout
 locale.setlocale(locale.LC_ALL, '')
 
 from pwiki.WikiPyparsing import *
+from pwiki import GrammarCache
+
+# The compiled regexes of the grammar are cached between starts
+_grammarCache = GrammarCache.beginGrammarBuild("MediaWikiParser", __file__)
 
 
 WIKIDPAD_PLUGIN = (("WikiParser", 1),)
@@ -120,7 +124,7 @@ def actionCutRightWhitespace(s, l, st, t):
     return None
 
   
-_CHECK_LEFT_RE = re.compile(ur"[ \t]*$", RE_FLAGS)
+_CHECK_LEFT_RE = compileRegex(ur"[ \t]*$", RE_FLAGS)
 
 
 def preActCheckNothingLeft(s, l, st, pe):
@@ -819,7 +823,7 @@ bracketStart = buildRegex(BracketStartPAT)
 bracketEnd = buildRegex(BracketEndPAT)
 
 
-UnescapeExternalFragmentRE   = re.compile(ur"#(.)",
+UnescapeExternalFragmentRE   = compileRegex(ur"#(.)",
                               re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -838,7 +842,7 @@ def actionSearchFragmentExtern(s, l, st, t):
     lt2.unescaped = UnescapeExternalFragmentRE.sub(ur"\1", lt2.text)
 
 
-UnescapeStandardRE = re.compile(EscapePlainCharPAT + ur"(.)",
+UnescapeStandardRE = compileRegex(EscapePlainCharPAT + ur"(.)",
                               re.DOTALL | re.UNICODE | re.MULTILINE)
 
 def actionSearchFragmentIntern(s, l, st, t):
@@ -1111,7 +1115,7 @@ anchorDef = buildRegex(ur"^[ \t]*anchor:[ \t]*") + buildRegex(ur"[A-Za-z0-9\_]+"
 anchorDef = anchorDef.setResultsNameNoCopy("anchorDef").setParseAction(actionAnchorDef)
 
 
-AnchorRE = re.compile(ur"^[ \t]*anchor:[ \t]*(?P<anchorValue>[A-Za-z0-9\_]+)\n",
+AnchorRE = compileRegex(ur"^[ \t]*anchor:[ \t]*(?P<anchorValue>[A-Za-z0-9\_]+)\n",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -1171,11 +1175,11 @@ extractableWikiWord = extractableWikiWord.setResultsNameNoCopy("extractableWikiW
         .parseWithTabs()
 
 
-wikiPageNameRE = re.compile(ur"^" + WikiPageNamePAT + ur"$",
+wikiPageNameRE = compileRegex(ur"^" + WikiPageNamePAT + ur"$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
-wikiLinkCoreRE = re.compile(ur"^" + WikiWordNccPAT + ur"$",
+wikiLinkCoreRE = compileRegex(ur"^" + WikiWordNccPAT + ur"$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -1203,7 +1207,7 @@ footnote = footnote.setResultsNameNoCopy("footnote")\
         .setParseAction(actionFootnote)
 
 
-footnoteRE = re.compile(ur"^" + footnotePAT + ur"$",
+footnoteRE = compileRegex(ur"^" + footnotePAT + ur"$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -1277,14 +1281,14 @@ insertion = insertion.setResultsNameNoCopy("insertion").setParseAction(actionIns
 # -------------------- Additional regexes to provide --------------------
 
 # Needed for auto-bullet/auto-unbullet functionality of editor
-BulletRE        = re.compile(ur"^(?P<indentBullet>[ \t]*)"
+BulletRE        = compileRegex(ur"^(?P<indentBullet>[ \t]*)"
         ur"(?P<preLastBullet>[\*#;: \t]*)"
         ur"(?P<lastBullet>[\*#;:])(?P<lastBulletWhite>[ \t]*)",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
 # Needed for handleRewrapText
-EmptyLineRE     = re.compile(ur"^[ \t\r\n]*$",
+EmptyLineRE     = compileRegex(ur"^[ \t\r\n]*$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -1292,36 +1296,36 @@ EmptyLineRE     = re.compile(ur"^[ \t\r\n]*$",
 
 # Reverse REs for autocompletion
 
-RevWikiWordRE2     = re.compile(ur"^" + WikiWordNccRevPAT + BracketStartRevPAT,
+RevWikiWordRE2     = compileRegex(ur"^" + WikiWordNccRevPAT + BracketStartRevPAT,
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
 
-RevAttributeValue     = re.compile(
+RevAttributeValue     = compileRegex(
         ur"^([\w\-\_ \t:;,.!?#/|]*?)([ \t]*[=:][ \t]*)([\w\-\_ \t\.]+?)" +
         BracketStartRevPAT,
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
 
 
-RevTodoKeyRE = re.compile(ur"^(?:[^:\s]{0,40}\.)??"
+RevTodoKeyRE = compileRegex(ur"^(?:[^:\s]{0,40}\.)??"
         ur"(?:odot|enod|tiaw|noitca|kcart|eussi|noitseuq|tcejorp)",
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
 
-RevTodoValueRE = re.compile(ur"^[^\n:]{0,30}:" + RevTodoKeyRE.pattern[1:],
+RevTodoValueRE = compileRegex(ur"^[^\n:]{0,30}:" + RevTodoKeyRE.pattern[1:],
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
 
-RevWikiWordAnchorRE2 = re.compile(ur"^(?P<anchorBegin>[A-Za-z0-9\_]{0,20})" + 
+RevWikiWordAnchorRE2 = compileRegex(ur"^(?P<anchorBegin>[A-Za-z0-9\_]{0,20})" + 
         WikiWordAnchorStartPAT + BracketEndRevPAT + ur"(?P<wikiWord>" + 
         WikiWordNccRevPAT + ur")" + BracketStartRevPAT,
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
 
 
 # Simple todo RE for autocompletion.
-ToDoREWithCapturing = re.compile(ur"^([^:\s]+):[ \t]*(.+?)$",
+ToDoREWithCapturing = compileRegex(ur"^([^:\s]+):[ \t]*(.+?)$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
 
 # For auto-link mode relax
-AutoLinkRelaxSplitRE = re.compile(r"[\W]+", re.IGNORECASE | re.UNICODE)
+AutoLinkRelaxSplitRE = compileRegex(r"[\W]+", re.IGNORECASE | re.UNICODE)
 
 AutoLinkRelaxJoinPAT = ur"[\W]+"
 AutoLinkRelaxJoinFlags = re.IGNORECASE | re.UNICODE
@@ -1329,7 +1333,7 @@ AutoLinkRelaxJoinFlags = re.IGNORECASE | re.UNICODE
 
 
 # For spell checking
-TextWordRE = re.compile(ur"(?P<negative>[0-9]+|"+ UrlPAT + u")|\b[\w']+",
+TextWordRE = compileRegex(ur"(?P<negative>[0-9]+|"+ UrlPAT + u")|\b[\w']+",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -1479,6 +1483,8 @@ todoAsWhole = todoAsWhole.optimize(("regexcombine",)).parseWithTabs()
 # Whole text, optimizes subelements recursively
 text = text.optimize(("regexcombine",)).parseWithTabs()
 
+GrammarCache.endGrammarBuild(_grammarCache)
+
 
 # print "--content regex", repr(findMarkup.getRegexCombiner().getRegex().pattern)
 # text = text.parseWithTabs()
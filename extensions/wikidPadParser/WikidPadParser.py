@@ -24,6 +24,10 @@ sys.stderr = sys.stdout
 locale.setlocale(locale.LC_ALL, '')
 
 from pwiki.WikiPyparsing import *
+from pwiki import GrammarCache
+
+# The compiled regexes of the grammar are cached between starts
+_grammarCache = GrammarCache.beginGrammarBuild("WikidPadParser", __file__)
 
 
 WIKIDPAD_PLUGIN = (("WikiParser", 1),)
@@ -102,7 +106,7 @@ def actionCutRightWhitespace(s, l, st, t):
     return None
 
   
-_CHECK_LEFT_RE = re.compile(ur"[ \t]*$", RE_FLAGS)
+_CHECK_LEFT_RE = compileRegex(ur"[ \t]*$", RE_FLAGS)
 
 
 def preActCheckNothingLeft(s, l, st, pe):
@@ -780,7 +784,7 @@ bracketStart = buildRegex(BracketStartPAT)
 bracketEnd = buildRegex(BracketEndPAT)
 
 
-UnescapeExternalFragmentRE   = re.compile(ur"#(.)",
+UnescapeExternalFragmentRE   = compileRegex(ur"#(.)",
                               re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -799,7 +803,7 @@ def actionSearchFragmentExtern(s, l, st, t):
     lt2.unescaped = UnescapeExternalFragmentRE.sub(ur"\1", lt2.text)
 
 
-UnescapeStandardRE = re.compile(EscapePlainCharPAT + ur"(.)",
+UnescapeStandardRE = compileRegex(EscapePlainCharPAT + ur"(.)",
                               re.DOTALL | re.UNICODE | re.MULTILINE)
 
 def actionSearchFragmentIntern(s, l, st, t):
@@ -970,7 +974,7 @@ anchorDef = buildRegex(ur"^[ \t]*anchor:[ \t]*") + buildRegex(ur"[A-Za-z0-9\_]+"
 anchorDef = anchorDef.setResultsNameNoCopy("anchorDef").setParseAction(actionAnchorDef)
 
 
-AnchorRE = re.compile(ur"^[ \t]*anchor:[ \t]*(?P<anchorValue>[A-Za-z0-9\_]+)\n",
+AnchorRE = compileRegex(ur"^[ \t]*anchor:[ \t]*(?P<anchorValue>[A-Za-z0-9\_]+)\n",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -1018,18 +1022,18 @@ extractableWikiWord = extractableWikiWord.setResultsNameNoCopy("extractableWikiW
         .parseWithTabs()
 
 
-wikiPageNameRE = re.compile(ur"^" + WikiPageNamePAT + ur"$",
+wikiPageNameRE = compileRegex(ur"^" + WikiPageNamePAT + ur"$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
-wikiWordCcRE = re.compile(ur"^" + WikiWordCcPAT + ur"$",
+wikiWordCcRE = compileRegex(ur"^" + WikiWordCcPAT + ur"$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 def isCcWikiWord(word):
     return bool(wikiWordCcRE.match(word))
 
 
-wikiLinkCoreRE = re.compile(ur"^" + WikiWordNccPAT + ur"$",
+wikiLinkCoreRE = compileRegex(ur"^" + WikiWordNccPAT + ur"$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -1055,7 +1059,7 @@ footnote = footnote.setResultsNameNoCopy("footnote")\
         .setParseAction(actionFootnote)
 
 
-footnoteRE = re.compile(ur"^" + footnotePAT + ur"$",
+footnoteRE = compileRegex(ur"^" + footnotePAT + ur"$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -1129,16 +1133,16 @@ insertion = insertion.setResultsNameNoCopy("insertion").setParseAction(actionIns
 
 
 # Needed for auto-bullet/auto-unbullet functionality of editor
-BulletRE        = re.compile(ur"^(?P<indentBullet>[ \t]*)(?P<actualBullet>\*[ \t])",
+BulletRE        = compileRegex(ur"^(?P<indentBullet>[ \t]*)(?P<actualBullet>\*[ \t])",
         re.DOTALL | re.UNICODE | re.MULTILINE)
-NumericSimpleBulletRE = re.compile(ur"^(?P<indentBullet>[ \t]*)(?P<actualBullet>#[ \t])",
+NumericSimpleBulletRE = compileRegex(ur"^(?P<indentBullet>[ \t]*)(?P<actualBullet>#[ \t])",
         re.DOTALL | re.UNICODE | re.MULTILINE)
-NumericBulletRE = re.compile(ur"^(?P<indentNumeric>[ \t]*)(?P<preLastNumeric>(?:\d+\.)*)(\d+)\.[ \t]",
+NumericBulletRE = compileRegex(ur"^(?P<indentNumeric>[ \t]*)(?P<preLastNumeric>(?:\d+\.)*)(\d+)\.[ \t]",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
 # Needed for handleRewrapText
-EmptyLineRE     = re.compile(ur"^[ \t\r\n]*$",
+EmptyLineRE     = compileRegex(ur"^[ \t\r\n]*$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
@@ -1151,47 +1155,47 @@ revSingleWikiWord    =       (ur"(?:[" +
                              UPPERCASE+
                              ur"])")   # Needed for auto-completion
 
-RevWikiWordRE      = re.compile(ur"^" +
+RevWikiWordRE      = compileRegex(ur"^" +
                              revSingleWikiWord + ur"(?![\~])\b",
                              re.DOTALL | re.UNICODE | re.MULTILINE)
                              # Needed for auto-completion
 
 
-RevWikiWordRE2     = re.compile(ur"^" + WikiWordNccRevPAT + BracketStartRevPAT,
+RevWikiWordRE2     = compileRegex(ur"^" + WikiWordNccRevPAT + BracketStartRevPAT,
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
 
-RevAttributeValue     = re.compile(
+RevAttributeValue     = compileRegex(
         ur"^([\w\-\_ \t:;,.!?#/|]*?)([ \t]*[=:][ \t]*)([\w\-\_ \t\.]+?)" +
         BracketStartRevPAT,
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
 
 
-RevTodoKeyRE = re.compile(ur"^(?:[^:\s]{0,40}\.)??"
+RevTodoKeyRE = compileRegex(ur"^(?:[^:\s]{0,40}\.)??"
         ur"(?:odot|enod|tiaw|noitca|kcart|eussi|noitseuq|tcejorp)",
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
 
-RevTodoValueRE = re.compile(ur"^[^\n:]{0,30}:" + RevTodoKeyRE.pattern[1:],
+RevTodoValueRE = compileRegex(ur"^[^\n:]{0,30}:" + RevTodoKeyRE.pattern[1:],
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
 
 
-RevWikiWordAnchorRE = re.compile(ur"^(?P<anchorBegin>[A-Za-z0-9\_]{0,20})" +
+RevWikiWordAnchorRE = compileRegex(ur"^(?P<anchorBegin>[A-Za-z0-9\_]{0,20})" +
         WikiWordAnchorStartPAT + ur"(?P<wikiWord>" + RevWikiWordRE.pattern[1:] + ur")",
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
         
-RevWikiWordAnchorRE2 = re.compile(ur"^(?P<anchorBegin>[A-Za-z0-9\_]{0,20})" + 
+RevWikiWordAnchorRE2 = compileRegex(ur"^(?P<anchorBegin>[A-Za-z0-9\_]{0,20})" + 
         WikiWordAnchorStartPAT + BracketEndRevPAT + ur"(?P<wikiWord>" + 
         WikiWordNccRevPAT + ur")" + BracketStartRevPAT,
         re.DOTALL | re.UNICODE | re.MULTILINE)  # Needed for auto-completion
 
 
 # Simple todo RE for autocompletion.
-ToDoREWithCapturing = re.compile(ur"^([^:\s]+):[ \t]*(.+?)$",
+ToDoREWithCapturing = compileRegex(ur"^([^:\s]+):[ \t]*(.+?)$",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
 
 
 # For auto-link mode relax
-AutoLinkRelaxSplitRE = re.compile(r"[\W]+", re.IGNORECASE | re.UNICODE)
+AutoLinkRelaxSplitRE = compileRegex(r"[\W]+", re.IGNORECASE | re.UNICODE)
 
 AutoLinkRelaxJoinPAT = ur"[\W]+"
 AutoLinkRelaxJoinFlags = re.IGNORECASE | re.UNICODE
@@ -1199,7 +1203,7 @@ AutoLinkRelaxJoinFlags = re.IGNORECASE | re.UNICODE
 
 
 # For spell checking
-TextWordRE = re.compile(ur"(?P<negative>[0-9]+|"+ UrlPAT + u"|\b(?<!~)" +
+TextWordRE = compileRegex(ur"(?P<negative>[0-9]+|"+ UrlPAT + u"|\b(?<!~)" +
         WikiWordCcPAT + ur"\b)|\b[\w']+",
         re.DOTALL | re.UNICODE | re.MULTILINE)
 
@@ -1349,6 +1353,8 @@ todoAsWhole = todoAsWhole.optimize(("regexcombine",)).parseWithTabs()
 
 # Whole text, optimizes subelements recursively
 text = text.optimize(("regexcombine",)).parseWithTabs()
+
+GrammarCache.endGrammarBuild(_grammarCache)
 # text = text.parseWithTabs()
 
 
@@ -28,6 +28,7 @@ from wikidata import DbBackendUtils
 from WikiExceptions import *
 
 import Serialization, PluginManager, SystemInfo
+from MiscEvent import batchScope
 
 
 
@@ -1709,13 +1710,21 @@ class ImportDialog(wx.Dialog):
         if panel is self.emptyPanel:
             panel = None
 
+        pgh = ProgressHandler(_(u"Importing"), u"", 0, self)
+        pgh.open(0)
+        pgh.update(0, _(u"Preparing"))
+
         try:
-            ob.doImport(self.mainControl.getWikiDocument(), itype, 
-                    guiToUni(self.ctrls.tfSource.GetValue()), 
-                    False, ob.getAddOpt(panel))
-        except ImportException, e:
-            self.mainControl.displayErrorMessage(_(u"Error while importing"),
-                    unicode(e))
+            try:
+                with batchScope():
+                    ob.doImport(self.mainControl.getWikiDocument(), itype, 
+                            guiToUni(self.ctrls.tfSource.GetValue()), 
+                            False, ob.getAddOpt(panel), progressHandler=pgh)
+            except ImportException, e:
+                self.mainControl.displayErrorMessage(_(u"Error while importing"),
+                        unicode(e))
+        finally:
+            pgh.close()
 
         self.EndModal(wx.ID_OK)
 
@@ -0,0 +1,37 @@
+"""
+Access to the application object for the data and export layers.
+
+Wiki documents, pages, databases and exporters need application-wide
+services (global configuration, wiki language parsers, plugins, collator).
+They retrieve them by getApp() instead of wx.GetApp() so that they also
+work without a running wx application, e.g. with the HeadlessApp used by
+the batch command line (see BatchCmd).
+
+This module must not import other modules of the package as it is used
+by basic modules like Utilities.
+"""
+
+
+# Application object returned by getApp()
+_app = None
+
+
+def setApp(app):
+    """
+    Set the application object to return by getApp(). Called by the
+    constructor of AppBase.AppBase.
+    """
+    global _app
+    _app = app
+
+
+def getApp():
+    """
+    Return the application object (derived from AppBase.AppBase).
+    Falls back to wx.GetApp() if none was set.
+    """
+    if _app is not None:
+        return _app
+
+    import wx
+    return wx.GetApp()
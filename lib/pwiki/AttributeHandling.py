@@ -16,6 +16,7 @@ from wxHelper import *
 from WikiExceptions import *
 
 from .Utilities import callInMainThreadAsync
+from .AppAccess import getApp
 from .SystemInfo import isUnicode
 
 from . import StringOps
@@ -163,7 +164,7 @@ def getBuiltinKeys():
 def getBuiltinValuesForKey(attrKey):
     # Handle exceptions here
     if attrKey == u"icon":
-        return wx.GetApp().getIconCache().iconLookupCache.keys()
+        return getApp().getIconCache().iconLookupCache.keys()
     elif attrKey == u"font" or attrKey == u"global.font":
         fenum = wx.FontEnumerator()
         fenum.EnumerateFacenames()
@@ -356,7 +357,7 @@ class AttributeCheckParent(AbstractAttributeCheck):
         self.foundAttributes.append((attrName, attrValue, start, end))
 
         wikiDocument = self.wikiPage.getWikiDocument()
-        langHelper = wx.GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 wikiDocument.getWikiDefaultWikiLanguage())
 
         wikiWord = self.wikiPage.getWikiWord()
@@ -406,7 +407,7 @@ class AttributeCheckAlias(AbstractAttributeCheck):
             attrs on a page
         """
         wikiDocument = self.wikiPage.getWikiDocument()
-        langHelper = wx.GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 wikiDocument.getWikiDefaultWikiLanguage())
 
         wikiWord = self.wikiPage.getWikiWord()
@@ -469,7 +470,7 @@ class AttributeCheckTemplate(AbstractAttributeCheck):
             attrs on a page
         """
         wikiDocument = self.wikiPage.getWikiDocument()
-        langHelper = wx.GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 wikiDocument.getWikiDefaultWikiLanguage())
 
         wikiWord = self.wikiPage.getWikiWord()
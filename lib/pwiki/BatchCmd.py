@@ -0,0 +1,482 @@
+"""
+Command line interface to run maintenance operations on a wiki without GUI
+(see WikidPadBatch.py):
+
+    WikidPadBatch.py [global options] <command> [command options]
+
+The result is written as one JSON object to standard output, errors are
+reported there as well with a nonzero exit code (see EXIT_* constants).
+"""
+
+from __future__ import with_statement
+
+import sys, os, os.path, re, getopt, json, traceback
+
+from .WikiExceptions import *
+from .StringOps import mbcsDec
+
+from . import Instrumentation
+
+
+EXIT_OK = 0
+EXIT_ERROR = 1   # Operation failed
+EXIT_USAGE = 2   # Command line couldn't be interpreted
+EXIT_NO_MATCH = 3   # "search" found no page
+EXIT_OUT_OF_SYNC = 4   # "check-ext --dry-run" found externally modified files
+
+
+USAGE = \
+u"""Usage: WikidPadBatch.py [global options] <command> [command options]
+
+Global options:
+
+    -h, --help: Show this message
+    -w, --wiki  <wiki path>: path to the .wiki file of the wiki (required)
+    --ignore-lock: open wiki even if it is locked by another instance
+    --update-db: update database of wiki if it has an outdated format
+    --progress: write progress information to standard error
+    --instrument-trace <path>: record timings and write them as Chrome trace
+               file on exit
+    --instrument-summary <path>: record timings and write summary table
+               on exit ("-" for standard error)
+
+Commands:
+
+    rebuild [--only-dirty]: rebuild the wiki database, with --only-dirty
+               only the pages with outdated meta-data
+    rebuild-index: rebuild the search index
+    check-ext [--dry-run]: update externally modified wiki files, with
+               --dry-run only report them (exit code 4 if there are some)
+    export --type <type> --dest <destination path> [--what <what>]
+               [-p <page name>]... [--compfn]: export whole wiki (default),
+               given pages ("page") or their subtrees ("subtree")
+    export --list-types: list available export types
+    search [--type <type>] [--case-sensitive] [--whole-word] <text>:
+               list pages matching text. Type is one of "asis", "regex"
+               (default), "boolean" or "index". Exit code 3 if no page
+               matches
+
+Exit codes: 0 success, 1 error, 2 bad command line, 3 no match,
+4 out of sync
+"""
+
+
+class BatchCmdError(Exception):
+    """
+    Error which ends the batch command with given exit code.
+    """
+    def __init__(self, message, exitCode=EXIT_ERROR):
+        Exception.__init__(self, message)
+        self.message = message
+        self.exitCode = exitCode
+
+
+
+def _dec(s):
+    return mbcsDec(s, "replace")[0]
+
+
+class BatchCmd(object):
+    """
+    Parses the command line and runs the command. Parsing is done
+    in the constructor so usage errors are found before plugins are loaded.
+    """
+
+    # Dictionary {command name: (short options, long options)}
+    COMMAND_OPTIONS = {
+            "rebuild": ("", ["only-dirty"]),
+            "rebuild-index": ("", []),
+            "check-ext": ("", ["dry-run"]),
+            "export": ("p:", ["type=", "dest=", "what=", "page=", "compfn",
+                    "list-types"]),
+            "search": ("", ["type=", "case-sensitive", "whole-word"])
+        }
+
+    SEARCH_TYPES = (u"asis", u"regex", u"boolean", u"index")
+    EXPORT_WHATS = (u"wiki", u"page", u"subtree")
+
+    def __init__(self, sargs):
+        """
+        sargs -- stripped args (normally sys.argv[1:])
+        Raises BatchCmdError with exit code EXIT_USAGE if sargs can't be
+        interpreted.
+        """
+        self.showHelp = False
+        self.wikiPath = None
+        self.ignoreLock = False
+        self.updateDb = False
+        self.progress = False
+        self.instrumentTrace = None
+        self.instrumentSummary = None
+        self.command = None
+        # Dictionary {option name without dashes: value} of the command,
+        # value is True for flags, a list for "page"
+        self.cmdOpts = {}
+        self.cmdArgs = []
+
+        try:
+            opts, rargs = getopt.getopt(sargs, "hw:",
+                    ["help", "wiki=", "ignore-lock", "update-db", "progress",
+                    "instrument-trace=", "instrument-summary="])
+        except getopt.GetoptError, e:
+            raise BatchCmdError(unicode(e), EXIT_USAGE)
+
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                self.showHelp = True
+            elif o in ("-w", "--wiki"):
+                self.wikiPath = _dec(a)
+            elif o == "--ignore-lock":
+                self.ignoreLock = True
+            elif o == "--update-db":
+                self.updateDb = True
+            elif o == "--progress":
+                self.progress = True
+            elif o == "--instrument-trace":
+                self.instrumentTrace = _dec(a)
+            elif o == "--instrument-summary":
+                self.instrumentSummary = _dec(a)
+
+        if self.showHelp:
+            return
+
+        if len(rargs) == 0:
+            raise BatchCmdError(u"No command given", EXIT_USAGE)
+
+        self.command = rargs[0]
+        cmdOptSpec = self.COMMAND_OPTIONS.get(self.command)
+        if cmdOptSpec is None:
+            raise BatchCmdError(u"Unknown command '%s'" % _dec(self.command),
+                    EXIT_USAGE)
+
+        try:
+            opts, self.cmdArgs = getopt.gnu_getopt(rargs[1:], *cmdOptSpec)
+        except getopt.GetoptError, e:
+            raise BatchCmdError(unicode(e), EXIT_USAGE)
+
+        valueOpts = set("--" + lo[:-1] for lo in cmdOptSpec[1]
+                if lo.endswith("="))
+
+        self.cmdArgs = [_dec(a) for a in self.cmdArgs]
+        self.cmdOpts["page"] = []
+        for o, a in opts:
+            if o in ("-p", "--page"):
+                self.cmdOpts["page"].append(_dec(a))
+            elif o in valueOpts:
+                self.cmdOpts[o[2:]] = _dec(a)
+            else:
+                self.cmdOpts[o[2:]] = True
+
+        self._checkCommand()
+
+
+    def _checkCommand(self):
+        """
+        Check the options and arguments of the command which can be checked
+        without opening the wiki.
+        """
+        cmdOpts = self.cmdOpts
+
+        if self.command == "export" and cmdOpts.get("list-types"):
+            # Wiki is needed as mainControl for the exporters
+            pass
+        elif self.command == "export":
+            if not (cmdOpts.get("type") and cmdOpts.get("dest")):
+                raise BatchCmdError(u"Options --type and --dest are needed "
+                        u"for export", EXIT_USAGE)
+            what = cmdOpts.setdefault("what", u"wiki")
+            if what not in self.EXPORT_WHATS:
+                raise BatchCmdError(u"Value for --what can be 'wiki', 'page' "
+                        u"or 'subtree'", EXIT_USAGE)
+            if what != u"wiki" and not cmdOpts["page"]:
+                raise BatchCmdError(u"Export of '%s' needs at least one "
+                        u"page given by --page" % what, EXIT_USAGE)
+        elif self.command == "search":
+            if len(self.cmdArgs) != 1:
+                raise BatchCmdError(u"Command search needs exactly one "
+                        u"search text", EXIT_USAGE)
+            if cmdOpts.setdefault("type", u"regex") not in self.SEARCH_TYPES:
+                raise BatchCmdError(u"Value for --type can be one of: %s" %
+                        u", ".join(self.SEARCH_TYPES), EXIT_USAGE)
+
+        if self.command != "search" and self.cmdArgs:
+            raise BatchCmdError(u"Unexpected argument '%s'" % self.cmdArgs[0],
+                    EXIT_USAGE)
+
+        if not self.wikiPath:
+            raise BatchCmdError(u"Option --wiki is needed", EXIT_USAGE)
+
+
+    def run(self, app, result):
+        """
+        Open the wiki, run the command and store its results in the
+        dictionary result. Returns exit code.
+        app -- HeadlessApp object
+        """
+        from .HeadlessApp import StreamProgressHandler, waitForBackgroundJobs
+
+        if self.progress:
+            progress = StreamProgressHandler(sys.stderr)
+        else:
+            progress = StreamProgressHandler()
+
+        wikiDocument = self._openWiki(app)
+        try:
+            cmdFunc = getattr(self, "cmd_" + self.command.replace("-", "_"))
+            return cmdFunc(app, wikiDocument, progress, result)
+        finally:
+            try:
+                waitForBackgroundJobs(wikiDocument)
+            finally:
+                wikiDocument.release()
+
+
+    def _openWiki(self, app):
+        from .wikidata import WikiDataManager
+
+        cfgPath = os.path.abspath(self.wikiPath)
+        if not os.path.isfile(cfgPath):
+            raise BatchCmdError(u"Wiki configuration file '%s' not found" %
+                    cfgPath)
+
+        globalConfig = app.getGlobalConfig()
+        ignoreLock = self.ignoreLock or globalConfig.getboolean("main",
+                "wikiLockFile_ignore", False)
+        createLock = globalConfig.getboolean("main", "wikiLockFile_create",
+                True)
+
+        try:
+            wikiDocument = WikiDataManager.openWikiDocument(cfgPath, None, None,
+                    ignoreLock, createLock)
+        except LockedWikiException:
+            raise BatchCmdError(u"Wiki is locked by another instance, use "
+                    u"--ignore-lock to open it anyway")
+        except AppBaseException, e:
+            raise BatchCmdError(u"Error opening wiki '%s': %s" % (cfgPath,
+                    unicode(e)))
+
+        try:
+            frmcode, frmtext = wikiDocument.checkDatabaseFormat()
+            if frmcode == 2:
+                raise BatchCmdError(u"Error connecting to database in '%s': %s"
+                        % (cfgPath, frmtext))
+            elif frmcode == 1 and not self.updateDb:
+                raise BatchCmdError(u"The wiki needs an update to work with "
+                        u"this version of WikidPad, use --update-db to "
+                        u"update it")
+
+            wikiDocument.connect()
+        except (BatchCmdError, AppBaseException), e:
+            wikiDocument.release()
+            if isinstance(e, BatchCmdError):
+                raise
+            raise BatchCmdError(u"Error connecting to wiki '%s': %s" %
+                    (cfgPath, unicode(e)))
+
+        return wikiDocument
+
+
+    def _checkWritable(self, wikiDocument):
+        if wikiDocument.isReadOnlyEffect():
+            raise BatchCmdError(u"Wiki is read-only")
+
+
+    def cmd_rebuild(self, app, wikiDocument, progress, result):
+        self._checkWritable(wikiDocument)
+        onlyDirty = bool(self.cmdOpts.get("only-dirty"))
+        wikiDocument.rebuildWiki(progress, onlyDirty)
+        result["onlyDirty"] = onlyDirty
+        return EXIT_OK
+
+
+    def cmd_rebuild_index(self, app, wikiDocument, progress, result):
+        self._checkWritable(wikiDocument)
+        if not wikiDocument.isSearchIndexEnabled():
+            raise BatchCmdError(u"Search index is not enabled for this wiki")
+
+        wikiDocument.rebuildSearchIndex(progress)
+        return EXIT_OK
+
+
+    def cmd_check_ext(self, app, wikiDocument, progress, result):
+        wikiData = wikiDocument.getWikiData()
+        if wikiData.checkCapability("filePerPage") != 1:
+            raise BatchCmdError(u"Wiki does not store pages in separate files")
+
+        dryRun = bool(self.cmdOpts.get("dry-run"))
+        if not dryRun:
+            self._checkWritable(wikiDocument)
+
+        namesBefore = set(wikiData.getAllDefinedWikiPageNames())
+        modified = sorted(name for name in namesBefore
+                if not wikiData.validateFileSignatureForWikiPageName(name))
+
+        result["dryRun"] = dryRun
+        if dryRun:
+            result["modified"] = modified
+            return EXIT_OUT_OF_SYNC if modified else EXIT_OK
+
+        wikiDocument.updateExtWikiFiles(progress)
+
+        namesAfter = set(wikiData.getAllDefinedWikiPageNames())
+        result["added"] = sorted(namesAfter - namesBefore)
+        result["removed"] = sorted(namesBefore - namesAfter)
+        result["modified"] = [name for name in modified if name in namesAfter]
+        return EXIT_OK
+
+
+    def cmd_export(self, app, wikiDocument, progress, result):
+        from . import PluginManager
+        from .HeadlessApp import HeadlessMainControl
+
+        mainControl = HeadlessMainControl(app, wikiDocument)
+        exportTypes = PluginManager.getSupportedExportTypes(mainControl, None)
+
+        if self.cmdOpts.get("list-types"):
+            result["types"] = [{"type": etype, "description": desc}
+                    for exporter, etype, desc, panel in
+                    sorted(exportTypes.values(), key=lambda t: t[1])]
+            return EXIT_OK
+
+        exportType = self.cmdOpts["type"]
+        if exportType not in exportTypes:
+            raise BatchCmdError(u"Value for --type can be one of: %s" %
+                    u", ".join(sorted(exportTypes)), EXIT_USAGE)
+
+        exporter = exportTypes[exportType][0]
+
+        what = self.cmdOpts["what"]
+        wikiData = wikiDocument.getWikiData()
+        if what == u"page":
+            wordList = self.cmdOpts["page"]
+        elif what == u"subtree":
+            wordList = wikiData.getAllSubWords(self.cmdOpts["page"])
+        else:
+            wordList = wikiData.getAllDefinedWikiPageNames()
+
+        exportDest = os.path.abspath(self.cmdOpts["dest"])
+        try:
+            exporter.export(wikiDocument, wordList, exportType, exportDest,
+                    bool(self.cmdOpts.get("compfn")), exporter.getAddOpt(None),
+                    progress)
+        except (IOError, OSError), e:
+            traceback.print_exc()
+            # unicode(e) returns different result for IOError
+            raise BatchCmdError(_dec(str(e)))
+        except ExportException, e:
+            raise BatchCmdError(unicode(e))
+
+        result["type"] = exportType
+        result["dest"] = exportDest
+        result["pageCount"] = len(wordList)
+        return EXIT_OK
+
+
+    def cmd_search(self, app, wikiDocument, progress, result):
+        searchType = self.cmdOpts["type"]
+        if searchType == u"index" and not wikiDocument.isSearchIndexEnabled():
+            raise BatchCmdError(u"Search index is not enabled for this wiki")
+
+        sarOp = buildSearchOperation(self.cmdArgs[0], searchType,
+                bool(self.cmdOpts.get("case-sensitive")),
+                bool(self.cmdOpts.get("whole-word")))
+
+        try:
+            pages = wikiDocument.searchWiki(sarOp, True)
+        except re.error, e:
+            raise BatchCmdError(u"Bad regular expression: %s" % _dec(str(e)),
+                    EXIT_USAGE)
+
+        result["type"] = searchType
+        result["pages"] = pages
+        return EXIT_OK if pages else EXIT_NO_MATCH
+
+
+
+def buildSearchOperation(searchStr, searchType=u"regex", caseSensitive=False,
+        wholeWord=False):
+    """
+    Return SearchReplaceOperation for a wiki-wide search with the same
+    settings as the search dialog would use.
+    searchType -- one of BatchCmd.SEARCH_TYPES
+    """
+    from .SearchAndReplace import SearchReplaceOperation, stripSearchString
+
+    sarOp = SearchReplaceOperation()
+    sarOp.searchStr = stripSearchString(searchStr)
+    sarOp.booleanOp = searchType == u"boolean"
+    sarOp.indexSearch = 'default' if searchType == u"index" else 'no'
+    sarOp.caseSensitive = caseSensitive
+    sarOp.wholeWord = wholeWord
+    sarOp.cycleToStart = False
+    sarOp.wildCard = 'no' if searchType == u"asis" else 'regex'
+    sarOp.wikiWide = True
+
+    return sarOp
+
+
+
+def _writeResult(result):
+    sys.stdout.write(json.dumps(result, sort_keys=True) + "\n")
+    sys.stdout.flush()
+
+
+def main(sargs):
+    """
+    Run batch command given by sargs (normally sys.argv[1:]) and write
+    result. Returns exit code.
+    """
+    startTime = Instrumentation.getTime()
+    result = {"command": None, "wiki": None, "ok": False}
+
+    try:
+        cmd = BatchCmd(sargs)
+    except BatchCmdError, e:
+        sys.stderr.write((e.message + u"\n\n" + USAGE).encode("utf-8"))
+        result.update(error=e.message, exitCode=e.exitCode)
+        _writeResult(result)
+        return e.exitCode
+
+    if cmd.showHelp:
+        sys.stdout.write(USAGE.encode("utf-8"))
+        return EXIT_OK
+
+    result["command"] = cmd.command
+    result["wiki"] = os.path.abspath(cmd.wikiPath)
+
+    if cmd.instrumentTrace or cmd.instrumentSummary:
+        summaryFile = cmd.instrumentSummary
+        # Standard output is reserved for the result
+        if summaryFile == u"-":
+            summaryFile = None
+        Instrumentation.start(cmd.instrumentTrace, summaryFile)
+
+    exitCode = EXIT_ERROR
+    app = None
+    try:
+        try:
+            from .HeadlessApp import HeadlessApp
+
+            app = HeadlessApp()
+            with Instrumentation.span("batch." + cmd.command):
+                exitCode = cmd.run(app, result)
+        except BatchCmdError, e:
+            exitCode = e.exitCode
+            result["error"] = e.message
+        except Exception, e:
+            traceback.print_exc()
+            exitCode = EXIT_ERROR
+            result["error"] = u"%s: %s" % (e.__class__.__name__, e)
+    finally:
+        if app is not None:
+            app.close()
+        recorder = Instrumentation.stop()
+        if recorder is not None and cmd.instrumentSummary == u"-":
+            sys.stderr.write(recorder.getSummary().encode("utf-8"))
+
+    result["ok"] = exitCode in (EXIT_OK, EXIT_NO_MATCH, EXIT_OUT_OF_SYNC)
+    result["exitCode"] = exitCode
+    result["seconds"] = round(Instrumentation.getTime() - startTime, 3)
+    _writeResult(result)
+
+    return exitCode
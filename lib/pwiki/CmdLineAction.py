@@ -47,6 +47,10 @@ class CmdLineAction:
         self.lastTabsSubCtrls = None  # Corresponding list of subcontrol names
                 # for each wikiword to open
         self.noRecent = False  # Do not modify history of recently opened wikis
+        self.instrumentTrace = None  # Path of Chrome trace file to write
+                # (interpreted by MainApp)
+        self.instrumentSummary = None  # Path of instrumentation summary
+                # to write (interpreted by MainApp)
 
         if len(sargs) == 0:
             return
@@ -70,7 +74,8 @@ class CmdLineAction:
                     "export-type=", "export-dest=", "export-compfn",
                     "export-saved=", "continuous-export-saved=",
                     "anchor",
-                    "rebuild", "update-ext", "no-recent", "preview", "editor"])
+                    "rebuild", "update-ext", "no-recent", "preview", "editor",
+                    "instrument-trace=", "instrument-summary="])
         except getopt.GetoptError:
             self.cmdLineError = True
             return
@@ -110,6 +115,10 @@ class CmdLineAction:
                 self._fillLastTabsSubCtrls(len(wikiWordsToOpen), "preview")
             elif o == "--editor":
                 self._fillLastTabsSubCtrls(len(wikiWordsToOpen), "textedit")
+            elif o == "--instrument-trace":
+                self.instrumentTrace = mbcsDec(a, "replace")[0]
+            elif o == "--instrument-summary":
+                self.instrumentSummary = mbcsDec(a, "replace")[0]
 
 
         if len(wikiWordsToOpen) > 0:
@@ -393,6 +402,10 @@ N_(u"""Options:
                are opened in preview mode. Otherwise all pages given after that
                option are opened in preview mode.
     --editor: Same as --preview but opens in text editor mode.
+    --instrument-trace <path>: record timings and write them as Chrome trace
+               file on exit
+    --instrument-summary <path>: record timings and write summary table
+               on exit ("-" for standard output)
 
 """)
 
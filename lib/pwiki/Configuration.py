@@ -627,6 +627,8 @@ GLOBALDEFAULTS = {
 
     ("main", "tree_updateGenerator_minDelay"): u"0.1",  # Minimum delay (in secs) between calls to
             # the update generator
+    ("main", "tree_childrenPageSize"): u"500",  # Maximum number of children of a node to create
+            # tree items for at once, more are shown on demand by a "more..." node. 0: no limit
 
 #     ("main", "tree_font_pointSize"): u"",  # Data about tree font. If pointSize is empty, default fonts is used
 #     ("main", "tree_font_family"): u"",  # Data about tree font.
@@ -662,9 +664,15 @@ GLOBALDEFAULTS = {
     ("main", "export_table_of_contents"): u"0",  # Show table of contents when exporting
             # 0:None, 1:formatted as tree, 2:as list
     ("main", "export_lastDialogTag"): u"",  # Tag of the last used export tag to set as default in export dialog
+    ("main", "export_multiPageText_threadCount"): u"0",  # Number of threads preparing pages
+            # ahead of writing in multipage text export. 0 or 1: no parallel preparation
     ("main", "html_toc_title"): u"Table of Contents",  # title of table of contents
     ("main", "html_export_singlePage_sepLineCount"): u"10",  # How many empty lines to separate
             # two wiki pages in a single HTML page
+    ("main", "html_export_incremental"): u"False",  # Only render HTML export files again
+            # if data they were rendered from changed since last export to same directory
+    ("main", "html_export_processCount"): u"0",  # Number of processes rendering pages in HTML export,
+            # 0 or 1: no parallel export, negative: number of CPUs
     ("main", "html_preview_renderer"): u"0",  # 0: Internal wxWidgets; 1: IE; 2: Mozilla; 3: Webkit
     ("main", "html_preview_ieShowIframes"): u"False",  # Show iframes with external sources inside IE preview?
     ("main", "html_preview_webkitViKeys"): u"False",  # Allow shortcut keys of vi editor to move around in Webkit preview
@@ -683,6 +691,8 @@ GLOBALDEFAULTS = {
     # Editor options
     ("main", "sync_highlight_byte_limit"): "400",  # Size limit when to start asyn. highlighting in editor
     ("main", "async_highlight_delay"): "0.2",  # Delay after keypress before starting async. highlighting
+    ("main", "viewport_highlight_byte_limit"): "100000",  # Size limit when to highlight the visible part
+            # of the editor first and the rest in chunks in background. 0 deactivates
     ("main", "editor_shortHint_delay"): "500",  # Delay in milliseconds until the short hint defined for a wikiword is displayed
             # 0 deactivates short hints
     ("main", "editor_autoUnbullets"): "True",  # When pressing return on line with lonely bullet, remove bullet?
@@ -829,6 +839,10 @@ GLOBALDEFAULTS = {
             # (advanced option to cure a problem on Mac OS)
     ("main", "search_stripSpaces"): "False", # Iff True then leading and trailing spaces are
             # stripped from search text before searching
+    ("main", "search_fileScan_threadCount"): u"4", # Number of threads reading page files
+            # when searching a wiki with one file per page (Original Sqlite)
+    ("main", "search_pageContentCache_maxSize"): u"16", # Maximum size in MB of page contents
+            # kept in memory between searches in such a wiki, 0 disables the cache
 
     # Miscellaneous
     ("main", "print_margins"): "0,0,0,0", # Left, upper, right, lower page margins on printing
@@ -861,6 +875,21 @@ GLOBALDEFAULTS = {
             # use "system" otherwise ))
     ("main", "tempHandling_tempDir"): u"", # Path to directory for temporary files. Only valid if
             # "tempHandling_tempMode" is set to "given".
+    ("main", "insertionRenderCache_maxSize"): u"20", # Maximum size in MB of the cache
+            # for images which insertions (GraphViz, Gnuplot, ...) create by external applications.
+            # 0 disables the cache
+    ("main", "insertion_parallelRenderCount"): u"4", # Maximum number of external applications
+            # which may run in parallel to render the insertions of a page. 0 or 1: no parallel rendering
+    ("main", "html_preview_renderCache_maxSize"): u"10", # Maximum size in MB of the cache
+            # for HTML previews of pages in the Webkit preview. 0 disables the cache and pre-rendering
+    ("main", "wikiPage_cache_maxSize"): u"20", # Maximum estimated memory size in MB of recently used
+            # wiki pages (with their parsed content) which are kept in memory. 0 disables the cache
+    ("main", "plugin_lazyLoading"): u"True", # If True, plugins are registered from a cache of
+            # their manifests and only imported when they are needed first
+    ("main", "instrumentation_traceFile"): u"", # If not empty, timings of startup and hot paths are
+            # recorded and written to this path as Chrome trace file on exit
+    ("main", "instrumentation_summaryFile"): u"", # If not empty, timings of startup and hot paths
+            # are recorded and a summary table is written to this path on exit ("-" for stdout)
     ("main", "wikiPathes_relative"): "False", # If True, pathes to last recently used wikis
             # are stored relative to application dir.
     ("main", "openWikiWordDialog_sortOrder"): "0", # Sort order in "Open Wiki Word" dialog
@@ -942,6 +971,8 @@ WIKIDEFAULTS = {
     ("main", "wikiPageFiles_maxNameLength"): u"120", # Maximum length of overall name of a wiki page file
     ("main", "wikiPageFiles_gracefulOutsideAddAndRemove"): u"True",   # Handle missing wiki page files gracefully and try
             # to find existing files even if they are not in database.
+    ("main", "wikiPageFiles_watchMode"): u"1",   # Watch page files for changes outside of WikidPad and update
+            # only the changed pages? 0: Off; 1: If supported by OS (inotify on Linux); 2: Also by polling
 
     ("main", "headingsAsAliases_depth"): "0",  # Maximum heading depth for which aliases should be generated for
             # each heading up to and including this depth.
@@ -9,10 +9,11 @@ WikidPad.
 
 import sqlite3, traceback
 
-from wx import GetApp
+from .AppAccess import getApp
 
 from pwiki.WikiExceptions import *
 from .StringOps import utf8Enc
+from . import Instrumentation
 
 
 # Connection (and Cursor)-Wrapper to simplify some operations
@@ -44,20 +45,22 @@ class ConnectWrapBase:
 
     def execSql(self, sql, params=None):
         "utility method, executes the sql"
-        if params:
-            self.dbCursor.execute(sql, params)
-        else:
-            self.dbCursor.execute(sql)
+        with Instrumentation.span("db.execSql", sql):
+            if params:
+                self.dbCursor.execute(sql, params)
+            else:
+                self.dbCursor.execute(sql)
 
 
     def execSqlQuery(self, sql, params=None):
         "utility method, executes the sql, returns query result"
-        if params:
-            self.dbCursor.execute(sql, params)
-        else:
-            self.dbCursor.execute(sql)
+        with Instrumentation.span("db.execSqlQuery", sql):
+            if params:
+                self.dbCursor.execute(sql, params)
+            else:
+                self.dbCursor.execute(sql)
 
-        return self.dbCursor.fetchall()
+            return self.dbCursor.fetchall()
 
 
 #     def execSqlQueryIter(self, sql, params=None):
@@ -86,16 +89,17 @@ class ConnectWrapBase:
         one column and returns result. If query results
         to 0 rows, default is returned (defaults to None)
         """
-        if params:
-            self.dbCursor.execute(sql, params)
-        else:
-            self.dbCursor.execute(sql)
+        with Instrumentation.span("db.execSqlQuerySingleItem", sql):
+            if params:
+                self.dbCursor.execute(sql, params)
+            else:
+                self.dbCursor.execute(sql)
 
-        row = self.fetchone()
-        if row is None:
-            return default
+            row = self.fetchone()
+            if row is None:
+                return default
             
-        return row[0]
+            return row[0]
 
         
     def execSqlUntilNoChange(self, sql, params=None):
@@ -114,10 +118,11 @@ class ConnectWrapBase:
         """
         Ignore sqlite errors on execution
         """
-        try:
-            self.dbCursor.execute(sql)
-        except sqlite3.Error:
-            pass
+        with Instrumentation.span("db.execSqlNoError", sql):
+            try:
+                self.dbCursor.execute(sql)
+            except sqlite3.Error:
+                pass
 
 
     def getLastRowid(self):
@@ -161,8 +166,8 @@ class ConnectWrapBase:
         """
         Set handling of temporary data according to user settings
         """
-#         if not GetApp().sqliteInitFlag:   # TODO: Check for init flag here?
-        globalConfig = GetApp().getGlobalConfig()
+#         if not getApp().sqliteInitFlag:   # TODO: Check for init flag here?
+        globalConfig = getApp().getGlobalConfig()
         if globalConfig.getboolean("main", "tempHandling_preferMemory",
                 False):
             tempMode = u"memory"
@@ -171,7 +176,7 @@ class ConnectWrapBase:
                     u"system")
     
         if tempMode == u"auto":
-            if GetApp().isInPortableMode():
+            if getApp().isInPortableMode():
                 tempMode = u"config"
             else:
                 tempMode = u"system"
@@ -189,13 +194,13 @@ class ConnectWrapBase:
             self.execSql("pragma temp_store = 1")
         elif tempMode == u"config":
             self.execSql("pragma temp_store_directory = '%s'" %
-                    utf8Enc(GetApp().getGlobalConfigSubDir())[0])
+                    utf8Enc(getApp().getGlobalConfigSubDir())[0])
             self.execSql("pragma temp_store = 1")
         else:   # tempMode == u"system"
             self.execSql("pragma temp_store_directory = ''")
             self.execSql("pragma temp_store = 1")
     
-#         GetApp().sqliteInitFlag = True
+#         getApp().sqliteInitFlag = True
 
 
 
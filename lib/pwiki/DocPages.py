@@ -25,6 +25,8 @@ from WikiPyparsing import buildSyntaxNode
 import ParseUtilities
 
 import Serialization
+import Instrumentation
+from .AppAccess import getApp
 
 
 
@@ -54,6 +56,13 @@ class DocPage(object, MiscEventSourceMixin):
         self.txtEditorListLock = TimeoutRLock(Consts.DEADBLOCKTIMEOUT)
         self.editorText = None  # Contains editor text, 
                 # if no text editor is registered, this cache is invalid
+
+        # Tuple (id of page AST, number of its nodes), cache for
+        # getEstimatedMemorySize()
+        self.livePageAstNodeCount = (None, 0)
+        # Result of the last getEstimatedMemorySize() call done by
+        # updateEstimatedMemorySize()
+        self.lastEstimatedMemorySize = self.PAGE_MEMORY_ESTIMATE
 #         self.pageState = STATE_TEXTCACHE_MATCHES_EDITOR
 
 
@@ -73,6 +82,43 @@ class DocPage(object, MiscEventSourceMixin):
     def isInvalid(self):
         return self.txtEditors is None
 
+
+    # Rough estimates in bytes for getEstimatedMemorySize()
+    PAGE_MEMORY_ESTIMATE = 1000
+    NODE_MEMORY_ESTIMATE = 300
+
+    def getEstimatedMemorySize(self):
+        """
+        Return rough estimate of the memory in bytes used by this page and
+        its cached data, mainly the text and the nodes of the page AST.
+        """
+        size = self.PAGE_MEMORY_ESTIMATE
+
+        pageAst = self.livePageAst
+        if pageAst is not None:
+            astId, nodeCount = self.livePageAstNodeCount
+            if astId != id(pageAst):
+                if pageAst.isTerminal():
+                    nodeCount = 1
+                else:
+                    nodeCount = sum(1 for node in pageAst.iterDeep())
+                self.livePageAstNodeCount = (id(pageAst), nodeCount)
+
+            size += pageAst.strLength * 2 + \
+                    nodeCount * self.NODE_MEMORY_ESTIMATE
+
+        return size
+
+    def getLastEstimatedMemorySize(self):
+        """
+        Return the size estimated when cached data of the page was built
+        the last time. Unlike getEstimatedMemorySize() this is cheap.
+        """
+        return self.lastEstimatedMemorySize
+
+    def updateEstimatedMemorySize(self):
+        self.lastEstimatedMemorySize = self.getEstimatedMemorySize()
+
     def getTextOperationLock(self):
         return self.textOperationLock
 
@@ -228,7 +274,7 @@ class DocPage(object, MiscEventSourceMixin):
 
 
     def createWikiLanguageHelper(self):
-        return wx.GetApp().createWikiLanguageHelper(self.getWikiLanguageName())
+        return getApp().createWikiLanguageHelper(self.getWikiLanguageName())
 
 
     def getContent(self):
@@ -380,6 +426,10 @@ class AliasWikiPage(DocPage):
         return self.realWikiPage.getLivePageAst(fireEvent, dieOnChange,
                 threadstop)
 
+    def getLastEstimatedMemorySize(self):
+        # The data belongs to the real page which is cached on its own
+        return self.PAGE_MEMORY_ESTIMATE
+
 
     # TODO A bit hackish, maybe remove
     def __getattr__(self, attr):
@@ -505,6 +555,12 @@ class AbstractWikiPage(DataCarryingPage):
         # liveTextPlaceHold object on which the liveSpellCheckerUnknownWords is based.
         self.liveSpellCheckerUnknownWordsBasePlaceHold = None
 
+        # Text and languages on which liveSpellCheckerUnknownWords
+        # is based. If text changed, unknown words are only searched again
+        # in changed lines
+        self.liveSpellCheckerUnknownWordsBaseText = None
+        self.liveSpellCheckerUnknownWordsBaseLanguage = None
+
         self.__sinkWikiDocumentSpellSession = KeyFunctionSinkAR((
                 ("modified spell checker session", self.onModifiedSpellCheckerSession),
         ))
@@ -525,6 +581,26 @@ class AbstractWikiPage(DataCarryingPage):
         super(AbstractWikiPage, self).invalidate()
         self.__sinkWikiDocumentSpellSession.setEventSource(None)
 
+
+    def getEstimatedMemorySize(self):
+        size = super(AbstractWikiPage, self).getEstimatedMemorySize()
+
+        unknownWords = self.liveSpellCheckerUnknownWords
+        if unknownWords is not None:
+            size += unknownWords.getChildrenCount() * \
+                    self.NODE_MEMORY_ESTIMATE
+
+        return size
+
+    def updateEstimatedMemorySize(self):
+        """
+        Estimate the memory size again and let the wiki document adjust its
+        page cache. Called after the page AST or the spell checker results
+        were built, not when the page is fetched.
+        """
+        super(AbstractWikiPage, self).updateEstimatedMemorySize()
+        self.wikiDocument.updateWikiPageCacheSize(self)
+
     # TODO: Replace getWikiWord by getWikiPageName where appropriate
     def getWikiWord(self):
         """
@@ -738,7 +814,7 @@ class AbstractWikiPage(DataCarryingPage):
                 return globalAttrs[attrkey]
 
             option = "attributeDefault_" + attrkey
-            config = wx.GetApp().getGlobalConfig()
+            config = getApp().getGlobalConfig()
             if config.isOptionAllowed("main", option):
                 return config.get("main", option, default)
             
@@ -806,7 +882,7 @@ class AbstractWikiPage(DataCarryingPage):
             paragraphMode = strToBool(self.getAttributeOrGlobal(
                     u"paragraph_mode"), False)
                     
-            langHelper = wx.GetApp().createWikiLanguageHelper(
+            langHelper = getApp().createWikiLanguageHelper(
                     self.wikiDocument.getWikiDefaultWikiLanguage())
 
             wikiLanguageDetails = langHelper.createWikiLanguageDetails(
@@ -950,6 +1026,7 @@ class AbstractWikiPage(DataCarryingPage):
                 self.livePageBasePlaceHold = liveTextPlaceHold
                 self.livePageBaseFormatDetails = formatDetails
 
+            self.updateEstimatedMemorySize()
 
         if self.isReadOnlyEffect():
             threadstop.testValidThread()
@@ -974,6 +1051,7 @@ class AbstractWikiPage(DataCarryingPage):
 
             self.liveSpellCheckerUnknownWords = None
             self.liveSpellCheckerUnknownWordsBasePlaceHold = None
+            self.liveSpellCheckerUnknownWordsBaseText = None
 
         self.fireMiscEventKeys(("modified spell checker session",))
 
@@ -1011,6 +1089,11 @@ class AbstractWikiPage(DataCarryingPage):
 
             unknownWords = self.getSpellCheckerUnknownWordsIfAvailable()
 
+            # Unknown words of previous text to update incrementally
+            baseText = self.liveSpellCheckerUnknownWordsBaseText
+            baseUnknownWords = self.liveSpellCheckerUnknownWords
+            baseLanguage = self.liveSpellCheckerUnknownWordsBaseLanguage
+
         if unknownWords is not None:
             return unknownWords
 
@@ -1029,12 +1112,15 @@ class AbstractWikiPage(DataCarryingPage):
             return
             
         spellSession.setCurrentDocPage(self)
+        # Words are found by the wiki language, checked by the dictionary
+        language = (spellSession.dictLanguage, self.getWikiLanguageName())
 
-        if len(text) == 0:
-            unknownWords = []
-        else:
-            unknownWords = spellSession.buildUnknownWordList(text,
-                    threadstop=threadstop)
+        if baseLanguage != language:
+            baseText = None
+
+        unknownWords = spellSession.buildUnknownWordList(text,
+                threadstop=threadstop, baseText=baseText,
+                baseUnknownWords=baseUnknownWords)
 
         spellSession.close()
 
@@ -1043,10 +1129,13 @@ class AbstractWikiPage(DataCarryingPage):
 
             self.liveSpellCheckerUnknownWords = unknownWords
             self.liveSpellCheckerUnknownWordsBasePlaceHold = liveTextPlaceHold
+            self.liveSpellCheckerUnknownWordsBaseText = text
+            self.liveSpellCheckerUnknownWordsBaseLanguage = language
             
             self.__sinkWikiDocumentSpellSession.setEventSource(
                     self.getWikiDocument().getOnlineSpellCheckerSession())
 
+        self.updateEstimatedMemorySize()
 
         if self.isReadOnlyEffect():
             threadstop.testValidThread()
@@ -1062,6 +1151,7 @@ class AbstractWikiPage(DataCarryingPage):
 
 
 ##     @profile
+    @Instrumentation.instrumented("parse.page")
     def parseTextInContext(self, text, formatDetails=None,
             threadstop=DUMBTHREADSTOP):
         """
@@ -1070,7 +1160,7 @@ class AbstractWikiPage(DataCarryingPage):
 
         text: unistring with text
         """
-        parser = wx.GetApp().createWikiParser(self.getWikiLanguageName()) # TODO debug mode  , True
+        parser = getApp().createWikiParser(self.getWikiLanguageName()) # TODO debug mode  , True
 
         if formatDetails is None:
             formatDetails = self.getFormatDetails()
@@ -1079,7 +1169,7 @@ class AbstractWikiPage(DataCarryingPage):
             pageAst = parser.parse(self.getWikiLanguageName(), text,
                     formatDetails, threadstop=threadstop)
         finally:
-            wx.GetApp().freeWikiParser(parser)
+            getApp().freeWikiParser(parser)
 
         threadstop.testValidThread()
 
@@ -1349,7 +1439,7 @@ class WikiPage(AbstractWikiPage):
             # Check for "template" attribute
             parents = self.getParentRelationships()
             if len(parents) > 0:
-                langHelper = wx.GetApp().createWikiLanguageHelper(
+                langHelper = getApp().createWikiLanguageHelper(
                         self.getWikiLanguageName())
 
                 templateSource = None
@@ -1629,7 +1719,7 @@ class WikiPage(AbstractWikiPage):
         if self.wikiDocument.isReadOnlyEffect():
             return True  # TODO Error?
 
-        langHelper = wx.GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 self.getWikiLanguageName())
 
         attrs = {}
@@ -1727,7 +1817,7 @@ class WikiPage(AbstractWikiPage):
                 Consts.WIKIWORDMATCHTERMS_TYPE_ASLINK | \
                 Consts.WIKIWORDMATCHTERMS_TYPE_FROM_ATTRIBUTES
 
-        langHelper = wx.GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 self.getWikiLanguageName())
 
         for w, k, v in self.getWikiDocument().getAttributeTriples(
@@ -2092,21 +2182,12 @@ class WikiPage(AbstractWikiPage):
                     excludeSet=excludeSet, includeSet=includeSet)
             if childSortOrder.startswith(u"desc"):
                 coll = wikiDocument.getCollator()
-
-                def cmpLowerDesc(a, b):
-                    return coll.strcoll(
-                            b.lower(), a.lower())
-                            
-                # TODO Python 3.0 supports only key argument, no cmp. function
-                relations.sort(cmpLowerDesc) # sort alphabetically
+                # sort alphabetically
+                coll.sortByKeyFunc(relations, lambda r: r.lower(),
+                        ascend=False)
             elif childSortOrder.startswith(u"asc"):
                 coll = wikiDocument.getCollator()
-
-                def cmpLowerAsc(a, b):
-                    return coll.strcoll(
-                            a.lower(), b.lower())
-
-                relations.sort(cmpLowerAsc)
+                coll.sortByKeyFunc(relations, lambda r: r.lower())
 
 
 
@@ -2367,7 +2448,7 @@ class FunctionalPage(DataCarryingPage):
 
 
     def _loadGlobalPage(self, subtag):
-        tbLoc = os.path.join(wx.GetApp().getGlobalConfigSubDir(),
+        tbLoc = os.path.join(getApp().getGlobalConfigSubDir(),
                 "[%s].wiki" % subtag)
         try:
             tbContent = loadEntireTxtFile(tbLoc)
@@ -2468,7 +2549,7 @@ class FunctionalPage(DataCarryingPage):
 
 
     def _saveGlobalPage(self, text, subtag):
-        tbLoc = os.path.join(wx.GetApp().getGlobalConfigSubDir(),
+        tbLoc = os.path.join(getApp().getGlobalConfigSubDir(),
                 "[%s].wiki" % subtag)
 
         writeEntireFile(tbLoc, text, True)
@@ -2535,7 +2616,7 @@ class FunctionalPage(DataCarryingPage):
                 if self.funcTag.startswith(u"wiki/"):
                     evtSource = self
                 else:
-                    evtSource = wx.GetApp()
+                    evtSource = getApp()
     
                 if self.funcTag in (u"global/TextBlocks", u"wiki/TextBlocks"):
                     # The text blocks for the text blocks submenu was updated
@@ -2600,7 +2681,7 @@ class FunctionalPage(DataCarryingPage):
                         return globalAttrs[attrkey]
 
         option = "attributeDefault_" + attrkey
-        config = wx.GetApp().getGlobalConfig()
+        config = getApp().getGlobalConfig()
         if config.isOptionAllowed("main", option):
             return config.get("main", option, default)
 
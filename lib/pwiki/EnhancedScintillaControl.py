@@ -3,7 +3,7 @@ from __future__ import with_statement
 ## import hotshot
 ## _prof = hotshot.Profile("hotshot.prf")
 
-import traceback, codecs
+import traceback, codecs, array
 
 import wx, wx.stc
 
@@ -31,45 +31,188 @@ def bytelenSct_mbcs(us):
 
 
 
-class StyleCollector(StringOps.SnippetCollector):
+class ByteOffsetTable(object):
+    """
+    Converts character positions of a text to byte positions in Scintilla.
+    The table is built once for a text and holds the prefix sums of the byte
+    lengths of blocks of CHECKPOINT_DISTANCE characters, so a conversion
+    only needs to encode the rest of a block.
+    """
+    CHECKPOINT_DISTANCE = 32
+
+    def __init__(self, text, bytelenSct):
+        self.text = text
+        self.bytelenSct = bytelenSct
+        self.byteLength = bytelenSct(text)
+
+        if self.byteLength == len(text):
+            # Each character needs one byte
+            self.checkpoints = None
+            return
+
+        dist = self.CHECKPOINT_DISTANCE
+        checkpoints = array.array("l", [0])
+        bytePos = 0
+        for blockStart in xrange(0, len(text) - dist + 1, dist):
+            blockEnd = blockStart + dist
+            if u"\ud800" <= text[blockEnd - 1] <= u"\udbff" and \
+                    blockEnd < len(text):
+                # Block splits a surrogate pair, count the bytes of the pair
+                # minus the bytes of the single low surrogate at start
+                # of next block
+                bytePos += bytelenSct(text[blockStart:blockEnd + 1]) - \
+                        bytelenSct(text[blockEnd])
+            else:
+                bytePos += bytelenSct(text[blockStart:blockEnd])
+            checkpoints.append(bytePos)
+
+        self.checkpoints = checkpoints
+
+
+    def charToByte(self, charPos):
+        """
+        Return byte position for character position charPos
+        (0 <= charPos <= len(text)).
+        """
+        if self.checkpoints is None:
+            return charPos
+
+        block = charPos // self.CHECKPOINT_DISTANCE
+        blockStart = block * self.CHECKPOINT_DISTANCE
+        return self.checkpoints[block] + \
+                self.bytelenSct(self.text[blockStart:charPos])
+
+
+    def isSingleByte(self):
+        """
+        True iff each character needs exactly one byte.
+        """
+        return self.checkpoints is None
+
+
+    def getByteLength(self):
+        return self.byteLength
+
+
+
+class StyleCollector(object):
     """
     Helps to collect the style bytes needed to set the syntax coloring in
-    Scintilla editor component
+    Scintilla editor component. The style bytes are filled into
+    a preallocated bytearray so the costs are linear in text length.
     """
-    def __init__(self, defaultStyleNo, text, bytelenSct, startCharPos=0):   
-        super(StyleCollector, self).__init__()
+    def __init__(self, defaultStyleNo, text, bytelenSct, startCharPos=0,
+            offsetTable=None, baseStyleBytes=None, endCharPos=None):
+        """
+        startCharPos, endCharPos -- Range of text to collect style bytes for,
+                endCharPos None means end of text
+        offsetTable -- ByteOffsetTable for text, created if None
+        baseStyleBytes -- bytestring of style bytes to start with. If None
+                all bytes are set to defaultStyleNo
+        """
         self.defaultStyleNo = defaultStyleNo
         self.text = text
-        self.bytelenSct = bytelenSct
+        if offsetTable is None:
+            offsetTable = ByteOffsetTable(text, bytelenSct)
+        self.offsetTable = offsetTable
+        self.bytelenSct = offsetTable.bytelenSct
+        self.singleByte = offsetTable.isSingleByte()
+        self.startCharPos = startCharPos
+        if endCharPos is None:
+            endCharPos = len(text)
+        self.endCharPos = endCharPos
         self.charPos = startCharPos
+        self.byteStart = offsetTable.charToByte(startCharPos)
+
+        # Character position and corresponding position in self.buffer
+        # after the last converted range. Styles are mostly bound in
+        # ascending order, so usually only the gap to the next range
+        # must be measured
+        self.cursorCharPos = startCharPos
+        self.cursorBytePos = 0
+
+        if baseStyleBytes is None:
+            self.buffer = bytearray(chr(defaultStyleNo)) * \
+                    (offsetTable.charToByte(endCharPos) - self.byteStart)
+        else:
+            self.buffer = bytearray(baseStyleBytes)
+
+
+    def _byteRange(self, targetCharPos, targetLength):
+        """
+        Return byte range in self.buffer for given character range.
+        """
+        endCharPos = targetCharPos + targetLength
+        if targetCharPos < self.startCharPos or endCharPos > self.endCharPos:
+            endCharPos = min(endCharPos, self.endCharPos)
+            targetCharPos = min(max(targetCharPos, self.startCharPos),
+                    self.endCharPos)
+            endCharPos = max(endCharPos, targetCharPos)
+
+        if self.singleByte:
+            return targetCharPos - self.startCharPos, \
+                    endCharPos - self.startCharPos
+
+        cursorCharPos = self.cursorCharPos
+        if cursorCharPos <= targetCharPos < cursorCharPos + \
+                ByteOffsetTable.CHECKPOINT_DISTANCE:
+            bs = self.cursorBytePos + \
+                    self.bytelenSct(self.text[cursorCharPos:targetCharPos])
+        else:
+            bs = self.offsetTable.charToByte(targetCharPos) - self.byteStart
+
+        be = bs + self.bytelenSct(self.text[targetCharPos:endCharPos])
+        self.cursorCharPos = endCharPos
+        self.cursorBytePos = be
+
+        return bs, be
 
 
     def bindStyle(self, targetCharPos, targetLength, styleNo):
         if targetCharPos < 0:
             return
-        
-        if targetCharPos < self.charPos:
-            # Due to some unknown reason we had overlapping styles and
-            # must remove some bytes
-            bytestylelen = self.bytelenSct(self.text[targetCharPos:self.charPos])
-            self.drop(bytestylelen)
-        else:
-            # There is possibly a gap between end of last style and current one
-            # -> fill it with default style
-            bytestylelen = self.bytelenSct(self.text[self.charPos:targetCharPos])
-            self.append(chr(self.defaultStyleNo) * bytestylelen)
 
+        if targetCharPos < self.charPos:
+            # Due to some unknown reason we had overlapping styles.
+            # Styles after the new one are removed
+            bs, be = self._byteRange(targetCharPos, self.charPos - targetCharPos)
+            self.buffer[bs:be] = chr(self.defaultStyleNo) * (be - bs)
+        
         self.charPos = targetCharPos + targetLength
-            
-        bytestylelen = self.bytelenSct(self.text[targetCharPos:self.charPos])
-        self.append(chr(styleNo) * bytestylelen)
+        bs, be = self._byteRange(targetCharPos, targetLength)
+        self.buffer[bs:be] = chr(styleNo) * (be - bs)
+
+
+    def orStyle(self, targetCharPos, targetLength, styleBits):
+        """
+        Set styleBits (e.g. an indicator mask) in the style bytes of given
+        range in addition to the style already there.
+        """
+        if targetCharPos < 0:
+            return
+
+        bs, be = self._byteRange(targetCharPos, targetLength)
+        self.buffer[bs:be] = str(self.buffer[bs:be]).translate(
+                _getOrTranslation(styleBits))
+
 
     def value(self):
-        if self.charPos < len(self.text):
-            bytestylelen = self.bytelenSct(self.text[self.charPos:len(self.text)])
-            self.append(chr(self.defaultStyleNo) * bytestylelen)
+        return str(self.buffer)
+
+
+_orTranslations = {}
+
+def _getOrTranslation(styleBits):
+    """
+    Return translation table for str.translate() which ORs each byte
+    with styleBits.
+    """
+    table = _orTranslations.get(styleBits)
+    if table is None:
+        table = "".join(chr(i | styleBits) for i in xrange(256))
+        _orTranslations[styleBits] = table
 
-        return super(StyleCollector, self).value()
+    return table
 
 
 
@@ -4,7 +4,7 @@ from __future__ import with_statement
 ## profile = profilehooks.profile(filename="profile.prf", immediate=False)
 
 # from Enum import Enumeration
-import sys, os, string, re, traceback, locale, time, urllib
+import sys, os, string, re, traceback, locale, time, urllib, threading
 from os.path import join, exists, splitext, abspath
 from cStringIO import StringIO
 import shutil
@@ -34,6 +34,9 @@ import SystemInfo, PluginManager
 import OsAbstract
 
 import DocPages
+from .timeView import Versioning
+from . import Instrumentation
+from .AppAccess import getApp
 
 
 
@@ -329,6 +332,7 @@ class TextExporter(AbstractExporter):
         ctrls.chTextEncoding.SetSelection(addOpt[0])
 
 
+    @Instrumentation.instrumented("export.text")
     def export(self, wikiDocument, wordList, exportType, exportDest,
             compatFilenames, addopt, progressHandler):
         """
@@ -419,45 +423,192 @@ class MultiPageTextAddOptPanel(wx.Panel):
 
 
 
-class _SeparatorFoundException(Exception): pass
-
-class _SeparatorWatchUtf8Writer(utf8Writer):
-    def __init__(self, stream, separator, errors="strict"):
-        utf8Writer.__init__(self, stream, errors)
-        self.separator = separator
-#         self.separatorRe = re.compile(u"^" + re.escape(separator) + u"$",
-#                 re.MULTILINE | re.UNICODE)
-        self.buffer = []
+class _MptStreamWriter(object):
+    """
+    Writes a multipage text file encoded in UTF-8. The text between two
+    separators (an entry) is collected and checked for the separator before
+    it is written, so the file is written in a single pass. If an entry
+    contains the separator, a new separator is chosen and patched into the
+    already written part of the stream in place (all separators have
+    the same length).
+
+    The stream must be opened for reading and writing in binary mode.
+    """
+    MAX_SEPARATOR_TRIES = 35
+    PATCH_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, stream, errors="strict", lineSep="\n"):
+        self.stream = stream
+        self.errors = errors
+        self.lineSep = lineSep
+        self.separator = self._createSeparator()
+        self.entryParts = []
+        # Stream position of the separator in the header
+        self.headerSepPos = None
         self.firstSeparatorCallDone = False
 
-    def write(self, object):
-        self.buffer.append(object)
-        utf8Writer.write(self, object)
 
-    def writelines(self, list):
-        self.buffer += list
-        utf8Writer.writelines(self, list)
+    @staticmethod
+    def _createSeparator():
+        return u"-----%s-----" % createRandomString(25)
 
-    def clearBuffer(self):
-        self.buffer = []
-    
-    def checkAndClearBuffer(self):
-#         if self.separatorRe.search(u"".join(self.buffer)):
-        if u"".join(self.buffer).find(u"\n%s\n" % self.separator) > -1:
-            raise _SeparatorFoundException()
 
-        self.clearBuffer()
+    def getSeparator(self):
+        return self.separator
+
+
+    def writeHeader(self, formatVer):
+        self.stream.write(BOM_UTF8)
+        self.stream.write("Multipage text format %i%s" % (formatVer,
+                self.lineSep))
+        self.stream.write("Separator: ")
+        self.headerSepPos = self.stream.tell()
+        self.stream.write(self.separator.encode("ascii") + self.lineSep)
+
+
+    def write(self, text):
+        self.entryParts.append(text)
+
+
+    def writelines(self, texts):
+        self.entryParts += texts
+
+
+    @staticmethod
+    def _containsSeparator(text, separator):
+        """
+        Returns True if text has a line equal to separator.
+        """
+        sepLine = u"\n%s\n" % separator
+        return text.find(sepLine) > -1 or text.startswith(sepLine[1:]) or \
+                text.endswith(sepLine[:-1]) or text == separator
+
+
+    def _writeEntry(self):
+        text = u"".join(self.entryParts)
+        self.entryParts = []
+
+        if self._containsSeparator(text, self.separator):
+            self._changeSeparator(text)
+
+        if self.lineSep != "\n":
+            text = text.replace(u"\n", self.lineSep)
+
+        self.stream.write(text.encode("utf-8", self.errors))
 
 
     def writeSeparator(self):
-        self.checkAndClearBuffer()
+        self._writeEntry()
 
         if self.firstSeparatorCallDone:
-            utf8Writer.write(self, u"\n%s\n" % self.separator)
+            self.stream.write((self.lineSep + self.separator +
+                    self.lineSep).encode("ascii"))
         else:
             self.firstSeparatorCallDone = True
 
 
+    def writeEntries(self, entries):
+        """
+        Write sequence of entries, each one preceded by a separator.
+        """
+        for entry in entries:
+            self.writeSeparator()
+            self.entryParts.append(entry)
+
+
+    def finish(self):
+        """
+        Write last entry. Must be called after everything was written.
+        """
+        self._writeEntry()
+        self.stream.flush()
+
+
+    def _changeSeparator(self, pendingText):
+        for tryNumber in xrange(self.MAX_SEPARATOR_TRIES):
+            newSeparator = self._createSeparator()
+            if self._containsSeparator(pendingText, newSeparator):
+                continue
+
+            if self._patchSeparator(newSeparator):
+                self.separator = newSeparator
+                return
+        else:
+            raise ExportException(_(u"No usable separator found"))
+
+
+    def _patchSeparator(self, newSeparator):
+        """
+        Replace all separator lines in the written part of the stream by
+        newSeparator. Returns False and changes nothing if the written part
+        contains a line equal to newSeparator.
+        """
+        oldLine = (self.lineSep + self.separator + self.lineSep).encode("ascii")
+        newLine = (self.lineSep + newSeparator + self.lineSep).encode("ascii")
+        newSepBytes = newSeparator.encode("ascii")
+        overlap = len(oldLine) - 1
+
+        endPos = self.stream.tell()
+        self.stream.seek(0)
+
+        # Positions of old separators
+        positions = []
+        chunkPos = 0
+        tail = ""
+        while chunkPos < endPos:
+            chunk = self.stream.read(min(self.PATCH_CHUNK_SIZE,
+                    endPos - chunkPos))
+            if not chunk:
+                break
+            data = tail + chunk
+            dataPos = chunkPos - len(tail)
+
+            if data.find(newLine) > -1:
+                self.stream.seek(endPos)
+                return False
+
+            i = data.find(oldLine)
+            while i > -1:
+                positions.append(dataPos + i + len(self.lineSep))
+                i = data.find(oldLine, i + 1)
+
+            tail = data[-overlap:]
+            chunkPos += len(chunk)
+
+        for pos in positions + [self.headerSepPos]:
+            self.stream.seek(pos)
+            self.stream.write(newSepBytes)
+
+        self.stream.seek(endPos)
+        return True
+
+
+
+class _MptEntryCollector(object):
+    """
+    Replaces the stream writer for a MultiPageTextWikiPageWriter to collect
+    the written text as list of entries (texts between separators), e.g.
+    in a worker thread.
+    """
+    def __init__(self):
+        self.entries = []
+
+    def write(self, text):
+        if not self.entries:
+            self.entries.append([])
+        self.entries[-1].append(text)
+
+    def writelines(self, texts):
+        for text in texts:
+            self.write(text)
+
+    def writeSeparator(self):
+        self.entries.append([])
+
+    def getEntries(self):
+        return [u"".join(parts) for parts in self.entries]
+
+
 
 
 class MultiPageTextWikiPageWriter(object):
@@ -486,6 +637,17 @@ class MultiPageTextWikiPageWriter(object):
             self.exportFile.write(u"important/encoding/base64  storeHint/%s\n" %
                     shText)
             self.exportFile.write(base64BlockEncode(datablock))
+        elif unifName.startswith(u"versioning/overview/"):
+            # Stored in binary format, but exported as XML text
+            content = Versioning.VersionOverview.overviewBytesToXmlBytes(
+                    self.wikiDocument,
+                    self.wikiDocument.retrieveDataBlock(unifName),
+                    unifName[20:])
+            content = fileContentToUnicode(lineendToInternal(content))
+
+            self.exportFile.write(u"important/encoding/text  storeHint/%s\n" %
+                    shText)
+            self.exportFile.write(content)
         else:
             content = self.wikiDocument.retrieveDataBlockAsText(unifName)
 
@@ -537,27 +699,16 @@ def getSingleWikiWordPacket(wikiDocument, word, writeVersionData=True,
     single wiki word (including versions). Returns it as a utf8-encoded
     bytestring.
     """
-    for tryNumber in range(35):
-        stream = StringIO()
-        stream.write(BOM_UTF8)
-        separator = u"-----%s-----" % createRandomString(25)
-        exportFile = _SeparatorWatchUtf8Writer(stream, separator)
-        wikiPageWriter = MultiPageTextWikiPageWriter(wikiDocument, exportFile,
-                writeVersionData, formatVer)
-
-        exportFile.write(u"Multipage text format %i\n" % formatVer)
-        # Separator line
-        exportFile.write(u"Separator: %s\n" % separator)
+    stream = StringIO()
+    exportFile = _MptStreamWriter(stream)
+    wikiPageWriter = MultiPageTextWikiPageWriter(wikiDocument, exportFile,
+            writeVersionData, formatVer)
 
-        try:
-            wikiPageWriter.exportWikiWord(word)
-            exportFile.checkAndClearBuffer()
+    exportFile.writeHeader(formatVer)
+    wikiPageWriter.exportWikiWord(word)
+    exportFile.finish()
 
-            return stream.getvalue()
-        except _SeparatorFoundException:
-            continue
-    else:
-        raise ExportException(_(u"No usable separator found"))
+    return stream.getvalue()
 
 
 
@@ -566,6 +717,12 @@ class MultiPageTextExporter(AbstractExporter):
     """
     Exports in multipage text format
     """
+    # Buffer size of the export file
+    WRITE_BUFFER_SIZE = 1024 * 1024
+
+    # Maximum number of pages per thread prepared ahead of writing
+    PARALLEL_WINDOW_PER_THREAD = 4
+
     def __init__(self, mainControl):
         AbstractExporter.__init__(self, mainControl)
         self.wordList = None
@@ -658,6 +815,7 @@ class MultiPageTextExporter(AbstractExporter):
             fileVersion = 1
             writeWikiFuncPages = 1
             writeSavedSearches = 1            
+            writeVersionData = 0
         else:
             ctrls = addoptpanel.ctrls
             fileVersion = ctrls.chFileVersion.GetSelection()
@@ -699,6 +857,17 @@ class MultiPageTextExporter(AbstractExporter):
             self.exportFile.write(u"important/encoding/base64  storeHint/%s\n" %
                     shText)
             self.exportFile.write(base64BlockEncode(datablock))
+        elif unifName.startswith(u"versioning/overview/"):
+            # Stored in binary format, but exported as XML text
+            content = Versioning.VersionOverview.overviewBytesToXmlBytes(
+                    self.wikiDocument,
+                    self.wikiDocument.retrieveDataBlock(unifName),
+                    unifName[20:])
+            content = fileContentToUnicode(lineendToInternal(content))
+
+            self.exportFile.write(u"important/encoding/text  storeHint/%s\n" %
+                    shText)
+            self.exportFile.write(content)
         else:
             content = self.wikiDocument.retrieveDataBlockAsText(unifName)
 
@@ -737,6 +906,7 @@ class MultiPageTextExporter(AbstractExporter):
 #             self.firstSeparatorCallDone = True
 
 
+    @Instrumentation.instrumented("export.multiPageText")
     def export(self, wikiDocument, wordList, exportType, exportDest,
             compatFilenames, addOpt, progressHandler):
         """
@@ -756,103 +926,167 @@ class MultiPageTextExporter(AbstractExporter):
         self.addOpt = addOpt
         self.exportFile = None
         self.rawExportFile = None
-        self.firstSeparatorCallDone = False
         
         self.formatVer = min(addOpt[0], 1)
         self.writeWikiFuncPages = addOpt[1] and (self.formatVer > 0)
         self.writeSavedSearches = addOpt[2] and (self.formatVer > 0)
         self.writeVersionData = addOpt[3] and (self.formatVer > 0)
 
+        threadCount = getApp().getGlobalConfig().getint("main",
+                "export_multiPageText_threadCount", 0)
+
         try:
-            for tryNumber in range(35):
-                self.separator = u"-----%s-----" % createRandomString(25)
-                try:
-                    self.rawExportFile = open(pathEnc(self.exportDest), "w")
-
-                    # Only UTF-8 mode currently
-                    self.rawExportFile.write(BOM_UTF8)
-                    self.exportFile = _SeparatorWatchUtf8Writer(
-                            self.rawExportFile, self.separator, "replace")
-
-                    self.wikiPageWriter = MultiPageTextWikiPageWriter(
-                            self.wikiDocument, self.exportFile,
-                            self.writeVersionData, self.formatVer)
-
-                    # Identifier line with file format
-                    self.exportFile.write(u"Multipage text format %i\n" %
-                            self.formatVer)
-                    # Separator line
-                    self.exportFile.write(u"Separator: %s\n" % self.separator)
-    
-    
-                    # Write wiki-bound functional pages
-                    if self.writeWikiFuncPages:
-                        # Only wiki related functional pages
-                        wikiFuncTags = [ft for ft in DocPages.getFuncTags()
-                                if ft.startswith("wiki/")]
-                        
-                        for ft in wikiFuncTags:
-                            self.exportFile.writeSeparator()
-                            self.exportFile.write(u"funcpage/%s\n" % ft)
-                            page = self.wikiDocument.getFuncPage(ft)
-                            self.exportFile.write(page.getLiveText())
-    
-    
-                    # Write saved searches
-                    if self.writeSavedSearches:
-                        # Wiki-wide searches
-                        wikiData = self.wikiDocument.getWikiData()
-                        unifNames = wikiData.getDataBlockUnifNamesStartingWith(
-                                u"savedsearch/")
-    
-                        for un in unifNames:
-                            self.exportFile.writeSeparator()
-                            self.exportFile.write(un + u"\n")
-                            datablock = wikiData.retrieveDataBlock(un)
-    
-                            self.exportFile.write(base64BlockEncode(datablock))
-                        
-                        # Page searches
-                        unifNames = wikiData.getDataBlockUnifNamesStartingWith(
-                                u"savedpagesearch/")
-    
-                        for un in unifNames:
-                            self.exportFile.writeSeparator()
-                            self._writeHintedDatablock(un, False)
+            self.rawExportFile = open(pathEnc(self.exportDest), "w+b",
+                    self.WRITE_BUFFER_SIZE)
 
-                    locale.setlocale(locale.LC_ALL, '')
-    
-                    # Write actual wiki words
-                    for word in self.wordList:
-                        self.wikiPageWriter.exportWikiWord(word)
-                        self.exportFile.checkAndClearBuffer()
-                    break
-
-                except _SeparatorFoundException:
-                    if self.exportFile is not None:
-                        self.exportFile.flush()
-                        self.exportFile = None
-        
-                    if self.rawExportFile is not None:
-                        self.rawExportFile.close()
-                        self.rawExportFile = None
+            # Only UTF-8 mode currently
+            self.exportFile = _MptStreamWriter(self.rawExportFile, "replace",
+                    os.linesep)
 
-                    continue
-                except Exception, e:
-                    traceback.print_exc()
-                    raise ExportException(unicode(e))
+            self.wikiPageWriter = MultiPageTextWikiPageWriter(
+                    self.wikiDocument, self.exportFile,
+                    self.writeVersionData, self.formatVer)
+
+            # Identifier and separator line
+            self.exportFile.writeHeader(self.formatVer)
+
+            # Write wiki-bound functional pages
+            if self.writeWikiFuncPages:
+                # Only wiki related functional pages
+                wikiFuncTags = [ft for ft in DocPages.getFuncTags()
+                        if ft.startswith("wiki/")]
+
+                for ft in wikiFuncTags:
+                    self.exportFile.writeSeparator()
+                    self.exportFile.write(u"funcpage/%s\n" % ft)
+                    page = self.wikiDocument.getFuncPage(ft)
+                    self.exportFile.write(page.getLiveText())
+
+
+            # Write saved searches
+            if self.writeSavedSearches:
+                # Wiki-wide searches
+                wikiData = self.wikiDocument.getWikiData()
+                unifNames = wikiData.getDataBlockUnifNamesStartingWith(
+                        u"savedsearch/")
+
+                for un in unifNames:
+                    self.exportFile.writeSeparator()
+                    self.exportFile.write(un + u"\n")
+                    datablock = wikiData.retrieveDataBlock(un)
+
+                    self.exportFile.write(base64BlockEncode(datablock))
+
+                # Page searches
+                unifNames = wikiData.getDataBlockUnifNamesStartingWith(
+                        u"savedpagesearch/")
+
+                for un in unifNames:
+                    self.exportFile.writeSeparator()
+                    self._writeHintedDatablock(un, False)
+
+            locale.setlocale(locale.LC_ALL, '')
+
+            # Write actual wiki words
+            if threadCount < 2 or len(self.wordList) < 2:
+                for word in self.wordList:
+                    self.wikiPageWriter.exportWikiWord(word)
             else:
-                raise ExportException(_(u"No usable separator found"))
+                for entries in self._iterWikiWordEntries(threadCount):
+                    self.exportFile.writeEntries(entries)
+
+            self.exportFile.finish()
+        except ExportException:
+            raise
+        except Exception, e:
+            traceback.print_exc()
+            raise ExportException(unicode(e))
         finally:
-            if self.exportFile is not None:
-                self.exportFile.flush()
-                self.exportFile = None
+            self.exportFile = None
 
             if self.rawExportFile is not None:
                 self.rawExportFile.close()
                 self.rawExportFile = None
 
 
+    def _collectWikiWordEntries(self, word):
+        """
+        Return list of entries (texts between separators) to export
+        for word.
+        """
+        collector = _MptEntryCollector()
+        MultiPageTextWikiPageWriter(self.wikiDocument, collector,
+                self.writeVersionData, self.formatVer).exportWikiWord(word)
+
+        return collector.getEntries()
+
+
+    def _iterWikiWordEntries(self, threadCount):
+        """
+        Iterate over the lists of entries for the words in self.wordList
+        in the order of the list. The lists are created by threadCount
+        worker threads, at most PARALLEL_WINDOW_PER_THREAD * threadCount
+        of them are ahead of the consumer.
+        """
+        wordList = self.wordList
+        window = threadCount * self.PARALLEL_WINDOW_PER_THREAD
+        cond = threading.Condition()
+        # Dictionary {index in wordList: (succeeded, entries or exception)}
+        results = {}
+        # Next word index to take by a worker, number of consumed results,
+        # stop flag
+        state = [0, 0, False]
+
+        def worker():
+            while True:
+                with cond:
+                    while not state[2] and state[0] < len(wordList) and \
+                            state[0] >= state[1] + window:
+                        cond.wait()
+
+                    if state[2] or state[0] >= len(wordList):
+                        return
+
+                    idx = state[0]
+                    state[0] += 1
+
+                try:
+                    result = (True, self._collectWikiWordEntries(
+                            wordList[idx]))
+                except Exception, e:
+                    traceback.print_exc()
+                    result = (False, e)
+
+                with cond:
+                    results[idx] = result
+                    cond.notifyAll()
+
+        threads = [threading.Thread(target=worker)
+                for i in xrange(min(threadCount, len(wordList)))]
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+
+        try:
+            for idx in xrange(len(wordList)):
+                with cond:
+                    while idx not in results:
+                        cond.wait()
+
+                    succeeded, value = results.pop(idx)
+                    state[1] = idx + 1
+                    cond.notifyAll()
+
+                if not succeeded:
+                    raise value
+
+                yield value
+        finally:
+            with cond:
+                state[2] = True
+                cond.notifyAll()
+
+
     def _getDatablocksClass(self, unifName):
         """
         """
@@ -866,6 +1100,8 @@ class MultiPageTextExporter(AbstractExporter):
             return 1 | 4  # text, hinted
         elif unifName.startswith(u"versioning/overview/"):
             return 1 | 4  # text, hinted
+        elif unifName.startswith(u"versioning/overviewchunk/"):
+            return 0  # contained in exported overview
         elif unifName.startswith(u"versioning/packet/"):
             return 2 | 4  # binary, hinted
         else:
@@ -906,6 +1142,15 @@ class MultiPageTextExporter(AbstractExporter):
 
             if cl & 3 == 1:
                 # as text
+                if unifName.startswith(u"versioning/overview/"):
+                    try:
+                        datablock = Versioning.VersionOverview\
+                                .overviewBytesToXmlBytes(self.wikiDocument,
+                                datablock, unifName[20:])
+                    except:
+                        # Damaged, export as is
+                        traceback.print_exc()
+
                 datablock = StringOps.fileContentToUnicode(
                         StringOps.lineendToInternal(datablock))
 
@@ -934,7 +1179,7 @@ class MultiPageTextExporter(AbstractExporter):
                         Consts.DATABLOCK_STOREHINT_INTERN)
                 
 
-        except _SeparatorFoundException:
+        except ExportException:
             raise
         except:
             traceback.print_exc()
@@ -957,7 +1202,7 @@ class MultiPageTextExporter(AbstractExporter):
                 except:
                     traceback.print_exc()
 
-        except _SeparatorFoundException:
+        except ExportException:
             raise
         except:
             traceback.print_exc()
@@ -1012,7 +1257,7 @@ class MultiPageTextExporter(AbstractExporter):
 
                 writeWord(word, content, modified, created, visited)
 
-        except _SeparatorFoundException:
+        except ExportException:
             raise
         except:
             traceback.print_exc()
@@ -1038,7 +1283,7 @@ class MultiPageTextExporter(AbstractExporter):
                 except:
                     traceback.print_exc()
 
-        except _SeparatorFoundException:
+        except ExportException:
             raise
         except:
             traceback.print_exc()
@@ -1055,50 +1300,26 @@ class MultiPageTextExporter(AbstractExporter):
         self.exportDest = exportDest
         self.exportFile = None
         self.rawExportFile = None
-        self.firstSeparatorCallDone = False
         
         self.formatVer = 1
         
         try:
-            for tryNumber in range(35):
-                self.separator = u"-----%s-----" % createRandomString(25)
-                try:
-                    self.rawExportFile = open(pathEnc(self.exportDest), "w")
+            self.rawExportFile = open(pathEnc(self.exportDest), "w+b",
+                    self.WRITE_BUFFER_SIZE)
 
-                    # Only UTF-8 mode currently
-                    self.rawExportFile.write(BOM_UTF8)
-                    self.exportFile = _SeparatorWatchUtf8Writer(
-                            self.rawExportFile, self.separator, "replace")
+            # Only UTF-8 mode currently
+            self.exportFile = _MptStreamWriter(self.rawExportFile, "replace",
+                    os.linesep)
 
-#                     self.wikiPageWriter = MultiPageTextWikiPageWriter(
-#                             self.wikiDocument, self.exportFile,
-#                             self.writeVersionData, self.formatVer)
+            # Identifier and separator line
+            self.exportFile.writeHeader(self.formatVer)
 
-                    # Identifier line with file format
-                    self.exportFile.write(u"Multipage text format %i\n" %
-                            self.formatVer)
-                    # Separator line
-                    self.exportFile.write(u"Separator: %s\n" % self.separator)
+            self._recoveryExportDatablocks()
+            self._recoveryExportWikiWords()
 
-                    self._recoveryExportDatablocks()
-                    self._recoveryExportWikiWords()
-                    
-                    break
-                except _SeparatorFoundException:
-                    if self.exportFile is not None:
-                        self.exportFile.flush()
-                        self.exportFile = None
-        
-                    if self.rawExportFile is not None:
-                        self.rawExportFile.close()
-                        self.rawExportFile = None
-
-            else:
-                raise ExportException(_(u"No usable separator found"))
+            self.exportFile.finish()
         finally:
-            if self.exportFile is not None:
-                self.exportFile.flush()
-                self.exportFile = None
+            self.exportFile = None
 
             if self.rawExportFile is not None:
                 self.rawExportFile.close()
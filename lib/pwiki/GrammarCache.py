@@ -0,0 +1,259 @@
+"""
+Cache for the compiled regular expressions of the wiki language grammars.
+
+Building a grammar with WikiPyparsing compiles some hundred (partly huge)
+regular expressions, which is most of the time needed to import a wiki
+language parser. The compiled code of these regexes is stored in a cache
+file in the user's configuration directory so later starts only load it.
+If there is no such directory or the private functions of the regex engine
+which are needed don't work as expected, nothing is cached.
+
+A parser module uses it like:
+
+    _grammarCache = GrammarCache.beginGrammarBuild("WikidPadParser", __file__)
+    ... build grammar ...
+    GrammarCache.endGrammarBuild(_grammarCache)
+"""
+
+from __future__ import with_statement
+
+import os, os.path, sys, re, sre_compile, sre_parse, marshal, \
+        hashlib, threading, traceback
+
+try:
+    import _sre
+except ImportError:
+    _sre = None
+
+from .StringOps import pathEnc
+from . import WikiPyparsing
+from .AppAccess import getApp
+
+
+class GrammarCache(object):
+    """
+    Cache of the compiled code of regular expressions, keyed by pattern
+    and flags. The cache file is only valid for a given source key (a hash
+    of the parser sources, the Python version and the regex engine version),
+    otherwise it is ignored and written anew.
+
+    The compile() method is thread-safe.
+    """
+
+    CACHE_MAGIC = "WDGrammarCache"
+    FORMAT_VERSION = 0
+
+    def __init__(self, cachePath, sourceKey):
+        """
+        cachePath -- path of the file to load cache from and save it to
+        sourceKey -- bytestring, cache file is only used if it was stored
+                with the same key
+        """
+        self.cachePath = cachePath
+        self.sourceKey = sourceKey
+        self.lock = threading.Lock()
+        # Regex compiler of WikiPyparsing which was set before this cache
+        self.previousCompiler = None
+        # Dictionary {(isUnicode, pattern, flags): (finalFlags, code,
+        # groups, groupindex, indexgroup)} with the arguments for
+        # _sre.compile()
+        self.entries = {}
+        self.dirty = False
+
+        self._load()
+
+
+    def _load(self):
+        try:
+            with open(pathEnc(self.cachePath), "rb") as f:
+                data = f.read()
+        except IOError:
+            return
+
+        try:
+            magic, formatVersion, sourceKey, entries = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            traceback.print_exc()
+            return
+
+        if magic != self.CACHE_MAGIC or formatVersion != self.FORMAT_VERSION \
+                or sourceKey != self.sourceKey:
+            # Outdated, built again on save
+            self.dirty = True
+            return
+
+        self.entries = entries
+
+
+    def save(self):
+        """
+        Write cache file if new regexes were compiled.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+
+            data = marshal.dumps((self.CACHE_MAGIC, self.FORMAT_VERSION,
+                    self.sourceKey, self.entries))
+            try:
+                with open(pathEnc(self.cachePath), "wb") as f:
+                    f.write(data)
+            except IOError:
+                traceback.print_exc()
+                return
+
+            self.dirty = False
+
+
+    def compile(self, pattern, flags=0):
+        """
+        Replacement for re.compile() which takes the compiled code from
+        the cache if possible.
+        """
+        if not isinstance(pattern, basestring) or flags & re.DEBUG:
+            return re.compile(pattern, flags)
+
+        key = (isinstance(pattern, unicode), pattern, flags)
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is None:
+            try:
+                entry = _compileToCode(pattern, flags)
+            except Exception:
+                # Let re module report the error
+                return re.compile(pattern, flags)
+
+            if entry is None:
+                return re.compile(pattern, flags)
+
+            with self.lock:
+                self.entries[key] = entry
+                self.dirty = True
+
+        finalFlags, code, groups, groupindex, indexgroup = entry
+        return _sre.compile(pattern, finalFlags, code, groups, groupindex,
+                indexgroup)
+
+
+
+def _compileToCode(pattern, flags):
+    """
+    Compile pattern like sre_compile.compile() but return the arguments
+    for _sre.compile() instead of the regex object. Returns None if
+    pattern can't be handled this way.
+    """
+    p = sre_parse.parse(pattern, flags)
+    if p.pattern.groups > 100:
+        return None
+
+    code = sre_compile._code(p, flags)
+
+    groupindex = p.pattern.groupdict
+    indexgroup = [None] * p.pattern.groups
+    for k, i in groupindex.iteritems():
+        indexgroup[i] = k
+
+    return (flags | p.pattern.flags, code, p.pattern.groups - 1, groupindex,
+            indexgroup)
+
+
+_codeCompileSupported = None
+
+def _isCodeCompileSupported():
+    """
+    Check once if the private functions sre_compile._code() and
+    _sre.compile() used by _compileToCode() and GrammarCache.compile()
+    exist and work as expected with this Python version.
+    """
+    global _codeCompileSupported
+
+    if _codeCompileSupported is None:
+        _codeCompileSupported = False
+        if _sre is not None and hasattr(_sre, "compile") and \
+                hasattr(sre_compile, "_code"):
+            try:
+                pattern = u"(?P<first>a+)(b|c)?"
+                finalFlags, code, groups, groupindex, indexgroup = \
+                        _compileToCode(pattern, re.UNICODE)
+                regex = _sre.compile(pattern, finalFlags, code, groups,
+                        groupindex, indexgroup)
+                match = regex.match(u"aac")
+                _codeCompileSupported = match is not None and \
+                        match.groups() == (u"aa", u"c") and \
+                        match.group("first") == u"aa" and \
+                        regex.flags == re.compile(pattern, re.UNICODE).flags
+            except Exception:
+                traceback.print_exc()
+
+    return _codeCompileSupported
+
+
+def _getSourceKey(sourceFiles):
+    """
+    Return hash of the contents of the source files together with the
+    Python and regex engine versions or None if a file can't be read.
+    """
+    h = hashlib.sha1()
+    h.update("%s\n%s\n" % (sys.version, sre_compile.MAGIC))
+    for path in sourceFiles:
+        if path.endswith((".pyc", ".pyo")):
+            path = path[:-1]
+        try:
+            with open(path, "rb") as f:
+                h.update(f.read())
+        except IOError:
+            return None
+
+    return h.hexdigest()
+
+
+def _getCacheDir():
+    """
+    Return the user's configuration directory or None if there is none.
+    Other directories (e.g. the temporary one) are not used as others might
+    place a file there which is then loaded.
+    """
+    app = getApp()
+    getGlobalConfigSubDir = getattr(app, "getGlobalConfigSubDir", None)
+    if getGlobalConfigSubDir is not None:
+        cacheDir = getGlobalConfigSubDir()
+        if cacheDir and os.path.isdir(cacheDir):
+            return cacheDir
+
+    return None
+
+
+def beginGrammarBuild(name, parserFile):
+    """
+    Open the grammar cache for the parser named name which is defined in
+    module file parserFile and let WikiPyparsing.compileRegex() use it.
+    Returns the cache or None if it can't be used.
+    """
+    cacheDir = _getCacheDir()
+    if cacheDir is None or not _isCodeCompileSupported():
+        return None
+
+    sourceKey = _getSourceKey((parserFile, WikiPyparsing.__file__,
+            __file__))
+    if sourceKey is None:
+        return None
+
+    cachePath = os.path.join(cacheDir, u"grammarCache_%s.dat" % name)
+    cache = GrammarCache(cachePath, sourceKey)
+    cache.previousCompiler = WikiPyparsing.setRegexCompiler(cache.compile)
+
+    return cache
+
+
+def endGrammarBuild(cache):
+    """
+    Stop using cache (returned by beginGrammarBuild()) for
+    WikiPyparsing.compileRegex() and save it.
+    """
+    if cache is None:
+        return
+
+    # Restore previous compiler unless another build replaced it meanwhile
+    WikiPyparsing.replaceRegexCompiler(cache.compile, cache.previousCompiler)
+    cache.save()
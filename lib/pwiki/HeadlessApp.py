@@ -0,0 +1,210 @@
+"""
+Use wikis without GUI: application object without wx.App, stand-in for the
+main frame and progress handler for batch operations (see BatchCmd).
+"""
+
+import os, os.path, time
+
+from .AppBase import AppBase, findDirs
+from . import Localization
+
+
+class PathIconCache(object):
+    """
+    Replacement for wxHelper.IconCache which only knows names and paths
+    of the icons. No bitmaps are loaded.
+    """
+    def __init__(self, iconDir):
+        self.iconDir = iconDir
+
+        # Same format as in IconCache: {iconname: (index, path, bitmap)}
+        self.iconLookupCache = {}
+
+        try:
+            fileNames = os.listdir(iconDir)
+        except OSError:
+            fileNames = ()
+
+        for fn in fileNames:
+            if fn.endswith(".gif"):
+                self.iconLookupCache[fn[:-4]] = (-1, os.path.join(iconDir, fn),
+                        None)
+
+
+    def lookupIcon(self, iconname):
+        return None
+
+    def lookupIconIndex(self, iconname):
+        return -1
+
+    def lookupIconPath(self, iconname):
+        """
+        Returns the path to icon file of the requested icon.
+        If icon is unknown, None is returned.
+        """
+        try:
+            return self.iconLookupCache[iconname][1]
+        except KeyError:
+            return None
+
+    def resolveIconDescriptor(self, desc, default=None):
+        return default
+
+
+
+class HeadlessApp(AppBase):
+    """
+    Provides the services of MainApp.App (global configuration, plugins,
+    wiki languages, collator) without creating a wx.App, so it works without
+    display. Only one application object should exist per process.
+    """
+    def __init__(self, wikiAppDir=None, globalConfigDir=None):
+        """
+        wikiAppDir -- installation directory of WikidPad
+        globalConfigDir -- directory containing the global configuration
+        If one of them is None, it is found as MainApp.App does.
+        """
+        AppBase.__init__(self)
+
+        if wikiAppDir is None or globalConfigDir is None:
+            foundWikiAppDir, foundGlobalConfigDir = findDirs()
+            if wikiAppDir is None:
+                wikiAppDir = foundWikiAppDir
+            if globalConfigDir is None:
+                globalConfigDir = foundGlobalConfigDir
+
+        self._initGlobalConfig(wikiAppDir, globalConfigDir)
+
+        Localization.loadLangList(self.wikiAppDir)
+        Localization.loadI18nDict(self.wikiAppDir, self.globalConfig.get(
+                "main", "gui_language", u""))
+
+        # Plugins may add panels to the options dialog while registering
+        # their options, some of them need this insertion mark
+        self.optionsDlgPanelList = [("??insert mark/current wiki", u"")]
+
+        self.iconCache = PathIconCache(os.path.join(self.wikiAppDir, "icons"))
+
+        self.reloadPlugins()
+
+        self.collator = None
+        self._rereadGlobalConfig()
+
+
+    def IsMainLoopRunning(self):
+        """
+        There is no main loop, so Utilities.callInMainThread() and
+        callInMainThreadAsync() call functions directly.
+        """
+        return False
+
+
+    def close(self):
+        """
+        Free resources held by plugins. Call before process ends.
+        """
+        self.getInsertionPluginManager().taskEnd()
+
+
+
+class HeadlessMainControl(object):
+    """
+    Stand-in for PersonalWikiFrame as "mainControl" for exporters and
+    other plugins which only need configuration and the wiki document.
+    """
+    def __init__(self, app, wikiDocument):
+        self.wikiAppDir = app.getWikiAppDir()
+        self.wikiDocument = wikiDocument
+        self.wikiName = wikiDocument.getWikiName()
+        self.dataDir = wikiDocument.getDataDir()
+
+        self.configuration = app.createCombinedConfiguration()
+        self.configuration.setGlobalConfig(app.getGlobalConfig())
+        self.configuration.setWikiConfig(wikiDocument.getWikiConfig())
+
+
+    def getConfig(self):
+        return self.configuration
+
+    def getWikiConfig(self):
+        return self.wikiDocument.getWikiConfig()
+
+    def getWikiDocument(self):
+        return self.wikiDocument
+
+    def getWikiData(self):
+        return self.wikiDocument.getWikiData()
+
+    def getCollator(self):
+        return self.wikiDocument.getCollator()
+
+    def isReadOnlyWiki(self):
+        return self.wikiDocument.isReadOnlyEffect()
+
+    def getWikiDefaultWikiLanguage(self):
+        return self.wikiDocument.getWikiDefaultWikiLanguage()
+
+
+
+class StreamProgressHandler(object):
+    """
+    Implementation of the GuiProgressHandler protocol (see
+    wxHelper.ProgressHandler) which writes the progress as lines
+    "progress <step>/<sum> <message>" to a stream, at most once per
+    minInterval seconds. If stream is None, nothing is written.
+    """
+    def __init__(self, stream=None, minInterval=1.0):
+        self.stream = stream
+        self.minInterval = minInterval
+        self.title = u""
+        self.msg = u""
+        self.sum = 0
+        self.lastWriteTime = 0
+
+
+    def setTitle(self, title):
+        self.title = title
+
+    def setMessage(self, msg):
+        self.msg = msg
+
+
+    def open(self, sum):
+        self.sum = sum
+        self.lastWriteTime = 0
+
+
+    def update(self, step, msg):
+        """
+        Called after a step is finished. Returns True to continue.
+        """
+        self.msg = msg
+
+        if self.stream is None:
+            return True
+
+        now = time.time()
+        if now - self.lastWriteTime >= self.minInterval:
+            self.lastWriteTime = now
+            self.stream.write((u"progress %i/%i %s\n" % (step, self.sum,
+                    msg)).encode("utf-8"))
+            self.stream.flush()
+
+        return True
+
+
+    def close(self):
+        pass
+
+
+
+def waitForBackgroundJobs(wikiDocument, pollInterval=0.2):
+    """
+    Wait until the update executor of wikiDocument has processed all
+    queued jobs (e.g. meta-data updates) and stop it.
+    """
+    executor = wikiDocument.getUpdateExecutor()
+    while executor.getJobCount() > 0:
+        time.sleep(pollInterval)
+
+    executor.end(hardEnd=False)
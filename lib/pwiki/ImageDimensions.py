@@ -0,0 +1,292 @@
+"""
+Determine width and height of images by reading only their headers and
+cache the results.
+"""
+
+from __future__ import with_statement
+
+import os, os.path, struct, traceback, threading
+
+from .WikiExceptions import SerializationException
+from .Serialization import SerializeStream
+from .StringOps import pathEnc
+
+
+# SOF markers of JPEG which contain the image dimensions. 0xc4 (DHT),
+# 0xc8 (JPG) and 0xcc (DAC) are in the same range but are no SOF markers
+_JPEG_SOF_MARKERS = frozenset((0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7,
+        0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf))
+
+# Number of bytes needed to determine dimensions of all formats except JPEG
+_HEADER_SIZE = 30
+
+
+def _getJpegDims(stream):
+    """
+    Walk through the segments of a JPEG file until the SOF segment is found.
+    stream must be positioned after the SOI marker.
+    """
+    while True:
+        b = stream.read(1)
+        if b != "\xff":
+            return None, None
+
+        # Any number of fill bytes may precede the marker
+        while b == "\xff":
+            b = stream.read(1)
+        if b == "":
+            return None, None
+
+        marker = ord(b)
+        if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+            # Markers without segment
+            continue
+        if marker == 0xd9 or marker == 0xda:
+            # End of image or start of scan before any SOF
+            return None, None
+
+        data = stream.read(2)
+        if len(data) < 2:
+            return None, None
+        segLength = struct.unpack(">H", data)[0]
+        if segLength < 2:
+            return None, None
+
+        if marker in _JPEG_SOF_MARKERS:
+            data = stream.read(5)
+            if len(data) < 5:
+                return None, None
+            height, width = struct.unpack(">xHH", data)
+            return width, height
+
+        stream.seek(segLength - 2, 1)
+
+
+def getImageDimsFromStream(stream):
+    """
+    Return tuple (width, height) of the PNG, JPEG, GIF, BMP or WebP image
+    in file-like object stream by reading its header.
+    Returns (None, None) if format is unknown or header is damaged.
+    The stream must support seek() relative to current position (whence 1).
+    """
+    header = stream.read(_HEADER_SIZE)
+
+    if header.startswith("\x89PNG\r\n\x1a\n"):
+        if len(header) >= 24 and header[12:16] == "IHDR":
+            return struct.unpack(">II", header[16:24])
+
+    elif header.startswith("\xff\xd8"):
+        stream.seek(2 - len(header), 1)
+        return _getJpegDims(stream)
+
+    elif header.startswith("GIF87a") or header.startswith("GIF89a"):
+        if len(header) >= 10:
+            return struct.unpack("<HH", header[6:10])
+
+    elif header.startswith("BM"):
+        if len(header) >= 26:
+            dibSize = struct.unpack("<I", header[14:18])[0]
+            if dibSize == 12:
+                # OS/2 BITMAPCOREHEADER
+                return struct.unpack("<HH", header[18:22])
+            elif dibSize >= 40:
+                width, height = struct.unpack("<ii", header[18:26])
+                # Negative height means top-down bitmap
+                return abs(width), abs(height)
+
+    elif header.startswith("RIFF") and header[8:12] == "WEBP":
+        if len(header) >= 30:
+            chunkType = header[12:16]
+            if chunkType == "VP8 " and header[23:26] == "\x9d\x01\x2a":
+                width, height = struct.unpack("<HH", header[26:30])
+                return width & 0x3fff, height & 0x3fff
+            elif chunkType == "VP8L" and header[20] == "\x2f":
+                bits = struct.unpack("<I", header[21:25])[0]
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+            elif chunkType == "VP8X":
+                width, height = struct.unpack("<II", header[24:27] + "\0" +
+                        header[27:30] + "\0")
+                return width + 1, height + 1
+
+    return None, None
+
+
+def getImageDimsFromFile(path):
+    """
+    Return tuple (width, height) of the image file path, see
+    getImageDimsFromStream(). Raises IOError if file can't be read.
+    """
+    with open(pathEnc(path), "rb") as f:
+        try:
+            return getImageDimsFromStream(f)
+        except (struct.error, ValueError):
+            return None, None
+
+
+
+class ImageDimensionCache(object):
+    """
+    Cache of image dimensions. Dimensions of local files are stored with
+    modification time and size of the file and persist across sessions,
+    dimensions of remote URLs are only held in memory.
+
+    The methods are thread-safe.
+    """
+
+    CACHE_MAGIC = "WDImageDims"
+    # Version 0 stored modification times as whole seconds
+    FORMAT_VERSION = 1
+
+    # If more files are cached, only the ones used in this session are saved
+    MAX_SAVED_FILES = 20000
+
+    def __init__(self, cachePath):
+        """
+        cachePath -- path of the file to load cache from and save it to
+        """
+        self.cachePath = cachePath
+        self.lock = threading.RLock()
+        # Dictionary {path: (mtime, size, width, height)} with None for
+        # undeterminable width and height. None if not yet loaded
+        self.fileDims = None
+        # Paths of fileDims used in this session
+        self.usedPaths = set()
+        # Dictionary {url: (width, height)}
+        self.urlDims = {}
+        self.dirty = False
+
+
+    def _ensureLoaded(self):
+        """
+        Must be called with self.lock held.
+        """
+        if self.fileDims is not None:
+            return
+
+        self.fileDims = {}
+        try:
+            with open(pathEnc(self.cachePath), "rb") as f:
+                data = f.read()
+        except IOError:
+            return
+
+        try:
+            self.fileDims = self._readCache(SerializeStream(stringBuf=data,
+                    readMode=True))
+        except (SerializationException, struct.error):
+            traceback.print_exc()
+
+
+    def getFileDims(self, path, probeFct):
+        """
+        Return tuple (width, height) for image file path. If not cached,
+        probeFct(path) is called to determine it.
+        Raises OSError if file doesn't exist.
+        """
+        st = os.stat(pathEnc(path))
+        # Full precision, so a file rewritten within the same second with
+        # same size is detected on filesystems with subsecond timestamps
+        mtime = st.st_mtime
+
+        with self.lock:
+            self._ensureLoaded()
+            entry = self.fileDims.get(path)
+            if entry is not None and entry[:2] == (mtime, st.st_size):
+                self.usedPaths.add(path)
+                return entry[2:]
+
+        dims = probeFct(path)
+
+        with self.lock:
+            self.fileDims[path] = (mtime, st.st_size) + tuple(dims)
+            self.usedPaths.add(path)
+            self.dirty = True
+
+        return dims
+
+
+    def getUrlDims(self, url, probeFct):
+        """
+        Return tuple (width, height) for image at URL url. If not cached,
+        probeFct(url) is called to determine it.
+        """
+        with self.lock:
+            dims = self.urlDims.get(url)
+            if dims is not None:
+                return dims
+
+        dims = probeFct(url)
+
+        with self.lock:
+            self.urlDims[url] = dims
+
+        return dims
+
+
+    def save(self):
+        """
+        Write dimensions of local files to cache file if they changed.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+
+            if len(self.fileDims) > self.MAX_SAVED_FILES:
+                self.fileDims = dict((path, entry)
+                        for path, entry in self.fileDims.iteritems()
+                        if path in self.usedPaths)
+
+            stream = SerializeStream(stringBuf="", readMode=False)
+            self._writeCache(stream)
+            try:
+                with open(pathEnc(self.cachePath), "wb") as f:
+                    f.write(stream.getBytes())
+            except IOError:
+                traceback.print_exc()
+                return
+
+            self.dirty = False
+
+
+    def _readCache(self, stream):
+        if stream.readBytes(len(self.CACHE_MAGIC)) != self.CACHE_MAGIC:
+            raise SerializationException(u"Not an image dimension cache")
+        formatVersion = stream.serUint8(0)
+        if formatVersion < self.FORMAT_VERSION:
+            # Old entries can't be compared with precise modification times
+            return {}
+        if formatVersion != self.FORMAT_VERSION:
+            raise SerializationException(
+                    u"Unknown image dimension cache version")
+
+        fileDims = {}
+        for i in xrange(stream.serUint32(0)):
+            path = stream.serUniUtf8(u"")
+            mtime = stream.serFloat64(0.0)
+            size = stream.serUint32(0)
+            if stream.serBool(False):
+                width = stream.serUint32(0)
+                height = stream.serUint32(0)
+            else:
+                width = height = None
+
+            fileDims[path] = (mtime, size, width, height)
+
+        return fileDims
+
+
+    def _writeCache(self, stream):
+        stream.writeBytes(self.CACHE_MAGIC)
+        stream.serUint8(self.FORMAT_VERSION)
+        entries = [(path, entry) for path, entry in self.fileDims.iteritems()
+                if 0 <= entry[1] < 0x100000000]
+
+        stream.serUint32(len(entries))
+        for path, (mtime, size, width, height) in entries:
+            stream.serUniUtf8(path)
+            stream.serFloat64(mtime)
+            stream.serUint32(size)
+            stream.serBool(width is not None)
+            if width is not None:
+                stream.serUint32(width)
+                stream.serUint32(height)
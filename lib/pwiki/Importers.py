@@ -1,5 +1,5 @@
 # from Enum import Enumeration
-import sys, os, string, re, traceback, time, sqlite3
+import sys, os, string, re, traceback, time, sqlite3, mmap, tempfile
 from codecs import BOM_UTF8
 from os.path import join, exists, splitext
 from calendar import timegm
@@ -22,11 +22,179 @@ import DocPages
 
 from MptImporterGui import MultiPageTextImporterDialog
 
+from TempFileSet import getDefaultTempFilePath
+
 from .timeView import Versioning
+from .AppAccess import getApp
+
+
+
+class _MptEntryReader(object):
+    """
+    Reads a multipage text file from a bytestring or memory-mapped file.
+    Separator lines are found by searching the raw bytes, only the entries
+    (texts between separators) which are really needed are decoded.
+
+    Before the separator is set, readline() reads header lines. Afterwards
+    readline() reads lines of the current entry and returns u"" at the end
+    of the file. collectContent() and skipContent() finish the current entry.
+    Line ends are converted to "\\n" as in universal newline mode.
+    """
+    def __init__(self, data, decode, startPos=0):
+        self.data = data
+        self.decode = decode
+        self.pos = startPos
+        self.sepBytes = None
+        # End of content of current entry and start of next entry or None
+        # if the positions are not known yet
+        self.contentEnd = None
+        self.nextEntryPos = None
+
+
+    def setSeparator(self, separator):
+        self.sepBytes = separator.encode("ascii")
+
+
+    def getPos(self):
+        return self.pos
+
+
+    def setPos(self, pos):
+        self.pos = pos
+        self.contentEnd = None
+        self.nextEntryPos = None
+
+
+    def getSize(self):
+        return len(self.data)
+
+
+    def _decode(self, rawData):
+        text = self.decode(rawData, "replace")[0]
+        if u"\r" in text:
+            text = text.replace(u"\r\n", u"\n").replace(u"\r", u"\n")
+
+        return text
+
+
+    def _findEntryBounds(self):
+        """
+        Find next separator line after self.pos and set self.contentEnd
+        and self.nextEntryPos.
+        """
+        data = self.data
+        dataLen = len(data)
+        sepLen = len(self.sepBytes)
+        searchPos = self.pos
+        while True:
+            i = data.find(self.sepBytes, searchPos)
+            if i == -1:
+                self.contentEnd = dataLen
+                self.nextEntryPos = dataLen
+                return
+
+            searchPos = i + 1
+            afterPos = i + sepLen
+
+            # Separator must be a complete line
+            if i > self.pos and data[i - 1] not in "\r\n":
+                continue
+
+            if afterPos == dataLen:
+                nextPos = afterPos
+            elif data[afterPos:afterPos + 2] == "\r\n":
+                nextPos = afterPos + 2
+            elif data[afterPos] in "\r\n":
+                nextPos = afterPos + 1
+            else:
+                continue
+
+            # The line end before the separator belongs to the separator
+            if i >= self.pos + 2 and data[i - 2:i] == "\r\n":
+                contentEnd = i - 2
+            elif i > self.pos:
+                contentEnd = i - 1
+            else:
+                contentEnd = i
+
+            self.contentEnd = contentEnd
+            self.nextEntryPos = nextPos
+            return
+
+
+    def readline(self):
+        """
+        Read next line (with line end) of the header or the current entry.
+        Returns u"" at end of file.
+        """
+        if self.sepBytes is None:
+            end = len(self.data)
+        else:
+            if self.contentEnd is None:
+                if self.pos >= len(self.data):
+                    return u""
+                self._findEntryBounds()
+            end = self.contentEnd
+
+        data = self.data
+        i = data.find("\n", self.pos, end)
+        j = data.find("\r", self.pos, end if i == -1 else i)
+        if j > -1:
+            # "\r\n" or single "\r" as line end
+            lineEnd = j + 1
+            if lineEnd < end and data[lineEnd] == "\n":
+                lineEnd += 1
+        elif i > -1:
+            lineEnd = i + 1
+        else:
+            # Line reaches end of entry
+            line = data[self.pos:end]
+            self.pos = end
+            return self._decode(line) + u"\n"
+
+        line = data[self.pos:lineEnd]
+        self.pos = lineEnd
+
+        return self._decode(line)
+
+
+    def collectContent(self):
+        """
+        Return decoded rest of current entry and go to next entry.
+        """
+        if self.contentEnd is None:
+            self._findEntryBounds()
+
+        content = self._decode(self.data[self.pos:self.contentEnd])
+        self.setPos(self.nextEntryPos)
+        return content
+
+
+    def skipContent(self):
+        """
+        Go to next entry without decoding the rest of current entry.
+        """
+        if self.contentEnd is None:
+            self._findEntryBounds()
+
+        self.setPos(self.nextEntryPos)
+
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = ""
 
 
 
 class MultiPageTextImporter:
+    # Content size of imported entries after which the wiki database
+    # is committed
+    COMMIT_BATCH_SIZE = 8 * 1024 * 1024
+
+    # Minimal time in seconds between two progress updates
+    PROGRESS_INTERVAL = 0.25
+
     def __init__(self, mainControl):
         """
         mainControl -- Currently PersonalWikiFrame object
@@ -109,53 +277,97 @@ class MultiPageTextImporter:
 
     def _collectContent(self):
         """
-        Collect lines from current position of importFile up to separator
-        or file end collect all lines and return them as list of lines.
+        Collect content from current position of importFile up to separator
+        or file end and return it.
         """
-        content = []                    
-        while True:
-            # Read lines of wikiword
-            line = self.importFile.readline()
-            if line == u"":
-                # The last page in mpt file without separator
-                # ends as the real wiki page
-#                 content = u"".join(content)
-                break
-            
-            if line == self.separator:
-                if len(content) > 0:
-                    # Iff last line of mpt page is empty, the original
-                    # page ended with a newline, so remove last
-                    # character (=newline)
-
-                    content[-1] = content[-1][:-1]
-#                     content = u"".join(content)
-                break
-
-            content.append(line)
-            
-        return u"".join(content)
+        content = self.importFile.collectContent()
+        self._entryDone(len(content))
+        return content
 
 
     def _skipContent(self):
         """
         Skip content until reaching next separator or end of file
         """
-        while True:
-            # Read lines of wikiword
-            line = self.importFile.readline()
-            if line == u"":
-                # The last page in mpt file without separator
-                # ends as the real wiki page
-                break
-            
-            if line == self.separator:
-                break
+        self.importFile.skipContent()
+        self._entryDone(0)
+
 
+    def _startProgress(self, msg):
+        self.progressMsg = msg
+        self.progressStartTime = time.time()
+        self.progressLastTime = 0
+        self.progressStartPos = self.importFile.getPos()
+        if self.progressHandler is not None:
+            self.progressHandler.open(self.importFile.getSize() // 1024)
+            self.progressHandler.update(0, msg)
+
+
+    def _entryDone(self, contentSize):
+        """
+        Called after each entry. Commits the wiki database after
+        COMMIT_BATCH_SIZE characters of content if self.commitBatches is
+        true and updates progress.
+        """
+        if self.commitBatches:
+            self.uncommittedSize += contentSize
+            if self.uncommittedSize >= self.COMMIT_BATCH_SIZE:
+                self.wikiDocument.getWikiData().commit()
+                self.uncommittedSize = 0
+
+        if self.progressHandler is None:
+            return
+
+        now = time.time()
+        if now - self.progressLastTime < self.PROGRESS_INTERVAL:
+            return
+
+        self.progressLastTime = now
+        pos = self.importFile.getPos()
+        elapsed = now - self.progressStartTime
+        if elapsed > 0:
+            rate = (pos - self.progressStartPos) / elapsed / (1024 * 1024)
+        else:
+            rate = 0.0
+
+        self.progressHandler.update(pos // 1024,
+                _(u"%s: %.1f of %.1f MB (%.1f MB/s)") % (self.progressMsg,
+                pos / (1024.0 * 1024), self.importFile.getSize() /
+                (1024.0 * 1024), rate))
+
+
+    def _openTempDb(self):
+        """
+        Create temporary database for pass 1 in the wiki temp directory or
+        the configured temp location. Returns path of the database file or
+        None if it is held in memory.
+        """
+        if getApp().getGlobalConfig().getboolean("main",
+                "tempHandling_preferMemory", False):
+            self.tempDb = ConnectWrapSyncCommit(sqlite3.connect(":memory:"))
+            return None
+
+        tempDir = self.wikiDocument.getWikiTempDir()
+        if tempDir is None:
+            tempDir = getDefaultTempFilePath()
+
+        if tempDir is not None and not os.path.exists(pathEnc(tempDir)):
+            os.makedirs(pathEnc(tempDir))
+
+        fd, tempPath = tempfile.mkstemp(".sli", "mptImport_",
+                None if tempDir is None else pathEnc(tempDir))
+        os.close(fd)
+
+        self.tempDb = ConnectWrapSyncCommit(sqlite3.connect(tempPath))
+        # Content is worthless after a crash
+        self.tempDb.execSql("pragma synchronous = off")
+        self.tempDb.execSql("pragma journal_mode = off")
+
+        return tempPath
 
 
     def doImport(self, wikiDocument, importType, importSrc,
-            compatFilenames, addOpt, importData=None):
+            compatFilenames, addOpt, importData=None, progressHandler=None):
         """
         Run import operation.
         
@@ -167,18 +379,32 @@ class MultiPageTextImporter:
         addOpt -- additional options returned by getAddOpt()
         importData -- if not None contains data to import as bytestring.
                 importSrc is ignored in this case. Needed for trashcan.
+        progressHandler -- GuiProgressListener or None. Its open() method
+                may be called multiple times, it must be closed by caller.
         returns True if import was done (needed for trashcan)
         """
         if importData is not None:
-            self.rawImportFile = StringIO(importData)
+            data = importData
         else:
             try:
-                self.rawImportFile = open(pathEnc(importSrc), "rU")
+                f = open(pathEnc(importSrc), "rb")
+                try:
+                    try:
+                        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    except (EnvironmentError, ValueError, OverflowError):
+                        # Empty file or address space exhausted
+                        data = f.read()
+                finally:
+                    f.close()
             except IOError:
                 raise ImportException(_(u"Opening import file failed"))
-            
+
         self.wikiDocument = wikiDocument
+        self.importFile = None
         self.tempDb = None
+        self.progressHandler = progressHandler
+        self.commitBatches = False
+        self.uncommittedSize = 0
         
         showImportTableAlways = addOpt[0]
 #         wikiData = self.wikiDocument.getWikiData()
@@ -189,20 +415,16 @@ class MultiPageTextImporter:
 
         try:
             try:
-                # Wrap input file to convert format
-                bom = self.rawImportFile.read(len(BOM_UTF8))
-                if bom != BOM_UTF8:
-                    self.rawImportFile.seek(0)
-                    decodingReader = mbcsReader
-                    decode = mbcsDec
+                if data[:len(BOM_UTF8)] != BOM_UTF8:
+                    self.importFile = _MptEntryReader(data, mbcsDec)
                 else:
-                    decodingReader = utf8Reader
-                    decode = utf8Dec
+                    self.importFile = _MptEntryReader(data, utf8Dec,
+                            len(BOM_UTF8))
 
-                line = decode(self.rawImportFile.readline())[0]
+                line = self.importFile.readline()
                 if line.startswith(u"#!"):
                     # Skip initial line with #! to allow execution as shell script
-                    line = decode(self.rawImportFile.readline())[0]
+                    line = self.importFile.readline()
 
                 if not line.startswith(u"Multipage text format "):
                     raise ImportException(
@@ -218,25 +440,28 @@ class MultiPageTextImporter:
                             self.formatVer)
 
                 # Next is the separator line
-                line = decode(self.rawImportFile.readline())[0]
+                line = self.importFile.readline()
                 if not line.startswith(u"Separator: "):
                     raise ImportException(
                             _(u"Bad file format, header not detected"))
 
-                self.separator = line[11:]
-                
-                startPos = self.rawImportFile.tell()
-                self.importFile = decodingReader(self.rawImportFile, "replace")
+                try:
+                    self.importFile.setSeparator(line[11:-1])
+                except UnicodeError:
+                    raise ImportException(
+                            _(u"Bad file format, invalid separator"))
+
+                startPos = self.importFile.getPos()
 
                 if self.formatVer == 0:
+                    self.commitBatches = True
+                    self._startProgress(_(u"Importing"))
                     self._doImportVer0()
                 elif self.formatVer == 1:
                     # Create temporary database. It is mainly filled during
                     # pass 1 to check for validity and other things before
                     # actual importing in pass 2
-                    
-                    # TODO Respect settings for general temp location!!!
-                    self.tempDb = ConnectWrapSyncCommit(sqlite3.connect(""))
+                    tempDbPath = self._openTempDb()
                     try:            # TODO: Remove column "collisionWithPresent", seems to be unused
                         self.tempDb.execSql("create table entries("
                                 "unifName text primary key not null, "   # Unified name in import file
@@ -272,7 +497,9 @@ class MultiPageTextImporter:
 
 
                         # Collect some initial information into the temporary database
+                        self._startProgress(_(u"Scanning"))
                         self._doImportVer1Pass1()
+                        self.tempDb.commit()
     
                         # Draw some logical conclusions on the temp db
                         self._markMissingDependencies()
@@ -293,14 +520,20 @@ class MultiPageTextImporter:
 
                         # Back to start of import file and import according to settings 
                         # in temp db
-                        self.rawImportFile.seek(startPos)
-                        self.importFile = decodingReader(self.rawImportFile, "replace")
+                        self.importFile.setPos(startPos)
+                        self.commitBatches = True
+                        self._startProgress(_(u"Importing"))
                         self._doImportVer1Pass2()
                         
                         return True
                     finally:
                         self.tempDb.close()
                         self.tempDb = None
+                        if tempDbPath is not None:
+                            try:
+                                os.remove(tempDbPath)
+                            except OSError:
+                                traceback.print_exc()
 
             except ImportException:
                 raise
@@ -309,7 +542,13 @@ class MultiPageTextImporter:
                 raise ImportException(unicode(e))
 
         finally:
-            self.rawImportFile.close()
+            if self.commitBatches:
+                self.wikiDocument.getWikiData().commit()
+            if self.importFile is not None:
+                self.importFile.close()
+                self.importFile = None
+            elif isinstance(data, mmap.mmap):
+                data.close()
 
 
     def _markMissingDependencies(self):
@@ -467,7 +706,7 @@ class MultiPageTextImporter:
         """
         Import wikiwords if format version is 0.
         """
-        langHelper = wx.GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 self.wikiDocument.getWikiDefaultWikiLanguage())
 
         while True:
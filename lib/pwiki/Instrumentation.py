@@ -0,0 +1,486 @@
+"""
+Instrumentation of hot paths: named spans (timed blocks of code), counters
+and histograms of values.
+
+As long as no recording was started, the functions of this module only
+check a global variable, so they can stay in the code permanently:
+
+    with Instrumentation.span("db.execSql", sql):
+        ...
+
+    @Instrumentation.instrumented("wiki.connect")
+    def connect(self):
+        ...
+
+    Instrumentation.count("miscEvent.sent")
+    Instrumentation.record("miscEvent.listeners", len(listeners))
+
+Recording is started by the command line options --instrument-trace and
+--instrument-summary or by the global options "instrumentation_traceFile"
+and "instrumentation_summaryFile". When it is stopped (on application exit)
+a Chrome trace event file (can be loaded in Chrome with
+"chrome://tracing") and/or a summary table is written.
+
+Span names should have the form "<category>.<name>", the category is used
+by the trace viewer.
+"""
+
+from __future__ import with_statement
+
+import os, sys, math, threading, thread, timeit, functools, json, \
+        traceback, collections
+
+
+# Clock with the best resolution on the platform
+getTime = timeit.default_timer
+
+
+class Histogram(object):
+    """
+    Summary of a series of values: count, sum, minimum, maximum and
+    logarithmic buckets to estimate percentiles (with an error of at most
+    19 percent). Only values > 0 are put into buckets.
+    """
+
+    BUCKETS_PER_OCTAVE = 4
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        # Dictionary {bucket index: count}, values <= 0 have index None
+        self.buckets = collections.defaultdict(int)
+
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if value > 0:
+            self.buckets[int(math.floor(math.log(value, 2) *
+                    self.BUCKETS_PER_OCTAVE))] += 1
+        else:
+            self.buckets[None] += 1
+
+
+    def getMean(self):
+        if self.count == 0:
+            return None
+
+        return float(self.total) / self.count
+
+
+    def getPercentile(self, fraction):
+        """
+        Return estimated value below which the given fraction (0 to 1) of
+        values lie or None if no values were added.
+        """
+        if self.count == 0:
+            return None
+
+        limit = fraction * self.count
+        seen = self.buckets.get(None, 0)
+        if seen >= limit and seen > 0:
+            return min(0, self.max)
+
+        for idx in sorted(k for k in self.buckets if k is not None):
+            seen += self.buckets[idx]
+            if seen >= limit:
+                # Upper bound of bucket
+                return min(2.0 ** (float(idx + 1) / self.BUCKETS_PER_OCTAVE),
+                        self.max)
+
+        return self.max
+
+
+
+class Recorder(object):
+    """
+    Collects spans, counters and histograms. The methods are thread-safe.
+    """
+
+    # Maximum number of single spans kept for the trace file, afterwards
+    # only the summary is updated
+    DEFAULT_MAX_TRACE_EVENTS = 500000
+
+    def __init__(self, keepTrace=True, maxTraceEvents=DEFAULT_MAX_TRACE_EVENTS):
+        """
+        keepTrace -- True to keep single spans for a trace file
+        """
+        self.lock = threading.Lock()
+        self.startTime = getTime()
+        # Dictionary {name: Histogram of durations in seconds}
+        self.spans = {}
+        # Dictionary {name: count}
+        self.counters = collections.defaultdict(int)
+        # Dictionary {name: Histogram}
+        self.histograms = {}
+
+        self.maxTraceEvents = maxTraceEvents
+        # List of tuples (name, threadId, start, end, detailString) or None
+        if keepTrace:
+            self.traceEvents = []
+        else:
+            self.traceEvents = None
+        self.droppedTraceEvents = 0
+        # Dictionary {threadId: thread name}
+        self.threadNames = {}
+
+
+    def addSpan(self, name, start, end, detail=None):
+        """
+        Add span which started and ended at given times (as returned by
+        getTime()). detail is an object further describing this occurrence,
+        it is only converted to a string (see _detailToString()) if spans
+        are kept for a trace file.
+        """
+        threadId = thread.get_ident()
+        if detail is not None and self.traceEvents is not None:
+            detail = self._detailToString(detail)
+
+        with self.lock:
+            hist = self.spans.get(name)
+            if hist is None:
+                hist = Histogram()
+                self.spans[name] = hist
+            hist.add(end - start)
+
+            if self.traceEvents is None:
+                return
+
+            if len(self.traceEvents) >= self.maxTraceEvents:
+                self.droppedTraceEvents += 1
+                return
+
+            self.traceEvents.append((name, threadId, start, end, detail))
+            if threadId not in self.threadNames:
+                self.threadNames[threadId] = threading.currentThread().getName()
+
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+
+    def record(self, name, value):
+        with self.lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = Histogram()
+                self.histograms[name] = hist
+            hist.add(value)
+
+
+    @staticmethod
+    def _toUnicode(value):
+        """
+        Convert value to unicode without failing. Bytestrings are decoded
+        as UTF-8 (invalid bytes replaced) so they can be written as JSON.
+        """
+        if isinstance(value, unicode):
+            return value
+
+        if isinstance(value, str):
+            return value.decode("utf-8", "replace")
+
+        try:
+            return unicode(value)
+        except Exception:
+            return repr(value).decode("latin-1")
+
+
+    @staticmethod
+    def _detailToString(detail):
+        """
+        Return short unicode string for detail: strings are shortened, for
+        dictionaries the keys are listed, for functions and classes their
+        name is used.
+        """
+        toUnicode = Recorder._toUnicode
+
+        if isinstance(detail, basestring):
+            # Decode before shortening to not split a multibyte character
+            return toUnicode(detail)[:200]
+
+        if isinstance(detail, dict):
+            return u", ".join(sorted(toUnicode(k) for k in detail))[:200]
+
+        name = getattr(detail, "__name__", None)
+        if isinstance(name, basestring):
+            return toUnicode(name)
+
+        return toUnicode(detail)[:200]
+
+
+    def getChromeTrace(self):
+        """
+        Return dictionary in Chrome trace event format.
+        """
+        pid = os.getpid()
+        with self.lock:
+            traceEvents = list(self.traceEvents or ())
+            threadNames = dict(self.threadNames)
+            counters = dict(self.counters)
+            droppedTraceEvents = self.droppedTraceEvents
+
+        events = [{"name": "thread_name", "ph": "M", "pid": pid,
+                "tid": threadId, "args": {"name": threadName}}
+                for threadId, threadName in threadNames.iteritems()]
+
+        for name, threadId, start, end, detail in traceEvents:
+            event = {"name": name, "cat": name.split(".", 1)[0], "ph": "X",
+                    "pid": pid, "tid": threadId,
+                    "ts": (start - self.startTime) * 1000000.0,
+                    "dur": (end - start) * 1000000.0}
+            if detail is not None:
+                event["args"] = {"detail": detail}
+            events.append(event)
+
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"counters": counters,
+                "droppedTraceEvents": droppedTraceEvents}}
+
+
+    def writeChromeTrace(self, path):
+        # Not imported at module level as MiscEvent uses this module
+        from .StringOps import pathEnc
+
+        data = json.dumps(self.getChromeTrace())
+        with open(pathEnc(path), "wb") as f:
+            f.write(data)
+
+
+    def getSummary(self):
+        """
+        Return summary table of spans, counters and histograms as unistring.
+        Times are given in milliseconds.
+        """
+        with self.lock:
+            spans = [(name, hist.count, hist.total, hist.getMean(),
+                    hist.getPercentile(0.5), hist.getPercentile(0.95),
+                    hist.max) for name, hist in self.spans.iteritems()]
+            counters = sorted(self.counters.iteritems())
+            histograms = [(name, hist.count, hist.getMean(),
+                    hist.getPercentile(0.5), hist.getPercentile(0.95),
+                    hist.max) for name, hist in self.histograms.iteritems()]
+            droppedTraceEvents = self.droppedTraceEvents
+
+        # Sort spans by total time, longest first
+        spans.sort(key=lambda s: s[2], reverse=True)
+        histograms.sort()
+
+        lines = [u"%-40s %9s %11s %9s %9s %9s %9s" % (u"Span", u"Count",
+                u"Total ms", u"Mean ms", u"P50 ms", u"P95 ms", u"Max ms")]
+        for name, cnt, total, mean, p50, p95, maxVal in spans:
+            lines.append(u"%-40s %9i %11.1f %9.3f %9.3f %9.3f %9.3f" % (name,
+                    cnt, total * 1000, mean * 1000, p50 * 1000, p95 * 1000,
+                    maxVal * 1000))
+
+        if counters:
+            lines.append(u"")
+            lines.append(u"%-40s %9s" % (u"Counter", u"Value"))
+            for name, value in counters:
+                lines.append(u"%-40s %9i" % (name, value))
+
+        if histograms:
+            lines.append(u"")
+            lines.append(u"%-40s %9s %11s %9s %9s %9s" % (u"Histogram",
+                    u"Count", u"Mean", u"P50", u"P95", u"Max"))
+            for name, cnt, mean, p50, p95, maxVal in histograms:
+                lines.append(u"%-40s %9i %11.3f %9.3f %9.3f %9.3f" % (name,
+                        cnt, mean, p50, p95, maxVal))
+
+        if droppedTraceEvents:
+            lines.append(u"")
+            lines.append(u"%i spans were not stored for the trace file" %
+                    droppedTraceEvents)
+
+        return u"\n".join(lines) + u"\n"
+
+
+    def writeSummary(self, path):
+        """
+        Write summary table to file path or to stdout if path is u"-".
+        """
+        from .StringOps import pathEnc
+
+        data = self.getSummary().encode("utf-8")
+        if path == u"-":
+            sys.stdout.write(data)
+            return
+
+        with open(pathEnc(path), "wb") as f:
+            f.write(data)
+
+
+
+# Current recorder or None if not recording
+_recorder = None
+_traceFile = None
+_summaryFile = None
+
+
+def isEnabled():
+    return _recorder is not None
+
+
+def getRecorder():
+    """
+    Return current Recorder or None.
+    """
+    return _recorder
+
+
+def start(traceFile=None, summaryFile=None):
+    """
+    Start recording (if not already running). When stop() is called, the
+    Chrome trace is written to traceFile and the summary table to
+    summaryFile (stdout if u"-"), each if not None.
+    Returns the Recorder.
+    """
+    global _recorder, _traceFile, _summaryFile
+
+    if _recorder is not None:
+        return _recorder
+
+    _traceFile = traceFile
+    _summaryFile = summaryFile
+    _recorder = Recorder(keepTrace=traceFile is not None)
+
+    return _recorder
+
+
+def stop():
+    """
+    Stop recording and write the files given to start().
+    Returns the Recorder or None if not recording.
+    """
+    global _recorder
+
+    recorder = _recorder
+    if recorder is None:
+        return None
+
+    _recorder = None
+
+    if _traceFile is not None:
+        try:
+            recorder.writeChromeTrace(_traceFile)
+        except (IOError, OSError, ValueError):
+            traceback.print_exc()
+
+    if _summaryFile is not None:
+        try:
+            recorder.writeSummary(_summaryFile)
+        except (IOError, OSError, ValueError):
+            traceback.print_exc()
+
+    return recorder
+
+
+
+class _Span(object):
+    __slots__ = ("recorder", "name", "detail", "start")
+
+    def __init__(self, recorder, name, detail):
+        self.recorder = recorder
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.start = getTime()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.recorder.addSpan(self.name, self.start, getTime(), self.detail)
+        return False
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, detail=None):
+    """
+    Return context manager which records the time the with-block needs
+    as span name. detail is an object further describing this occurrence
+    (e.g. the SQL statement), it is only converted to a string when a
+    trace is recorded.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NULL_SPAN
+
+    return _Span(recorder, name, detail)
+
+
+def instrumented(name):
+    """
+    Decorator to record each call of the function as span name.
+    """
+    def decorator(fct):
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return fct(*args, **kwargs)
+
+            start = getTime()
+            try:
+                return fct(*args, **kwargs)
+            finally:
+                recorder.addSpan(name, start, getTime())
+
+        return functools.wraps(fct)(wrapper)
+
+    return decorator
+
+
+def addSpan(name, start, end=None, detail=None):
+    """
+    Record span which started at start (as returned by getTime()) and
+    ended at end or now.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return
+
+    if end is None:
+        end = getTime()
+
+    recorder.addSpan(name, start, end, detail)
+
+
+def count(name, value=1):
+    """
+    Add value to counter name.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return
+
+    recorder.count(name, value)
+
+
+def record(name, value):
+    """
+    Add value to histogram name.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return
+
+    recorder.record(name, value)
@@ -71,20 +71,14 @@ class AbstractCollator:
 
         ascend -- If True sort ascending, descending otherwise
         """
-        # TODO Python 3.0 will no longer support compare function in sort
-        lst.sort(self.strcoll, reverse=not ascend)
-#         if not ascend:
-#             lst.reverse()
+        self.sortByKeyFunc(lst, lambda s: s, ascend)
 
     def sortByItem(self, lst, i, ascend=True):
         """
         Similar to sort(), but lst items are sequences where only item number i
         is taken for sorting.
         """
-        def strcollByItem(left, right):
-            return self.strcoll(left[i], right[i])
-
-        lst.sort(strcollByItem, reverse=not ascend)
+        self.sortByKeyFunc(lst, lambda item: item[i], ascend)
 
 
     def sortByFirst(self, lst, ascend=True):
@@ -92,9 +86,28 @@ class AbstractCollator:
         Similar to sort(), but lst items are sequences where only the first
         element is taken for sorting.
         """
-        lst.sort(self.strcollByFirst, reverse=not ascend)
-#         if not ascend:
-#             lst.reverse()
+        self.sortByItem(lst, 0, ascend)
+
+
+    def sortByKeyFunc(self, lst, keyFunc, ascend=True):
+        """
+        Sort list lst inplace by the strings keyFunc returns for its items.
+        The collation keys are computed once per item (by sortKey()) instead
+        of calling strcoll() for each comparison. If a key can't be computed
+        the list is sorted by strcoll() instead.
+        """
+        try:
+            keys = [self.sortKey(keyFunc(item)) for item in lst]
+        except (UnicodeError, NotImplementedError):
+            def strcollByKeyFunc(left, right):
+                return self.strcoll(keyFunc(left), keyFunc(right))
+
+            lst.sort(strcollByKeyFunc, reverse=not ascend)
+            return
+
+        order = sorted(xrange(len(lst)), key=keys.__getitem__,
+                reverse=not ascend)
+        lst[:] = [lst[i] for i in order]
 
 
     def strcoll(self, left, right):
@@ -125,6 +138,15 @@ class AbstractCollator:
         raise NotImplementedError   # abstract
 
 
+    def sortKey(self, s):
+        """
+        Returns a sort key for unicode string s. Keys of the same collator
+        compare like the strings do with strcoll(). May raise UnicodeError
+        if no key can be built for s.
+        """
+        return self.strxfrm(s)
+
+
 
 # TODO case insensitivity
 
@@ -158,6 +180,9 @@ class _CCollator(AbstractCollator):
         """
         return utf8Enc(s)[0]
 
+    def sortKey(self, s):
+        return s
+
 
         
 
@@ -174,6 +199,7 @@ class _PythonCollator(AbstractCollator):
         """
         self.locStr = locStr
         self.prevLocale = locale.setlocale(locale.LC_ALL, self.locStr)
+        self.encoding = locale.getpreferredencoding(False) or "ascii"
 
     def strcoll(self, left, right):
         return locale.strcoll(left, right)
@@ -181,6 +207,12 @@ class _PythonCollator(AbstractCollator):
     def strxfrm(self, s):
         return locale.strxfrm(s)
 
+    def sortKey(self, s):
+        # locale.strxfrm() only accepts byte strings in the locale's encoding
+        if isinstance(s, unicode):
+            s = s.encode(self.encoding)
+        return locale.strxfrm(s)
+
 
 
 class _PythonCollatorUppercaseFirst(AbstractCollator):
@@ -195,6 +227,7 @@ class _PythonCollatorUppercaseFirst(AbstractCollator):
         """
         self.locStr = locStr
         self.prevLocale = locale.setlocale(locale.LC_ALL, self.locStr)
+        self.encoding = locale.getpreferredencoding(False) or "ascii"
 
     def strcoll(self, left, right):
         ml = min(len(left), len(right))
@@ -229,6 +262,20 @@ class _PythonCollatorUppercaseFirst(AbstractCollator):
 
         return locale.strxfrm(s)
 
+    def sortKey(self, s):
+        # Mirrors strcoll(): per character first lower case flag, then
+        # locale order of the lower case character. The final (2, "") makes
+        # a string greater than any longer string it is a prefix of.
+        key = []
+        for c in s:
+            lc = c.lower()
+            if isinstance(lc, unicode):
+                lc = lc.encode(self.encoding)
+            key.append((int(c.islower()), locale.strxfrm(lc)))
+
+        key.append((2, ""))
+        return tuple(key)
+
 
 
 # Function taken from standard lib Python 2.4 tool msgfmt.py, written by
@@ -464,6 +511,15 @@ def getI18nEntry(key):
         return result
 
 
+def installI18nDummies():
+    """
+    Install the builtins N_() and _() without translation, as needed before
+    loadI18nDict() can be called.
+    """
+    __builtins__["N_"] = tt_noop
+    __builtins__["_"] = getI18nEntryDummy
+
+
 def getGuiLocale():
     global i18nLocale
     return i18nLocale
@@ -14,90 +14,23 @@ import wx, wx.xrc
 # import srePersistent
 # srePersistent.loadCodeCache()
 
-from Consts import CONFIG_FILENAME, CONFIG_GLOBALS_DIRNAME
-
-from MiscEvent import KeyFunctionSink, MiscEventSourceMixin
+from MiscEvent import KeyFunctionSink
 
 from WikiExceptions import *
-import Configuration
 from StringOps import mbcsDec, createRandomString, pathEnc, \
         writeEntireFile, loadEntireFile
 
-import SystemInfo
 import WindowLayout
 from CmdLineAction import CmdLineAction
+import Instrumentation
+from AppBase import AppBase, findDirs
 
 
 
-# For wx.GetOsVersion()
-wxWINDOWS_NT = SystemInfo.wxWINDOWS_NT
-wxWIN95 = SystemInfo.wxWIN95
-
-
-
-def findDirs():
-    """
-    Returns tuple (wikiAppDir, globalConfigDir)
-    """
-    wikiAppDir = None
-    
-    isWindows = (wx.GetOsVersion()[0] == wxWIN95) or \
-            (wx.GetOsVersion()[0] == wxWINDOWS_NT)
-
-#     try:
-    wikiAppDir = os.path.dirname(os.path.abspath(sys.argv[0]))
-    if not wikiAppDir:
-        wikiAppDir = r"C:\Program Files\WikidPad"
-        
-    globalConfigDir = None
-
-    # This allows to keep the program with config on an USB stick
-    if os.path.exists(pathEnc(os.path.join(wikiAppDir, CONFIG_FILENAME))):
-        globalConfigDir = wikiAppDir
-    elif os.path.exists(pathEnc(os.path.join(wikiAppDir, "." + CONFIG_FILENAME))):
-        globalConfigDir = wikiAppDir
-    else:
-        globalConfigDir = os.environ.get("HOME")
-        if not (globalConfigDir and os.path.exists(pathEnc(globalConfigDir))):
-            # Instead of checking USERNAME, the user config dir. is
-            # now used
-            globalConfigDir = wx.StandardPaths.Get().GetUserConfigDir()
-            # For Windows the user config dir is "...\Application data"
-            # therefore we go down to "...\Application data\WikidPad"
-            if os.path.exists(pathEnc(globalConfigDir)) and isWindows:
-                try:
-                    realGlobalConfigDir = os.path.join(globalConfigDir,
-                            "WikidPad")
-                    if not os.path.exists(pathEnc(realGlobalConfigDir)):
-                        # If it doesn't exist, create the directory
-                        os.mkdir(pathEnc(realGlobalConfigDir))
-
-                    globalConfigDir = realGlobalConfigDir
-                except:
-                    traceback.print_exc()
-
-#     finally:
-#         pass
-
-    if not globalConfigDir:
-        globalConfigDir = wikiAppDir
-
-    # mbcs decoding
-    if wikiAppDir is not None:
-        wikiAppDir = mbcsDec(wikiAppDir, "replace")[0]
-
-    if globalConfigDir is not None:
-        globalConfigDir = mbcsDec(globalConfigDir, "replace")[0]
-        
-    ExceptionLogger.setLogDestDir(globalConfigDir)
-    
-    return (wikiAppDir, globalConfigDir)
-
-
 _defRedirect = (wx.Platform == '__WXMSW__' or wx.Platform == '__WXMAC__')
 
 
-class App(wx.App, MiscEventSourceMixin): 
+class App(wx.App, AppBase): 
     def __init__(self, *args, **kwargs):
         global app
         app = self
@@ -105,7 +38,7 @@ class App(wx.App, MiscEventSourceMixin):
         # Hack for Windows to allow installation in non-ascii path
         sys.prefix = mbcsDec(sys.prefix)[0]
 
-        MiscEventSourceMixin.__init__(self)
+        AppBase.__init__(self)
 
         wx.App.__init__(self, *args, **kwargs)
         self.SetAppName("WikidPad")
@@ -114,6 +47,7 @@ class App(wx.App, MiscEventSourceMixin):
 
     def OnInit(self):
         ## _prof.start()
+        initStartTime = Instrumentation.getTime()
 #         global PREVIEW_CSS
 
         self.SetAppName("WikidPad")
@@ -122,8 +56,6 @@ class App(wx.App, MiscEventSourceMixin):
 #         self.Connect(-1, -1, self._CallAfterId,
 #                     lambda event: event.callable(*event.args, **event.kw) )
 # 
-        self.sqliteInitFlag = False   # Read and modified only by WikiData classes
-        
         WindowLayout.initiateAfterWxApp()
         self.removeAppLockOnExit = False
         wx.EVT_END_SESSION(self, self.OnEndSession)
@@ -132,75 +64,16 @@ class App(wx.App, MiscEventSourceMixin):
         self.mainFrameSet = set()
 
         wikiAppDir, globalConfigDir = findDirs()
+        self._initGlobalConfig(wikiAppDir, globalConfigDir)
 
-        if not globalConfigDir or not os.path.exists(globalConfigDir):
-            raise Exception(_(u"Error initializing environment, couldn't locate "
-                    u"global config directory"))
-                    
-        self.wikiAppDir = wikiAppDir
-        self.globalConfigDir = globalConfigDir
-
-        # Find/create global config subdirectory "WikidPadGlobals"
-        if SystemInfo.isWindows():
-            defaultGlobalConfigSubDir = os.path.join(self.globalConfigDir,
-                    CONFIG_GLOBALS_DIRNAME)
-        else:
-            defaultGlobalConfigSubDir = os.path.join(self.globalConfigDir,
-                    "." + CONFIG_GLOBALS_DIRNAME)
-
-        self.globalConfigSubDir = os.path.join(self.globalConfigDir,
-                CONFIG_GLOBALS_DIRNAME)
-        if not os.path.exists(pathEnc(self.globalConfigSubDir)):
-            self.globalConfigSubDir = os.path.join(self.globalConfigDir,
-                    "." + CONFIG_GLOBALS_DIRNAME)
-            if not os.path.exists(pathEnc(self.globalConfigSubDir)):
-                self.globalConfigSubDir = defaultGlobalConfigSubDir
-                os.mkdir(self.globalConfigSubDir)
-
-#         pCssLoc = os.path.join(self.globalConfigSubDir, "wikipreview.css")
-#         if not os.path.exists(pathEnc(pCssLoc)):
-#             tbFile = open(pathEnc(pCssLoc), "w")
-#             tbFile.write(PREVIEW_CSS)
-#             tbFile.close()
-
-        # Create default config dicts
-        self.defaultGlobalConfigDict = Configuration.GLOBALDEFAULTS.copy()
-        self.defaultWikiConfigDict = Configuration.WIKIDEFAULTS.copy()
-        self.wikiConfigFallthroughDict = Configuration.WIKIFALLTHROUGH.copy()
         self.pageSearchHistory = []
         self.wikiSearchHistory = []
 
-        # load or create global configuration
-        self.globalConfig = self.createGlobalConfiguration()
-
-        # Find/create global config file "WikidPad.config"
-        if SystemInfo.isWindows():
-            defaultGlobalConfigLoc = os.path.join(self.globalConfigDir,
-                    CONFIG_FILENAME)
-        else:
-            defaultGlobalConfigLoc = os.path.join(self.globalConfigDir,
-                    "." + CONFIG_FILENAME)
-
-        globalConfigLoc = os.path.join(self.globalConfigDir, CONFIG_FILENAME)
-        if os.path.exists(pathEnc(globalConfigLoc)):
-            try:
-                self.globalConfig.loadConfig(globalConfigLoc)
-            except Configuration.Error, MissingConfigurationFileException:
-                self.createDefaultGlobalConfig(globalConfigLoc)
-        else:
-            globalConfigLoc = os.path.join(self.globalConfigDir,
-                    "." + CONFIG_FILENAME)
-            if os.path.exists(pathEnc(globalConfigLoc)):
-                try:
-                    self.globalConfig.loadConfig(globalConfigLoc)
-                except Configuration.Error, MissingConfigurationFileException:
-                    self.createDefaultGlobalConfig(globalConfigLoc)
-            else:
-                self.createDefaultGlobalConfig(defaultGlobalConfigLoc)
-
         splash = None
         
         cmdLine = CmdLineAction(sys.argv[1:])
+        self._startInstrumentation(cmdLine)
+
         if not cmdLine.exitFinally and self.globalConfig.getboolean("main",
                 "startup_splashScreen_show", True):
             bitmap = wx.Bitmap(os.path.join(appdir, "icons/pwiki.ico"))
@@ -211,11 +84,29 @@ class App(wx.App, MiscEventSourceMixin):
                 wx.Yield()
 
         try:
-            return self.initStep2(cmdLine)
+            with Instrumentation.span("app.initStep2"):
+                return self.initStep2(cmdLine)
         finally:
             if splash:
                 splash.Destroy()
 
+            Instrumentation.addSpan("app.init", initStartTime)
+
+
+    def _startInstrumentation(self, cmdLine):
+        """
+        Start recording of timings if requested by command line or
+        global configuration.
+        """
+        traceFile = cmdLine.instrumentTrace or \
+                self.globalConfig.get("main", "instrumentation_traceFile", u"")
+        summaryFile = cmdLine.instrumentSummary or \
+                self.globalConfig.get("main", "instrumentation_summaryFile",
+                u"")
+
+        if traceFile or summaryFile:
+            Instrumentation.start(traceFile or None, summaryFile or None)
+
 
     def initStep2(self, cmdLine):
         # Block of modules to import while splash screen is shown
@@ -404,84 +295,6 @@ class App(wx.App, MiscEventSourceMixin):
         return True
 
 
-    def reloadPlugins(self):
-        """
-        Load or reload application-wide plugins. Normally called only once
-        automatically at startup. Later calls only recommended during plugin
-        development as they can have unwanted side effects!
-        """
-        from PluginManager import PluginManager, InsertionPluginManager, \
-                KeyInParamLearningDispatcher
-
-        dirs = ( os.path.join(self.wikiAppDir, u'extensions'),
-                os.path.join(self.wikiAppDir, u'user_extensions'),
-                os.path.join(self.globalConfigSubDir, u'user_extensions') )
-
-        self.pluginManager = PluginManager(dirs, systemDirIdx=0)
-
-        # Register app-wide plugin APIs
-        describeInsertionApi = self.pluginManager.registerSimplePluginAPI(
-                ("InsertionByKey", 1), ("describeInsertionKeys",))
-
-        registerOptionsApi = self.pluginManager.registerSimplePluginAPI(
-                ("Options", 1), ("registerOptions",))
-
-        describeWikiLanguageApi = self.pluginManager.registerSimplePluginAPI(
-                ("WikiParser", 1), ("describeWikiLanguage",))
-
-        self.describeExportersApi = self.pluginManager.registerSimplePluginAPI(
-                ("Exporters", 1), ("describeExportersV01",))
-
-        self.describePrintsApi = self.pluginManager.registerSimplePluginAPI(
-                ("Prints", 1), ("describePrintsV01",))
-                
-        menuModifierApi = self.pluginManager.registerSimplePluginAPI(
-                ("MenuModifier", 1), ("modifyMenuV01",))
-
-        menuItemProviderApi = self.pluginManager.registerSimplePluginAPI(
-                ("MenuItemProvider", 1), ("provideMenuItemV01",))
-
-        # Load plugins
-#         dirs = ( os.path.join(self.wikiAppDir, u'user_extensions'),
-#                 os.path.join(self.wikiAppDir, u'extensions') )
-
-        self.pluginManager.loadPlugins([ u'KeyBindings.py',
-                u'EvalLibrary.py'] )
-
-        # Register options
-        registerOptionsApi.registerOptions(1, self)
-
-#         # Retrieve descriptions for InsertionByKey
-#         insertionDescriptions = reduce(lambda a, b: a+list(b),
-#                 describeInsertionApi.describeInsertionKeys(1, self), [])
-# 
-#         self.insertionPluginManager = InsertionPluginManager(
-#                 insertionDescriptions)
-
-        # Retrieve descriptions for InsertionByKey
-        insertionDescriptions = reduce(lambda a, b: a+list(b),
-                describeInsertionApi.describeInsertionKeys(1, self), [])
-
-        self.insertionPluginManager = InsertionPluginManager(
-                insertionDescriptions)
-
-        wikiLanguageDescriptions = reduce(lambda a, b: a+list(b),
-                describeWikiLanguageApi.describeWikiLanguage(1, self), [])
-
-        self.wikiLanguageDescDict = dict(( (item[0], item)
-                for item in wikiLanguageDescriptions ))
-
-        # Parameters to .dispatch(): contextName, contextDict, menu;
-        # contextName is key for LearningDispatcher
-        self.modifyMenuDispatcher = KeyInParamLearningDispatcher(
-                menuModifierApi.modifyMenuV01, 0)
-
-        # Parameters to .dispatch(): menuItemUnifName, contextName, contextDict,
-        # menu, insertIdx; menuItemUnifName is key for LearningDispatcher
-        self.provideMenuItemDispatcher = KeyInParamLearningDispatcher(
-                menuItemProviderApi.provideMenuItemV01, 0)
-
-
 
     def _readSocketLine(self, sock):
         result = []
@@ -494,74 +307,6 @@ class App(wx.App, MiscEventSourceMixin):
             read += 1
             
         return ""
-
-
-    def getWikiLanguageDescription(self, intLanguageName):
-        """
-        Returns the parser description tuple as provided by a WikiParser plugin
-        or None if intLanguageName not found.
-        """
-        return self.wikiLanguageDescDict.get(intLanguageName)
-
-    def listWikiLanguageDescriptions(self):
-        """
-        Return list of internal names of all available wiki languages
-        """
-        if self.wikiLanguageDescDict.has_key("wikidpad_default_2_0"):
-            return [self.getWikiLanguageDescription("wikidpad_default_2_0")] + \
-                    [l for l in self.wikiLanguageDescDict.values()
-                    if l[0] != "wikidpad_default_2_0"]
-        else:
-            return self.wikiLanguageDescDict.values()
-
-
-    def getModifyMenuDispatcher(self):
-        return self.modifyMenuDispatcher
-
-    def getProvideMenuItemDispatcher(self):
-        return self.provideMenuItemDispatcher
-
-
-    def createWikiParser(self, intLanguageName, debugMode=False):   # ):True
-        """
-        Must be thread-safe!
-        """
-        desc = self.getWikiLanguageDescription(intLanguageName)
-        if desc is None:
-            return None
-        # Call parser factory function
-        return desc[2](intLanguageName, debugMode)
-
-    def freeWikiParser(self, parser):
-        """
-        Must be thread-safe, must accept None as parser!
-        """
-        pass
-        
-    def getUserDefaultWikiLanguage(self):
-        """
-        Returns the internal name of the default wiki language of the user.
-        """
-        # TODO! Configurable
-        return "wikidpad_default_2_0"
-
-
-
-    def createWikiLanguageHelper(self, intLanguageName, debugMode=False):
-        """
-        Must be thread-safe
-        """
-        desc = self.getWikiLanguageDescription(intLanguageName)
-        if desc is None:
-            return None
-        # Call language helper factory function
-        return desc[4](intLanguageName, debugMode)
-
-    def freeWikiLanguageHelper(self, helper):
-        """
-        Must be thread-safe, must accept None as helper!
-        """
-        pass
         
         
     def FilterEvent(self, evt):
@@ -597,13 +342,6 @@ class App(wx.App, MiscEventSourceMixin):
                 
         result = wx.App.FilterEvent(self, evt)
         return result
-        
-
-    def pauseBackgroundThreads(self):
-        self.fireMiscEventKeys(("pause background threads",))
-
-    def resumeBackgroundThreads(self):
-        self.fireMiscEventKeys(("resume background threads",))
 
     def onChangedGlobalConfiguration(self, miscevt):
         self._rereadGlobalConfig()
@@ -613,27 +351,8 @@ class App(wx.App, MiscEventSourceMixin):
         """
         Make settings from global config which are changeable during session
         """
-        import Localization
-        
-        collationOrder = self.globalConfig.get("main", "collation_order")
-        collationUppercaseFirst = self.globalConfig.getboolean("main",
-                "collation_uppercaseFirst")
-                
-        if collationUppercaseFirst:
-            collationCaseMode = Localization.CASEMODE_UPPER_FIRST
-        else:
-            collationCaseMode = Localization.CASEMODE_UPPER_INSIDE
+        AppBase._rereadGlobalConfig(self)
 
-        try:
-            self.collator = Localization.getCollatorByString(collationOrder,
-                    collationCaseMode)
-        except:
-            try:
-                self.collator = Localization.getCollatorByString(u"Default",
-                        collationCaseMode)
-            except:
-                self.collator = Localization.getCollatorByString(u"C",
-                        collationCaseMode)
         try:
             self.SetCallFilterEvent(self.globalConfig.getboolean("main",
                     "mouse_scrollUnderPointer"))
@@ -664,6 +383,8 @@ class App(wx.App, MiscEventSourceMixin):
         except:
             traceback.print_exc()
 
+        Instrumentation.stop()
+
         if ExceptionLogger._exceptionOccurred and hasattr(sys, 'frozen'):
             wx.MessageBox(_(u"An error occurred during this session\nSee file %s") %
                     os.path.join(ExceptionLogger.getLogDestDir()),
@@ -722,56 +443,6 @@ class App(wx.App, MiscEventSourceMixin):
                 return frame
         
         return None
-
-
-    def describeExporters(self, mainControl):
-        return reduce(lambda a, b: a+list(b),
-                self.describeExportersApi.describeExporters(mainControl), [])
-
-    def describePrints(self, mainControl):
-        return reduce(lambda a, b: a+list(b),
-                self.describePrintsApi.describePrintsV01(mainControl), [])
-
-
-    def createDefaultGlobalConfig(self, globalConfigLoc):
-        self.globalConfig.createEmptyConfig(globalConfigLoc)
-        self.globalConfig.fillWithDefaults()
-
-        wikidPadHelp = os.path.join(self.wikiAppDir, 'WikidPadHelp',
-                'WikidPadHelp.wiki')
-
-        self.globalConfig.set("main", "wiki_history", wikidPadHelp)
-        self.globalConfig.set("main", "last_wiki", wikidPadHelp)
-
-        self.globalConfig.set("main", "last_active_dir", os.getcwd())
-
-
-    def getGlobalConfigSubDir(self):
-        return self.globalConfigSubDir
-
-    def getGlobalConfigDir(self):
-        return self.globalConfigDir
-
-    def getGlobalConfig(self):
-        return self.globalConfig
-        
-    def getWikiAppDir(self):
-        return self.wikiAppDir
-    
-    def isInPortableMode(self):
-        return self.globalConfigDir == self.wikiAppDir
-
-    def getIconCache(self):
-        """
-        Return the icon cache object
-        """
-        return self.iconCache
-
-    def getCollator(self):
-        return self.collator
-
-    def getInsertionPluginManager(self):
-        return self.insertionPluginManager
         
     def getPageSearchHistory(self):
         return self.pageSearchHistory
@@ -784,149 +455,4 @@ class App(wx.App, MiscEventSourceMixin):
         return self.wikiSearchHistory
 
     def setWikiSearchHistory(self, hist):
-        self.wikiSearchHistory = hist
-
-    def createGlobalConfiguration(self):
-        return Configuration.SingleConfiguration(
-                self.getDefaultGlobalConfigDict())
-
-    def createWikiConfiguration(self):
-        return Configuration.SingleConfiguration(
-                self.getDefaultWikiConfigDict(), self.wikiConfigFallthroughDict)
-
-    def createCombinedConfiguration(self):
-        return Configuration.CombinedConfiguration(
-                self.createGlobalConfiguration(), self.createWikiConfiguration())
-
-    def getDefaultGlobalConfigDict(self):
-        """
-        Returns the dictionary of the global configuration defaults.
-        It is a copy of Configuration.GLOBALDEFAULTS.
-        The dictionary can be manipulated by plugins to add further
-        configuration options.
-        """
-        return self.defaultGlobalConfigDict
-
-    def getDefaultWikiConfigDict(self):
-        """
-        Returns the dictionary of the wiki configuration defaults.
-        It is a copy of Configuration.WIKIDEFAULTS.
-        The dictionary can be manipulated by plugins to add further
-        configuration options.
-        """
-        return self.defaultWikiConfigDict
-
-    def getWikiConfigFallthroughDict(self):
-        """
-        Returns the dictionary of the wiki fallthrough settings.
-        The fallthrough dict must only contain keys which are present
-        as options in wiki config. and global config.        
-        If the key in wiki config. has the equal value as the same key
-        in the fallthrough dict, the combined configuration takes the
-        key value from global config. instead.
-
-        This is intended for wiki-bound options which can be set to
-        "use default" mode to use the app-bound setting instead.
-
-        It is a copy of Configuration.WIKIFALLTHROUGH.
-        The dictionary can be manipulated by plugins to add further
-        configuration options.
-        """
-        return self.wikiConfigFallthroughDict
-        
-
-    def getOptionsDlgPanelList(self):        
-        return self.optionsDlgPanelList
-
-    def addGlobalPluginOptionsDlgPanel(self, factory, title):
-        """
-        Add option page to global plugin options 
-        
-        factory -- Factory function taking parameters
-            (parent, optionsDlg, mainControl) where
-                parent: GUI parent of panel
-                optionsDlg: OptionsDialog object
-                mainControl: PersonalWikiFrame object
-        title -- unistring with title to show in the left list in options
-            dialog
-        """
-        pl = self.getOptionsDlgPanelList()
-        try:
-            insPos = pl.index(("??insert mark/plugins global", u""))
-        except ValueError:
-            pl.append(("", _(u"Plugin options")))
-            insPos = len(pl)
-            pl.append(("??insert mark/plugins global", u""))
-
-        pl.insert(insPos, (factory, 2 * u" " + title))
-
-
-    def addOptionsDlgPanel(self, factory, title):
-        # Wrap factory function expecting old parameters with one for
-        # the new parameters.
-        def optionsPanelFactoryWrapper(parent, optionsDlg, mainControl):
-            return factory(parent, optionsDlg, wx.GetApp())
-
-        """
-        Deprecated function, use addGlobalPluginOptionsDlgPanel() instead!
-
-        Add option page to global plugin options.
-        
-        factory -- Factory function (or class taking parameters
-            (parent, optionsDlg, app) where
-                parent: GUI parent of panel
-                optionsDlg: OptionsDialog object
-                app: MainApp object
-        title -- unistring with title to show in the left list in options
-            dialog
-        """
-        if title[:2] == u"  ":
-            title = title[2:]
-
-        self.addGlobalPluginOptionsDlgPanel(optionsPanelFactoryWrapper, title)
-
-
-    def addWikiWikiLangOptionsDlgPanel(self, factory, title):
-        """
-        factory -- Factory function (or class taking parameters
-            (parent, optionsDlg, mainControl) where
-                parent: GUI parent of panel
-                optionsDlg: OptionsDialog object
-                mainControl: PersonalWikiFrame object
-        title -- unistring with title to show in the left list in options
-            dialog
-        """
-        pl = self.getOptionsDlgPanelList()
-
-        try:
-            insPos = pl.index(("??insert mark/current wiki/wiki lang", u""))
-        except ValueError:
-            insPos = pl.index(("??insert mark/current wiki", u""))
-            pl.insert(insPos, ("??insert mark/current wiki/wiki lang", u""))
-            pl.insert(insPos, ("", 2 * u" " + _(u"Wiki language")))
-            insPos += 1
-
-        pl.insert(insPos, (factory, 4 * u" " + title))
-
-
-    def addWikiPluginOptionsDlgPanel(self, factory, title):
-        """
-        factory -- Factory function (or class taking parameters
-            (parent, optionsDlg, mainControl) where
-                parent: GUI parent of panel
-                optionsDlg: OptionsDialog object
-                mainControl: PersonalWikiFrame object
-        title -- unistring with title to show in the left list in options
-            dialog
-        """
-        pl = self.getOptionsDlgPanelList()
-
-        try:
-            insPos = pl.index(("??insert mark/current wiki/plugins", u""))
-        except ValueError:
-            insPos = pl.index(("??insert mark/current wiki", u""))
-            pl.insert(insPos, ("??insert mark/current wiki/plugins", u""))
-            pl.insert(insPos, ("", 2 * u" " + _(u"Plugins")))
-            insPos += 1
-
-        pl.insert(insPos, (factory, 4 * u" " + title))
+        self.wikiSearchHistory = hist
\ No newline at end of file
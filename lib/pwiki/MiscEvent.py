@@ -1,8 +1,19 @@
 # TODO Weak references!
 
-import weakref, traceback
+from __future__ import with_statement
 
-import wx
+import weakref, traceback, threading, functools, collections
+
+try:
+    from wx import PyDeadObjectError as _PyDeadObjectError
+except ImportError:
+    # Without wxPython (e.g. batch command line) there are no wx objects
+    class _PyDeadObjectError(Exception):
+        pass
+
+import Instrumentation
+from .AppAccess import getApp
+from .WikiExceptions import WikiWordNotFoundException
 
 class MiscEventSourceMixin:
     """
@@ -52,37 +63,56 @@ class MiscEventSourceMixin:
 
 class ListenerList(object):
     __slots__ = ("__weakref__", "listeners", "userCount", "cleanupFlag",
-            "parentList")
+            "parentList", "coalescedRefs")
 
     def __init__(self):
         self.listeners = []
         self.userCount = 0
         self.cleanupFlag = False
-        self.parentList = None  # Don't know yet what it's good for
+        self.parentList = None  # List this one was cloned from
+        # Set of the entries of listeners which were added in coalesced mode
+        # or None if there are none
+        self.coalescedRefs = None
         
     def clone(self):
         result = ListenerList()
         result.listeners = self.listeners[:]
         result.userCount = 0
         result.parentList = self
+        if self.coalescedRefs:
+            result.coalescedRefs = self.coalescedRefs.copy()
         if self.cleanupFlag:
             result.cleanDeadRefs()
 
         return result
 
 
-    def addListener(self, listener, isWeak=True):
+    def addListener(self, listener, isWeak=True, coalesced=False):
         """
         isWeak -- Iff true, store weak reference to listener instead
                 of listener itself
+        coalesced -- Iff true, events are not delivered to the listener
+                while they are sent but merged and delivered later
+                (see batchScope())
         """
         if isWeak:
-            self.listeners.append(weakref.ref(listener))
+            lref = weakref.ref(listener)
         else:
-            self.listeners.append(listener)
+            lref = listener
+
+        self.listeners.append(lref)
+
+        if coalesced:
+            if self.coalescedRefs is None:
+                self.coalescedRefs = set()
+            self.coalescedRefs.add(lref)
 
 
     def removeListener(self, listener):
+        if self.coalescedRefs:
+            self.coalescedRefs.discard(weakref.ref(listener))
+            self.coalescedRefs.discard(listener)
+
         if self.userCount == 0:
             # No users -> manipulate list directly
             try:
@@ -112,6 +142,13 @@ class ListenerList(object):
 
     def hasListener(self, listener):
         return self.findListener(listener) != -1
+
+    def isCoalescedAt(self, i):
+        """
+        True iff listener at index i was added in coalesced mode.
+        """
+        return self.coalescedRefs is not None and \
+                self.listeners[i] in self.coalescedRefs
 #         try:
 #             self.listeners.index(weakref.ref(listener))
 #             return True
@@ -190,7 +227,11 @@ class ListenerList(object):
                 continue # Do not increment i here
 
             i += 1
-            
+
+        if self.coalescedRefs:
+            self.coalescedRefs = set(lref for lref in self.coalescedRefs
+                    if self.getActualObject(lref) is not None)
+
     def __len__(self):
         return len(self.listeners)
 
@@ -279,12 +320,14 @@ class MiscEvent(object):
 
     # A MiscEvent manages the listener list itself.
 
-    def addListener(self, listener, isWeak=True):
+    def addListener(self, listener, isWeak=True, coalesced=False):
         """
         isWeak -- Iff true, store weak reference to listener instead
                 of listener itself
+        coalesced -- Iff true, events for listener are merged and delivered
+                later, see ListenerList.addListener()
         """
-        return self.listenerList.addListener(listener, isWeak)
+        return self.listenerList.addListener(listener, isWeak, coalesced)
 
     def removeListener(self, listener):
         return self.listenerList.removeListener(listener)
@@ -340,9 +383,20 @@ class MiscEvent(object):
         if self.getParent() is None:
             raise StandardError("This must be a clone")  # TODO Create/Find a better exception
 
+        with Instrumentation.span("miscEvent.processSend", self.properties):
+            self._processSend(first)
+
+        return self
+
+
+    def _processSend(self, first):
         if first is not None:
             first.miscEventHappened(self);
         
+        Instrumentation.count("miscEvent.sent")
+        Instrumentation.record("miscEvent.listeners", len(self.listenerList))
+        coalescing = self.listenerList.coalescedRefs is not None
+        deferred = False
         self.listenerList.incListenerUser()
         try:
             i = 0
@@ -351,11 +405,17 @@ class MiscEvent(object):
                 if l is None:
                     i += 1
                     continue
+
+                if coalescing and self.listenerList.isCoalescedAt(i):
+                    _deferDelivery(self.listenerList.listeners[i], self)
+                    deferred = True
+                    i += 1
+                    continue
                 
                 self.activeListenerIndex = i
                 try:
                     l.miscEventHappened(self)
-                except wx.PyDeadObjectError:
+                except _PyDeadObjectError:
                     # The object is a wxPython object for which the C++ part was
                     # deleted already, so remove object from listener list.
                     self.listenerList.invalidateObjectAt(i)
@@ -372,7 +432,8 @@ class MiscEvent(object):
 
         self.activeListenerIndex = -1
 
-        return self
+        if deferred:
+            _scheduleFlush(False)
             
             
     def createClone(self, shareListenerList=False):
@@ -447,6 +508,24 @@ class MiscEvent(object):
         return event
 
 
+    def getAffectedPages(self):
+        """
+        Return dictionary {wikiWord: wikiPage} of the pages the event is
+        about: for a coalesced event the pages of all merged events,
+        otherwise the page in property "wikiPage" or the source if it is
+        a page. The page object is None if only the name is known (e.g.
+        new name of a renamed page) or, for a coalesced event, if the page
+        didn't exist anymore when the event was delivered. The returned
+        dictionary should not be altered.
+        """
+        affectedPages = self.properties.get("affected pages")
+        if affectedPages is None:
+            affectedPages = {}
+            _addAffectedPages(affectedPages, self.properties, self.source)
+
+        return affectedPages
+
+
 #     def noChildrenForMe():
 #         """
 #         Called by a listener to ensure that it doesn't get any child events
@@ -531,19 +610,22 @@ class KeyFunctionSinkAR(KeyFunctionSink):
     Key function sink which automatically adds/removes itself as listener
     to one particular object (Auto Register).
     """
-    __slots__= ("eventSource",)
+    __slots__= ("eventSource", "coalesced")
     
-    def __init__(self, activationTable, eventSource=None):
+    def __init__(self, activationTable, eventSource=None, coalesced=False):
         """
         activationTable -- Sequence of tuples (<key in props>, <function to call>)
         eventSource -- object with getMiscEvent() function to listen to (may be None)
+        coalesced -- Iff true, listen in coalesced mode (see batchScope())
         """
         KeyFunctionSink.__init__(self, activationTable)
         
         self.eventSource = eventSource
+        self.coalesced = coalesced
         
         if self.eventSource is not None:
-            self.eventSource.getMiscEvent().addListener(self)
+            self.eventSource.getMiscEvent().addListener(self,
+                    coalesced=self.coalesced)
 
     def getEventSource(self):
         return self.eventSource
@@ -559,7 +641,8 @@ class KeyFunctionSinkAR(KeyFunctionSink):
         self.eventSource = eventSource
 
         if self.eventSource is not None:
-            self.eventSource.getMiscEvent().addListener(self)
+            self.eventSource.getMiscEvent().addListener(self,
+                    coalesced=self.coalesced)
 
     def disconnect(self):
         """
@@ -569,6 +652,300 @@ class KeyFunctionSinkAR(KeyFunctionSink):
 
 
 
+# Coalesced delivery of events.
+#
+# Listeners added in coalesced mode don't get events while they are sent.
+# The events are collected and merged per listener, source and set of keys
+# instead, merged events have the additional properties "affected pages"
+# (see MiscEvent.getAffectedPages()) and "coalesced events" (number of
+# merged events). Until delivery only the names of the affected pages are
+# held, the page objects are retrieved when the event is delivered.
+# Events with a key in _UNMERGED_KEYS (renaming) are delivered one by one
+# and events sent after them aren't merged with those sent before, so the
+# listener sees all events in the order they were sent.
+# While a batch scope is open (bulk operations like rebuilding or
+# importing), they are delivered when the outermost scope ends, otherwise
+# as soon as the main thread processes pending events, so bursts of events
+# sent by background threads are coalesced as well.
+
+_UNMERGED_KEYS = frozenset(("renamed wiki page",))
+
+_coalesceLock = threading.RLock()
+_batchDepth = 0
+_batchStartTime = None
+_flushScheduled = False
+# Ordered dictionary
+# {(listener ref, id(source), keys, sequence no.): _CoalescedDelivery}
+_pendingDeliveries = collections.OrderedDict()
+# Dictionary {listener ref: sequence no.}, the number is increased for
+# each unmerged event deferred for the listener
+_pendingSequenceNos = {}
+
+
+def _addAffectedPages(affectedPages, props, source):
+    """
+    Add pages an event with properties props and source is about
+    to dictionary affectedPages (see MiscEvent.getAffectedPages()).
+    """
+    pages = props.get("affected pages")
+    if pages is not None:
+        affectedPages.update(pages)
+        return
+
+    page = props.get("wikiPage")
+    if page is None:
+        page = source
+
+    getWikiWord = getattr(page, "getWikiWord", None)
+    if getWikiWord is not None:
+        wikiWord = getWikiWord()
+        if wikiWord is not None:
+            affectedPages[wikiWord] = page
+
+    newWord = props.get("newWord")
+    if newWord is not None:
+        affectedPages.setdefault(newWord, None)
+
+
+def _lookUpPage(wikiDocument, wikiWord):
+    """
+    Return page for wikiWord in wikiDocument or None if it doesn't exist.
+    """
+    if wikiDocument is None:
+        return None
+
+    try:
+        return wikiDocument.getWikiPage(wikiWord)
+    except WikiWordNotFoundException:
+        return None
+    except:
+        traceback.print_exc()
+        return None
+
+
+
+class _CoalescedDelivery(object):
+    """
+    Merged events with the same source and keys for one coalesced listener.
+    """
+    __slots__ = ("listenerRef", "listenerList", "parent", "source",
+            "properties", "merged", "affectedWords", "wikiDocument",
+            "count", "firstTime")
+
+    def __init__(self, listenerRef, miscevt, merged):
+        """
+        merged -- Iff false, the delivery takes only the one event
+        """
+        self.listenerRef = listenerRef
+        self.listenerList = miscevt.listenerList
+        self.parent = miscevt.parent
+        self.source = miscevt.source
+        self.properties = {}
+        self.merged = merged
+        # Set of names of affected pages and wiki document to retrieve
+        # the pages from on delivery
+        self.affectedWords = set()
+        self.wikiDocument = None
+        self.count = 0
+        self.firstTime = Instrumentation.getTime()
+
+
+    def add(self, miscevt):
+        self.properties.update(miscevt.properties)
+
+        affectedPages = {}
+        _addAffectedPages(affectedPages, miscevt.properties, miscevt.source)
+        for wikiWord, wikiPage in affectedPages.iteritems():
+            self.affectedWords.add(wikiWord)
+            if self.wikiDocument is None and wikiPage is not None:
+                self.wikiDocument = wikiPage.getWikiDocument()
+
+        if self.merged:
+            # Don't hold page objects until delivery
+            self.properties.pop("wikiPage", None)
+            self.properties.pop("affected pages", None)
+
+        self.count += miscevt.properties.get("coalesced events", 1)
+
+
+    def deliver(self):
+        listener = ListenerList.getActualObject(self.listenerRef)
+        if listener is None:
+            return
+
+        # Check if listener was removed in the meantime
+        listenerList = self.listenerList
+        while listenerList.parentList is not None:
+            listenerList = listenerList.parentList
+
+        if not listenerList.hasListener(listener):
+            return
+
+        miscevt = MiscEvent(self.source)
+        miscevt.parent = self.parent
+        miscevt.properties = self.properties
+        miscevt.properties["affected pages"] = dict(
+                (wikiWord, _lookUpPage(self.wikiDocument, wikiWord))
+                for wikiWord in self.affectedWords)
+        miscevt.properties["coalesced events"] = self.count
+
+        Instrumentation.addSpan("miscEvent.coalesceDelay", self.firstTime)
+        Instrumentation.record("miscEvent.coalescedEvents", self.count)
+
+        with Instrumentation.span("miscEvent.deliverCoalesced", self.count):
+            try:
+                listener.miscEventHappened(miscevt)
+            except _PyDeadObjectError:
+                pass
+            except:
+                traceback.print_stack()
+                traceback.print_exc()
+
+
+
+def _deferDelivery(listenerRef, miscevt):
+    """
+    Called by MiscEvent._processSend() for a listener in coalesced mode.
+    """
+    keys = frozenset(miscevt.properties)
+
+    with _coalesceLock:
+        sequenceNo = _pendingSequenceNos.get(listenerRef, 0)
+        merged = keys.isdisjoint(_UNMERGED_KEYS)
+        if not merged:
+            # Later events get a new key so they aren't merged with
+            # earlier ones
+            _pendingSequenceNos[listenerRef] = sequenceNo + 1
+
+        key = (listenerRef, id(miscevt.source), keys, sequenceNo)
+
+        delivery = _pendingDeliveries.get(key)
+        if delivery is None:
+            delivery = _CoalescedDelivery(listenerRef, miscevt, merged)
+            _pendingDeliveries[key] = delivery
+
+        delivery.add(miscevt)
+
+    Instrumentation.count("miscEvent.coalesced")
+
+
+def _scheduleFlush(immediate):
+    """
+    Arrange delivery of pending events if no batch scope is open.
+    immediate -- Iff true and called in main thread, deliver now
+    """
+    global _flushScheduled
+
+    with _coalesceLock:
+        if _batchDepth > 0 or _flushScheduled or not _pendingDeliveries:
+            return
+        _flushScheduled = True
+
+    app = getApp()
+    if app is None or not app.IsMainLoopRunning():
+        flushCoalescedEvents()
+        return
+
+    import wx
+
+    if immediate and wx.Thread_IsMain():
+        flushCoalescedEvents()
+    else:
+        wx.CallAfter(flushCoalescedEvents)
+
+
+def flushCoalescedEvents():
+    """
+    Deliver all pending merged events to the coalesced listeners now.
+    """
+    global _flushScheduled, _pendingDeliveries, _pendingSequenceNos
+
+    with _coalesceLock:
+        deliveries = _pendingDeliveries.values()
+        _pendingDeliveries = collections.OrderedDict()
+        _pendingSequenceNos = {}
+        _flushScheduled = False
+
+    if not deliveries:
+        return
+
+    with Instrumentation.span("miscEvent.flushCoalesced", len(deliveries)):
+        for delivery in deliveries:
+            delivery.deliver()
+
+
+def beginBatch():
+    """
+    Open a batch scope. Events for coalesced listeners are held back until
+    the outermost scope is closed by endBatch(). Scopes are global, not
+    per thread.
+    """
+    global _batchDepth, _batchStartTime
+
+    with _coalesceLock:
+        if _batchDepth == 0:
+            _batchStartTime = Instrumentation.getTime()
+        _batchDepth += 1
+
+
+def endBatch():
+    """
+    Close a batch scope opened by beginBatch(). When the outermost scope
+    is closed, the merged events are delivered (directly if called in main
+    thread).
+    """
+    global _batchDepth
+
+    with _coalesceLock:
+        if _batchDepth == 0:
+            return
+        _batchDepth -= 1
+        if _batchDepth > 0:
+            return
+
+    Instrumentation.addSpan("miscEvent.batchScope", _batchStartTime)
+    _scheduleFlush(True)
+
+
+class _BatchScope(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        beginBatch()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        endBatch()
+        return False
+
+
+_BATCH_SCOPE = _BatchScope()
+
+
+def batchScope():
+    """
+    Return context manager which runs the with-block in a batch scope
+    (see beginBatch()), e.g.:
+
+        with MiscEvent.batchScope():
+            for wikiPage in pages:
+                wikiPage.replaceLiveText(...)
+    """
+    return _BATCH_SCOPE
+
+
+def batched(fct):
+    """
+    Decorator to run each call of the function in a batch scope.
+    """
+    def wrapper(*args, **kwargs):
+        with _BATCH_SCOPE:
+            return fct(*args, **kwargs)
+
+    return functools.wraps(fct)(wrapper)
+
+
+
 # class EventResenderAR(MiscEventSourceMixin):
 #     def __init__(self, eventSource=None):
 #         """
@@ -436,6 +436,7 @@ class OptionsDialog(wx.Dialog):
                     "btnSelectTreeFont"),
             ("tree_updateGenerator_minDelay", "tfTreeUpdateGeneratorMinDelay",
                     "f0+"),
+            ("tree_childrenPageSize", "tfTreeChildrenPageSize", "i0+"),
 
             ("start_browser_after_export", "cbStartBrowserAfterExport", "b"),
             ("facename_html_preview", "tfFacenameHtmlPreview", "t"),
@@ -653,11 +654,12 @@ class OptionsDialog(wx.Dialog):
 
             ("option/wiki/log_window_autoshow", "cbLogWindowAutoShowWiki", "b3"),
 
-            # The following three need special handling on dialog construction
+            # The following four need special handling on dialog construction
             ("wikiPageFiles_asciiOnly", "cbWikiPageFilesAsciiOnly", "b"),
             ("wikiPageFiles_maxNameLength", "tfWikiPageFilesMaxNameLength", "i0+"),
             ("wikiPageFiles_gracefulOutsideAddAndRemove",
                     "cbWikiPageFilesGracefulOutsideAddAndRemove", "b"),
+            ("wikiPageFiles_watchMode", "chWikiPageFilesWatchMode", "seli"),
 
 
             ("wiki_icon", "tfWikiIcon", "t"),
@@ -989,6 +991,9 @@ class OptionsDialog(wx.Dialog):
             self.ctrls.tfWikiPageFilesMaxNameLength.Enable(fppCap is not None)
             self.ctrls.cbWikiPageFilesGracefulOutsideAddAndRemove.Enable(
                     fppCap is not None)
+            self.ctrls.chWikiPageFilesWatchMode.Enable(
+                    wikiDocument.getWikiData().checkCapability("fileWatch")
+                    is not None)
             self.ctrls.chTrashcanStorageLocation.Enable(
                     fppCap is not None)
             self.ctrls.chVersioningStorageLocation.Enable(
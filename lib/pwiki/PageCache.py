@@ -0,0 +1,102 @@
+"""
+Strong cache for recently used doc pages.
+"""
+
+from __future__ import with_statement
+
+import threading
+
+from .Utilities import LruCache
+
+
+class PageLruCache(object):
+    """
+    Holds strong references to recently used pages so that they and their
+    derived data (page AST, attributes, spell checker results) are not
+    garbage collected as soon as no editor shows them anymore.
+
+    The cache is bounded by the summed estimated memory size of the pages
+    (see DocPage.getLastEstimatedMemorySize()). If it is exceeded, the least
+    recently used pages are dropped. Pages don't estimate their size when
+    put into the cache, but when their cached data was built
+    (see AbstractWikiPage.updateEstimatedMemorySize()), which calls
+    updatePageSize() then.
+
+    The methods are thread-safe.
+    """
+
+    def __init__(self, maxSize):
+        """
+        maxSize -- maximum summed estimated size of cached pages in bytes.
+                If 0, no pages are held.
+        """
+        self.maxSize = maxSize
+        self.lock = threading.RLock()
+        self.pages = LruCache(maxSize)
+
+        # Statistics of page lookups
+        self.hits = 0
+        self.misses = 0
+
+
+    def put(self, key, page):
+        """
+        Put page into cache or mark it as most recently used if already
+        there.
+        """
+        if self.maxSize <= 0:
+            return
+
+        with self.pages.lock:
+            if self.pages.get(key) is not page:
+                self.pages.put(key, page, page.getLastEstimatedMemorySize())
+
+
+    def updatePageSize(self, key, page):
+        """
+        Called after the estimated size of page changed. Nothing is done
+        if page isn't cached under key.
+        """
+        self.pages.setSize(key, page.getLastEstimatedMemorySize(), page)
+
+
+    def remove(self, key):
+        self.pages.pop(key)
+
+
+    def clear(self):
+        self.pages.clear()
+
+
+    def recordLookup(self, hit):
+        """
+        Count a lookup of a page for statistics. hit is True if the page
+        object was still available.
+        """
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+    def getStatistics(self):
+        """
+        Return dictionary with statistics:
+            "hits", "misses": number of page lookups where the page object
+                    was still available or had to be created,
+            "hitRate": hits / (hits + misses) or None if nothing was looked up,
+            "pageCount": number of pages held by this cache,
+            "size", "maxSize": summed estimated size of these pages and
+                    the maximum
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            if lookups == 0:
+                hitRate = None
+            else:
+                hitRate = float(self.hits) / lookups
+
+            return {"hits": self.hits, "misses": self.misses,
+                    "hitRate": hitRate, "pageCount": len(self.pages),
+                    "size": self.pages.getSize(), "maxSize": self.maxSize}
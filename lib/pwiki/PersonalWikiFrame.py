@@ -22,7 +22,8 @@ from . import wxHelper
 
 from . import TextTree
 
-from .MiscEvent import MiscEventSourceMixin, ProxyMiscEvent  # , DebugSimple
+from .MiscEvent import MiscEventSourceMixin, ProxyMiscEvent, \
+        batchScope  # , DebugSimple
 
 from WikiExceptions import *
 from Consts import HOMEPAGE
@@ -55,6 +56,7 @@ from .DocPagePresenter import DocPagePresenter
 from .Ipc import EVT_REMOTE_COMMAND
 
 from . import AttributeHandling, SpellChecker
+from . import Instrumentation
 
 
 from . import AdditionalDialogs
@@ -249,7 +251,8 @@ camelCaseWordsEnabled: false;a=[camelCaseWordsEnabled: false]\\n
         dirs = ( os.path.join(self.wikiAppDir, u'extensions'),
                 os.path.join(self.wikiAppDir, u'user_extensions'),
                 os.path.join(self.globalConfigSubDir, u'user_extensions') )
-        self.pluginManager = PluginManager.PluginManager(dirs, systemDirIdx=0)
+        self.pluginManager = PluginManager.PluginManager(dirs, systemDirIdx=0,
+                manifestPath=wx.GetApp().getPluginManifestPath())
 
 #         wx.GetApp().pauseBackgroundThreads()
 
@@ -293,8 +296,9 @@ camelCaseWordsEnabled: false;a=[camelCaseWordsEnabled: false]\\n
 
         del plm
 
-        self.pluginManager.loadPlugins([ u'KeyBindings.py',
-                u'EvalLibrary.py' ] )
+        with Instrumentation.span("plugins.load", "frame"):
+            self.pluginManager.loadPlugins([ u'KeyBindings.py',
+                    u'EvalLibrary.py' ] )
 
 
         self.attributeChecker = AttributeHandling.AttributeChecker(self)
@@ -3937,20 +3941,21 @@ camelCaseWordsEnabled: false;a=[camelCaseWordsEnabled: false]\\n
             self.saveAllDocPages()
 
             # TODO Don't recycle variable names!
-            for wikiWord, toWikiWord in renameSeq:
-
-                if wikiWord == wikiDoc.getWikiName():
-                    # Renaming of root word = renaming of wiki config file
-                    wikiConfigFilename = wikiDoc.getWikiConfigPath()
-                    self.removeFromWikiHistory(wikiConfigFilename)
-    #                 self.wikiHistory.remove(wikiConfigFilename)
-                    wikiDoc.renameWikiWord(wikiWord, toWikiWord,
-                            modifyText)
-                    # Store some additional information
-                    self.lastAccessedWiki(wikiDoc.getWikiConfigPath())
-                else:
-                    wikiDoc.renameWikiWord(wikiWord, toWikiWord,
-                            modifyText)
+            with batchScope():
+                for wikiWord, toWikiWord in renameSeq:
+
+                    if wikiWord == wikiDoc.getWikiName():
+                        # Renaming of root word = renaming of wiki config file
+                        wikiConfigFilename = wikiDoc.getWikiConfigPath()
+                        self.removeFromWikiHistory(wikiConfigFilename)
+    #                     self.wikiHistory.remove(wikiConfigFilename)
+                        wikiDoc.renameWikiWord(wikiWord, toWikiWord,
+                                modifyText)
+                        # Store some additional information
+                        self.lastAccessedWiki(wikiDoc.getWikiConfigPath())
+                    else:
+                        wikiDoc.renameWikiWord(wikiWord, toWikiWord,
+                                modifyText)
 
             return True
         except (IOError, OSError, DbAccessError), e:
@@ -1,15 +1,16 @@
 from __future__ import with_statement
 
 from zipimport import zipimporter
-import os, sys, traceback, os.path, imp, new, collections
+import os, sys, traceback, os.path, imp, new, collections, threading, marshal
 
 # sys.path.append(ur"C:\Daten\Projekte\Wikidpad\Next20\extensions")
 
-import wx
-
 import Utilities
+import Consts
 
 from .StringOps import mbcsEnc, pathEnc
+from .AppAccess import getApp
+from .Localization import getGuiLocale
 
 
 
@@ -56,6 +57,25 @@ from .StringOps import mbcsEnc, pathEnc
    only one return value, you can unpack it directly to a variable with the 
    following syntax:
    a, = api.call1()
+
+   If the PluginManager is created with a manifestPath, it stores for each
+   plugin file the descriptors of WIKIDPAD_PLUGIN and the names of the
+   functions the plugin defines (the "manifest"). On later starts plugins
+   are registered from the manifest and the module is imported only when one
+   of its functions is called the first time.
+
+   Functions of a SimplePluginAPI can be declared static:
+
+   api = pm.registerSimplePluginAPI(("myAPI",1), ["describe", "call1"],
+           staticFunctions=["describe"])
+
+   The result of a static function is stored in the manifest as well and
+   returned from there as long as the module isn't imported. It may only
+   contain None, numbers, strings, tuples, lists and functions or classes
+   defined at module level of the plugin. These are represented by
+   stand-ins which import the module when they are called or an attribute
+   of them is needed. Static functions must return the same result for each
+   call, independent of their parameters.
    """
 
 
@@ -66,11 +86,14 @@ class SimplePluginAPI(object):
        created that calls the registered plugin functions. The descriptor must 
        appear in the WIKIDPAD_PLUGIN sequence object of the any module to have
        the module registered. After that the module just has to implement a 
-       subset of the api's functions to be registered."""
+       subset of the api's functions to be registered.
+       The names in staticFunctions (a subset of functions) are functions
+       whose results may be taken from the plugin manifest."""
 
-    def __init__(self, descriptor, functions):
+    def __init__(self, descriptor, functions, staticFunctions=()):
         self.descriptor = descriptor
         self._functionNames = functions
+        self._staticFunctionNames = frozenset(staticFunctions)
         self._plugins = {}
         for f in self._functionNames:
             pluginlist = []
@@ -97,8 +120,9 @@ class SimplePluginAPI(object):
         registered = False
         if self.descriptor in module.WIKIDPAD_PLUGIN:
             for f in self._functionNames:
-                if hasattr(module, f):
-                    self._plugins[f].append(getattr(module,f))
+                if _hasPluginFunction(module, f):
+                    self._plugins[f].append(_getPluginFunction(module, f,
+                            f in self._staticFunctionNames))
                     registered = True
             if not registered:
                 sys.stderr.write("plugin " + module.__name__ + " exposes " +
@@ -167,13 +191,13 @@ class WrappedPluginAPI(object):
         registered = False
         for f in self._functionNames:
             if self._wrappedFunctions[f] is None:
-                if hasattr(module, f):
-                    self._plugins[f].append(getattr(module,f))
+                if _hasPluginFunction(module, f):
+                    self._plugins[f].append(_getPluginFunction(module, f))
                     registered = True
             elif isinstance(self._wrappedFunctions[f], (str, unicode)):
                 realF = self._wrappedFunctions[f]
-                if hasattr(module, realF):
-                    self._plugins[f].append(getattr(module,realF))
+                if _hasPluginFunction(module, realF):
+                    self._plugins[f].append(_getPluginFunction(module, realF))
                     registered = True
             else:
                 self._plugins[f].append(module)
@@ -213,18 +237,364 @@ class PluginAPIAggregation(object):
 
 
 
+def _hasPluginFunction(module, name):
+    if isinstance(module, LazyPluginModule):
+        return module.hasPluginFunction(name)
+
+    return hasattr(module, name)
+
+
+def _getPluginFunction(module, name, static=False):
+    if isinstance(module, LazyPluginModule):
+        return module.getPluginFunction(name, static)
+
+    return getattr(module, name)
+
+
+
+class PluginManifestCache(object):
+    """
+    Persistent cache of the manifests of plugin files. A manifest is a
+    dictionary with the keys:
+        "descriptors": tuple of WIKIDPAD_PLUGIN or None if the module
+                doesn't have it,
+        "functions": list of names of callable module members,
+        "static": dictionary {functionName: encodedResult} of the recorded
+                results of static API functions
+    A manifest is only valid as long as modification time and size of the
+    plugin file, the GUI language and the WikidPad version are unchanged
+    (the static results may contain translated texts).
+
+    Use getPluginManifestCache() to get the cache for a path so that all
+    plugin managers share it. The methods are thread-safe.
+    """
+
+    CACHE_MAGIC = "WDPluginManifest"
+    FORMAT_VERSION = 0
+
+    def __init__(self, cachePath):
+        self.cachePath = cachePath
+        self.lock = threading.RLock()
+        # Dictionary {path: (fileKey, manifest)} where fileKey is tuple
+        # (modification time, size, GUI locale, WikidPad version)
+        self.entries = {}
+        self.dirty = False
+
+        self._load()
+
+
+    def _load(self):
+        try:
+            with open(pathEnc(self.cachePath), "rb") as f:
+                data = f.read()
+        except IOError:
+            return
+
+        try:
+            magic, formatVersion, entries = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            traceback.print_exc()
+            return
+
+        if magic != self.CACHE_MAGIC or formatVersion != self.FORMAT_VERSION:
+            return
+
+        self.entries = entries
+
+
+    def save(self):
+        """
+        Write cache file if manifests were changed.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+
+            data = marshal.dumps((self.CACHE_MAGIC, self.FORMAT_VERSION,
+                    self.entries))
+            try:
+                with open(pathEnc(self.cachePath), "wb") as f:
+                    f.write(data)
+            except IOError:
+                traceback.print_exc()
+                return
+
+            self.dirty = False
+
+
+    @staticmethod
+    def getFileKey(path):
+        """
+        Return key for the current state of file path and of the
+        application or None if it can't be determined.
+        """
+        try:
+            st = os.stat(pathEnc(path))
+        except OSError:
+            return None
+
+        return (st.st_mtime, st.st_size, getGuiLocale(), Consts.VERSION_STRING)
+
+
+    def getManifest(self, path, fileKey):
+        """
+        Return manifest for file path or None if no valid one is stored.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != fileKey:
+                return None
+
+            return entry[1]
+
+
+    def setManifest(self, path, fileKey, manifest):
+        with self.lock:
+            self.entries[path] = (fileKey, manifest)
+            self.dirty = True
+
+
+    def setStaticResult(self, path, fileKey, fctName, encodedResult):
+        """
+        Store the encoded result of static function fctName in the manifest
+        of file path if it is still valid.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != fileKey:
+                return
+
+            entry[1]["static"][fctName] = encodedResult
+            self.dirty = True
+
+
+    def removeMissing(self, directory, fileNames):
+        """
+        Remove manifests of files in directory which are not in the
+        sequence fileNames anymore.
+        """
+        with self.lock:
+            for path in self.entries.keys():
+                if os.path.dirname(path) == directory and \
+                        not os.path.basename(path) in fileNames:
+                    del self.entries[path]
+                    self.dirty = True
+
+
+
+_manifestCaches = {}
+_manifestCachesLock = threading.Lock()
+
+
+def getPluginManifestCache(cachePath):
+    """
+    Return the shared PluginManifestCache for cachePath.
+    """
+    with _manifestCachesLock:
+        cache = _manifestCaches.get(cachePath)
+        if cache is None:
+            cache = PluginManifestCache(cachePath)
+            _manifestCaches[cachePath] = cache
+
+        return cache
+
+
+
+def _buildManifest(module):
+    """
+    Return manifest for loaded plugin module or None if it can't be stored.
+    """
+    descriptors = getattr(module, "WIKIDPAD_PLUGIN", None)
+    if descriptors is not None:
+        descriptors = tuple(descriptors)
+        try:
+            marshal.dumps(descriptors)
+        except ValueError:
+            return None
+
+    return {"descriptors": descriptors,
+            "functions": [name for name, value in module.__dict__.iteritems()
+                if callable(value)],
+            "static": {}}
+
+
+def _encodeStaticValue(value, module):
+    """
+    Encode result of a static plugin function for the manifest. Tuples and
+    lists become tuples ("t", items) and ("l", items), module level
+    functions and classes of module become ("r", name).
+    Raises ValueError if value can't be encoded.
+    """
+    if value is None or isinstance(value, (bool, int, long, float,
+            basestring)):
+        return value
+    if isinstance(value, tuple):
+        return ("t", [_encodeStaticValue(v, module) for v in value])
+    if isinstance(value, list):
+        return ("l", [_encodeStaticValue(v, module) for v in value])
+
+    name = getattr(value, "__name__", None)
+    if isinstance(name, basestring) and \
+            module.__dict__.get(name) is value:
+        return ("r", name)
+
+    raise ValueError("Can't encode %r" % (value,))
+
+
+def _decodeStaticValue(value, lazyModule):
+    if not isinstance(value, tuple):
+        return value
+
+    tag, content = value
+    if tag == "t":
+        return tuple(_decodeStaticValue(v, lazyModule) for v in content)
+    if tag == "l":
+        return [_decodeStaticValue(v, lazyModule) for v in content]
+
+    return lazyModule.getReference(content)
+
+
+
+class LazyPluginReference(object):
+    """
+    Stands in for a function or class defined at module level of a plugin
+    which wasn't imported yet. Calling it or getting an attribute of it
+    imports the module.
+    """
+    def __init__(self, lazyModule, name):
+        self._lazyModule = lazyModule
+        self._name = name
+
+    def getObject(self):
+        return getattr(self._lazyModule.getPluginModule(), self._name)
+
+    def __call__(self, *args, **kwargs):
+        return self.getObject()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        if attr.startswith("__") and attr.endswith("__"):
+            raise AttributeError(attr)
+
+        return getattr(self.getObject(), attr)
+
+
+
+class LazyPluginModule(object):
+    """
+    Stands in for a plugin module which was registered by its manifest.
+    The module is imported when one of its functions is called the first
+    time or another attribute of it is needed.
+    """
+    def __init__(self, pluginManager, packageName, directory, fileName,
+            fileKey, manifest, module=None):
+        self.__name__ = packageName + "." + os.path.splitext(fileName)[0]
+        self.__file__ = os.path.join(directory, fileName)
+        self.WIKIDPAD_PLUGIN = manifest["descriptors"]
+
+        self._pluginManager = pluginManager
+        self._packageName = packageName
+        self._directory = directory
+        self._fileName = fileName
+        self._fileKey = fileKey
+        self._manifest = manifest
+        self._functionNames = frozenset(manifest["functions"])
+        self._module = module
+        # Dictionary {name: LazyPluginReference}
+        self._references = {}
+
+
+    def isLoaded(self):
+        return self._module is not None
+
+
+    def getPluginModule(self):
+        """
+        Return the real module, import it if necessary.
+        """
+        module = self._module
+        if module is None:
+            module = self._pluginManager._importPlugin(self._packageName,
+                    self._directory, self._fileName)
+            self._module = module
+
+        return module
+
+
+    def getReference(self, name):
+        ref = self._references.get(name)
+        if ref is None:
+            ref = LazyPluginReference(self, name)
+            self._references[name] = ref
+
+        return ref
+
+
+    def hasPluginFunction(self, name):
+        return name in self._functionNames
+
+
+    def getPluginFunction(self, name, static=False):
+        """
+        Return function which calls the module function name. If static is
+        True, its result is recorded in the manifest and, while the module
+        isn't imported, returned from there.
+        """
+        if not static:
+            return lambda *args, **kwargs: getattr(self.getPluginModule(),
+                    name)(*args, **kwargs)
+
+        def staticFunction(*args, **kwargs):
+            staticResults = self._manifest["static"]
+            if self._module is None and name in staticResults:
+                return _decodeStaticValue(staticResults[name], self)
+
+            module = self.getPluginModule()
+            result = getattr(module, name)(*args, **kwargs)
+            if not name in staticResults:
+                try:
+                    encoded = _encodeStaticValue(result, module)
+                except ValueError:
+                    pass
+                else:
+                    self._pluginManager.manifestCache.setStaticResult(
+                            self.__file__, self._fileKey, name, encoded)
+                    self._pluginManager.manifestCache.save()
+
+            return result
+
+        return staticFunction
+
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+
+        return getattr(self.getPluginModule(), attr)
+
+
+
 
 class PluginManager(object):
-    """manages all PluginAPIs and plugins."""
-    def __init__(self, directories, systemDirIdx=-1):
+    """manages all PluginAPIs and plugins.
+       If manifestPath is given, plugins are loaded lazily using the
+       manifest cache stored there."""
+    def __init__(self, directories, systemDirIdx=-1, manifestPath=None):
         self.pluginAPIs = {}  # Dictionary {<type name>:<verReg dict>}
                 # where verReg dict is list of tuples (<version No>:<PluginAPI instance>)
         self.plugins = {}  
         self.directories = directories
         self.systemDirIdx = systemDirIdx
+        if manifestPath is None:
+            self.manifestCache = None
+        else:
+            self.manifestCache = getPluginManifestCache(manifestPath)
+
+        # Held while a plugin module is imported
+        self.importLock = threading.RLock()
         
-    def registerSimplePluginAPI(self, descriptor, functions):
-        api = SimplePluginAPI(descriptor, functions)
+    def registerSimplePluginAPI(self, descriptor, functions,
+            staticFunctions=()):
+        api = SimplePluginAPI(descriptor, functions, staticFunctions)
         self.pluginAPIs[descriptor] = api
         return api
 
@@ -307,7 +677,10 @@ class PluginManager(object):
            
            Files and directories given in exludeFiles are not loaded at all. Also 
            directories are searched in order for plugins. Therefore plugins
-           appearing in earlier directories are not loaded from later ones."""
+           appearing in earlier directories are not loaded from later ones.
+           
+           With a manifest cache, files with a valid manifest are only
+           registered and imported on demand."""
         import imp
         exclusions = excludeFiles[:]
         
@@ -329,33 +702,117 @@ class PluginManager(object):
 
             for name in files:
                 try:
-                    module = None
                     fullname = os.path.join(directory, name)
                     ( moduleName, ext ) = os.path.splitext(name)
                     if name in exclusions:
                         continue
-                    if os.path.isfile(fullname):
-                        if ext == '.py':
-                            with open(fullname) as f:
-                                module = imp.load_module(packageName + "." + moduleName, f,
-                                        mbcsEnc(fullname)[0], (".py", "r", imp.PY_SOURCE))
-                        elif ext == '.zip':
-                            module = imp.new_module(
-                                    packageName + "." + moduleName)
-                            module.__path__ = [fullname]
-                            module.__zippath__ = fullname
-                            sys.modules[packageName + "." + moduleName] = module
-                            zi = zipimporter(fullname)
-                            co = zi.get_code("__init__")
-                            exec co in module.__dict__
-
-                    if module:
-                        setattr(package, moduleName, module)
-                        if hasattr(module, "WIKIDPAD_PLUGIN"):
-                            self.registerPlugin(module)
+                    if not ext in ('.py', '.zip') or \
+                            not os.path.isfile(fullname):
+                        continue
+
+                    if self.manifestCache is not None:
+                        self._loadPluginByManifest(package, packageName,
+                                directory, name)
+                        continue
+
+                    module = self._loadPluginModule(packageName, directory,
+                            name)
+                    if module and hasattr(module, "WIKIDPAD_PLUGIN"):
+                        self.registerPlugin(module)
                 except:
                     traceback.print_exc()
             del sys.path[-1]
+
+            if self.manifestCache is not None:
+                self.manifestCache.removeMissing(directory, files)
+
+        if self.manifestCache is not None:
+            self.manifestCache.save()
+
+
+    def _loadPluginModule(self, packageName, directory, name):
+        """
+        Import plugin file name in directory as member of package
+        packageName and return the module or None if the file type isn't
+        supported. The parent directory of directory must be in sys.path.
+        """
+        import imp
+        module = None
+        fullname = os.path.join(directory, name)
+        ( moduleName, ext ) = os.path.splitext(name)
+
+        if ext == '.py':
+            with open(fullname) as f:
+                module = imp.load_module(packageName + "." + moduleName, f,
+                        mbcsEnc(fullname)[0], (".py", "r", imp.PY_SOURCE))
+        elif ext == '.zip':
+            module = imp.new_module(
+                    packageName + "." + moduleName)
+            module.__path__ = [fullname]
+            module.__zippath__ = fullname
+            sys.modules[packageName + "." + moduleName] = module
+            zi = zipimporter(fullname)
+            co = zi.get_code("__init__")
+            exec co in module.__dict__
+
+        if module:
+            setattr(sys.modules[packageName], moduleName, module)
+
+        return module
+
+
+    def _loadPluginByManifest(self, package, packageName, directory, name):
+        """
+        Register plugin file name from its manifest. If no valid manifest
+        is stored, the module is imported and the manifest created.
+        """
+        fullname = os.path.join(directory, name)
+        fileKey = PluginManifestCache.getFileKey(fullname)
+        manifest = self.manifestCache.getManifest(fullname, fileKey)
+        module = None
+
+        if manifest is None:
+            module = self._loadPluginModule(packageName, directory, name)
+            if not module:
+                return
+
+            manifest = _buildManifest(module)
+            if manifest is None or fileKey is None:
+                # Can't be cached, use module as is
+                if hasattr(module, "WIKIDPAD_PLUGIN"):
+                    self.registerPlugin(module)
+                return
+
+            self.manifestCache.setManifest(fullname, fileKey, manifest)
+
+        if manifest["descriptors"] is None:
+            # Not a plugin
+            return
+
+        lazyModule = LazyPluginModule(self, packageName, directory, name,
+                fileKey, manifest, module)
+        if module is None:
+            setattr(package, os.path.splitext(name)[0], lazyModule)
+
+        self.registerPlugin(lazyModule)
+
+
+    def _importPlugin(self, packageName, directory, name):
+        """
+        Import plugin file on demand for a LazyPluginModule.
+        """
+        with self.importLock:
+            module = getattr(sys.modules.get(packageName),
+                    os.path.splitext(name)[0], None)
+            if module is not None and \
+                    not isinstance(module, LazyPluginModule):
+                return module
+
+            sys.path.append(os.path.dirname(directory))
+            try:
+                return self._loadPluginModule(packageName, directory, name)
+            finally:
+                del sys.path[-1]
           
     def importDirectory(self, name, add_to_sys_modules = False): 
         name = mbcsEnc(name, "replace")[0]
@@ -530,7 +987,7 @@ class InsertionPluginManager:
             else:
                 key, etlist, factory = keyDesc
                 try:
-                    obj = factory(wx.GetApp())
+                    obj = factory(getApp())
                 except:
                     traceback.print_exc()
                     obj = None
@@ -552,6 +1009,74 @@ class InsertionPluginManager:
         return result
 
 
+    def prefetchContents(self, exporter, exportType, insTokens,
+            fallbackExportType=None):
+        """
+        Let handlers which support the extra feature "prefetchContent"
+        prepare the content of insTokens (e.g. by running external
+        applications to render images) in parallel before createContent()
+        is called for each of them one after another. Handlers must then
+        provide a method prefetchContent(exporter, exportType, insToken)
+        which must be thread-safe.
+
+        The number of parallel jobs is limited by global option
+        "insertion_parallelRenderCount". Returns when all jobs are done.
+
+        exporter -- Calling exporter object
+        exportType -- string describing the export type
+        insTokens -- iterable of insertion tokens (AST nodes)
+        fallbackExportType -- export type to use if no handler exists for
+                exportType
+        """
+        jobCount = getApp().getGlobalConfig().getint("main",
+                "insertion_parallelRenderCount", 4)
+        if jobCount < 2:
+            return
+
+        jobs = collections.deque()
+        for insToken in insTokens:
+            et = exportType
+            handler = self.getHandler(exporter, et, insToken.key)
+            if handler is None and fallbackExportType is not None:
+                et = fallbackExportType
+                handler = self.getHandler(exporter, et, insToken.key)
+
+            if handler is None:
+                continue
+
+            try:
+                if not "prefetchContent" in handler.getExtraFeatures():
+                    continue
+            except:
+                traceback.print_exc()
+                continue
+
+            jobs.append((handler, et, insToken))
+
+        if len(jobs) < 2:
+            # Nothing gained by another thread
+            return
+
+        def runJobs():
+            while True:
+                try:
+                    handler, et, insToken = jobs.popleft()
+                except IndexError:
+                    return
+                try:
+                    handler.prefetchContent(exporter, et, insToken)
+                except:
+                    traceback.print_exc()
+
+        threads = [threading.Thread(target=runJobs)
+                for i in xrange(min(jobCount, len(jobs)))]
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+        for t in threads:
+            t.join()
+
+
     def taskEnd(self):
         """
         Call taskEnd() of all created handlers.
@@ -571,7 +1096,7 @@ def getExporterClasses(mainControl):
     
     # TODO: Cache?
     return reduce(lambda a, b: a+list(b),
-            wx.GetApp().describeExportersApi.describeExportersV01(mainControl),
+            getApp().describeExportersApi.describeExportersV01(mainControl),
             list(Exporters.describeExportersV01(mainControl)))
 
 #     classIds = set()
@@ -695,7 +1220,7 @@ def getPrintTypeDict(mainControl):
     result = {}
 
     # External plugins can overwrite internal exporter types
-    for c in wx.GetApp().describePrints(mainControl):
+    for c in getApp().describePrints(mainControl):
         for tnt in c.getPrintTypes(mainControl):
             tname, tnameHr = tnt[:2]
             result[tname] = (c, tname, tnameHr)
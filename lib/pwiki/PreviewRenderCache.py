@@ -0,0 +1,132 @@
+"""
+Cache for HTML previews of wiki pages.
+"""
+
+from __future__ import with_statement
+
+import traceback
+
+from .StringOps import pathEnc, utf8Enc
+from .Utilities import LruCache
+from .RenderCache import RenderCache
+
+
+class PreviewRenderCache(object):
+    """
+    Stores the HTML previews of wiki pages in a RenderCache (so files are
+    evicted in least recently used order) under a key built from the wiki
+    word, the preview settings of the exporter and the fingerprints of all
+    data the page was rendered from.
+
+    For the MAX_ENTRIES most recently used pages and settings the format
+    details and dependencies of the last rendering are held in memory.
+    A preview is taken from the cache if format details are equivalent and
+    all dependencies are unchanged.
+
+    The exporter must be an HtmlExporter. The methods are thread-safe
+    as long as each exporter is only used by one thread at a time.
+    """
+
+    SUFFIX = ".html"
+
+    MAX_ENTRIES = 1000
+
+    def __init__(self, cacheDir, maxSize):
+        """
+        cacheDir -- directory to store HTML files in, created on demand
+        maxSize -- maximum summed size of cached files in bytes. If 0, the
+                cache is disabled and each preview is rendered directly.
+        """
+        self.renderCache = RenderCache(cacheDir, maxSize)
+        # LruCache {(word, settingsFingerprint): (formatDetails,
+        # dependencies)} where dependencies is a dictionary
+        # {dependency: fingerprint} as returned by
+        # HtmlExporter.exportWikiPageToHtmlStringRecording()
+        self.entries = LruCache(self.MAX_ENTRIES)
+
+
+    def isEnabled(self):
+        return self.renderCache.isEnabled()
+
+
+    @staticmethod
+    def _makeKey(word, settings, dependencies):
+        return RenderCache.makeKey(word, settings,
+                *sorted(dependencies.iteritems()))
+
+
+    def _getCachedPath(self, exporter, wikiPage, settings):
+        """
+        Return path of the cached up-to-date preview of wikiPage or None.
+        """
+        word = wikiPage.getWikiWord()
+        entry = self.entries.get((word, settings))
+        if entry is None:
+            return None
+
+        formatDetails, dependencies = entry
+        if not formatDetails.isEquivTo(wikiPage.getFormatDetails()) or \
+                not exporter.areDependenciesUpToDate(dependencies):
+            return None
+
+        return self.renderCache.getCachedPath(
+                self._makeKey(word, settings, dependencies), self.SUFFIX)
+
+
+    def _render(self, exporter, wikiPage, settings):
+        """
+        Render preview of wikiPage, store it in the cache if it can be
+        reused and return it as UTF-8 bytestring.
+        """
+        formatDetails = wikiPage.getFormatDetails()
+        html, dependencies = exporter.exportWikiPageToHtmlStringRecording(
+                wikiPage)
+        data = utf8Enc(html)[0]
+
+        if dependencies is None or not self.isEnabled():
+            return data
+
+        def writeFile(path):
+            with open(path, "wb") as f:
+                f.write(data)
+            return u""
+
+        word = wikiPage.getWikiWord()
+        self.renderCache.prefetch(self._makeKey(word, settings, dependencies),
+                self.SUFFIX, writeFile)
+        self.entries.put((word, settings), (formatDetails, dependencies))
+
+        return data
+
+
+    def getHtml(self, exporter, wikiPage):
+        """
+        Return HTML preview of wikiPage created by exporter as UTF-8
+        bytestring, either from the cache or rendered.
+        """
+        settings = exporter.getPreviewSettingsFingerprint()
+        if self.isEnabled():
+            path = self._getCachedPath(exporter, wikiPage, settings)
+            if path is not None:
+                try:
+                    with open(pathEnc(path), "rb") as f:
+                        return f.read()
+                except IOError:
+                    # Evicted in between?
+                    traceback.print_exc()
+
+        return self._render(exporter, wikiPage, settings)
+
+
+    def prerender(self, exporter, wikiPage):
+        """
+        Ensure that an up-to-date preview of wikiPage is cached. Does nothing
+        if the cache is disabled.
+        """
+        if not self.isEnabled():
+            return
+
+        settings = exporter.getPreviewSettingsFingerprint()
+        if self._getCachedPath(exporter, wikiPage, settings) is None:
+            self._render(exporter, wikiPage, settings)
+
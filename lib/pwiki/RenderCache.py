@@ -0,0 +1,328 @@
+"""
+Content-addressed cache for files created by external applications,
+e.g. images rendered by insertion handlers calling GraphViz or Gnuplot.
+"""
+
+from __future__ import with_statement
+
+import os, os.path, time, traceback, tempfile, threading, hashlib
+
+from . import OsAbstract
+from .StringOps import pathEnc, utf8Enc
+from .Utilities import LruCache
+
+
+class RenderCache(object):
+    """
+    Stores rendered files in a directory under a name built from a hash key
+    of everything which influences the result (handler, external
+    application, source and parameters). If the summed size of the files
+    exceeds maxSize, the least recently used files are deleted. A cache hit
+    refreshes the modification time of the file which therefore serves as
+    time of last use when the cache directory is read again in a later
+    session.
+
+    The methods are thread-safe, an external application is only run once
+    at a time for the same key.
+
+    Renderings by prefetch() which failed or gave an empty file can't be
+    stored. They are held in memory until the next provide() for the same
+    key so the external application isn't run a second time.
+    """
+
+    # Prefix of files which are currently rendered and not yet stored
+    # under their key
+    RENDER_PREFIX = "render_"
+
+    # Maximum number of failed prefetches held until provide() is called
+    MAX_FAILED_PREFETCHES = 100
+
+    def __init__(self, cacheDir, maxSize):
+        """
+        cacheDir -- directory to store files in, created on demand
+        maxSize -- maximum summed size of cached files in bytes. If 0, the
+                cache is disabled and everything is rendered directly.
+        """
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.lock = threading.RLock()
+        # Dictionary {key: lock} of keys currently looked up or rendered
+        self.keyLocks = {}
+        # LruCache {file name: size} of the files in the cache directory,
+        # None until the directory was read
+        self.files = None
+        # LruCache {(key, suffix): errResponse} of prefetches which stored
+        # nothing, errResponse is empty if the result was an empty file
+        self.failedPrefetches = LruCache(self.MAX_FAILED_PREFETCHES)
+
+
+    @staticmethod
+    def makeKey(*parts):
+        """
+        Return a hex digest built from parts. Parts may be unistrings,
+        bytestrings or other objects with a stable repr().
+        """
+        h = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, unicode):
+                part = utf8Enc(part)[0]
+            elif not isinstance(part, str):
+                part = repr(part)
+
+            # Length prefix, so e.g. ("ab", "c") and ("a", "bc") differ
+            h.update("%i:" % len(part))
+            h.update(part)
+
+        return h.hexdigest()
+
+
+    def isEnabled(self):
+        return self.maxSize > 0
+
+
+    def _getKeyLock(self, key):
+        with self.lock:
+            keyLock = self.keyLocks.get(key)
+            if keyLock is None:
+                keyLock = threading.Lock()
+                self.keyLocks[key] = keyLock
+
+            return keyLock
+
+    def _releaseKeyLock(self, key, keyLock):
+        with self.lock:
+            if self.keyLocks.get(key) is keyLock:
+                del self.keyLocks[key]
+
+
+    def getCachedPath(self, key, suffix):
+        """
+        Return full path of the file cached under key or None if not cached.
+        """
+        fileName = key + suffix
+        path = os.path.join(self.cacheDir, fileName)
+        try:
+            # Mark as recently used
+            os.utime(pathEnc(path), None)
+        except OSError:
+            with self.lock:
+                if self.files is not None:
+                    self.files.pop(fileName)
+            return None
+
+        with self.lock:
+            files = self._getFiles()
+            if files.get(fileName) is None:
+                # Stored by another process
+                try:
+                    size = os.path.getsize(pathEnc(path))
+                except OSError:
+                    return None
+                files.put(fileName, size, size)
+
+        return path
+
+
+    def _renderToCache(self, key, suffix, renderFct):
+        """
+        Call renderFct(renderPath) to create the file and store it under key.
+        renderFct must return an error response which is empty if no error
+        occurred. Erroneous and empty results are not cached.
+
+        Returns tuple (path, errResponse, isFinal) where path is None if
+        nothing was stored. isFinal is True if the result is known without
+        rendering again, i.e. if path is not None, errResponse is not empty
+        or the result was an empty file. It is False if the cache directory
+        is not usable or the file is too large for the cache.
+        """
+        try:
+            if not os.path.exists(pathEnc(self.cacheDir)):
+                os.makedirs(pathEnc(self.cacheDir))
+
+            fd, renderPath = tempfile.mkstemp(pathEnc(suffix),
+                    self.RENDER_PREFIX, pathEnc(self.cacheDir))
+            os.close(fd)
+        except (IOError, OSError):
+            traceback.print_exc()
+            return None, "", False
+
+        try:
+            errResponse = renderFct(renderPath)
+            if errResponse:
+                return None, errResponse, True
+
+            try:
+                if os.path.getsize(renderPath) == 0:
+                    return None, "", True
+            except OSError:
+                traceback.print_exc()
+                return None, "", False
+
+            path = self._store(key, suffix, renderPath)
+            return path, "", path is not None
+        finally:
+            if os.path.exists(renderPath):
+                try:
+                    os.remove(renderPath)
+                except OSError:
+                    traceback.print_exc()
+
+
+    def _store(self, key, suffix, renderPath):
+        """
+        Move non-empty file renderPath into the cache under key and return
+        the new path or None if the file can't be moved.
+        """
+        fileName = key + suffix
+        path = os.path.join(self.cacheDir, fileName)
+        try:
+            size = os.path.getsize(renderPath)
+
+            with self.lock:
+                files = self._getFiles()
+                if os.path.exists(pathEnc(path)):
+                    # Windows can't rename onto an existing file
+                    files.pop(fileName)
+                    os.remove(pathEnc(path))
+
+                os.rename(renderPath, pathEnc(path))
+
+                if not files.put(fileName, size, size):
+                    # Larger than the whole cache
+                    os.remove(pathEnc(path))
+                    return None
+        except (IOError, OSError):
+            traceback.print_exc()
+            return None
+
+        return path
+
+
+    def _getFiles(self):
+        """
+        Return the LruCache of cached files, read the cache directory
+        if necessary. Must be called with self.lock held.
+        """
+        if self.files is not None:
+            return self.files
+
+        entries = []
+        staleTime = time.time() - 3600
+        try:
+            fileNames = os.listdir(pathEnc(self.cacheDir))
+        except OSError:
+            fileNames = []
+
+        for fn in fileNames:
+            path = os.path.join(pathEnc(self.cacheDir), fn)
+            try:
+                st = os.stat(path)
+                if fn.startswith(self.RENDER_PREFIX):
+                    # Leftover of an interrupted rendering?
+                    if st.st_mtime < staleTime:
+                        os.remove(path)
+                    continue
+            except OSError:
+                continue
+
+            entries.append((st.st_mtime, fn, st.st_size))
+
+        # Oldest first, so they are evicted first
+        entries.sort()
+        self.files = LruCache(self.maxSize, self._deleteFile)
+        for mtime, fn, size in entries:
+            self.files.put(fn, size, size)
+
+        return self.files
+
+
+    def _deleteFile(self, fileName, size):
+        """
+        Called by the LruCache for files evicted from the cache
+        """
+        try:
+            os.remove(os.path.join(pathEnc(self.cacheDir), fileName))
+        except OSError:
+            traceback.print_exc()
+
+
+    def prefetch(self, key, suffix, renderFct):
+        """
+        Ensure that the file for key is cached, calling renderFct (see
+        _renderToCache()) if it isn't. Does nothing if cache is disabled
+        or key is None.
+        """
+        if key is None or not self.isEnabled():
+            return
+
+        keyLock = self._getKeyLock(key)
+        try:
+            with keyLock:
+                if (key, suffix) in self.failedPrefetches or \
+                        self.getCachedPath(key, suffix) is not None:
+                    return
+
+                path, errResponse, isFinal = self._renderToCache(key,
+                        suffix, renderFct)
+                if path is None and isFinal:
+                    # Hand over result to provide()
+                    self.failedPrefetches.put((key, suffix), errResponse)
+        finally:
+            self._releaseKeyLock(key, keyLock)
+
+
+    def provide(self, key, dstPath, renderFct):
+        """
+        Create the file for key at dstPath, either by copying it from the
+        cache or by calling renderFct (see _renderToCache()). The suffix
+        of dstPath is part of the cached file name. If key is None,
+        the cache is bypassed.
+
+        Returns the error response of renderFct or an empty string.
+        """
+        if key is None or not self.isEnabled():
+            return renderFct(dstPath)
+
+        suffix = os.path.splitext(dstPath)[1]
+
+        keyLock = self._getKeyLock(key)
+        try:
+            with keyLock:
+                errResponse = self.failedPrefetches.pop((key, suffix))
+                if errResponse is not None:
+                    isFinal = True
+                    path = None
+                else:
+                    path = self.getCachedPath(key, suffix)
+                    isFinal = path is not None
+                    if path is None:
+                        path, errResponse, isFinal = self._renderToCache(key,
+                                suffix, renderFct)
+
+                if errResponse:
+                    return errResponse
+        finally:
+            self._releaseKeyLock(key, keyLock)
+
+        if path is None and isFinal:
+            # Result is an empty file
+            try:
+                open(pathEnc(dstPath), "wb").close()
+            except (IOError, OSError):
+                traceback.print_exc()
+                return renderFct(dstPath)
+
+            return ""
+
+        if path is None:
+            # Cache not usable or result too large for it
+            return renderFct(dstPath)
+
+        try:
+            OsAbstract.copyFile(pathEnc(path), pathEnc(dstPath))
+        except (IOError, OSError):
+            # Evicted in between or copying failed otherwise
+            traceback.print_exc()
+            return renderFct(dstPath)
+
+        return ""
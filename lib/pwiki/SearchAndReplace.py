@@ -1,8 +1,7 @@
-import re, traceback
-
-import wx
+import re, sre_parse, sre_constants, traceback
 
 from WikiExceptions import *
+from .AppAccess import getApp
 
 from Serialization import SerializeStream, findXmlElementFlat, \
         iterXmlElementFlat, serToXmlUnicode, serFromXmlUnicode, \
@@ -60,6 +59,19 @@ class AbstractSearchNode:
         Should return True in case of doubt.
         """
         return True
+
+    def getRequiredLiterals(self):
+        """
+        Returns a description of literal strings the text must contain
+        so that testWikiPage() can return True, or None if nothing is known.
+        It allows storage backends to skip pages before decoding their content.
+
+        The description is a tuple, either ("literal", unistr, ignoreCase)
+        or ("and", desc, desc) or ("or", desc, desc). If ignoreCase is
+        True, the literal is compared as by a regex with IGNORECASE and
+        UNICODE flags.
+        """
+        return None
         
 
 #     def testText(self, text):
@@ -619,6 +631,10 @@ class AbstractAndOrSearchNode(AbstractContentSearchNode):
     def isTextNeededForTest(self):
         return self.left.isTextNeededForTest() or self.right.isTextNeededForTest()
 
+    def getRequiredLiterals(self):
+        # Unknown connection of the children, so nothing is known
+        return None
+
     def searchDocPageAndText(self, docPage, text, searchCharStartPos=0,
             cycleToStart=False):
         """
@@ -767,6 +783,17 @@ class AndSearchNode(AbstractAndOrSearchNode):
             
         return Unknown
 
+    def getRequiredLiterals(self):
+        left = self.left.getRequiredLiterals()
+        right = self.right.getRequiredLiterals()
+        
+        if left is None:
+            return right
+        if right is None:
+            return left
+
+        return ("and", left, right)
+
 
 class OrSearchNode(AbstractAndOrSearchNode):
     """
@@ -790,6 +817,50 @@ class OrSearchNode(AbstractAndOrSearchNode):
 
         return Unknown
 
+    def getRequiredLiterals(self):
+        left = self.left.getRequiredLiterals()
+        right = self.right.getRequiredLiterals()
+        
+        if left is None or right is None:
+            return None
+
+        return ("or", left, right)
+
+
+
+def _getRegexRequiredLiteral(rePattern):
+    """
+    Returns the longest run of literal characters on top level of the
+    compiled regex rePattern as description for getRequiredLiterals()
+    or None.
+    """
+    if rePattern.flags & re.LOCALE:
+        return None
+
+    try:
+        parsed = sre_parse.parse(rePattern.pattern, rePattern.flags)
+    except (sre_constants.error, OverflowError, RuntimeError):
+        return None
+
+    ignoreCase = bool(parsed.pattern.flags & re.IGNORECASE)
+
+    best = u""
+    run = []
+    for op, av in list(parsed) + [(None, None)]:
+        if op == sre_constants.LITERAL and av not in (10, 13):
+            # Line ends are not taken as they are stored differently in files
+            run.append(unichr(av))
+            continue
+
+        if len(run) > len(best):
+            best = u"".join(run)
+        run = []
+
+    if not best:
+        return None
+
+    return ("literal", best, ignoreCase)
+
 
 
 class RegexTextNode(AbstractContentSearchNode):
@@ -825,6 +896,9 @@ class RegexTextNode(AbstractContentSearchNode):
     def testWikiPage(self, word, text):
         return bool(self.rePattern.search(text))
 
+    def getRequiredLiterals(self):
+        return _getRegexRequiredLiteral(self.rePattern)
+
 #     def testText(self, text):
 #         return bool(self.rePattern.search(text))
 
@@ -878,6 +952,12 @@ class SimpleStrNode(AbstractContentSearchNode):
     def testWikiPage(self, word, text):
         return text.find(self.subStr) != -1
 
+    def getRequiredLiterals(self):
+        if not self.subStr:
+            return None
+
+        return ("literal", self.subStr, False)
+
 
 #     def testText(self, text):
 #         return text.find(self.subStr) != -1
@@ -1935,6 +2015,18 @@ class SearchReplaceOperation:
                 self.searchOpTree.isTextNeededForTest()
 
 
+    def getRequiredLiterals(self):
+        """
+        Returns description of literals the text of a page must contain
+        to fulfill the search criteria or None, see
+        AbstractSearchNode.getRequiredLiterals().
+        """
+        if self.searchOpTree is None:
+            self.rebuildSearchOpTree()
+
+        return self.searchOpTree.getRequiredLiterals()
+
+
     def testWikiPageByDocPage(self, docPage):
         return self.testWikiPage(docPage.getWikiWord(), docPage.getLiveText())
 
@@ -1986,7 +2078,7 @@ def stripSearchString(searchStr):
     Strip leading and trailing spaces from a search string if appropriate
     option is set.
     """
-    if wx.GetApp().getGlobalConfig().getboolean("main", "search_stripSpaces",
+    if getApp().getGlobalConfig().getboolean("main", "search_stripSpaces",
             True):
         return searchStr.strip(u" ")
     else:
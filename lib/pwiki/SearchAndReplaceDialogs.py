@@ -8,7 +8,7 @@ import wx, wx.html, wx.xrc
 from rtlibRepl import minidom
 
 import Consts
-from .MiscEvent import MiscEventSourceMixin, KeyFunctionSink
+from .MiscEvent import MiscEventSourceMixin, KeyFunctionSink, batchScope
 from WikiExceptions import *
 from .Utilities import DUMBTHREADSTOP, callInMainThread, callInMainThreadAsync, \
         ThreadHolder, FunctionThreadStop
@@ -1617,40 +1617,41 @@ class SearchWikiDialog(wx.Dialog, MiscEventSourceMixin):
             
             replaceCount = 0
     
-            for i in xrange(self.ctrls.htmllbPages.GetCount()):
-                self.ctrls.htmllbPages.SetSelection(i)
-                wikiWord = guiToUni(self.ctrls.htmllbPages.GetSelectedWord())
-                wikiPage = wikiDocument.getWikiPageNoError(wikiWord)
-                text = wikiPage.getLiveTextNoTemplate()
-                if text is None:
-                    continue
+            with batchScope():
+                for i in xrange(self.ctrls.htmllbPages.GetCount()):
+                    self.ctrls.htmllbPages.SetSelection(i)
+                    wikiWord = guiToUni(self.ctrls.htmllbPages.GetSelectedWord())
+                    wikiPage = wikiDocument.getWikiPageNoError(wikiWord)
+                    text = wikiPage.getLiveTextNoTemplate()
+                    if text is None:
+                        continue
     
-                charStartPos = 0
+                    charStartPos = 0
     
-                sarOp.beginWikiSearch(self.mainControl.getWikiDocument())
-                try:
-                    while True:
-                        try:
-                            found = sarOp.searchDocPageAndText(wikiPage, text,
-                                    charStartPos)
-                            start, end = found[:2]
-                        except:
-                            # Regex error -> Stop searching
-                            return
+                    sarOp.beginWikiSearch(self.mainControl.getWikiDocument())
+                    try:
+                        while True:
+                            try:
+                                found = sarOp.searchDocPageAndText(wikiPage, text,
+                                        charStartPos)
+                                start, end = found[:2]
+                            except:
+                                # Regex error -> Stop searching
+                                return
                             
-                        if start is None: break
+                            if start is None: break
                         
-                        repl = sarOp.replace(text, found)
-                        text = text[:start] + repl + text[end:]  # TODO Faster?
-                        charStartPos = start + len(repl)
-                        replaceCount += 1
-                        if start == end:
-                            # Otherwise replacing would go infinitely
-                            break
-                finally:
-                    sarOp.endWikiSearch()
-
-                wikiPage.replaceLiveText(text)
+                            repl = sarOp.replace(text, found)
+                            text = text[:start] + repl + text[end:]  # TODO Faster?
+                            charStartPos = start + len(repl)
+                            replaceCount += 1
+                            if start == end:
+                                # Otherwise replacing would go infinitely
+                                break
+                    finally:
+                        sarOp.endWikiSearch()
+
+                    wikiPage.replaceLiveText(text)
                     
             self._refreshPageList()
             
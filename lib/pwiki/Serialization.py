@@ -107,6 +107,19 @@ class SerializeStream:
             return val
 
 
+    def serFloat64(self, val):
+        """
+        Serialize 64bit float val (IEEE 754 double precision). This means:
+        if stream is in read mode, val is ignored and the float read from
+        stream is returned, if in write mode, val is written and returned
+        """
+        if self.isReadMode():
+            return unpack(">d", self.readBytes(8))[0]
+        else:
+            self.writeBytes(pack(">d", val))
+            return val
+
+
     def serString(self, s):
         """
         Serialize string s, including length. This means: if stream is in read
@@ -1,4 +1,7 @@
-import traceback
+from __future__ import with_statement
+
+import traceback, threading
+from collections import OrderedDict
 
 import wx, wx.xrc
 
@@ -7,12 +10,14 @@ from WikiExceptions import *
 # from wxHelper import *
 
 from . import MiscEvent
+from .AppAccess import getApp
 
 from .Utilities import DUMBTHREADSTOP
 
 from .wxHelper import GUI_ID, XrcControls, autosizeColumn, wxKeyFunctionSink
 
 from .WikiPyparsing import buildSyntaxNode
+from .StringOps import findChangedRegion
 
 
 try:
@@ -155,7 +160,7 @@ class SpellCheckerDialog(wx.Dialog):
 
         checkedWikiWord = firstCheckedWikiWord
 
-        langHelper = wx.GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 self.session.getCurrentDocPage().getWikiLanguageName())
 
         text = activeEditor.GetText()
@@ -334,6 +339,45 @@ class SpellCheckerDialog(wx.Dialog):
 
 
 
+class SpellVerdictCache(object):
+    """
+    Bounded cache of the verdicts of enchant dictionaries, keyed by tuple
+    (dictionary language, word). If full, the least recently used verdict
+    is dropped. One instance is shared by all spell checker sessions of
+    a wiki.
+
+    Only the dictionaries are asked, the personal word lists and the
+    ignore list of the session are checked before, so changes to them
+    don't invalidate the cache.
+    """
+    def __init__(self, maxSize=50000):
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        # OrderedDict {(language, word): verdict}, most recently used last
+        self.verdicts = OrderedDict()
+
+    def get(self, language, word):
+        """
+        Return cached verdict (True or False) or None if not cached
+        """
+        key = (language, word)
+        with self.lock:
+            verdict = self.verdicts.pop(key, None)
+            if verdict is not None:
+                self.verdicts[key] = verdict
+
+            return verdict
+
+    def put(self, language, word, verdict):
+        key = (language, word)
+        with self.lock:
+            self.verdicts.pop(key, None)
+            self.verdicts[key] = verdict
+            if len(self.verdicts) > self.maxSize:
+                self.verdicts.popitem(last=False)
+
+
+
 class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
     def __init__(self, wikiDocument):
         MiscEvent.MiscEventSourceMixin.__init__(self)
@@ -343,6 +387,7 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
 
         self.enchantDict = None
         self.dictLanguage = None
+        self.verdictCache = wikiDocument.getSpellVerdictCache()
         
         # For current session
         self.autoReplaceWords = {}
@@ -362,7 +407,7 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
         self.__sinkApp = wxKeyFunctionSink((
                 ("reread personal word list needed",
                     self.onRereadPersonalWordlistNeeded),
-        ), wx.GetApp().getMiscEvent())
+        ), getApp().getMiscEvent())
 
 
 
@@ -383,6 +428,7 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
         self.spellChkAddedLocal = None
         self.localPwlPage = None
         self.wikiDocument = None
+        self.verdictCache = None
         self.__sinkWikiDocument.disconnect()
         self.__sinkApp.disconnect()
 
@@ -492,11 +538,20 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
 
 
     def checkWord(self, spWord):
-        return spWord in self.spellChkIgnore or \
+        if spWord in self.spellChkIgnore or \
                 spWord in self.spellChkAddedGlobal or \
-                spWord in self.spellChkAddedLocal or \
-                (self.enchantDict is not None and \
-                self.enchantDict.check(spWord))
+                spWord in self.spellChkAddedLocal:
+            return True
+
+        if self.enchantDict is None:
+            return False
+
+        verdict = self.verdictCache.get(self.dictLanguage, spWord)
+        if verdict is None:
+            verdict = bool(self.enchantDict.check(spWord))
+            self.verdictCache.put(self.dictLanguage, spWord, verdict)
+
+        return verdict
 
     def suggest(self, spWord):
         if self.enchantDict is None:
@@ -553,7 +608,17 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
         self.localPwlPage.replaceLiveText(u"\n".join(words))
 
 
-    def buildUnknownWordList(self, text, threadstop=DUMBTHREADSTOP):
+    def buildUnknownWordList(self, text, threadstop=DUMBTHREADSTOP,
+            baseText=None, baseUnknownWords=None):
+        """
+        Return NonTerminalNode "unknownSpellList" with a TerminalNode
+        "unknownSpelling" for each unknown word in text.
+
+        If baseUnknownWords, the result for baseText with the same
+        dictionary, is given, only the lines of text differing from
+        baseText are checked again. This relies on words for spell checking
+        never spanning a line break.
+        """
         if not self.hasEnchantDict():
             return buildSyntaxNode([], -1, "unknownSpellList")
         
@@ -562,23 +627,58 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
         if docPage is None:
             return buildSyntaxNode([], -1, "unknownSpellList")
         
-        result = []
-
-        langHelper = wx.GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 docPage.getWikiLanguageName())
 
-        startPos = 0
+        if baseText is None or baseUnknownWords is None:
+            return buildSyntaxNode(self._findUnknownWords(langHelper, docPage,
+                    text, 0, len(text), threadstop), -1, "unknownSpellList")
+
+        start, baseEnd, end = findChangedRegion(baseText, text)
+
+        # Extend changed region to whole lines
+        start = text.rfind(u"\n", 0, start) + 1
+        lineEnd = text.find(u"\n", end)
+        if lineEnd == -1:
+            lineEnd = len(text)
+        baseEnd += lineEnd - end
+        end = lineEnd
+
+        baseNodes = baseUnknownWords.getChildren()
+        result = [node for node in baseNodes if node.pos < start]
+        result += self._findUnknownWords(langHelper, docPage, text, start, end,
+                threadstop)
+
+        delta = end - baseEnd
+        for node in baseNodes:
+            if node.pos < baseEnd:
+                continue
+            if delta != 0:
+                # Nodes may be in use, so don't modify them
+                node = buildSyntaxNode(node.getText(), node.pos + delta,
+                        "unknownSpelling")
+            result.append(node)
+
+        return buildSyntaxNode(result, -1, "unknownSpellList")
+
+
+    def _findUnknownWords(self, langHelper, docPage, text, startPos, endPos,
+            threadstop):
+        """
+        Return list of TerminalNodes "unknownSpelling" of the unknown words
+        in text starting in range startPos to endPos.
+        """
+        result = []
 
         while True:
             threadstop.testValidThread()
 
             start, end, spWord = langHelper.findNextWordForSpellcheck(text,
                     startPos, docPage)
-            
 
-            if start is None:
-                # End of page reached
-                return buildSyntaxNode(result, -1, "unknownSpellList")
+            if start is None or start >= endPos:
+                # End of range reached
+                return result
 
             startPos = end
 
@@ -591,7 +691,7 @@ class SpellCheckerSession(MiscEvent.MiscEventSourceMixin):
             # It is added as a WikiPyparsing.TerminalNode
             
             result.append(buildSyntaxNode(spWord, start, "unknownSpelling"))
-            
+
 
 
 def isSpellCheckSupported():
@@ -16,8 +16,6 @@ import urllib, urlparse, cgi
 
 from codecs import BOM_UTF8, BOM_UTF16_BE, BOM_UTF16_LE
 
-import wx
-
 import re as _re # import pwiki.srePersistent as reimport pwiki.srePersistent as _re
 from WikiExceptions import *
 
@@ -921,6 +919,9 @@ def strftimeUB(frmStr, timet=None):
     also unescapes some backslash codes, supports unicode and shows local time
     if timet is GMT.
     """
+    # Imported here so the module also works without wxPython (see BatchCmd)
+    import wx
+
     if timet is None:
         return formatWxDate(frmStr, wx.DateTime_Now())
 
@@ -1885,16 +1886,236 @@ def applyBinCompact(a, bops):
     return applyCompact(a, binCompactToCompact(bops))
 
 
-def getBinCompactForDiff(a, b):
+def getCompactForDiffDifflib(a, b):
+    """
+    Return compact ops to change string a to b. Runs difflib.SequenceMatcher
+    over the whole strings which becomes very slow for large ones.
+    """
+    sm = difflib.SequenceMatcher(None, a, b)
+    return difflibToCompact(sm.get_opcodes(), b)
+
+
+# Lines occurring more often than this in a region are not used as anchors
+_HISTOGRAM_MAX_OCCURRENCES = 64
+
+# Changed regions up to this summed size in bytes are refined by a byte-level
+# diff, larger ones become a single replace operation
+_BYTE_REFINE_MAX_SIZE = 8192
+
+
+def _histogramFindAnchor(a, alo, ahi, b, blo, bhi):
+    """
+    Find a block of equal lines in a[alo:ahi] and b[blo:bhi] around the
+    line which occurs least often in the a-region (the longest block
+    among those). Returns tuple (i, j, length) or None if there is no
+    common line occurring not too often.
+    """
+    positions = {}
+    for i in xrange(alo, ahi):
+        positions.setdefault(a[i], []).append(i)
+
+    best = None
+    bestCount = _HISTOGRAM_MAX_OCCURRENCES + 1
+    bestLen = 0
+
+    j = blo
+    while j < bhi:
+        pos = positions.get(b[j])
+        if pos is None or len(pos) > bestCount:
+            j += 1
+            continue
+
+        nextJ = j + 1
+        for i in pos:
+            si, sj = i, j
+            while si > alo and sj > blo and a[si - 1] == b[sj - 1]:
+                si -= 1
+                sj -= 1
+
+            ei, ej = i + 1, j + 1
+            while ei < ahi and ej < bhi and a[ei] == b[ej]:
+                ei += 1
+                ej += 1
+
+            if len(pos) < bestCount or ei - si > bestLen:
+                best = (si, sj, ei - si)
+                bestCount = len(pos)
+                bestLen = ei - si
+
+            if ej > nextJ:
+                nextJ = ej
+
+        j = nextJ
+
+    return best
+
+
+def _histogramMatchingBlocks(a, b):
+    """
+    Return sorted list of tuples (i, j, length) of matching blocks of
+    the sequences a and b (of hashable items) like
+    difflib.SequenceMatcher.get_matching_blocks() but without the
+    terminating dummy block.
+    """
+    result = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+
+        # Common prefix and suffix
+        pre = 0
+        while alo + pre < ahi and blo + pre < bhi and \
+                a[alo + pre] == b[blo + pre]:
+            pre += 1
+        if pre:
+            result.append((alo, blo, pre))
+            alo += pre
+            blo += pre
+
+        suf = 0
+        while ahi - suf > alo and bhi - suf > blo and \
+                a[ahi - suf - 1] == b[bhi - suf - 1]:
+            suf += 1
+        if suf:
+            result.append((ahi - suf, bhi - suf, suf))
+            ahi -= suf
+            bhi -= suf
+
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchor = _histogramFindAnchor(a, alo, ahi, b, blo, bhi)
+        if anchor is None:
+            continue
+
+        i, j, length = anchor
+        result.append(anchor)
+        stack.append((alo, i, blo, j))
+        stack.append((i + length, ahi, j + length, bhi))
+
+    result.sort()
+    return result
+
+
+def _refineChangedRegion(a, a1, a2, b, b1, b2, result):
+    """
+    Append compact ops to change a[a1:a2] to b[b1:b2] to result.
+    """
+    # Common byte prefix and suffix (e.g. changes inside a long line)
+    while a1 < a2 and b1 < b2 and a[a1] == b[b1]:
+        a1 += 1
+        b1 += 1
+    while a2 > a1 and b2 > b1 and a[a2 - 1] == b[b2 - 1]:
+        a2 -= 1
+        b2 -= 1
+
+    if a1 == a2:
+        if b1 < b2:
+            result.append((2, a1, b[b1:b2]))
+        return
+    if b1 == b2:
+        result.append((1, a1, a2))
+        return
+
+    if (a2 - a1) + (b2 - b1) > _BYTE_REFINE_MAX_SIZE:
+        result.append((0, a1, a2, b[b1:b2]))
+        return
+
+    bPart = b[b1:b2]
+    sm = difflib.SequenceMatcher(None, a[a1:a2], bPart, autojunk=False)
+    for op in difflibToCompact(sm.get_opcodes(), bPart):
+        if op[0] == 0:
+            result.append((0, op[1] + a1, op[2] + a1, op[3]))
+        elif op[0] == 1:
+            result.append((1, op[1] + a1, op[2] + a1))
+        else:
+            result.append((2, op[1] + a1, op[2]))
+
+
+def findChangedRegion(a, b):
+    """
+    Return tuple (start, aEnd, bEnd) so that a[:start] == b[:start] and
+    a[aEnd:] == b[bEnd:] with longest possible common prefix and (not
+    overlapping) suffix, so a[start:aEnd] was replaced by b[start:bEnd].
+    Slices are compared in a binary search which is fast for long strings.
+    """
+    maxLen = min(len(a), len(b))
+
+    lo, hi = 0, maxLen
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    start = lo
+
+    lo, hi = 0, maxLen - start
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return start, len(a) - lo, len(b) - lo
+
+
+def getCompactForDiffLines(a, b):
+    """
+    Return compact ops to change string a to b. Lines are matched by a
+    histogram diff first, changed regions are then refined byte by byte.
+    Time is roughly linear in the size of a and b for typical page edits.
+    """
+    if a == b:
+        return []
+
+    aLines = a.splitlines(True)
+    bLines = b.splitlines(True)
+
+    # Intern lines as integers so comparisons and hashing are cheap
+    lineIds = {}
+    aIds = [lineIds.setdefault(l, len(lineIds)) for l in aLines]
+    bIds = [lineIds.setdefault(l, len(lineIds)) for l in bLines]
+
+    # Byte offsets of line starts
+    aOffsets = [0]
+    for l in aLines:
+        aOffsets.append(aOffsets[-1] + len(l))
+    bOffsets = [0]
+    for l in bLines:
+        bOffsets.append(bOffsets[-1] + len(l))
+
+    result = []
+    ai = bj = 0
+    for i, j, length in _histogramMatchingBlocks(aIds, bIds) + \
+            [(len(aIds), len(bIds), 0)]:
+        if ai < i or bj < j:
+            _refineChangedRegion(a, aOffsets[ai], aOffsets[i],
+                    b, bOffsets[bj], bOffsets[j], result)
+        ai = i + length
+        bj = j + length
+
+    return result
+
+
+# Available engines to create compact diff ops, all must fulfill
+# applyCompact(a, engine(a, b)) == b
+COMPACT_DIFF_ENGINES = {
+        "difflib": getCompactForDiffDifflib,
+        "lines": getCompactForDiffLines
+    }
+
+
+def getBinCompactForDiff(a, b, engine="lines"):
     """
     Return the binary compact codes to change binary string a to b.
     For strings a and b (NOT unicode) it is always true that
         applyBinCompact(a, getBinCompactForDiff(a, b)) == b
-    """
 
-    sm = difflib.SequenceMatcher(None, a, b)
-    ops = sm.get_opcodes()
-    return compactToBinCompact(difflibToCompact(ops, b))
+    engine -- name of the diff engine in COMPACT_DIFF_ENGINES
+    """
+    return compactToBinCompact(COMPACT_DIFF_ENGINES[engine](a, b))
 
 
 # ---------- Unicode constants ----------
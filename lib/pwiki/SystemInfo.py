@@ -1,33 +1,31 @@
-import os, traceback
+import os, sys, traceback
 
-import wx
-
-
-# Bug workaround: In wxPython 2.6 these constants weren't defined
-#    in 2.8 they are defined under a different name and with different values
-
-try:
-    wxWINDOWS_NT = wx.OS_WINDOWS_NT
-except AttributeError:
-    wxWINDOWS_NT = 18   # For wx.GetOsVersion()
-    
-try:
-    wxWIN95 = wx.OS_WINDOWS_9X
-except AttributeError:
-    wxWIN95 = 20   # For wx.GetOsVersion(), this includes also Win 98 and ME
+# wx is imported inside the functions so that the module also works without
+# wxPython, e.g. for the batch command line (see BatchCmd)
 
 
 # Placed here to avoid circular dependency with StringOps
 def isUnicode():
     """
-    Return if GUI is in unicode mode
+    Return if GUI is in unicode mode. Without wxPython there is no GUI
+    to convert strings for, this counts as unicode mode.
     """
+    try:
+        import wx
+    except ImportError:
+        return True
+
     return wx.PlatformInfo[2] == "unicode"
 
 def isOSX():
     """
     Return if running on Mac OSX
     """
+    try:
+        import wx
+    except ImportError:
+        return sys.platform == "darwin"
+
     return '__WXMAC__' in wx.PlatformInfo
     
 def isLinux():
@@ -40,8 +38,38 @@ def isLinux():
         return False
 
 
-_ISWIN9x = wx.GetOsVersion()[0] == wxWIN95
-_ISWINNT = wx.GetOsVersion()[0] == wxWINDOWS_NT
+def _getWindowsFlags():
+    """
+    Return tuple (isWin9x, isWinNT)
+    """
+    try:
+        import wx
+    except ImportError:
+        try:
+            # Platform 1 is Windows 95/98/ME, 2 is Windows NT and later
+            platform = sys.getwindowsversion()[3]
+        except AttributeError:
+            return (False, False)
+
+        return (platform == 1, platform == 2)
+
+    # Bug workaround: In wxPython 2.6 these constants weren't defined
+    #    in 2.8 they are defined under a different name and with different values
+    try:
+        wxWINDOWS_NT = wx.OS_WINDOWS_NT
+    except AttributeError:
+        wxWINDOWS_NT = 18   # For wx.GetOsVersion()
+
+    try:
+        wxWIN95 = wx.OS_WINDOWS_9X
+    except AttributeError:
+        wxWIN95 = 20   # For wx.GetOsVersion(), this includes also Win 98 and ME
+
+    osId = wx.GetOsVersion()[0]
+    return (osId == wxWIN95, osId == wxWINDOWS_NT)
+
+
+_ISWIN9x, _ISWINNT = _getWindowsFlags()
 
 def isWin9x():
     """
@@ -7,6 +7,7 @@ from codecs import BOM_UTF8    # , BOM_UTF16_BE, BOM_UTF16_LE
 import wx
 
 from StringOps import urlFromPathname, relativeFilePath, escapeHtml, pathEnc
+from .AppAccess import getApp
 
 
 class TempFileSet:
@@ -54,6 +55,13 @@ class TempFileSet:
         self.fileSet.add(fullPath)
 
 
+    def getFileSet(self):
+        """
+        Return a copy of the set of stored paths
+        """
+        return set(self.fileSet)
+
+
     def mkstemp(self, suffix=None, prefix=None, path=None, text=False):
         """
         Same as tempfile.mkstemp from standard library, but
@@ -318,12 +326,12 @@ def getDefaultTempFilePath():
     Return default temp directory depending on global configuration settings.
     May return None for system default temp dir.
     """
-    globalConfig = wx.GetApp().getGlobalConfig()
+    globalConfig = getApp().getGlobalConfig()
     tempMode = globalConfig.get("main", "tempHandling_tempMode",
             u"system")
 
     if tempMode == u"auto":
-        if wx.GetApp().isInPortableMode():
+        if getApp().isInPortableMode():
             tempMode = u"config"
         else:
             tempMode = u"system"
@@ -331,7 +339,7 @@ def getDefaultTempFilePath():
     if tempMode == u"given":
         return globalConfig.get("main", "tempHandling_tempDir", u"")
     elif tempMode == u"config":
-        return wx.GetApp().getGlobalConfigSubDir()
+        return getApp().getGlobalConfigSubDir()
     else:   # tempMode == u"system"
         return None
 
@@ -4,13 +4,13 @@ import threading, traceback, collections, heapq
 from thread import allocate_lock as _allocate_lock
 from time import time as _time, sleep as _sleep
 
-import wx
-
 from Consts import DEADBLOCKTIMEOUT
 from .WikiExceptions import NotCurrentThreadException, \
         DeadBlockPreventionTimeOutError, InternalError
 
 from . import MiscEvent
+from . import Instrumentation
+from .AppAccess import getApp
 
 
 class Dummy(object):
@@ -295,7 +295,8 @@ class SingleThreadExecutor(BasicThreadStop, MiscEvent.MiscEventSourceMixin):
                     kwargs["threadstop"] = self
 
             try:
-                retObj.setResult(fct(*args, **kwargs))
+                with Instrumentation.span("executor.job", fct):
+                    retObj.setResult(fct(*args, **kwargs))
                 self.incDoneJobCount()
 
             except Exception, e:
@@ -386,24 +387,27 @@ class SingleThreadExecutor(BasicThreadStop, MiscEvent.MiscEventSourceMixin):
 
         If the queues are empty, executor stops in each case.
         """
-        if self.thread is None or not self.thread.isAlive():
+        # Local copy as another thread may end the executor concurrently
+        thread = self.thread
+        if thread is None or not thread.isAlive():
             return
 
         with self.dequeCondition:
             if hardEnd:
                 self.deques = None
-            else:
+            elif self.deques is not None:
                 self.deques[-1].appendleft(
                         (SingleThreadExecutor.ENDOBJECT, None, None, None, None,
                         False))
             self.dequeCondition.notify()
 
-        self.thread.join(120)  # TODO: Replace by constant
+        thread.join(120)  # TODO: Replace by constant
 
-        if self.thread.isAlive():
+        if thread.isAlive():
             raise DeadBlockPreventionTimeOutError()
 
-        self.thread = None
+        if self.thread is thread:
+            self.thread = None
 
 
     def pause(self, wait=False):
@@ -436,7 +440,10 @@ class SingleThreadExecutor(BasicThreadStop, MiscEvent.MiscEventSourceMixin):
 
 
 def callInMainThread(fct, *args, **kwargs):
-    if wx.Thread_IsMain() or not wx.GetApp().IsMainLoopRunning():
+    # Imported here so the module also works without wxPython (see BatchCmd)
+    import wx
+
+    if wx.Thread_IsMain() or not getApp().IsMainLoopRunning():
         return fct(*args, **kwargs)
     
     returnOb = ExecutionResult()
@@ -467,7 +474,9 @@ def callInMainThread(fct, *args, **kwargs):
 
 
 def callInMainThreadAsync(fct, *args, **kwargs):
-    if wx.Thread_IsMain() or not wx.GetApp().IsMainLoopRunning():
+    import wx
+
+    if wx.Thread_IsMain() or not getApp().IsMainLoopRunning():
         return fct(*args, **kwargs)
     def _mainRun(*args, **kwargs):
         try:
@@ -712,6 +721,127 @@ class DictFromFields(object):
 
 
 
+class LruCache(object):
+    """
+    Mapping which holds the most recently used values, bounded by the
+    summed size of the values (by default each value has size 1, so the
+    number of values is bounded). If maxSize is exceeded, least recently
+    used entries are removed until EVICT_LOW_WATER * maxSize is reached
+    so eviction does not happen on each put. The entry put last is never
+    removed this way.
+
+    The methods are thread-safe.
+    """
+
+    EVICT_LOW_WATER = 0.75
+
+    def __init__(self, maxSize, onEvict=None):
+        """
+        maxSize -- maximum summed size of the values. If 0, nothing is
+                stored.
+        onEvict -- function onEvict(key, value) called for each entry
+                removed to make room or None. It is called with the lock
+                of the cache held.
+        """
+        self.maxSize = maxSize
+        self.onEvict = onEvict
+        self.lock = threading.RLock()
+        # OrderedDict {key: (value, size)}, most recently used last
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+
+    def isEnabled(self):
+        return self.maxSize > 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def getSize(self):
+        return self.size
+
+
+    def get(self, key, default=None):
+        """
+        Return value of key and mark it as most recently used or return
+        default if key is not in cache.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return default
+
+            self.entries[key] = entry
+            return entry[0]
+
+
+    def put(self, key, value, size=1):
+        """
+        Store value under key as most recently used entry. Returns False if
+        value is larger than the whole cache and therefore not stored.
+        """
+        with self.lock:
+            self.pop(key)
+            if size > self.maxSize:
+                return False
+
+            self.entries[key] = (value, size)
+            self.size += size
+            self._evict()
+            return True
+
+
+    def setSize(self, key, size, value=None):
+        """
+        Change the size of the entry for key, e.g. after the value grew.
+        If value is not None, this is only done if the entry holds
+        this object.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (value is not None and entry[0] is not value):
+                return
+
+            self.entries[key] = (entry[0], size)
+            self.size += size - entry[1]
+            self._evict()
+
+
+    def pop(self, key, default=None):
+        """
+        Remove key and return its value or default if key is not in cache.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return default
+
+            self.size -= entry[1]
+            return entry[0]
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+    def _evict(self):
+        if self.size <= self.maxSize:
+            return
+
+        lowWater = int(self.maxSize * self.EVICT_LOW_WATER)
+        while self.size > lowWater and len(self.entries) > 1:
+            key, (value, size) = self.entries.popitem(last=False)
+            self.size -= size
+            if self.onEvict is not None:
+                self.onEvict(key, value)
+
+
+
 def iterMergesort(list_of_lists, key=None):
     # Based on http://code.activestate.com/recipes/511509-n-way-merge-sort/
     # from Mike Klaas
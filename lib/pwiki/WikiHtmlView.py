@@ -119,10 +119,13 @@ class WikiHtmlView(wx.html.HtmlWindow):
         ), wx.GetApp().getMiscEvent())
         
         self.__sinkDocPage = wxKeyFunctionSink((
-                ("updated wiki page", self.onUpdatedWikiPage),
-                ("changed live text", self.onChangedLiveText)
+                ("changed live text", self.onChangedLiveText),
         ), self.presenter.getCurrentDocPageProxyEvent())
 
+        self.__sinkDocPageUpdated = wxKeyFunctionSink((
+                ("updated wiki page", self.onUpdatedWikiPage),
+        ), self.presenter.getCurrentDocPageProxyEvent(), coalesced=True)
+
         self.visible = False
         self.outOfSync = True   # HTML content is out of sync with live content
         self.counterResizeIgnore = 0  # How often to ignore a size event
@@ -217,6 +220,7 @@ class WikiHtmlView(wx.html.HtmlWindow):
         self.presenterListener.disconnect()
         self.__sinkApp.disconnect()
         self.__sinkDocPage.disconnect()
+        self.__sinkDocPageUpdated.disconnect()
 
 
 # This doesn't work for wxPython 2.8 and newer, constants are missing
@@ -1,5 +1,5 @@
 import cStringIO as StringIO
-import urllib, os, os.path, traceback
+import urllib, os, os.path, traceback, time
 
 import wx, wx.html2
 
@@ -225,16 +225,23 @@ class LinkConverterForPreviewWk:
     """
     Faked link dictionary for HTML exporter
     """
-    def __init__(self, wikiDocument):
+    def __init__(self, wikiDocument, htmlExporter):
         self.wikiDocument = wikiDocument
+        self.htmlExporter = htmlExporter
         
     def getLinkForWikiWord(self, word, default = None):
+        self.htmlExporter.addDependency(u"linkterm", word)
         if self.wikiDocument.isDefinedWikiLinkTerm(word):
             return urlQuote(u"http://internaljump/wikipage/%s" % word, u"/#:;@")
         else:
             return default
  
 class WikiHtmlView2(wx.Panel):
+    # Maximum number of pages to pre-render after a page was loaded
+    PRERENDER_MAX_PAGES = 10
+    # Pause in seconds before each pre-rendered page to keep the UI responsive
+    PRERENDER_PAUSE = 0.2
+
     def __init__(self, presenter, parent, ID):
 
         wx.Panel.__init__(self, parent, ID, style=wx.FRAME_NO_TASKBAR|wx.FRAME_FLOAT_ON_PARENT)
@@ -246,6 +253,8 @@ class WikiHtmlView2(wx.Panel):
         self.SetSizer(self.box)
 
         self.exportingThreadHolder = ThreadHolder()
+        # Held while the exporter is used by an exporting thread
+        self.renderLock = threading.Lock()
         
         self.vi = None # Contains ViFunctions instance if vi key handling enabled
         self.keyEventConn = None
@@ -294,10 +303,13 @@ class WikiHtmlView2(wx.Panel):
         ), wx.GetApp().getMiscEvent())
 
         self.__sinkDocPage = wxKeyFunctionSink((
-                ("updated wiki page", self.onUpdatedWikiPage),
-                ("changed live text", self.onChangedLiveText)
+                ("changed live text", self.onChangedLiveText),
         ), self.presenter.getCurrentDocPageProxyEvent())
 
+        self.__sinkDocPageUpdated = wxKeyFunctionSink((
+                ("updated wiki page", self.onUpdatedWikiPage),
+        ), self.presenter.getCurrentDocPageProxyEvent(), coalesced=True)
+
         self.visible = False
         self.outOfSync = True   # HTML content is out of sync with live content
 
@@ -335,7 +347,8 @@ class WikiHtmlView2(wx.Panel):
                 self.presenter.getWikiDocument())
 
         self.exporterInstance.setLinkConverter(
-                LinkConverterForPreviewWk(self.presenter.getWikiDocument()))
+                LinkConverterForPreviewWk(self.presenter.getWikiDocument(),
+                self.exporterInstance))
 
         # Two files prevents a wierd bug that occurs when using anchors 
         # with a single file.
@@ -968,6 +981,7 @@ if ((typeof jQuery !== 'undefined')) {
         self.presenterListener.disconnect()
         self.__sinkApp.disconnect()
         self.__sinkDocPage.disconnect()
+        self.__sinkDocPageUpdated.disconnect()
 
     def refresh(self):
         # TODO: Rewrite HtmlExporter in include a threadstop
@@ -1010,7 +1024,8 @@ if ((typeof jQuery !== 'undefined')) {
             if old_thread is not None:
                 eth.setThread(None)
 
-            t = threading.Thread(None, self.generateExportHtml, args =  (wikiPage, eth))
+            t = threading.Thread(None, self.generateExportHtml, args =  (wikiPage, eth,
+                    self._getPrerenderWords()))
 
             eth.setThread(t)
             t.setDaemon(True)
@@ -1033,7 +1048,8 @@ if ((typeof jQuery !== 'undefined')) {
         self.anchor = None
         self.outOfSync = False
 
-    def generateExportHtml(self, wikiPage, threadstop=DUMBTHREADSTOP):
+    def generateExportHtml(self, wikiPage, threadstop=DUMBTHREADSTOP,
+            prerenderWords=None):
         try:
             wikiDocument = self.presenter.getWikiDocument()
             if wikiDocument is None:
@@ -1051,25 +1067,29 @@ if ((typeof jQuery !== 'undefined')) {
 
             self.presenter.setTabProgressThreadSafe(0, threadstop)
             
-            # Remove previously used temporary files
-            self.exporterInstance.tempFileSet.clear()
-            self.exporterInstance.buildStyleSheetList()
+            with self.renderLock:
+                # Remove previously used temporary files
+                self.exporterInstance.tempFileSet.clear()
+                self.exporterInstance.buildStyleSheetList()
 
-            self.exporterInstance.setWikiDocument(   # ?
-                    self.presenter.getWikiDocument())
+                self.exporterInstance.setWikiDocument(   # ?
+                        self.presenter.getWikiDocument())
 
-            self.exporterInstance.setLinkConverter(
-                    LinkConverterForPreviewWk(self.presenter.getWikiDocument()))   # /?
-            
-            threadstop.testValidThread()
+                self.exporterInstance.setLinkConverter(
+                        LinkConverterForPreviewWk(self.presenter.getWikiDocument(),
+                        self.exporterInstance))   # /?
+                
+                threadstop.testValidThread()
 
-            self.presenter.setTabProgressThreadSafe(20, threadstop)
+                self.presenter.setTabProgressThreadSafe(20, threadstop)
 
-            html = self.exporterInstance.exportWikiPageToHtmlString(wikiPage)
+                # UTF-8 encoded HTML, rendered or from cache
+                html = wikiDocument.getPreviewRenderCache().getHtml(
+                        self.exporterInstance, wikiPage)
 
-            threadstop.testValidThread()
+                threadstop.testValidThread()
 
-            wx.GetApp().getInsertionPluginManager().taskEnd()
+                wx.GetApp().getInsertionPluginManager().taskEnd()
 
             self.presenter.setTabProgressThreadSafe(30, threadstop)
             
@@ -1079,7 +1099,7 @@ if ((typeof jQuery !== 'undefined')) {
                 htpath = self.htpaths[self.currentHtpath]
 
                 with open(htpath, "w") as f:
-                    f.write(utf8Enc(html)[0])
+                    f.write(html)
 
                 url = "file:" + urlFromPathname(htpath)
                 self.currentLoadedUrl = url
@@ -1101,7 +1121,7 @@ if ((typeof jQuery !== 'undefined')) {
                 htpath = self.htpaths[self.currentHtpath]
                 
                 with open(htpath, "w") as f:
-                    f.write(utf8Enc(html)[0])
+                    f.write(html)
 
                 url = "file:" + urlFromPathname(htpath)
                 self.currentLoadedUrl = url
@@ -1125,6 +1145,88 @@ if ((typeof jQuery !== 'undefined')) {
         finally:
             self.presenter.setTabProgressThreadSafe(100, threadstop)
 
+        if prerenderWords is not None:
+            try:
+                self._prerenderPages(wikiDocument, word, prerenderWords,
+                        threadstop)
+            except NotCurrentThreadException:
+                return
+
+
+    def _getPrerenderWords(self):
+        """
+        Return tuple (historyWords, openWords) of wiki words the user will
+        probably view next: the neighbours of the current word in the
+        page history and the words of the open tabs.
+        Must be called in main thread.
+        """
+        historyWords = []
+        pageHistory = self.presenter.getPageHistory()
+        if pageHistory is not None:
+            # Position points one element behind current word
+            history = pageHistory.getHrHistoryList()
+            pos = pageHistory.getPosition()
+            if pos >= 2:
+                historyWords.append(history[pos - 2])
+            if pos < len(history):
+                historyWords.append(history[pos])
+
+        openWords = self.presenter.getMainControl().getMainAreaPanel()\
+                .getOpenWikiWordsSubCtrlsAndActiveNo()[0]
+
+        return historyWords, openWords or []
+
+
+    def _prerenderPages(self, wikiDocument, word, prerenderWords,
+            threadstop):
+        """
+        Render previews of the pages the user will probably view next
+        into the preview render cache of wikiDocument: history neighbours
+        and open tabs as returned by _getPrerenderWords() and the children
+        of word. Called by the exporting thread after page of word was
+        loaded, stops as soon as another page is exported.
+        """
+        previewCache = wikiDocument.getPreviewRenderCache()
+        if not previewCache.isEnabled():
+            return
+
+        historyWords, openWords = prerenderWords
+        words = historyWords + \
+                wikiDocument.getWikiPage(word).getChildRelationships(
+                existingonly=True, selfreference=False) + \
+                openWords
+
+        seen = set([word])
+        count = 0
+        for preWord in words:
+            if count >= self.PRERENDER_MAX_PAGES:
+                break
+            if preWord in seen:
+                continue
+            seen.add(preWord)
+
+            if not wikiDocument.isDefinedWikiPageName(preWord):
+                continue
+
+            time.sleep(self.PRERENDER_PAUSE)
+            threadstop.testValidThread()
+            if not self.visible:
+                return
+
+            with self.renderLock:
+                threadstop.testValidThread()
+                try:
+                    previewCache.prerender(self.exporterInstance,
+                            wikiDocument.getWikiPage(preWord))
+                except NotCurrentThreadException:
+                    raise
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    wx.GetApp().getInsertionPluginManager().taskEnd()
+
+            count += 1
+
 
     def postRefresh(self, anchor):
         self.lastAnchor = anchor
@@ -1185,7 +1287,8 @@ if ((typeof jQuery !== 'undefined')) {
         self.exporterInstance.setWikiDocument(
                 self.presenter.getWikiDocument())
         self.exporterInstance.setLinkConverter(
-                LinkConverterForPreviewWk(self.presenter.getWikiDocument()))
+                LinkConverterForPreviewWk(self.presenter.getWikiDocument(),
+                self.exporterInstance))
 
     def onClosingCurrentWiki(self, miscevt):
         if self.currentLoadedWikiWord:
@@ -119,10 +119,13 @@ class WikiHtmlViewIE(iewin.IEHtmlWindow):
         ), wx.GetApp().getMiscEvent())
 
         self.__sinkDocPage = wxKeyFunctionSink((
-                ("updated wiki page", self.onUpdatedWikiPage),
-                ("changed live text", self.onChangedLiveText)
+                ("changed live text", self.onChangedLiveText),
         ), self.presenter.getCurrentDocPageProxyEvent())
 
+        self.__sinkDocPageUpdated = wxKeyFunctionSink((
+                ("updated wiki page", self.onUpdatedWikiPage),
+        ), self.presenter.getCurrentDocPageProxyEvent(), coalesced=True)
+
         self.visible = False
         self.outOfSync = True   # HTML content is out of sync with live content
         self.deferredScrollPos = None  # Used by scrollDeferred()
@@ -204,6 +207,7 @@ class WikiHtmlViewIE(iewin.IEHtmlWindow):
         self.presenterListener.disconnect()
         self.__sinkApp.disconnect()
         self.__sinkDocPage.disconnect()
+        self.__sinkDocPageUpdated.disconnect()
 
 
     def refresh(self):
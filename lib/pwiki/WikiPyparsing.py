@@ -81,6 +81,7 @@ import warnings
 import re
 import sre_constants
 import traceback
+import threading
 
 from Utilities import DUMBTHREADSTOP
 #~ sys.stderr.write( "testing pyparsing module, version %s, %s\n" % (__version__,__versionTime__ ) )
@@ -102,7 +103,7 @@ __all__ = [
 'punc8bit', 'pythonStyleComment', 'quotedString', 'removeQuotes', 'replaceHTMLEntity',
 'replaceWith', 'restOfLine', 'sglQuotedString', 'srange', 'stringEnd',
 'stringStart', 'traceParseAction', 'unicodeString', 'upcaseTokens', 'withAttribute',
-'indentedBlock', 'originalTextFor',
+'indentedBlock', 'originalTextFor', 'compileRegex',
 ]
 
 
@@ -155,6 +156,49 @@ if not _PY3K:
 else:
 	_str2dict = set
 
+# Function to compile regular expressions while building a grammar,
+# see setRegexCompiler()
+_regexCompiler = re.compile
+_regexCompilerLock = threading.Lock()
+
+def setRegexCompiler(compiler):
+    """
+    Set function with the signature of re.compile() which compileRegex()
+    uses (e.g. GrammarCache.compile()). None resets it to re.compile().
+    Returns the previously set function.
+    """
+    global _regexCompiler
+    if compiler is None:
+        compiler = re.compile
+
+    with _regexCompilerLock:
+        previous = _regexCompiler
+        _regexCompiler = compiler
+
+    return previous
+
+def replaceRegexCompiler(oldCompiler, newCompiler):
+    """
+    Set newCompiler as in setRegexCompiler() but only if oldCompiler
+    is currently set. Returns True iff it was replaced.
+    """
+    global _regexCompiler
+    if newCompiler is None:
+        newCompiler = re.compile
+
+    with _regexCompilerLock:
+        if _regexCompiler != oldCompiler:
+            return False
+
+        _regexCompiler = newCompiler
+        return True
+
+def compileRegex(pattern, flags=0):
+    """
+    Same as re.compile() but uses the compiler set by setRegexCompiler()
+    """
+    return _regexCompiler(pattern, flags)
+
 def _xml_escape(data):
     """Escape &, <, >, ", ', etc. in a string of data."""
 
@@ -2049,7 +2093,7 @@ class Literal(Token, NecessaryRegexProvider):
 
     def getRegex(self):
         try:
-            return re.compile(re.escape(self.match))
+            return compileRegex(re.escape(self.match))
         except:
             traceback.print_exc()
             return None
@@ -2240,7 +2284,7 @@ class Word(Token):
             if self.asKeyword:
                 self.reString = r"\b"+self.reString+r"\b"
             try:
-                self.re = re.compile( self.reString )
+                self.re = compileRegex( self.reString )
             except:
                 self.re = None
 
@@ -2332,7 +2376,7 @@ class Regex(Token, NecessaryRegexProvider):
             self.flagsMask = flagsMask
 
         try:
-            self.re = re.compile(self.pattern, self.flags)
+            self.re = compileRegex(self.pattern, self.flags)
             self.reString = self.pattern
         except sre_constants.error:
             warnings.warn("invalid pattern (%s) passed to Regex" % pattern,
@@ -2455,7 +2499,7 @@ class QuotedString(Token, NecessaryRegexProvider):
         self.pattern += (r')*%s' % re.escape(self.endQuoteChar))
 
         try:
-            self.re = re.compile(self.pattern, self.flags)
+            self.re = compileRegex(self.pattern, self.flags)
             self.reString = self.pattern
         except sre_constants.error:
             warnings.warn("invalid pattern (%s) passed to Regex" % self.pattern,
@@ -3066,7 +3110,7 @@ class And(ParseExpression, NecessaryRegexProvider):
             
             self.reFlagsMask = flagsMask
             self.reComplete = complete
-            return re.compile(u"".join(result), flags)
+            return compileRegex(u"".join(result), flags)
         finally:
             self.buildingRegex = False
 
@@ -3302,7 +3346,7 @@ class MatchFirst(ParseExpression, NecessaryRegexProvider):
 
     def getRegex(self):
         if self.regexCombiner is not None:
-            return re.compile(self.regexCombiner.getCleanPattern(),
+            return compileRegex(self.regexCombiner.getCleanPattern(),
                     self.regexCombiner.getFlags())
 
 
@@ -3407,7 +3451,7 @@ class Choice(ParseExpression, NecessaryRegexProvider):
 
     def getRegex(self):
         if self.regexCombiner is not None:
-            return re.compile(self.regexCombiner.getCleanPattern(),
+            return compileRegex(self.regexCombiner.getCleanPattern(),
                     self.regexCombiner.getFlags())
 
 
@@ -3970,7 +4014,7 @@ class FollowedBy(ParseElementEnhance, NecessaryRegexProvider):
         self.buildingRegex = True
         try:
             r = self.expr.getRegex()
-            return re.compile(u"(?=" + r.pattern + u")", r.flags)
+            return compileRegex(u"(?=" + r.pattern + u")", r.flags)
         finally:
             self.buildingRegex = False
 
@@ -4059,7 +4103,7 @@ class NotAny(ParseElementEnhance, NecessaryRegexProvider):
         self.buildingRegex = True
         try:
             r = self.expr.getRegex()
-            return re.compile(u"(?!" + r.pattern + u")", r.flags)
+            return compileRegex(u"(?!" + r.pattern + u")", r.flags)
         finally:
             self.buildingRegex = False
 
@@ -4112,7 +4156,7 @@ class ZeroOrMore(ParseElementEnhance):
             if regex is None:
                 return None
             try:
-                return re.compile("(?:" + regex.pattern + ")*", regex.flags)
+                return compileRegex("(?:" + regex.pattern + ")*", regex.flags)
             except re.error:
                 return None
         finally:
@@ -4206,7 +4250,7 @@ class OneOrMore(ParseElementEnhance, NecessaryRegexProvider):
             if regex is None:
                 return None
             try:
-                return re.compile("(?:" + regex.pattern + ")+", regex.flags)
+                return compileRegex("(?:" + regex.pattern + ")+", regex.flags)
             except re.error:
                 return None
         finally:
@@ -4316,7 +4360,7 @@ class Optional(ParseElementEnhance, NecessaryRegexProvider):
             if regex is None:
                 return None
             try:
-                return re.compile("(?:" + regex.pattern + ")?", regex.flags)
+                return compileRegex("(?:" + regex.pattern + ")?", regex.flags)
             except re.error:
                 return None
         finally:
@@ -4945,10 +4989,10 @@ class RegexCombiner(object):
             selectionPart = "".join(regexPatterns)
 
             if self.reMode == RegexCombiner.REMODE_SEARCH_ALL:
-                self.regEx = re.compile(selectionPart +
+                self.regEx = compileRegex(selectionPart +
                         "(?:" + self.cleanPattern + ")", self.flags)
             else:
-                self.regEx = re.compile(selectionPart, self.flags)
+                self.regEx = compileRegex(selectionPart, self.flags)
                 
 #             print "--RegexCombiner.combine24", repr(self.regEx.pattern)
             return True
@@ -4956,7 +5000,7 @@ class RegexCombiner(object):
         else:
             for i in xrange(len(regexPatterns)):
                 regexPatterns[i] = ("(?P<style%02i>" % i)+ regexPatterns[i] + ")"
-            self.regEx = re.compile("|".join(regexPatterns), self.flags)
+            self.regEx = compileRegex("|".join(regexPatterns), self.flags)
     
 #             print "--RegexCombiner.combine29", repr(self.regEx.pattern)
             return True
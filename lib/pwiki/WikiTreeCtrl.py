@@ -1,4 +1,4 @@
-import sys, time, traceback
+import sys, time, traceback, threading
 
 ## import profilehooks
 ## profile = profilehooks.profile(filename="profile.prf")
@@ -64,6 +64,163 @@ class NodeStyle(object):
 _SETTABLE_ATTRS = (u"bold", u"icon", u"color", u"bgcolor")
 
 
+
+class WikiTreeDataProvider(object):
+    """
+    Caches the child relations of wiki pages as needed by the tree to decide
+    if a node needs an expand button. Relations are fetched for a whole
+    batch of sibling pages with one query and kept until a misc event
+    ("updated wiki page", "renamed wiki page", "deleted wiki page") tells
+    that they may be outdated.
+    """
+    def __init__(self, treeCtrl):
+        self.treeCtrl = treeCtrl
+        self.lock = threading.RLock()
+        # Page name -> tuple of (relation, pageName) where pageName is the
+        # page the relation resolves to or None if undefined
+        self.childRelations = {}
+        # Relation (link term) -> set of page names having it as child
+        self.relationParents = {}
+        # Resolved page name -> set of page names having it as child
+        self.targetParents = {}
+
+
+    def clear(self):
+        with self.lock:
+            self.childRelations = {}
+            self.relationParents = {}
+            self.targetParents = {}
+
+
+    def _forget(self, word):
+        """
+        Remove cached relations of page word. Caller must hold self.lock.
+        """
+        entries = self.childRelations.pop(word, None)
+        if entries is None:
+            return
+
+        for relation, target in entries:
+            parents = self.relationParents.get(relation)
+            if parents is not None:
+                parents.discard(word)
+                if not parents:
+                    del self.relationParents[relation]
+            if target is not None:
+                parents = self.targetParents.get(target)
+                if parents is not None:
+                    parents.discard(word)
+                    if not parents:
+                        del self.targetParents[target]
+
+
+    def invalidateWord(self, word, aliases=()):
+        """
+        Called if page word was modified, created, deleted or renamed.
+        Forgets relations of word itself and of all pages which have word
+        (or one of the link terms in aliases) as child because their
+        "defined" state may have changed.
+        """
+        with self.lock:
+            affected = set((word,))
+            affected.update(self.relationParents.get(word, ()))
+            affected.update(self.targetParents.get(word, ()))
+            for alias in aliases:
+                affected.update(self.relationParents.get(alias, ()))
+
+            for w in affected:
+                self._forget(w)
+
+
+    def invalidateWikiPage(self, wikiPage):
+        """
+        Like invalidateWord() but takes the aliases from the attributes of
+        the (already updated) wikiPage object.
+        """
+        if wikiPage is None:
+            return
+
+        try:
+            wikiPage = wikiPage.getNonAliasPage()
+            aliases = wikiPage.getAttributes().get(u"alias", ())
+        except (WikiWordNotFoundException, AttributeError):
+            aliases = ()
+
+        self.invalidateWord(wikiPage.getWikiWord(), aliases)
+
+
+    def prefetch(self, words):
+        """
+        Ensure that relations for all page names in words are cached,
+        missing ones are retrieved with a single batch query.
+        """
+        with self.lock:
+            missing = [w for w in words if w not in self.childRelations]
+
+        if not missing:
+            return
+
+        wikiData = self.treeCtrl.pWiki.getWikiData()
+        if wikiData is None:
+            return
+
+        fetched = wikiData.getChildRelationshipTargetsForWords(missing)
+
+        with self.lock:
+            for word, entries in fetched.iteritems():
+                if word in self.childRelations:
+                    continue
+                self.childRelations[word] = tuple(entries)
+                for relation, target in entries:
+                    self.relationParents.setdefault(relation, set()).add(word)
+                    if target is not None:
+                        self.targetParents.setdefault(target, set()).add(word)
+
+
+    def getChildRelationTargets(self, word):
+        """
+        Return tuple of (relation, pageName) for children of page word.
+        """
+        with self.lock:
+            entries = self.childRelations.get(word)
+        if entries is not None:
+            return entries
+
+        self.prefetch((word,))
+
+        with self.lock:
+            return self.childRelations.get(word, ())
+
+
+    def prefetchChildrenOf(self, word, children):
+        """
+        Prefetch relations for the pages that the link terms in children
+        (a subset of the children of page word) resolve to.
+        """
+        children = set(children)
+        self.prefetch([target for relation, target in
+                self.getChildRelationTargets(word)
+                if target is not None and relation in children])
+
+
+    def hasValidChildren(self, word, existingonly=False,
+            excludeSet=frozenset()):
+        """
+        Check if page word has children which aren't a self-reference,
+        aren't in excludeSet and (if existingonly is true) are defined.
+        """
+        for relation, target in self.getChildRelationTargets(word):
+            if relation == word or relation in excludeSet:
+                continue
+            if existingonly and target is None:
+                continue
+
+            return True
+
+        return False
+
+
+
 # New style class to allow __slots__ for efficiency
 class AbstractNode(object):
     """
@@ -197,7 +354,8 @@ class WikiWordNode(AbstractNode):
     """
     Represents a wiki word
     """
-    __slots__ = ("wikiWord", "flagChildren", "flagRoot", "ancestors", "newLabel")
+    __slots__ = ("wikiWord", "flagChildren", "flagRoot", "ancestors",
+            "childAncestors", "newLabel")
 
     def __init__(self, tree, parentNode, wikiWord):
         AbstractNode.__init__(self, tree, parentNode)
@@ -206,6 +364,7 @@ class WikiWordNode(AbstractNode):
 
         self.flagRoot = False
         self.ancestors = None
+        self.childAncestors = None
         
         # Calculate label
         self.newLabel = self.wikiWord
@@ -234,21 +393,31 @@ class WikiWordNode(AbstractNode):
 
     def getAncestors(self):  # TODO Check for cache clearing conditions
         """
-        Returns a set with the ancestor words (parent, grandparent, ...).
+        Returns a frozenset with the ancestor words (parent, grandparent, ...).
+        The set is shared between all children of the same parent.
         """
         if self.ancestors is None:
             parent = self.getParentNode()
             if parent is not None:
-                result = parent.getAncestors().copy()
-                result.add(parent.getWikiWord())
+                self.ancestors = parent._getChildAncestors()
             else:
-                result = set()
-
-            self.ancestors = result
+                self.ancestors = frozenset()
 
         return self.ancestors            
 
 
+    def _getChildAncestors(self):
+        """
+        Returns the ancestors set for the children of this node which is
+        computed only once for all of them.
+        """
+        if self.childAncestors is None:
+            self.childAncestors = self.getAncestors() | \
+                    frozenset((self.getWikiWord(),))
+
+        return self.childAncestors
+
+
     def _getValidChildren(self, wikiPage, withFields=()):
         """
         Get all valid children, filter out undefined and/or cycles
@@ -270,10 +439,12 @@ class WikiWordNode(AbstractNode):
         return relations
 
 
-    def _hasValidChildren(self, wikiPage):  # TODO More efficient
+    def _hasValidChildren(self, wikiPage):
         """
         Check if represented word has valid children, filter out undefined
-        and/or cycles if options are set accordingly
+        and/or cycles if options are set accordingly.
+        The relations are taken from the data provider of the tree which
+        normally has them already prefetched for all siblings.
         """
         if self.treeCtrl.pWiki.getConfig().getboolean("main", "tree_no_cycles"):
             # Filter out cycles
@@ -281,18 +452,10 @@ class WikiWordNode(AbstractNode):
         else:
             ancestors = frozenset()  # Empty
 
-        relations = wikiPage.getChildRelationships(
+        return self.treeCtrl.getDataProvider().hasValidChildren(
+                wikiPage.getNonAliasPage().getWikiWord(),
                 existingonly=self.treeCtrl.getHideUndefined(),
-                selfreference=False, withFields=())
-
-        if len(relations) > len(ancestors):
-            return True
-            
-        for r in relations:
-            if r not in ancestors:
-                return True
-                
-        return False
+                excludeSet=ancestors)
 
 
     def _createNodePresentation(self, baselabel, fast=False):
@@ -439,6 +602,11 @@ class WikiWordNode(AbstractNode):
                 existingonly=self.treeCtrl.getHideUndefined(),
                 excludeSet=ancestors, includeSet=includeSet)
 
+        # Retrieve relations of all children at once so creating their
+        # presentations doesn't need a query per child
+        self.treeCtrl.getDataProvider().prefetchChildrenOf(
+                wikiPage.getNonAliasPage().getWikiWord(), children)
+
         result = [WikiWordNode(self.treeCtrl, self, c)
                 for c in children]
 
@@ -723,21 +891,13 @@ class TodoNode(AbstractNode):
                     addedTodoSubCategories.append(nextSubCategory)
 
         collator = self.treeCtrl.pWiki.getCollator()
-        
-        def cmpAddWords(left, right):
-            result = collator.strcoll(left[0], right[0])
-            if result != 0:
-                return result
-            
-            result = collator.strcoll(left[1], right[1])
-            if result != 0:
-                return result            
-            
-            return collator.strcoll(left[2], right[2])
 
         collator.sort(addedTodoSubCategories)
 
-        addedWords.sort(cmpAddWords)  # TODO no compare function support in Python 3!
+        # Sort by word, then todo key, then todo value. As sorting is stable
+        # this is done by sorting by the least significant item first
+        for i in (2, 1, 0):
+            collator.sortByItem(addedWords, i)
 
         result = []
         # First list real categories, then right sides, then words
@@ -1296,6 +1456,38 @@ class FuncPageNode(AbstractNode):
 
 
 
+class MoreChildrenNode(AbstractNode):
+    """
+    Placeholder shown as last child if a node has more children than
+    configured by "tree_childrenPageSize". It holds the node objects of the
+    remaining children, tree items for them are only created when the
+    placeholder is selected or activated.
+    """
+
+    __slots__ = ("remainingNodes",)
+
+    def __init__(self, tree, parentNode, remainingNodes):
+        AbstractNode.__init__(self, tree, parentNode)
+        self.remainingNodes = remainingNodes
+        self.unifiedName = u"helpernode/morechildren"
+
+    def getNodePresentation(self):
+        style = NodeStyle()
+        style.label = _(u"more... (%i)") % len(self.remainingNodes)
+        style.icon = u"cog"
+        style.hasChildren = False
+        return style
+
+    def onSelected(self):
+        # Selection handling must be finished before the tree is modified
+        wx.CallAfter(self.treeCtrl.showMoreChildren, self.wxItemId)
+
+    def onActivated(self):
+        self.treeCtrl.showMoreChildren(self.wxItemId)
+        return True
+
+
+
 
 # ----------------------------------------------------------------------
 
@@ -1328,6 +1520,8 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
         # if functionality was switched off by user
         self.expandedNodePathes = StringPathSet()
         self.mainTreeMode = True  # Is this the main tree?
+        # Cache of child relations for the "has children" flags of nodes
+        self.dataProvider = WikiTreeDataProvider(self)
         
         self.onOptionsChanged(None)
 
@@ -1424,14 +1618,20 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
         ), self.pWiki.getCurrentPresenterProxyEvent(), self)
 
         self.__sinkWikiDoc = wxKeyFunctionSink((
-                ("renamed wiki page", self.onRenamedWikiPage),
-                ("deleted wiki page", self.onDeletedWikiPage),
-                ("updated wiki page", self.onWikiPageUpdated),
                 ("changed wiki configuration", self.onChangedWikiConfiguration),
                 ("begin foreground update", self.onBeginForegroundUpdate),
                 ("end foreground update", self.onEndForegroundUpdate),
         ), self.pWiki.getCurrentWikiDocumentProxyEvent(), self)
 
+        # Bulk operations update or delete many pages at once, the tree is
+        # refreshed only once for them. Renaming is coalesced as well to
+        # keep the order of the events.
+        self.__sinkWikiDocPages = wxKeyFunctionSink((
+                ("deleted wiki page", self.onDeletedWikiPage),
+                ("renamed wiki page", self.onRenamedWikiPage),
+                ("updated wiki page", self.onWikiPageUpdated),
+        ), self.pWiki.getCurrentWikiDocumentProxyEvent(), self, coalesced=True)
+
         self.__sinkApp = wxKeyFunctionSink((
                 ("options changed", self.onOptionsChanged),
         ), wx.GetApp().getMiscEvent(), self)
@@ -1452,6 +1652,7 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
         self.__sinkMc.disconnect()
         self.__sinkDocPagePresenter.disconnect()
         self.__sinkWikiDoc.disconnect()
+        self.__sinkWikiDocPages.disconnect()
         self.__sinkApp.disconnect()
         self.refreshExecutor.end(hardEnd=True)
 
@@ -1497,6 +1698,109 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
     def getHideUndefined(self):
         return self.pWiki.getConfig().getboolean("main", "hideundefined")
 
+    def getDataProvider(self):
+        return self.dataProvider
+
+    def getChildrenPageSize(self):
+        """
+        Return maximum number of children items created at once for a node
+        or 0 for no limit
+        """
+        return self.childrenPageSize
+
+
+    def _limitChildNodes(self, parentNode, childnodes, count):
+        """
+        If childnodes is longer than count, return its first count elements
+        followed by a MoreChildrenNode holding the rest. count is rounded up
+        to a multiple of the page size, a page size of 0 disables paging.
+        """
+        pageSize = self.getChildrenPageSize()
+        if pageSize <= 0:
+            return childnodes
+
+        count = max(pageSize, ((count + pageSize - 1) // pageSize) * pageSize)
+
+        if len(childnodes) <= count:
+            return childnodes
+
+        return childnodes[:count] + [MoreChildrenNode(self, parentNode,
+                childnodes[count:])]
+
+
+    def _insertChildNodes(self, parentItem, childnodes, pos=None):
+        """
+        Create tree items for childnodes below parentItem, either appended
+        or inserted starting at index pos. Returns True if a background
+        refresh is needed to get the accurate presentation.
+        """
+        refreshNeeded = False
+
+        for ch in childnodes:
+            if pos is None:
+                newit = self.AppendItem(parentItem, u"")
+            else:
+                newit = self.InsertItemBefore(parentItem, pos, u"")
+                pos += 1
+
+            self.joinItemIdToNode(newit, ch)
+
+            nodeStyle = ch.getNodePresentationFast()
+            if nodeStyle is None:
+                nodeStyle = ch.getNodePresentation()
+            else:
+                refreshNeeded = True
+
+            self.setNodePresentation(newit, nodeStyle)
+
+            if self.expandedNodePathes is not None:
+                if nodeStyle.hasChildren:
+                    if tuple(ch.getNodePath()) in self.expandedNodePathes:
+                        self.Expand(newit)
+
+        return refreshNeeded
+
+
+    def showMoreChildren(self, moreItemId, minCount=0):
+        """
+        Create tree items for the next page of children hidden behind the
+        "more..." placeholder item moreItemId (at least minCount ones).
+        The first new item is selected (without sending events).
+        """
+        parentItem = self.GetItemParent(moreItemId)
+        if parentItem is None or moreItemId not in parentItem.GetChildren():
+            # Placeholder was removed meanwhile (e.g. by refresh)
+            return
+
+        moreNode = self.GetPyData(moreItemId)
+        count = max(self.getChildrenPageSize(), minCount)
+        newNodes = moreNode.remainingNodes[:count]
+        moreNode.remainingNodes = moreNode.remainingNodes[count:]
+
+        if len(newNodes) == 0:
+            return
+
+        self.Freeze()
+        try:
+            pos = parentItem.GetChildren().index(moreItemId)
+            refreshNeeded = self._insertChildNodes(parentItem, newNodes, pos)
+
+            firstNewItem = parentItem.GetChildren()[pos]
+            self._unbindSelection()
+            self.SelectItem(firstNewItem, send_events=False)
+            self._bindSelection()
+
+            if len(moreNode.remainingNodes) > 0:
+                self.setNodePresentation(moreItemId,
+                        moreNode.getNodePresentation())
+            else:
+                self.Delete(moreItemId)
+        finally:
+            self.Thaw()
+
+        if refreshNeeded:
+            self._startBackgroundRefresh()
+
 
     def onChangedPresenter(self, miscevt):
         currentDpp = self.pWiki.getCurrentDocPagePresenter()
@@ -1675,6 +1979,7 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
 
     def onEndForegroundUpdate(self, miscEvt):
         self.refreshStartLock = False
+        self.dataProvider.clear()
         self._startBackgroundRefresh()
 
     def onBeginForegroundUpdate(self, miscEvt):
@@ -1684,7 +1989,18 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
 
 
 
+    def _invalidateAffectedPages(self, miscevt):
+        for wikiWord, wikiPage in miscevt.getAffectedPages().iteritems():
+            if wikiPage is None:
+                # Deleted or renamed in the meantime
+                self.dataProvider.invalidateWord(wikiWord)
+            else:
+                self.dataProvider.invalidateWikiPage(wikiPage)
+
+
     def onWikiPageUpdated(self, miscevt):
+        self._invalidateAffectedPages(miscevt)
+
         if not self.pWiki.getConfig().getboolean("main", "tree_update_after_save"):
             return
 
@@ -1692,8 +2008,9 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
 
 
 
-    def onDeletedWikiPage(self, miscevt):  # TODO May be called multiple times if
-                                           # multiple pages are deleted at once
+    def onDeletedWikiPage(self, miscevt):
+        self._invalidateAffectedPages(miscevt)
+
         if not self.pWiki.getConfig().getboolean("main", "tree_update_after_save"):
             return
 
@@ -1742,6 +2059,9 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
         self.refreshGeneratorLastCallMinDelay = config.getfloat("main",
                 "tree_updateGenerator_minDelay", 0.1)
 
+        self.childrenPageSize = config.getint("main",
+                "tree_childrenPageSize", 500)
+
         self._startBackgroundRefresh()
 
 
@@ -1825,6 +2145,13 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
             while nodeid is not None and nodeid.IsOk():
                 oldChildNodeIds.append(nodeid)
                 nodeid, cookie = self.GetNextChild(parentnodeid, cookie)
+
+            # Keep as many pages of children as were shown before
+            shownCount = len(oldChildNodeIds)
+            if shownCount > 0 and isinstance(
+                    self.GetPyData(oldChildNodeIds[-1]), MoreChildrenNode):
+                shownCount -= 1
+            children = self._limitChildNodes(nodeObj, children, shownCount)
             
             idIdx = 0
             
@@ -1837,6 +2164,11 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
                     nodeid = oldChildNodeIds[idIdx]
                     nodeObj = self.GetPyData(nodeid)
                     if c.nodeEquality(nodeObj):
+                        if isinstance(c, MoreChildrenNode):
+                            # Take over new list of remaining children
+                            self.joinItemIdToNode(nodeid, c)
+                            nodeObj = c
+
                         # Previous child matches new child -> normal refreshing
                         if self.IsExpanded(nodeid):
                             # Recursive generator call
@@ -1939,6 +2271,9 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
 
 
     def onRenamedWikiPage(self, miscevt):
+        self.dataProvider.invalidateWikiPage(miscevt.get("wikiPage"))
+        self.dataProvider.invalidateWord(miscevt.get("newWord"))
+
         rootItem = self.GetPyData(self.GetRootItem())
         if isinstance(rootItem, WikiWordNode) and \
                 miscevt.get("wikiPage").getWikiWord() == \
@@ -1980,11 +2315,13 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
         self._stopBackgroundRefresh()
         self.refreshExecutor.end(hardEnd=True)
         self.refreshExecutor.start()
+        self.dataProvider.clear()
 
 
     def onClosedCurrentWiki(self, miscevt):
 #         self.refreshExecutor.end(hardEnd=True)
         self._stopBackgroundRefresh()
+        self.dataProvider.clear()
         if self.expandedNodePathes is not None:
             self.expandedNodePathes = StringPathSet()
 
@@ -2225,15 +2562,26 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
         return False    
 
     def findChildTreeNodeByWikiWord(self, fromNode, findWord):
+        wikiDocument = self.pWiki.getWikiDocument()
         (child, cookie) = self.GetFirstChild(fromNode)    # , 0
         while child:
             nodeobj = self.GetPyData(child)
 #             if nodeobj.representsFamilyWikiWord() and nodeobj.getWikiWord() == findWord:
             if nodeobj.representsFamilyWikiWord() and \
-                    self.pWiki.getWikiDocument().getWikiPageNameForLinkTerm(
+                    wikiDocument.getWikiPageNameForLinkTerm(
                     nodeobj.getWikiWord()) == findWord:
                 return child
-            
+
+            if isinstance(nodeobj, MoreChildrenNode):
+                # Word may be hidden behind the "more..." placeholder
+                for i, remNode in enumerate(nodeobj.remainingNodes):
+                    if remNode.representsFamilyWikiWord() and \
+                            wikiDocument.getWikiPageNameForLinkTerm(
+                            remNode.getWikiWord()) == findWord:
+                        self.showMoreChildren(child, i + 1)
+                        return remNode.wxItemId
+                return None
+
             (child, cookie) = self.GetNextChild(fromNode, cookie)
         return None
 
@@ -2428,27 +2776,13 @@ class WikiTreeCtrl(customtreectrl.CustomTreeCtrl):          # wxTreeCtrl):
         else:
             refreshNeeded = True
 
+        # Very wide nodes show only the first page of children
+        childnodes = self._limitChildNodes(itemobj, childnodes, 0)
+
         self.Freeze()
         try:
-            for ch in childnodes:
-                newit = self.AppendItem(item, u"")
-                self.joinItemIdToNode(newit, ch)
-                
-                nodeStyle = ch.getNodePresentationFast()
-                if nodeStyle is None:
-                    nodeStyle = ch.getNodePresentation()
-                else:
-                    refreshNeeded = True
-
-                self.setNodePresentation(newit, nodeStyle)
-                
-                if self.expandedNodePathes is not None:
-                    if nodeStyle.hasChildren:
-                        if tuple(ch.getNodePath()) in self.expandedNodePathes:
-                            self.Expand(newit)
-#                     else:
-#                         self.expandedNodePathes.discardStartsWith(
-#                                 tuple(ch.getNodePath()))
+            if self._insertChildNodes(item, childnodes):
+                refreshNeeded = True
         finally:
             self.Thaw()
         
@@ -6,7 +6,7 @@ import traceback, codecs
 from cStringIO import StringIO
 import string, itertools, contextlib
 import re # import pwiki.srePersistent as re
-import threading
+import threading, bisect
 
 import subprocess
 import textwrap
@@ -35,7 +35,8 @@ from .SystemInfo import isUnicode, isOSX, isLinux, isWindows
 
 from .ParseUtilities import getFootnoteAnchorDict
 
-from .EnhancedScintillaControl import StyleCollector
+from .EnhancedScintillaControl import StyleCollector, ByteOffsetTable
+from . import Instrumentation
 
 from .SearchableScintillaControl import SearchableScintillaControl
 
@@ -104,6 +105,12 @@ class WikiTxtCtrl(SearchableScintillaControl):
                 presenter.getMainControl(), parent, ID)
         self.evalScope = None
         self.stylingThreadHolder = ThreadHolder()
+        # Byte ranges already styled while styling in chunks,
+        # None if not styling in chunks
+        self.styledByteRanges = None
+        # Byte position of the visible part of the editor which should be
+        # styled next while styling in chunks
+        self.stylingPriorityBytePos = 0
         self.calltipThreadHolder = ThreadHolder()
         self.clearStylingCache()
         self.pageType = "normal"   # The pagetype controls some special editor behaviour
@@ -269,6 +276,7 @@ class WikiTxtCtrl(SearchableScintillaControl):
         wx.stc.EVT_STC_MARGINCLICK(self, ID, self.OnMarginClick)
         wx.stc.EVT_STC_DWELLSTART(self, ID, self.OnDwellStart)
         wx.stc.EVT_STC_DWELLEND(self, ID, self.OnDwellEnd)
+        wx.stc.EVT_STC_UPDATEUI(self, ID, self.OnUpdateUI)
 
 #         wx.EVT_LEFT_DOWN(self, self.OnClick)
         wx.EVT_MIDDLE_DOWN(self, self.OnMiddleDown)
@@ -1462,6 +1470,8 @@ class WikiTxtCtrl(SearchableScintillaControl):
             self.stylingThreadHolder.setThread(None)
             self.clearStylingCache()
 
+        # Byte ranges already styled while styling in chunks
+        self.styledByteRanges = None
 
         if textlen < self.presenter.getConfig().getint(
                 "main", "sync_highlight_byte_limit"):
@@ -1479,6 +1489,20 @@ class WikiTxtCtrl(SearchableScintillaControl):
                 self.storeStylingAndAst(None, self.foldingseq)
         else:
             # Asynchronous styling
+            viewportLimit = self.presenter.getConfig().getint(
+                    "main", "viewport_highlight_byte_limit", 0)
+            chunked = viewportLimit > 0 and textlen >= viewportLimit
+
+            if chunked:
+                # Style visible part now, the rest in chunks afterwards
+                self.styledByteRanges = []
+                if isinstance(evt, wx.stc.StyledTextEvent):
+                    neededBytePos = evt.GetPosition()
+                else:
+                    neededBytePos = -1
+
+                self.styleViewport(text, neededBytePos)
+
             # This avoids further request from STC:
             self.stopStcStyler()
 
@@ -1486,7 +1510,8 @@ class WikiTxtCtrl(SearchableScintillaControl):
 
             delay = self.presenter.getConfig().getfloat(
                     "main", "async_highlight_delay")
-            t = threading.Thread(None, self.buildStyling, args = (text, delay, sth))
+            t = threading.Thread(None, self.buildStyling,
+                    args = (text, delay, sth, chunked))
             sth.setThread(t)
             t.setDaemon(True)
             t.start()
@@ -1771,9 +1796,18 @@ class WikiTxtCtrl(SearchableScintillaControl):
         self.SetFocus()
 
 
+    # Number of lines before and after the visible ones which are styled
+    # first on huge pages
+    VIEWPORT_STYLING_MARGIN = 50
+
+    # Number of characters styled at once when styling in chunks
+    STYLING_CHUNK_SIZE = 65536
+
     def clearStylingCache(self):
         self.stylebytes = None
         self.foldingseq = None
+        # Tuple (text, ByteOffsetTable) of the last styled text
+        self.styledTextOffsetTable = (None, None)
 #         self.pageAst = None
 
 
@@ -1804,7 +1838,14 @@ class WikiTxtCtrl(SearchableScintillaControl):
 
 
 
-    def buildStyling(self, text, delay, threadstop=DUMBTHREADSTOP):
+    @Instrumentation.instrumented("styling.build")
+    def buildStyling(self, text, delay, threadstop=DUMBTHREADSTOP,
+            chunked=False):
+        """
+        chunked -- if True, syntax styling is processed and shown in chunks
+                starting with the visible part of the editor. Only works
+                asynchronously.
+        """
         try:
             if delay != 0 and not threadstop is DUMBTHREADSTOP:
                 sleep(delay)
@@ -1823,7 +1864,11 @@ class WikiTxtCtrl(SearchableScintillaControl):
                 else:
                     break
 
-            stylebytes = self.processTokens(text, pageAst, threadstop)
+            if chunked:
+                stylebytes = self.processTokensInChunks(text, pageAst,
+                        threadstop)
+            else:
+                stylebytes = self.processTokens(text, pageAst, threadstop)
 
             threadstop.testValidThread()
 
@@ -1847,25 +1892,187 @@ class WikiTxtCtrl(SearchableScintillaControl):
                 threadstop.testValidThread()
 
                 if scTokens.getChildrenCount() > 0:
-                    spellStyleBytes = self.processSpellCheckTokens(text, scTokens,
-                            threadstop)
+                    stylebytes = self.processSpellCheckTokens(text, scTokens,
+                            threadstop, stylebytes)
 
                     threadstop.testValidThread()
 
-                    # TODO: Faster? How?
-                    stylebytes = "".join([chr(ord(a) | ord(b))
-                            for a, b in itertools.izip(stylebytes, spellStyleBytes)])
-
                     self.storeStylingAndAst(stylebytes, None, styleMask=0xff)
                 else:
                     self.storeStylingAndAst(stylebytes, None, styleMask=0xff)
             else:
                 self.storeStylingAndAst(stylebytes, foldingseq, styleMask=0xff)
 
+            if chunked:
+                wx.CallAfter(self._endChunkedStyling,
+                        threading.currentThread())
+
         except NotCurrentThreadException:
             return
 
 
+    def getViewportByteRange(self, margin=0):
+        """
+        Return tuple (startBytePos, endBytePos) of the visible lines of the
+        editor plus margin lines before and after them.
+        """
+        firstVisible = self.GetFirstVisibleLine()
+        firstLine = max(0, self.DocLineFromVisible(firstVisible) - margin)
+        lastLine = min(self.GetLineCount() - 1, self.DocLineFromVisible(
+                firstVisible + self.LinesOnScreen()) + margin)
+
+        return self.PositionFromLine(firstLine), \
+                self.GetLineEndPosition(lastLine)
+
+
+    def _isByteRangeStyled(self, startBytePos, endBytePos):
+        """
+        Return True if byte range is completely covered by
+        self.styledByteRanges
+        """
+        for rangeStart, rangeEnd in sorted(self.styledByteRanges):
+            if rangeStart > startBytePos:
+                break
+            startBytePos = max(startBytePos, rangeEnd)
+            if startBytePos >= endBytePos:
+                return True
+
+        return startBytePos >= endBytePos
+
+
+    def styleViewport(self, text, neededBytePos=-1):
+        """
+        Style the visible part of the editor (at least up to neededBytePos)
+        quickly while the whole text is styled in the background.
+        The current page AST is used if available, otherwise the visible
+        text is parsed beginning at the start of its paragraph.
+        Must be called in main thread.
+        """
+        docPage = self.getLoadedDocPage()
+        if docPage is None or not isinstance(docPage,
+                DocPages.AbstractWikiPage):
+            return
+
+        startBytePos, endBytePos = self.getViewportByteRange(
+                self.VIEWPORT_STYLING_MARGIN)
+        # Honor the end position requested by Scintilla unless it is far
+        # beyond the visible part
+        endBytePos = max(endBytePos, min(neededBytePos, self.GetLength(),
+                endBytePos + self.STYLING_CHUNK_SIZE))
+
+        startCharPos = len(self.GetTextRange(0, startBytePos))
+        endCharPos = startCharPos + len(self.GetTextRange(startBytePos,
+                endBytePos))
+
+        try:
+            pageAst = docPage.getLivePageAstIfAvailable()
+            if pageAst is not None:
+                stylebytes = self.processTokens(text, pageAst, DUMBTHREADSTOP,
+                        startCharPos, endCharPos)
+            else:
+                parseStartPos = text.rfind(u"\n\n", 0, startCharPos) + 1
+                if startCharPos - parseStartPos > self.STYLING_CHUNK_SIZE:
+                    parseStartPos = text.rfind(u"\n", 0, startCharPos) + 1
+                partText = text[parseStartPos:endCharPos]
+                pageAst = docPage.parseTextInContext(partText)
+                # Own table to keep the cached one of the whole text
+                stylebytes = self.processTokens(partText, pageAst,
+                        DUMBTHREADSTOP, startCharPos - parseStartPos,
+                        offsetTable=ByteOffsetTable(partText,
+                        self.bytelenSct))
+        except:
+            traceback.print_exc()
+            return
+
+        if startBytePos + len(stylebytes) <= self.GetLength():
+            self.StartStyling(startBytePos, 0x1f)
+            self.SetStyleBytes(len(stylebytes), stylebytes)
+            self.styledByteRanges.append(
+                    (startBytePos, startBytePos + len(stylebytes)))
+
+
+    def OnUpdateUI(self, evt):
+        evt.Skip()
+        if self.styledByteRanges is None:
+            return
+
+        # Styling in chunks is running, style newly visible part first
+        startBytePos, endBytePos = self.getViewportByteRange()
+        self.stylingPriorityBytePos = startBytePos
+
+        if not self._isByteRangeStyled(startBytePos, endBytePos):
+            docPage = self.getLoadedDocPage()
+            if docPage is not None:
+                self.styleViewport(docPage.getLiveText())
+
+
+    def _applyStylingChunk(self, thread, startBytePos, stylebytes):
+        """
+        Called in main thread to show styling of a chunk created in
+        processTokensInChunks()
+        """
+        if self.stylingThreadHolder.getThread() is not thread or \
+                self.styledByteRanges is None:
+            return
+
+        if startBytePos + len(stylebytes) <= self.GetLength():
+            self.StartStyling(startBytePos, 0x1f)
+            self.SetStyleBytes(len(stylebytes), stylebytes)
+            self.styledByteRanges.append(
+                    (startBytePos, startBytePos + len(stylebytes)))
+
+
+    def _endChunkedStyling(self, thread):
+        if self.stylingThreadHolder.getThread() is thread:
+            self.styledByteRanges = None
+
+
+    def processTokensInChunks(self, text, pageAst, threadstop):
+        """
+        Like processTokens() but processes the text in chunks of
+        STYLING_CHUNK_SIZE characters and sends each to the main thread
+        to apply it. The next chunk is always the first unprocessed one at or
+        after the visible part of the editor.
+        """
+        offsetTable = self.getByteOffsetTable(text)
+        chunkSize = self.STYLING_CHUNK_SIZE
+        chunkCount = max(1, (len(text) + chunkSize - 1) // chunkSize)
+        chunkByteStarts = [offsetTable.charToByte(i * chunkSize)
+                for i in xrange(chunkCount)]
+        chunkStylebytes = [None] * chunkCount
+        thread = threading.currentThread()
+
+        # The top level nodes are walked once, each chunk only processes
+        # those overlapping it
+        topNodes = list(pageAst.iterFlatNamed())
+        nodeStarts = [node.pos for node in topNodes]
+        nodeEnds = [node.pos + node.strLength for node in topNodes]
+
+        for i in xrange(chunkCount):
+            threadstop.testValidThread()
+
+            # Find next chunk to process
+            chunk = max(0, bisect.bisect_right(chunkByteStarts,
+                    self.stylingPriorityBytePos) - 1)
+            while chunk < chunkCount and chunkStylebytes[chunk] is not None:
+                chunk += 1
+            if chunk == chunkCount:
+                chunk = chunkStylebytes.index(None)
+
+            startCharPos = chunk * chunkSize
+            endCharPos = min(startCharPos + chunkSize, len(text))
+            chunkNodes = topNodes[bisect.bisect_right(nodeEnds, startCharPos):
+                    bisect.bisect_left(nodeStarts, endCharPos)]
+            stylebytes = self.processTokens(text, pageAst, threadstop,
+                    startCharPos, endCharPos, topNodes=chunkNodes)
+            chunkStylebytes[chunk] = stylebytes
+
+            wx.CallAfter(self._applyStylingChunk, thread,
+                    chunkByteStarts[chunk], stylebytes)
+
+        return "".join(chunkStylebytes)
+
+
 
     _TOKEN_TO_STYLENO = {
         "bold": FormatTypes.Bold,
@@ -1930,15 +2137,50 @@ class WikiTxtCtrl(SearchableScintillaControl):
 
 
 
-    def processTokens(self, text, pageAst, threadstop):
+    def getByteOffsetTable(self, text):
+        """
+        Return ByteOffsetTable for text. The table of the last text is
+        reused if the same text is styled again.
+        """
+        lastText, offsetTable = self.styledTextOffsetTable
+        if lastText is not text and lastText != text:
+            offsetTable = ByteOffsetTable(text, self.bytelenSct)
+            self.styledTextOffsetTable = (text, offsetTable)
+
+        return offsetTable
+
+
+    def processTokens(self, text, pageAst, threadstop, startCharPos=0,
+            endCharPos=None, offsetTable=None, topNodes=None):
+        """
+        Return style bytes for the range startCharPos to endCharPos
+        (None: end of text) of text.
+
+        offsetTable -- ByteOffsetTable for text, if None the one of
+                getByteOffsetTable() is used
+        topNodes -- sequence of those nodes of pageAst.iterFlatNamed()
+                which overlap the range or None to check all
+        """
+        if endCharPos is None:
+            endCharPos = len(text)
+        if offsetTable is None:
+            offsetTable = self.getByteOffsetTable(text)
+        if topNodes is None:
+            topNodes = pageAst.iterFlatNamed()
+
         wikiDoc = self.presenter.getWikiDocument()
         stylebytes = StyleCollector(FormatTypes.Default,
-                text, self.bytelenSct)
+                text, self.bytelenSct, startCharPos=startCharPos,
+                offsetTable=offsetTable, endCharPos=endCharPos)
 
-        def process(pageAst, stack):
-            for node in pageAst.iterFlatNamed():
+        def process(nodes, stack):
+            for node in nodes:
                 threadstop.testValidThread()
 
+                if node.pos >= endCharPos or \
+                        node.pos + node.strLength <= startCharPos:
+                    continue
+
                 styleNo = WikiTxtCtrl._TOKEN_TO_STYLENO.get(node.name)
 
                 if styleNo is not None:
@@ -1973,12 +2215,12 @@ class WikiTxtCtrl(SearchableScintillaControl):
                     stylebytes.bindStyle(node.pos, node.strLength, styleNo)
 
                 elif node.name == "todoEntry":
-                    process(node, stack + ["todoEntry"])
+                    process(node.iterFlatNamed(), stack + ["todoEntry"])
                 elif node.name == "key" and "todoEntry" in stack:
                     stylebytes.bindStyle(node.pos, node.strLength,
                             FormatTypes.ToDo)
                 elif node.name == "value" and "todoEntry" in stack:
-                    process(node, stack[:])
+                    process(node.iterFlatNamed(), stack[:])
 
                 elif node.name == "heading":
                     if node.level < 5:
@@ -1993,17 +2235,24 @@ class WikiTxtCtrl(SearchableScintillaControl):
                         self.wikiLanguageHelper.getRecursiveStylingNodeNames() or \
                         (getattr(node, "helperRecursive", False) and \
                         not node.isTerminal()):
-                    process(node, stack[:])
+                    process(node.iterFlatNamed(), stack[:])
 
-        process(pageAst, [])
+        process(topNodes, [])
         return stylebytes.value()
 
 
-    def processSpellCheckTokens(self, text, scTokens, threadstop):
-        stylebytes = StyleCollector(0, text, self.bytelenSct)
+    def processSpellCheckTokens(self, text, scTokens, threadstop,
+            baseStyleBytes):
+        """
+        Return baseStyleBytes with spell checker indicator set for the
+        unknown words in scTokens.
+        """
+        stylebytes = StyleCollector(0, text, self.bytelenSct,
+                offsetTable=self.getByteOffsetTable(text),
+                baseStyleBytes=baseStyleBytes)
         for node in scTokens:
             threadstop.testValidThread()
-            stylebytes.bindStyle(node.pos, node.strLength,
+            stylebytes.orStyle(node.pos, node.strLength,
                     wx.stc.STC_INDIC2_MASK)
 
         return stylebytes.value()
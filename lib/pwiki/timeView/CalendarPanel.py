@@ -143,7 +143,8 @@ class CalendarPanel(wx.Window, TimePresentationBase):
             self.__sinkWikiDoc = wxKeyFunctionSink((
                     ("updated wiki page", self.onUpdateNeeded),
                     ("deleted wiki page", self.onUpdateNeeded)
-            ), self.mainControl.getCurrentWikiDocumentProxyEvent(), self)
+            ), self.mainControl.getCurrentWikiDocumentProxyEvent(), self,
+                    coalesced=True)
 
             self.__sinkApp = wxKeyFunctionSink((
                     ("options changed", self.onUpdateNeeded),
@@ -142,7 +142,8 @@ class TimelinePanel(EnhancedListControl, TimePresentationBase):
             self.__sinkWikiDoc = wxKeyFunctionSink((
                     ("updated wiki page", self.onUpdateNeeded),
                     ("deleted wiki page", self.onUpdateNeeded)
-            ), self.mainControl.getCurrentWikiDocumentProxyEvent(), self)
+            ), self.mainControl.getCurrentWikiDocumentProxyEvent(), self,
+                    coalesced=True)
 
             self.__sinkApp = wxKeyFunctionSink((
                     ("options changed", self.onUpdateNeeded),
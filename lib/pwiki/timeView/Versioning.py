@@ -4,6 +4,7 @@ Processes versions of wiki pages.
 
 import time, zlib, re
 from calendar import timegm
+from struct import pack, unpack, calcsize
 
 from ..rtlibRepl import minidom
 
@@ -13,12 +14,13 @@ from pwiki.WikiExceptions import *
 import Consts
 
 from ..MiscEvent import MiscEventSourceMixin
+from ..Utilities import LruCache
 
 from ..StringOps import applyBinCompact, getBinCompactForDiff, \
         fileContentToUnicode, BOM_UTF8, formatWxDate
 
 from ..Serialization import serToXmlUnicode, serFromXmlUnicode, serToXmlInt, \
-        serFromXmlInt, iterXmlElementFlat
+        serFromXmlInt, iterXmlElementFlat, findXmlElementFlat
 
 from ..DocPages import AbstractWikiPage
 
@@ -27,10 +29,41 @@ from ..DocPages import AbstractWikiPage
 DAMAGED = object()
 
 
+# Binary format of version overview: Magic bytes followed by format version,
+# read compatibility version and write compatibility version (each one
+# byte) and the numbers (each 4 bytes) of the chunks holding the records of
+# the version entries.
+# Format version 0 (only read) contained the records directly after
+# the header.
+OVERVIEW_BIN_MAGIC = "WDVerOv"
+OVERVIEW_BIN_HEADER = OVERVIEW_BIN_MAGIC + pack(">BBB", 1, 1, 1)
+
+# The records are stored in separate datablocks ("chunks"), chunk n
+# contains the entries with version numbers n * OVERVIEW_CHUNK_SIZE up to
+# (n + 1) * OVERVIEW_CHUNK_SIZE - 1. Adding a version therefore only
+# rewrites the last one or two chunks instead of the whole overview.
+OVERVIEW_CHUNK_SIZE = 64
+
+# Fixed part of an entry record: record length, version number, creation
+# time, content differencing, content encoding, flags, packet size (-1 if
+# unknown), length of description. Then follows the UTF-8 encoded
+# description. Later formats may append fields to the record.
+ENTRY_BIN_STRUCT = ">IIdBBBiI"
+ENTRY_BIN_FIXED_LEN = calcsize(ENTRY_BIN_STRUCT)
+
+ENTRY_BIN_FLAG_DESCRIPTION = 1
+
+_CONTENT_DIFFERENCING_TO_BIN = {u"complete": 0, u"revdiff": 1}
+_BIN_TO_CONTENT_DIFFERENCING = {0: u"complete", 1: u"revdiff"}
+
+_CONTENT_ENCODING_TO_BIN = {None: 0, u"zlib": 1}
+_BIN_TO_CONTENT_ENCODING = {0: None, 1: u"zlib"}
+
+
 class VersionEntry(object):
     __slots__ = ("creationTimeStamp", "unifiedBasePageName", "description",
             "versionNumber", "contentDifferencing", "contentEncoding",
-            "xmlNode")
+            "packetSize", "xmlNode")
 
     def __init__(self, unifiedBasePageName, description=None,
             contentDifferencing=u"revdiff", contentEncoding = None):
@@ -43,6 +76,9 @@ class VersionEntry(object):
         # "complete" or reverse differential ("revdiff") content?
         self.contentDifferencing = contentDifferencing
         self.contentEncoding = contentEncoding
+        # Size of stored reverse diff packet or None if unknown
+        # or not differential
+        self.packetSize = None
         
         self.xmlNode = None
 
@@ -89,6 +125,14 @@ class VersionEntry(object):
             serToXmlUnicode(xmlNode, xmlDoc, u"contentEncoding",
                     self.contentEncoding, replace=True)
 
+        if self.packetSize is not None:
+            serToXmlInt(xmlNode, xmlDoc, u"packetSize", self.packetSize,
+                    replace=True)
+        else:
+            subNode = findXmlElementFlat(xmlNode, u"packetSize", False)
+            if subNode is not None:
+                xmlNode.removeChild(subNode)
+
 
 
     def serializeOverviewFromXml(self, xmlNode):
@@ -111,6 +155,65 @@ class VersionEntry(object):
 
         self.contentEncoding = serFromXmlUnicode(xmlNode, u"contentEncoding", None)
 
+        self.packetSize = serFromXmlInt(xmlNode, u"packetSize", None)
+
+
+    def serializeOverviewToBin(self):
+        """
+        Return record with all overview information (not content) about
+        this object as bytestring.
+        """
+        flags = 0
+        description = ""
+        if self.description is not None:
+            flags |= ENTRY_BIN_FLAG_DESCRIPTION
+            description = self.description.encode("utf-8")
+
+        packetSize = self.packetSize
+        if packetSize is None:
+            packetSize = -1
+
+        return pack(ENTRY_BIN_STRUCT, ENTRY_BIN_FIXED_LEN + len(description),
+                self.versionNumber, self.creationTimeStamp,
+                _CONTENT_DIFFERENCING_TO_BIN[self.contentDifferencing],
+                _CONTENT_ENCODING_TO_BIN[self.contentEncoding], flags,
+                packetSize, len(description)) + description
+
+
+    def serializeOverviewFromBin(self, data, pos):
+        """
+        Set object state from record in bytestring data starting at pos.
+        Returns position after the record.
+        """
+        recLen, self.versionNumber, self.creationTimeStamp, differencing, \
+                encoding, flags, packetSize, descLen = unpack(
+                ENTRY_BIN_STRUCT, data[pos:pos + ENTRY_BIN_FIXED_LEN])
+
+        try:
+            self.contentDifferencing = \
+                    _BIN_TO_CONTENT_DIFFERENCING[differencing]
+            self.contentEncoding = _BIN_TO_CONTENT_ENCODING[encoding]
+        except KeyError:
+            raise SerializationException(
+                    "Unknown content differencing or encoding in version "
+                    "overview entry")
+
+        if flags & ENTRY_BIN_FLAG_DESCRIPTION:
+            descStart = pos + ENTRY_BIN_FIXED_LEN
+            self.description = data[descStart:descStart + descLen].decode(
+                    "utf-8", "replace")
+        else:
+            self.description = None
+
+        if packetSize < 0:
+            self.packetSize = None
+        else:
+            self.packetSize = packetSize
+
+        self.xmlNode = None
+
+        return pos + recLen
+
 
     def getUnifiedPageName(self):
         return u"versioning/packet/versionNo/%s/%s" % (self.versionNumber,
@@ -119,6 +222,15 @@ class VersionEntry(object):
 
 
 class VersionOverview(MiscEventSourceMixin):
+    # Maximum summed size in bytes of reconstructed versions kept in memory
+    VERSION_CACHE_MAX_SIZE = 4 * 1024 * 1024
+
+    # When a new version is added, the previous head version is kept
+    # complete (as keyframe) if the reverse diffs which must be applied to
+    # it to reconstruct the oldest version depending on it become larger
+    # than this factor times its size
+    KEYFRAME_DELTA_FACTOR = 1.0
+
     def __init__(self, wikiDocument, basePage=None, unifiedBasePageName=None):
         MiscEventSourceMixin.__init__(self)
 
@@ -130,8 +242,15 @@ class VersionOverview(MiscEventSourceMixin):
             self.unifiedBasePageName = unifiedBasePageName
         self.versionEntries = []
         self.maxVersionNumber = 0
+        # Raw content of reconstructed versions {versionNumber: content}
+        self.versionCache = LruCache(self.VERSION_CACHE_MAX_SIZE)
         
         self.xmlNode = None
+        # Sorted list of numbers of the chunks stored in database and set of
+        # numbers of chunks which must be written again. Both are None if
+        # unknown (e.g. after reading XML) so all chunks must be written.
+        self.storedChunkNos = []
+        self.changedChunkNos = set()
 
 
     def getUnifiedName(self):
@@ -152,12 +271,21 @@ class VersionOverview(MiscEventSourceMixin):
         Read overview from bytestring content. Needed to handle multi-page text
         imports.
         """
+        self.versionCache.clear()
+
         if content is None:
             self.versionEntries = []
             self.maxVersionNumber = 0
             self.xmlNode = None
+            self.storedChunkNos = []
+            self.changedChunkNos = set()
             return
 
+        if content.startswith(OVERVIEW_BIN_MAGIC):
+            self.serializeFromBin(content)
+            return
+
+        # Old XML format, converted to binary on next write
         xmlDoc = minidom.parseString(content)
         xmlNode = xmlDoc.firstChild
         self.serializeFromXml(xmlNode)
@@ -201,6 +329,8 @@ class VersionOverview(MiscEventSourceMixin):
             result = []
         else:
             result = [u"versioning/overview/" + unifiedPageName]
+            for chunkNo in self._getStoredChunkNos():
+                result.append(self._getChunkUnifName(chunkNo))
 
         for entry in self.versionEntries:
             result.append(u"versioning/packet/versionNo/%s/%s" % (entry.versionNumber,
@@ -241,6 +371,9 @@ class VersionOverview(MiscEventSourceMixin):
 
             self.wikiDocument.deleteDataBlock(oldUnifName)
 
+        for chunkNo in self._getStoredChunkNos():
+            self.wikiDocument.deleteDataBlock(self._getChunkUnifName(chunkNo))
+
         oldUnifName = u"versioning/overview/" + oldUnifiedPageName
         self.wikiDocument.deleteDataBlock(oldUnifName)
         
@@ -260,6 +393,9 @@ class VersionOverview(MiscEventSourceMixin):
 
             self.wikiDocument.deleteDataBlock(unifName)
 
+        for chunkNo in self._getStoredChunkNos():
+            self.wikiDocument.deleteDataBlock(self._getChunkUnifName(chunkNo))
+
         unifName = u"versioning/overview/" + self.unifiedBasePageName
         self.wikiDocument.deleteDataBlock(unifName)
 
@@ -285,6 +421,13 @@ class VersionOverview(MiscEventSourceMixin):
                 u"versioning/packet/versionNo/")
         
         dataBlocks = [db for db in dataBlocks if matOb.match(db)]
+
+        matOb = re.compile(u"^versioning/overviewchunk/[0-9]+/%s$" %
+                re.escape(unifPageName))
+        dataBlocks += [db for db in
+                wikiDocument.getDataBlockUnifNamesStartingWith(
+                u"versioning/overviewchunk/") if matOb.match(db)]
+
         dataBlocks.append(u"versioning/overview/" + unifPageName)
 
         for db in dataBlocks:
@@ -292,23 +435,251 @@ class VersionOverview(MiscEventSourceMixin):
 
 
     def writeOverview(self, unifPageName=None):
-        if unifPageName is None:
-            unifName = u"versioning/overview/" + self.unifiedBasePageName
+        """
+        Write overview to database. Only the chunks containing entries
+        which changed since last reading or writing are stored again.
+
+        unifPageName -- if not None, write the complete overview for this
+                unified base page name instead (used for renaming)
+        """
+        if unifPageName is None or unifPageName == self.unifiedBasePageName:
+            if self.changedChunkNos is None or self.storedChunkNos is None:
+                self._writeAllChunks(self.unifiedBasePageName)
+            else:
+                self._writeChangedChunks()
         else:
-            unifName = u"versioning/overview/" + unifPageName
+            self._writeAllChunks(unifPageName)
+
+
+    def _getChunkUnifName(self, chunkNo, unifiedBasePageName=None):
+        if unifiedBasePageName is None:
+            unifiedBasePageName = self.unifiedBasePageName
+
+        return u"versioning/overviewchunk/%s/%s" % (chunkNo,
+                unifiedBasePageName)
+
+
+    def _invalidateChunks(self):
+        self.storedChunkNos = None
+        self.changedChunkNos = None
+
+
+    def _markChunkChanged(self, versionNumber):
+        """
+        Mark chunk containing entry with versionNumber to be written again.
+        """
+        if self.changedChunkNos is not None:
+            self.changedChunkNos.add(versionNumber // OVERVIEW_CHUNK_SIZE)
+
+
+    def _findStoredChunkNos(self):
+        """
+        Return list of numbers of the chunks in database by searching their
+        names. Only used if they are unknown otherwise.
+        """
+        matOb = re.compile(u"^versioning/overviewchunk/([0-9]+)/%s$" %
+                re.escape(self.unifiedBasePageName))
+
+        result = []
+        for unifName in self.wikiDocument.getDataBlockUnifNamesStartingWith(
+                u"versioning/overviewchunk/"):
+            mat = matOb.match(unifName)
+            if mat:
+                result.append(int(mat.group(1)))
+
+        return result
+
+
+    def _getStoredChunkNos(self):
+        if self.storedChunkNos is None:
+            return self._findStoredChunkNos()
+
+        return self.storedChunkNos
+
+
+    def _getEntriesOfChunk(self, chunkNo):
+        """
+        Return list of version entries belonging to chunk chunkNo.
+        """
+        lowNo = chunkNo * OVERVIEW_CHUNK_SIZE
+        highNo = lowNo + OVERVIEW_CHUNK_SIZE
 
         if len(self.versionEntries) == 0:
+            return []
+
+        # Entries are sorted by version number and changed chunks are
+        # usually the first or last ones, so search from the nearer end
+        if lowNo - self.versionEntries[0].versionNumber < \
+                self.versionEntries[-1].versionNumber - lowNo:
+            result = []
+            for entry in self.versionEntries:
+                if entry.versionNumber >= highNo:
+                    break
+                if entry.versionNumber >= lowNo:
+                    result.append(entry)
+        else:
+            result = []
+            for entry in reversed(self.versionEntries):
+                if entry.versionNumber < lowNo:
+                    break
+                if entry.versionNumber < highNo:
+                    result.append(entry)
+            result.reverse()
+
+        return result
+
+
+    @staticmethod
+    def _serializeChunk(entries):
+        return "".join(entry.serializeOverviewToBin() for entry in entries)
+
+
+    def _storeMainBlock(self, unifiedBasePageName, chunkNos):
+        unifName = u"versioning/overview/" + unifiedBasePageName
+
+        if len(chunkNos) == 0:
             self.wikiDocument.deleteDataBlock(unifName)
             return
 
+        self.wikiDocument.storeDataBlock(unifName, OVERVIEW_BIN_HEADER +
+                pack(">%sI" % len(chunkNos), *chunkNos),
+                storeHint=self.getStorageHint())
+
+
+    def _writeChangedChunks(self):
+        if len(self.changedChunkNos) == 0:
+            return
+
+        chunkNos = set(self.storedChunkNos)
+        for chunkNo in self.changedChunkNos:
+            unifName = self._getChunkUnifName(chunkNo)
+            entries = self._getEntriesOfChunk(chunkNo)
+            if len(entries) == 0:
+                self.wikiDocument.deleteDataBlock(unifName)
+                chunkNos.discard(chunkNo)
+            else:
+                self.wikiDocument.storeDataBlock(unifName,
+                        self._serializeChunk(entries),
+                        storeHint=self.getStorageHint())
+                chunkNos.add(chunkNo)
+
+        self.changedChunkNos = set()
+
+        # The main block changes only if a chunk was added or removed
+        chunkNos = sorted(chunkNos)
+        if chunkNos != self.storedChunkNos:
+            self.storedChunkNos = chunkNos
+            self._storeMainBlock(self.unifiedBasePageName, chunkNos)
+
+
+    def _writeAllChunks(self, unifiedBasePageName):
+        chunks = {}
+        for entry in self.versionEntries:
+            chunks.setdefault(entry.versionNumber // OVERVIEW_CHUNK_SIZE,
+                    []).append(entry)
+
+        for chunkNo, entries in chunks.iteritems():
+            self.wikiDocument.storeDataBlock(
+                    self._getChunkUnifName(chunkNo, unifiedBasePageName),
+                    self._serializeChunk(entries),
+                    storeHint=self.getStorageHint())
+
+        chunkNos = sorted(chunks)
+
+        if unifiedBasePageName == self.unifiedBasePageName:
+            # Remove chunks which are no longer needed
+            for chunkNo in self._getStoredChunkNos():
+                if chunkNo not in chunks:
+                    self.wikiDocument.deleteDataBlock(
+                            self._getChunkUnifName(chunkNo))
+
+            self.storedChunkNos = chunkNos
+            self.changedChunkNos = set()
+
+        self._storeMainBlock(unifiedBasePageName, chunkNos)
+
+
+    def _deserializeEntries(self, data, pos):
+        """
+        Return list of version entries read from the records in bytestring
+        data starting at pos.
+        """
+        versionEntries = []
+        while pos < len(data):
+            entry = VersionEntry(self.unifiedBasePageName)
+            pos = entry.serializeOverviewFromBin(data, pos)
+            versionEntries.append(entry)
+
+        return versionEntries
+
+
+    def serializeFromBin(self, data):
+        """
+        Set object state from binary serialization data of the main
+        datablock. The chunks are read from the database.
+        """
+        formatVer, readCompatVer = unpack(">BB", data[len(OVERVIEW_BIN_MAGIC):
+                len(OVERVIEW_BIN_MAGIC) + 2])
+        if readCompatVer > 1:
+            raise SerializationException(
+                    "Wrong version no. %s for version overview" %
+                    readCompatVer)
+
+        self.xmlNode = None
+        pos = len(OVERVIEW_BIN_HEADER)
+
+        if formatVer == 0:
+            # Records directly in main datablock, converted to chunks on
+            # next write
+            versionEntries = self._deserializeEntries(data, pos)
+            self._invalidateChunks()
+        else:
+            chunkNos = list(unpack(">%sI" % ((len(data) - pos) // 4),
+                    data[pos:]))
+
+            versionEntries = []
+            for chunkNo in chunkNos:
+                chunkData = self.wikiDocument.retrieveDataBlock(
+                        self._getChunkUnifName(chunkNo), default=None)
+                if chunkData is None:
+                    raise VersioningException(_(u"Versioning data damaged"))
+
+                versionEntries += self._deserializeEntries(chunkData, 0)
+
+            self.storedChunkNos = chunkNos
+            self.changedChunkNos = set()
+
+        self.versionEntries = versionEntries
+        self.maxVersionNumber = max([0] + [entry.versionNumber
+                for entry in versionEntries])
+
+
+    def serializeToXmlBytes(self):
+        """
+        Return XML serialization of the overview as UTF-8 bytestring
+        (used for export).
+        """
         xmlDoc = minidom.getDOMImplementation().createDocument(None, None, None)
         xmlNode = self.serializeToXmlProd(xmlDoc)
 
         xmlDoc.appendChild(xmlNode)
-        content = xmlDoc.toxml("utf-8")
+        return xmlDoc.toxml("utf-8")
 
-        self.wikiDocument.storeDataBlock(unifName, content,
-                storeHint=self.getStorageHint())
+
+    @staticmethod
+    def overviewBytesToXmlBytes(wikiDocument, content, unifiedBasePageName):
+        """
+        Convert a stored version overview datablock (binary or XML)
+        to XML bytestring. The chunks of a binary overview are read
+        from wikiDocument.
+        """
+        if content is None or not content.startswith(OVERVIEW_BIN_MAGIC):
+            return content
+
+        ovw = VersionOverview(wikiDocument,
+                unifiedBasePageName=unifiedBasePageName)
+        ovw.serializeFromBin(content)
+        return ovw.serializeToXmlBytes()
 
 
     def invalidate(self):
@@ -319,6 +690,8 @@ class VersionOverview(MiscEventSourceMixin):
         self.basePage = None
         self.wikiDocument = None
         self.versionEntries = []
+        self.versionCache.clear()
+        self._invalidateChunks()
 
 
     def isInvalid(self):
@@ -392,6 +765,7 @@ class VersionOverview(MiscEventSourceMixin):
                     formatVer)
 
         self.xmlNode = xmlNode
+        self._invalidateChunks()
         
         versionEntries = []
         maxVersionNumber = 0
@@ -407,7 +781,19 @@ class VersionOverview(MiscEventSourceMixin):
         self.maxVersionNumber = maxVersionNumber
 
 
+    def _getPacketUnifName(self, versionNumber):
+        return u"versioning/packet/versionNo/%s/%s" % (versionNumber,
+                self.unifiedBasePageName)
+
+
     def getVersionContentRaw(self, versionNumber):
+        """
+        Return content of version as bytestring. Starting from the nearest
+        newer version which is either cached or stored completely, the
+        reverse diffs are applied. All needed packets are retrieved at once
+        and all reconstructed versions are cached, so stepping to an
+        adjacent version needs at most one diff application.
+        """
         if len(self.versionEntries) == 0:
             raise InternalError(u"Tried to retrieve non-existing "
                     u"version number %s from empty list." % versionNumber)
@@ -415,50 +801,60 @@ class VersionOverview(MiscEventSourceMixin):
         if versionNumber == -1:
             versionNumber = self.versionEntries[-1].versionNumber
 
-        base = None
-        workList = []
-        for i in xrange(len(self.versionEntries) - 1, -1, -1):
-            entry = self.versionEntries[i]
-            if entry.contentDifferencing == u"complete":
-                workList = []
-                base = entry
-            else:
-                workList.append(entry)
+        content = self.versionCache.get(versionNumber)
+        if content is not None:
+            return content
 
-            if entry.versionNumber == versionNumber:
+        for idx in xrange(len(self.versionEntries) - 1, -1, -1):
+            if self.versionEntries[idx].versionNumber == versionNumber:
                 break
         else:
             raise InternalError(u"Tried to retrieve non-existing "
                     u"version number %s." % versionNumber)
 
+        base = None
+        for baseIdx in xrange(idx, len(self.versionEntries)):
+            entry = self.versionEntries[baseIdx]
+            if baseIdx > idx and entry.versionNumber in self.versionCache:
+                base = entry
+                content = self.versionCache.get(entry.versionNumber)
+                break
+            if entry.contentDifferencing == u"complete":
+                base = entry
+                break
+
         if base is None:
             raise InternalError(u"No base version found for getVersionContent(%s)" %
                     versionNumber)
 
-        unifName = u"versioning/packet/versionNo/%s/%s" % (base.versionNumber,
-                self.unifiedBasePageName)
+        workList = self.versionEntries[idx:baseIdx]
+        workList.reverse()
 
-        content = self.wikiDocument.retrieveDataBlock(unifName, default=DAMAGED)
-        if content is DAMAGED:
-            raise VersioningException(_(u"Versioning data damaged"))
-        elif content is None:
-            raise InternalError(u"Tried to retrieve non-existing "
-                    u"packet for version number %s" % versionNumber)
+        unifNames = [self._getPacketUnifName(entry.versionNumber)
+                for entry in workList]
+        if content is None:
+            unifNames.append(self._getPacketUnifName(base.versionNumber))
 
-        content = self.decodeContent(content, entry.contentEncoding)
+        packets = self.wikiDocument.retrieveDataBlocks(unifNames,
+                default=DAMAGED)
 
-        for entry in workList:
-            unifName = u"versioning/packet/versionNo/%s/%s" % (entry.versionNumber,
-                    self.unifiedBasePageName)
-            packet = self.wikiDocument.retrieveDataBlock(unifName, default=None)
-            if content is DAMAGED:
+        for packet in packets.itervalues():
+            if packet is DAMAGED:
                 raise VersioningException(_(u"Versioning data damaged"))
-            elif content is None:
+            elif packet is None:
                 raise InternalError(u"Tried to retrieve non-existing "
                         u"packet for version number %s" % versionNumber)
 
+        if content is None:
+            content = self.decodeContent(
+                    packets[self._getPacketUnifName(base.versionNumber)],
+                    base.contentEncoding)
+            self.versionCache.put(base.versionNumber, content, len(content))
 
-            content = applyBinCompact(content, packet)
+        for entry in workList:
+            content = applyBinCompact(content,
+                    packets[self._getPacketUnifName(entry.versionNumber)])
+            self.versionCache.put(entry.versionNumber, content, len(content))
 
         return content
 
@@ -467,6 +863,23 @@ class VersionOverview(MiscEventSourceMixin):
         return fileContentToUnicode(self.getVersionContentRaw(versionNumber))
 
 
+    def _isKeyframeNeeded(self, newPacketSize, prevHeadSize):
+        """
+        Called by addVersion(). Returns True if the previous head version
+        should stay complete because otherwise the chain of reverse diffs
+        ending at it would be larger than allowed by KEYFRAME_DELTA_FACTOR.
+        Packets of unknown size (stored by older versions) are not counted.
+        """
+        chainSize = newPacketSize
+        for entry in reversed(self.versionEntries[:-2]):
+            if entry.contentDifferencing == u"complete":
+                break
+            if entry.packetSize is not None:
+                chainSize += entry.packetSize
+
+        return chainSize > prevHeadSize * self.KEYFRAME_DELTA_FACTOR
+
+
     def addVersion(self, content, entry):
         """
         entry.versionNumber is assumed invalid and will be filled by this function.
@@ -503,7 +916,10 @@ class VersionOverview(MiscEventSourceMixin):
         entry.unifiedBasePageName = self.unifiedBasePageName
         entry.contentDifferencing = "complete"
         entry.contentEncoding = None
+        entry.packetSize = None
         self.versionEntries.append(entry)
+        self.versionCache.put(newHeadVerNo, content, len(content))
+        self._markChunkChanged(newHeadVerNo)
 
         if len(self.versionEntries) > 1:
             if asRevDiff:
@@ -514,11 +930,15 @@ class VersionOverview(MiscEventSourceMixin):
                         self.unifiedBasePageName)
                 diffPacket = getBinCompactForDiff(content, prevHeadContent)
 
-                if len(diffPacket) < len(prevHeadContent):
+                if len(diffPacket) < len(prevHeadContent) and \
+                        not self._isKeyframeNeeded(len(diffPacket),
+                        len(prevHeadContent)):
                     prevHeadEntry.contentDifferencing = "revdiff"
                     prevHeadEntry.contentEncoding = None
+                    prevHeadEntry.packetSize = len(diffPacket)
                     self.wikiDocument.storeDataBlock(unifName, diffPacket,
                             storeHint=self.getStorageHint())
+                    self._markChunkChanged(prevHeadEntry.versionNumber)
 
         self.fireMiscEventKeys(("appended version", "changed version overview"))
 
@@ -538,6 +958,8 @@ class VersionOverview(MiscEventSourceMixin):
 
             self.wikiDocument.deleteDataBlock(unifName)
             del self.versionEntries[0]
+            self.versionCache.pop(versionNumber)
+            self._markChunkChanged(versionNumber)
             self.fireMiscEventKeys(("deleted version", "changed version overview"))
 
             return
@@ -554,6 +976,7 @@ class VersionOverview(MiscEventSourceMixin):
             unifName = u"versioning/packet/versionNo/%s/%s" % (prevHeadEntry.versionNumber,
                     self.unifiedBasePageName)
             prevHeadEntry.contentDifferencing = "complete"
+            prevHeadEntry.packetSize = None
             self.wikiDocument.storeDataBlock(unifName, newContent,
                     storeHint=self.getStorageHint())
                 
@@ -561,6 +984,9 @@ class VersionOverview(MiscEventSourceMixin):
                     self.unifiedBasePageName)
             self.wikiDocument.deleteDataBlock(unifName)
             del self.versionEntries[-1]
+            self.versionCache.pop(versionNumber)
+            self._markChunkChanged(prevHeadEntry.versionNumber)
+            self._markChunkChanged(versionNumber)
             self.fireMiscEventKeys(("deleted version", "changed version overview"))
 
             return
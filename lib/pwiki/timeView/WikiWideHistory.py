@@ -1,5 +1,6 @@
 import traceback, time
 from calendar import timegm
+from struct import pack, unpack, calcsize
 
 import wx
 
@@ -19,15 +20,38 @@ from .. import DocPages
 
 DAMAGED = object()
 
+
+# Binary format of wiki-wide history: Magic bytes followed by format version,
+# read compatibility version and write compatibility version (each one
+# byte) and the records of the history entries
+HISTORY_BIN_MAGIC = "WDWWHist"
+HISTORY_BIN_HEADER = HISTORY_BIN_MAGIC + pack(">BBB", 0, 0, 0)
+
+# Fixed part of an entry record: record length, visited time, length of
+# unified page name. Then follows the UTF-8 encoded unified page name.
+ENTRY_BIN_STRUCT = ">IdI"
+ENTRY_BIN_FIXED_LEN = calcsize(ENTRY_BIN_STRUCT)
+
+# Entries added since the history was last compacted are appended as
+# "wikiwidehistory/log/<n>" datablocks (same binary format) instead of
+# rewriting the whole "wikiwidehistory" datablock. The log is merged into
+# the main datablock when it has HISTORY_LOG_COMPACT_COUNT datablocks or
+# when already stored entries were changed (rename, delete, clear).
+HISTORY_LOG_PREFIX = u"wikiwidehistory/log/"
+HISTORY_LOG_COMPACT_COUNT = 20
+
+
 class HistoryEntry(object):
     __slots__ = ("visitedTimeStamp", "unifiedPageName",
-            "xmlNode")
+            "xmlNode", "binRecord")
 
     def __init__(self, unifiedPageName=None):
 
         self.unifiedPageName = unifiedPageName
         self.visitedTimeStamp = time.time()
         self.xmlNode = None
+        # Cached binary record, None if not yet created or outdated
+        self.binRecord = None
 
 
     def getFormattedVisitedDate(self, formatStr):
@@ -75,6 +99,36 @@ class HistoryEntry(object):
                 "%Y-%m-%d/%H:%M:%S"))
 
 
+    def serializeToBin(self):
+        """
+        Return record with all information about this object as bytestring.
+        """
+        if self.binRecord is None:
+            name = self.unifiedPageName.encode("utf-8")
+            self.binRecord = pack(ENTRY_BIN_STRUCT,
+                    ENTRY_BIN_FIXED_LEN + len(name), self.visitedTimeStamp,
+                    len(name)) + name
+
+        return self.binRecord
+
+
+    def serializeFromBin(self, data, pos):
+        """
+        Set object state from record in bytestring data starting at pos.
+        Returns position after the record.
+        """
+        recLen, self.visitedTimeStamp, nameLen = unpack(ENTRY_BIN_STRUCT,
+                data[pos:pos + ENTRY_BIN_FIXED_LEN])
+
+        nameStart = pos + ENTRY_BIN_FIXED_LEN
+        self.unifiedPageName = data[nameStart:nameStart + nameLen].decode(
+                "utf-8", "replace")
+        self.xmlNode = None
+        self.binRecord = data[pos:pos + recLen]
+
+        return pos + recLen
+
+
     def getUnifiedPageName(self):
         return self.unifiedPageName
 
@@ -101,6 +155,14 @@ class WikiWideHistory(object, MiscEventSourceMixin):
         self.historyEntries = []
         self.wikiDocument = wikiDocument
         self.xmlNode = None
+        # True if entries changed since last reading or writing
+        self.modified = False
+        # Entries added since last writing, appended to the log on next write
+        self.unwrittenEntries = []
+        # True if stored entries were changed so the log must be compacted
+        self.needsCompaction = False
+        # Numbers of the stored log datablocks
+        self.logNumbers = []
 
 #         self.mainControlSink = KeyFunctionSink((
 #                 ("opened wiki", self.onOpenedWiki),
@@ -142,6 +204,7 @@ class WikiWideHistory(object, MiscEventSourceMixin):
 
 
     def onChangedConfiguration(self, miscevt):
+        # The limit is also applied when reading, so nothing must be written
         self.limitEntries()
         self.fireMiscEventKeys(("changed wiki wide history",))
 
@@ -172,14 +235,19 @@ class WikiWideHistory(object, MiscEventSourceMixin):
             # Page is neither a wiki page nor a standard functional page
             return
 
-        self.historyEntries.append(HistoryEntry(upname))
+        entry = HistoryEntry(upname)
+        self.historyEntries.append(entry)
+        self.unwrittenEntries.append(entry)
 
         self.limitEntries()
+        self.modified = True
         self.fireMiscEventKeys(("changed wiki wide history",))
 
 
     def clearAll(self):
         self.historyEntries = []
+        self.needsCompaction = True
+        self.modified = True
         self.fireMiscEventKeys(("changed wiki wide history",))
 
 
@@ -191,9 +259,16 @@ class WikiWideHistory(object, MiscEventSourceMixin):
         
         # print "onDeletedWikiPage1",  self.pos, repr(self.historyEntries)
 
-        self.historyEntries = [w for w in self.historyEntries
+        historyEntries = [w for w in self.historyEntries
                 if w.unifiedPageName != upname]
-                
+        if len(historyEntries) == len(self.historyEntries):
+            return
+
+        self.historyEntries = historyEntries
+        self.unwrittenEntries = [w for w in self.unwrittenEntries
+                if w.unifiedPageName != upname]
+        self.needsCompaction = True
+        self.modified = True
         self.fireMiscEventKeys(("changed wiki wide history",))
 
 
@@ -204,10 +279,18 @@ class WikiWideHistory(object, MiscEventSourceMixin):
         oldUpname = u"wikipage/" + miscevt.get("wikiPage").getWikiWord()
         newUpname = u"wikipage/" + miscevt.get("newWord")
         
+        found = False
         for i in xrange(len(self.historyEntries)):
             if self.historyEntries[i].unifiedPageName == oldUpname:
                 self.historyEntries[i].unifiedPageName = newUpname
-                
+                self.historyEntries[i].binRecord = None
+                found = True
+
+        if not found:
+            return
+
+        self.needsCompaction = True
+        self.modified = True
         self.fireMiscEventKeys(("changed wiki wide history",))
 
 
@@ -216,15 +299,25 @@ class WikiWideHistory(object, MiscEventSourceMixin):
         Read overview from bytestring content. Needed to handle multi-page text
         imports.
         """
+        self.modified = False
+        self.unwrittenEntries = []
+        self.needsCompaction = False
         try:
             if content is None:
                 self.historyEntries = []
                 self.xmlNode = None
                 return
-    
+
+            if content.startswith(HISTORY_BIN_MAGIC):
+                self.serializeFromBin(content)
+                return
+
+            # Old XML format, converted to binary on next write
             xmlDoc = minidom.parseString(content)
             xmlNode = xmlDoc.firstChild
             self.serializeFromXml(xmlNode)
+            self.needsCompaction = True
+            self.modified = True
         except:
             traceback.print_exc()
             self.historyEntries = []
@@ -240,31 +333,137 @@ class WikiWideHistory(object, MiscEventSourceMixin):
 
         content = self.wikiDocument.retrieveDataBlock(unifName, default=DAMAGED)
         if content is DAMAGED:
-            self.historyEntries = []
-            self.xmlNode = None
-            return
+            content = None
 
         self.readOverviewFromBytes(content)
+        self.readLog()
 
         self.fireMiscEventKeys(("reread wiki wide history",
                 "changed wiki wide history"))
 
 
+    def readLog(self):
+        """
+        Append the entries of the log datablocks to the entries read from
+        the main datablock.
+        """
+        logNames = {}
+        for logName in self.wikiDocument.getDataBlockUnifNamesStartingWith(
+                HISTORY_LOG_PREFIX):
+            try:
+                logNames[int(logName[len(HISTORY_LOG_PREFIX):])] = logName
+            except ValueError:
+                continue
+
+        self.logNumbers = sorted(logNames)
+        if len(self.logNumbers) == 0:
+            return
+
+        contents = self.wikiDocument.retrieveDataBlocks(logNames.values(),
+                default=None)
+        for n in self.logNumbers:
+            content = contents.get(logNames[n])
+            if content is None or not content.startswith(HISTORY_BIN_MAGIC):
+                continue
+            try:
+                self.historyEntries += self._entriesFromBin(content)
+            except:
+                traceback.print_exc()
+
+        self.limitEntries()
+
+
     def writeOverview(self):
+        """
+        Write history to database if it was modified. New entries are
+        appended as a log datablock, the whole history (limited by option
+        "wikiWideHistory_maxEntries") is only rewritten into one datablock
+        if stored entries were changed or the log became too long.
+        """
+        if not self.modified:
+            return
+
+        self.modified = False
+
+        if self.needsCompaction or \
+                len(self.logNumbers) >= HISTORY_LOG_COMPACT_COUNT:
+            self.compact()
+            return
+
+        if len(self.unwrittenEntries) == 0:
+            return
+
+        if len(self.logNumbers) == 0:
+            n = 0
+        else:
+            n = self.logNumbers[-1] + 1
+
+        self.wikiDocument.storeDataBlock(HISTORY_LOG_PREFIX + unicode(n),
+                HISTORY_BIN_HEADER + "".join(entry.serializeToBin()
+                for entry in self.unwrittenEntries),
+                storeHint=Consts.DATABLOCK_STOREHINT_INTERN)
+
+        self.logNumbers.append(n)
+        self.unwrittenEntries = []
+
+
+    def compact(self):
+        """
+        Write the whole history into the main datablock and delete the log.
+        """
         unifName = u"wikiwidehistory"
 
         if len(self.historyEntries) == 0:
             self.wikiDocument.deleteDataBlock(unifName)
-            return
+        else:
+            self.wikiDocument.storeDataBlock(unifName, self.serializeToBin(),
+                    storeHint=Consts.DATABLOCK_STOREHINT_INTERN)
 
-        xmlDoc = minidom.getDOMImplementation().createDocument(None, None, None)
-        xmlNode = self.serializeToXmlProd(xmlDoc)
+        for n in self.logNumbers:
+            self.wikiDocument.deleteDataBlock(HISTORY_LOG_PREFIX + unicode(n))
 
-        xmlDoc.appendChild(xmlNode)
-        content = xmlDoc.toxml("utf-8")
+        self.logNumbers = []
+        self.unwrittenEntries = []
+        self.needsCompaction = False
 
-        self.wikiDocument.storeDataBlock(unifName, content,
-                storeHint=Consts.DATABLOCK_STOREHINT_INTERN)
+
+    def serializeToBin(self):
+        """
+        Return binary serialization of the history. Records of entries are
+        cached, so only those of new or renamed entries are created.
+        """
+        return HISTORY_BIN_HEADER + "".join(entry.serializeToBin()
+                for entry in self.historyEntries)
+
+
+    def serializeFromBin(self, data):
+        """
+        Set object state from binary serialization data.
+        """
+        self.xmlNode = None
+
+        self.historyEntries = self._entriesFromBin(data)
+
+
+    @staticmethod
+    def _entriesFromBin(data):
+        """
+        Return list of entries in binary serialization data (either of main
+        datablock or of a log datablock).
+        """
+        readCompatVer = unpack(">B", data[len(HISTORY_BIN_MAGIC) + 1:
+                len(HISTORY_BIN_HEADER) - 1])[0]
+        if readCompatVer > 0:
+            return []
+
+        historyEntries = []
+        pos = len(HISTORY_BIN_HEADER)
+        while pos < len(data):
+            entry = HistoryEntry()
+            pos = entry.serializeFromBin(data, pos)
+            historyEntries.append(entry)
+
+        return historyEntries
 
 
     def serializeToXmlProd(self, xmlDoc):
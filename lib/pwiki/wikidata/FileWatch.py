@@ -0,0 +1,317 @@
+"""
+Watching the page files of a wiki for changes done outside of WikidPad
+(external editor, synchronization tools, ...).
+
+On Linux inotify is used (through ctypes), on other systems or if inotify
+is not available the directory can be polled instead.
+"""
+
+import os, os.path, time, struct, select, threading, traceback
+
+from ..StringOps import pathEnc, pathDec
+from ..Utilities import callInMainThreadAsync
+
+
+class InotifyWatcher(object):
+    """
+    Reports changed files of a directory using the Linux inotify API.
+    Raises OSError on construction if inotify isn't available.
+    """
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+
+    WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+            IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+    # Events after which the directory must be scanned completely
+    RESCAN_MASK = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, dirPath, suffix):
+        import ctypes, ctypes.util
+
+        libcName = ctypes.util.find_library("c")
+        if libcName is None:
+            raise OSError("inotify: libc not found")
+
+        try:
+            libc = ctypes.CDLL(libcName, use_errno=True)
+            inotify_init = libc.inotify_init
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError), e:
+            raise OSError("inotify not supported: %s" % e)
+
+        inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p,
+                ctypes.c_uint32)
+
+        self.suffix = suffix
+        self.fd = inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+
+        if inotify_add_watch(self.fd, pathEnc(dirPath), self.WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            self.fd = -1
+            raise OSError(errno, "inotify_add_watch failed")
+
+        self.buffer = ""
+
+
+    def waitForChanges(self, timeout):
+        """
+        Wait up to timeout seconds for changes. Returns tuple
+        (fileNames, rescan) with the set of names of changed, added or
+        removed files and a flag if the whole directory must be rescanned
+        because not all changes could be reported.
+        """
+        fileNames = set()
+        rescan = False
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return fileNames, rescan
+
+        self.buffer += os.read(self.fd, 65536)
+
+        hSize = self.EVENT_HEADER.size
+        pos = 0
+        while len(self.buffer) - pos >= hSize:
+            wd, mask, cookie, nameLen = self.EVENT_HEADER.unpack_from(
+                    self.buffer, pos)
+            if len(self.buffer) - pos < hSize + nameLen:
+                break
+
+            name = self.buffer[pos + hSize:pos + hSize + nameLen].rstrip("\0")
+            pos += hSize + nameLen
+
+            if mask & self.RESCAN_MASK:
+                rescan = True
+            elif name:
+                name = pathDec(name)
+                if name.endswith(self.suffix):
+                    fileNames.add(name)
+
+        self.buffer = self.buffer[pos:]
+
+        return fileNames, rescan
+
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+
+class PollingWatcher(object):
+    """
+    Reports changed files of a directory by comparing size and modification
+    time of all files in regular intervals.
+    """
+    def __init__(self, dirPath, suffix, pollInterval=10.0):
+        self.dirPath = dirPath
+        self.suffix = suffix
+        self.pollInterval = pollInterval
+        # Dictionary {fileName: (size, modification time)} from last scan,
+        # None before first scan
+        self.fileStats = None
+        self.nextScanTime = 0
+
+
+    def _scan(self):
+        result = {}
+        for name in os.listdir(self.dirPath):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                st = os.stat(os.path.join(self.dirPath, name))
+            except OSError:
+                continue
+
+            result[name] = (st.st_size, st.st_mtime)
+
+        return result
+
+
+    def waitForChanges(self, timeout):
+        """
+        See InotifyWatcher.waitForChanges()
+        """
+        waitTime = self.nextScanTime - time.time()
+        if waitTime > timeout:
+            time.sleep(timeout)
+            return set(), False
+
+        if waitTime > 0:
+            time.sleep(waitTime)
+
+        self.nextScanTime = time.time() + self.pollInterval
+
+        try:
+            fileStats = self._scan()
+        except OSError:
+            # Directory not accessible, maybe temporarily (network drive)
+            return set(), False
+
+        oldFileStats = self.fileStats
+        self.fileStats = fileStats
+
+        if oldFileStats is None:
+            # First scan is just the base to compare to
+            return set(), False
+
+        fileNames = set(name for name, stat in fileStats.iteritems()
+                if oldFileStats.get(name) != stat)
+        fileNames.update(name for name in oldFileStats
+                if name not in fileStats)
+
+        return fileNames, False
+
+
+    def close(self):
+        pass
+
+
+
+def createWatcher(dirPath, suffix, allowPolling):
+    """
+    Return an InotifyWatcher if possible. Otherwise return a PollingWatcher
+    if allowPolling is true or None if it isn't.
+    """
+    try:
+        return InotifyWatcher(dirPath, suffix)
+    except OSError:
+        pass
+
+    if allowPolling:
+        return PollingWatcher(dirPath, suffix)
+
+    return None
+
+
+
+class PageFileWatchService(object):
+    """
+    Runs a watcher in a daemon thread and calls
+    callback(fileNames, rescan) in the main thread for each batch of
+    changes. Changes are collected until no new ones arrive for SETTLE_TIME
+    seconds (or for at most MAX_DELAY seconds) so that a file written
+    in multiple steps is only reported once.
+    """
+    SETTLE_TIME = 0.5
+    MAX_DELAY = 5.0
+    IDLE_TIMEOUT = 1.0
+
+    def __init__(self, watcher, callback):
+        self.watcher = watcher
+        self.callback = callback
+        self.stopFlag = False
+        # True if the thread should end without closing the watcher
+        self.pauseFlag = False
+        self.thread = None
+        # Changes not yet reported, kept here while paused
+        self.pendingNames = set()
+        self.pendingRescan = False
+        self.firstChangeTime = None
+        # Held while the callback runs so stop() doesn't return during a
+        # call. Reentrant as the callback may stop the service itself
+        self.callbackLock = threading.RLock()
+
+
+    def start(self):
+        """
+        Start watching or resume after pause().
+        """
+        self.stopFlag = False
+        self.pauseFlag = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+
+    def stop(self):
+        """
+        Stop watching. The thread ends and closes the watcher after
+        its current wait. If the callback is running in another thread
+        (there is no main loop, see Utilities.callInMainThreadAsync())
+        this waits until it returns.
+        """
+        with self.callbackLock:
+            self.stopFlag = True
+            self.pauseFlag = False
+            if self.thread is None:
+                # Not started or paused
+                self.watcher.close()
+
+
+    def pause(self):
+        """
+        End the thread and wait until it ended, but keep the watcher open
+        so that changes made meanwhile are reported after start() is called
+        again.
+        """
+        with self.callbackLock:
+            thread = self.thread
+            if thread is None:
+                return
+            self.stopFlag = True
+            self.pauseFlag = True
+
+        if thread is not threading.currentThread():
+            thread.join()
+
+
+    def _run(self):
+        try:
+            while not self.stopFlag:
+                if self.firstChangeTime is None:
+                    timeout = self.IDLE_TIMEOUT
+                else:
+                    timeout = self.SETTLE_TIME
+
+                try:
+                    fileNames, rescan = self.watcher.waitForChanges(timeout)
+                except (IOError, OSError, select.error):
+                    traceback.print_exc()
+                    return
+
+                if self.stopFlag:
+                    return
+
+                if fileNames or rescan:
+                    self.pendingNames.update(fileNames)
+                    self.pendingRescan = self.pendingRescan or rescan
+                    if self.firstChangeTime is None:
+                        self.firstChangeTime = time.time()
+
+                    if time.time() - self.firstChangeTime < self.MAX_DELAY:
+                        continue
+                elif self.firstChangeTime is None:
+                    continue
+
+                callInMainThreadAsync(self._callCallback,
+                        frozenset(self.pendingNames), self.pendingRescan)
+
+                self.pendingNames = set()
+                self.pendingRescan = False
+                self.firstChangeTime = None
+        finally:
+            with self.callbackLock:
+                self.thread = None
+                if not self.pauseFlag:
+                    self.watcher.close()
+
+
+    def _callCallback(self, fileNames, rescan):
+        with self.callbackLock:
+            if not self.stopFlag:
+                self.callback(fileNames, rescan)
@@ -0,0 +1,454 @@
+"""
+Scanning the page files of a file-per-page wiki for a wiki-wide search.
+
+Files are read by a pool of threads. Before a file is decoded, its raw
+bytes are checked against the literal strings the search requires (see
+SearchAndReplace.AbstractSearchNode.getRequiredLiterals()) so that most
+non-matching pages are skipped without decoding. Decoded content can be
+kept in a PageContentCache between searches.
+"""
+
+from __future__ import with_statement
+
+import os, os.path, re, mmap, threading, traceback, Queue
+from codecs import BOM_UTF8, BOM_UTF16_BE, BOM_UTF16_LE
+
+from ..StringOps import mbcsEnc, mbcsDec, fileContentToUnicode, \
+        longPathEnc, pathEnc, getFileSignatureBlock
+from ..Utilities import LruCache
+
+
+
+# Dictionary {char: list of case-equivalent chars}, built on first use
+_caseEquivalents = None
+
+def _getCaseEquivalents(ch):
+    """
+    Return list of characters a case-insensitive unicode regex may treat as
+    equal to ch (chars with the same lowercase or uppercase, a superset is
+    harmless). Returns None for characters outside of the BMP.
+    """
+    global _caseEquivalents
+
+    if ord(ch) > 0xffff:
+        return None
+
+    if _caseEquivalents is None:
+        # Union-find over the relations "is lowercase of" and "is
+        # uppercase of"
+        parent = {}
+
+        def find(c):
+            while parent.get(c, c) != c:
+                c = parent[c]
+            return c
+
+        for cp in xrange(0x10000):
+            c = unichr(cp)
+            for other in (c.lower(), c.upper()):
+                if len(other) == 1 and other != c:
+                    rootC = find(c)
+                    rootO = find(other)
+                    if rootC != rootO:
+                        parent[rootC] = rootO
+
+        classes = {}
+        for c in parent:
+            classes.setdefault(find(c), []).append(c)
+
+        equivs = {}
+        for root, members in classes.iteritems():
+            if root not in members:
+                members.append(root)
+            for c in members:
+                equivs[c] = members
+
+        _caseEquivalents = equivs
+
+    return _caseEquivalents.get(ch, [ch])
+
+
+
+def _encodeChar(ch, encoding):
+    """
+    Return bytestring for ch in encoding ("utf-8" or "mbcs") or None
+    if it can't be encoded reliably.
+    """
+    try:
+        if encoding == "utf-8":
+            return ch.encode("utf-8")
+
+        enc = mbcsEnc(ch, "strict")[0]
+        # Some codecs replace unencodable characters instead of failing
+        if mbcsDec(enc, "strict")[0] != ch:
+            return None
+
+        return enc
+    except UnicodeError:
+        return None
+
+
+def _splitChars(literal):
+    """
+    Return list of the characters of literal with a surrogate pair (as used
+    by narrow builds for characters outside of the BMP) as one item, or None
+    if literal contains a lone surrogate.
+    """
+    result = []
+    i = 0
+    while i < len(literal):
+        ch = literal[i]
+        if u"\ud800" <= ch <= u"\udbff" and i + 1 < len(literal) and \
+                u"\udc00" <= literal[i + 1] <= u"\udfff":
+            result.append(literal[i:i + 2])
+            i += 2
+            continue
+        if u"\ud800" <= ch <= u"\udfff":
+            return None
+        result.append(ch)
+        i += 1
+
+    return result
+
+
+def _buildLiteralRegex(literal, ignoreCase, encoding):
+    """
+    Return compiled regex for bytestrings which may contain literal
+    in the given encoding or None if no such regex can be built.
+    """
+    chars = _splitChars(literal)
+    if chars is None:
+        return None
+
+    parts = []
+    for ch in chars:
+        if len(ch) > 1:
+            # Surrogate pair, the regex compares the halves on their own
+            # and they have no case variants
+            variants = [ch]
+        elif ignoreCase:
+            variants = _getCaseEquivalents(ch)
+            if variants is None:
+                return None
+        else:
+            variants = [ch]
+
+        encVariants = []
+        for v in variants:
+            enc = _encodeChar(v, encoding)
+            if enc is not None:
+                encVariants.append(enc)
+
+        if not encVariants:
+            return None
+
+        if len(encVariants) == 1:
+            parts.append(re.escape(encVariants[0]))
+        else:
+            parts.append("(?:" + "|".join(re.escape(e) for e in encVariants)
+                    + ")")
+
+    if encoding != "utf-8":
+        # Encoding must be stateless, i.e. the encoded literal is the
+        # concatenation of its encoded characters
+        enc = "".join(_encodeChar(ch, encoding) or "" for ch in chars)
+        try:
+            if mbcsEnc(literal, "strict")[0] != enc:
+                return None
+        except UnicodeError:
+            return None
+
+    return re.compile("".join(parts))
+
+
+
+class BytesPrefilter(object):
+    """
+    Checks raw page file content against a description of required
+    literals as returned by getRequiredLiterals() of a search operation.
+    """
+    def __init__(self, requiredLiterals):
+        self.requiredLiterals = requiredLiterals
+        # Dictionary {encoding: compiled test tree}
+        self.compiled = {}
+        self.lock = threading.Lock()
+
+
+    def _compile(self, desc, encoding):
+        """
+        Returns tree of tuples like the description but with regexes
+        instead of literals. A literal which can't be represented
+        becomes None (= may match).
+        """
+        if desc[0] == "literal":
+            rex = _buildLiteralRegex(desc[1], desc[2], encoding)
+            if rex is None:
+                return None
+            return ("literal", rex)
+
+        left = self._compile(desc[1], encoding)
+        right = self._compile(desc[2], encoding)
+
+        if desc[0] == "and":
+            if left is None:
+                return right
+            if right is None:
+                return left
+        else:  # "or"
+            if left is None or right is None:
+                return None
+
+        return (desc[0], left, right)
+
+
+    def _getCompiled(self, encoding):
+        with self.lock:
+            try:
+                return self.compiled[encoding]
+            except KeyError:
+                comp = self._compile(self.requiredLiterals, encoding)
+                self.compiled[encoding] = comp
+                return comp
+
+
+    @staticmethod
+    def _test(comp, data):
+        if comp[0] == "literal":
+            return comp[1].search(data) is not None
+        elif comp[0] == "and":
+            return BytesPrefilter._test(comp[1], data) and \
+                    BytesPrefilter._test(comp[2], data)
+        else:
+            return BytesPrefilter._test(comp[1], data) or \
+                    BytesPrefilter._test(comp[2], data)
+
+
+    def mightMatch(self, data):
+        """
+        Return False if page file content data (bytestring or mmap)
+        can't match the search, True if it may match.
+        """
+        if self.requiredLiterals is None:
+            return True
+
+        head = data[:3]
+        if head.startswith(BOM_UTF8):
+            encoding = "utf-8"
+        elif head.startswith(BOM_UTF16_BE) or head.startswith(BOM_UTF16_LE):
+            return True
+        else:
+            encoding = "mbcs"
+
+        comp = self._getCompiled(encoding)
+        if comp is None:
+            return True
+
+        return self._test(comp, data)
+
+
+
+class PageContentCache(object):
+    """
+    Holds decoded content of page files. An entry is only valid as long as
+    the file signature block (size and modification time) of the file is
+    unchanged. If the summed length of cached content exceeds maxSize
+    characters, least recently used entries are removed.
+    """
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        # LruCache {filePath: (fileSignature, content)}
+        self.entries = LruCache(maxSize)
+
+
+    def isEnabled(self):
+        return self.maxSize > 0
+
+
+    def get(self, filePath, fileSignature):
+        with self.entries.lock:
+            entry = self.entries.get(filePath)
+            if entry is None:
+                return None
+            if entry[0] != fileSignature:
+                self.entries.pop(filePath)
+                return None
+
+            return entry[1]
+
+
+    def put(self, filePath, fileSignature, content):
+        if len(content) > self.maxSize // 4:
+            # Don't let a single page push out everything else
+            return
+
+        self.entries.put(filePath, (fileSignature, content), len(content))
+
+
+    def clear(self):
+        self.entries.clear()
+
+
+
+class _MissingFile(Exception):
+    pass
+
+
+class PageFileScanner(object):
+    """
+    Reads page files with a pool of threads and delivers the decoded
+    content of those pages which may match a search.
+    """
+    # Files of at least this size are memory mapped for the prefilter test
+    # so they are only copied into memory if they may match
+    MMAP_MIN_SIZE = 1024 * 1024
+
+    # Maximum number of decoded pages waiting for the consumer per thread
+    QUEUE_SIZE_PER_THREAD = 8
+
+    def __init__(self, dataDir, requiredLiterals=None, threadCount=4,
+            contentCache=None):
+        """
+        dataDir -- directory the relative file paths are based on
+        requiredLiterals -- description of literals a matching page
+                must contain (see BytesPrefilter) or None
+        threadCount -- number of reading threads, 0 or 1 reads in the
+                calling thread
+        contentCache -- PageContentCache or None
+        """
+        self.dataDir = dataDir
+        self.prefilter = BytesPrefilter(requiredLiterals)
+        self.threadCount = threadCount
+        if contentCache is not None and not contentCache.isEnabled():
+            contentCache = None
+        self.contentCache = contentCache
+
+
+    def _readPage(self, filePath):
+        """
+        Return decoded content of page file filePath (relative to dataDir)
+        or None if the prefilter excludes it.
+        Raises _MissingFile if the file doesn't exist.
+        """
+        fullPath = longPathEnc(os.path.join(self.dataDir, filePath))
+
+        try:
+            fileSig = getFileSignatureBlock(fullPath)
+        except OSError:
+            raise _MissingFile()
+
+        if self.contentCache is not None:
+            content = self.contentCache.get(filePath, fileSig)
+            if content is not None:
+                return content
+
+        f = open(pathEnc(fullPath), "rb")
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size >= self.MMAP_MIN_SIZE:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    if not self.prefilter.mightMatch(mm):
+                        return None
+                    data = mm[:]
+                finally:
+                    mm.close()
+            else:
+                data = f.read()
+                if not self.prefilter.mightMatch(data):
+                    return None
+        finally:
+            f.close()
+
+        # Same line ending handling as reading in universal newline mode
+        if "\r" in data:
+            data = data.replace("\r\n", "\n").replace("\r", "\n")
+
+        content = fileContentToUnicode(data)
+
+        if self.contentCache is not None:
+            self.contentCache.put(filePath, fileSig, content)
+
+        return content
+
+
+    def iterPages(self, entries):
+        """
+        Iterate over entries, a sequence of tuples (word, filePath) with
+        filePath relative to dataDir. Yields tuples (word, content) for
+        pages which may match the search and (word, None) for pages whose
+        file doesn't exist. Pages excluded by the prefilter are omitted.
+        Order of results is arbitrary.
+
+        Raises IOError or OSError if a file can't be read.
+        """
+        if self.threadCount <= 1 or len(entries) < 2:
+            for word, filePath in entries:
+                try:
+                    content = self._readPage(filePath)
+                except _MissingFile:
+                    yield (word, None)
+                    continue
+
+                if content is not None:
+                    yield (word, content)
+            return
+
+        entryQueue = Queue.Queue()
+        for entry in entries:
+            entryQueue.put(entry)
+
+        threadCount = min(self.threadCount, len(entries))
+        resultQueue = Queue.Queue(threadCount * self.QUEUE_SIZE_PER_THREAD)
+        stopEvent = threading.Event()
+
+        def putResult(item):
+            while not stopEvent.isSet():
+                try:
+                    resultQueue.put(item, timeout=0.5)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def worker():
+            try:
+                while not stopEvent.isSet():
+                    try:
+                        word, filePath = entryQueue.get_nowait()
+                    except Queue.Empty:
+                        break
+
+                    try:
+                        content = self._readPage(filePath)
+                    except _MissingFile:
+                        if not putResult(("page", word, None)):
+                            return
+                        continue
+
+                    if content is not None:
+                        if not putResult(("page", word, content)):
+                            return
+            except Exception, e:
+                traceback.print_exc()
+                putResult(("error", e, None))
+            finally:
+                putResult(("done", None, None))
+
+        threads = [threading.Thread(target=worker) for i in xrange(threadCount)]
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+
+        try:
+            running = threadCount
+            while running > 0:
+                kind, value, content = resultQueue.get()
+                if kind == "page":
+                    yield (value, content)
+                elif kind == "done":
+                    running -= 1
+                else:
+                    raise value
+        finally:
+            stopEvent.set()
+
@@ -5,38 +5,46 @@ from __future__ import with_statement
 
 
 from weakref import WeakValueDictionary
-import os, os.path, time, shutil, traceback, ConfigParser
+import os, os.path, time, shutil, traceback, ConfigParser, tempfile, hashlib
 # from collections import deque
 
 import re
 
-from wx import GetApp
+from ..AppAccess import getApp
 
 import Consts
 from pwiki.WikiExceptions import *
 
 from ..Utilities import TimeoutRLock, SingleThreadExecutor, DUMBTHREADSTOP
 
-from ..MiscEvent import MiscEventSourceMixin
+from ..MiscEvent import MiscEventSourceMixin, batched
 
 from .. import ParseUtilities
 from .. import StringOps
 from ..StringOps import mbcsDec, re_sub_escape, pathEnc, pathDec, \
         unescapeWithRe, strToBool, pathnameFromUrl, urlFromPathname, \
-        relativeFilePath, getFileSignatureBlock
+        relativeFilePath, getFileSignatureBlock, utf8Enc
 from ..DocPages import DocPage, WikiPage, FunctionalPage, AliasWikiPage
 # from ..timeView.Versioning import VersionOverview
 
 from ..timeView.WikiWideHistory import WikiWideHistory
 
+from ..TempFileSet import getDefaultTempFilePath
+from ..RenderCache import RenderCache
+from ..PreviewRenderCache import PreviewRenderCache
+from ..ImageDimensions import ImageDimensionCache
+from ..PageCache import PageLruCache
+
 from .. import AttributeHandling
 
 from ..SearchAndReplace import SearchReplaceOperation
 
 from .. import SpellChecker
+from .. import Instrumentation
 from .. import Trashcan
 
 import DbBackendUtils, FileStorage
+from .FileWatch import createWatcher, PageFileWatchService
 
 # Some functions import parts of the whoosh library
 
@@ -131,7 +139,7 @@ def splitConfigPathAndWord(wikiCombinedFilename):
     return: tuple (cfg, wikiword) with cfg real config filepath (None if it
             couldn't be found. wikiword is the wikiword to jump to or None
     """
-    wikiConfig = GetApp().createWikiConfiguration()
+    wikiConfig = getApp().createWikiConfiguration()
     if os.path.supports_unicode_filenames:
         wikiConfigFilename = mbcsDec(wikiCombinedFilename)[0]
     else:
@@ -316,7 +324,7 @@ class WikiDataManager(MiscEventSourceMixin):
         else:
             self.lockFileName = None
 
-        wikiConfig = GetApp().createWikiConfiguration()
+        wikiConfig = getApp().createWikiConfiguration()
         self.connected = False
         self.readAccessFailed = False
         self.writeAccessFailed = False
@@ -390,7 +398,7 @@ class WikiDataManager(MiscEventSourceMixin):
         else:
             wikiConfig.set("main", "wiki_wikiLanguage", wikiLangName)
 
-        if GetApp().getWikiLanguageDescription(wikiLangName) is None:
+        if getApp().getWikiLanguageDescription(wikiLangName) is None:
             self._releaseLockFile()
             raise UnknownWikiLanguageException(
                     _(u'Required wiki language handler "%s" not available') %
@@ -410,6 +418,9 @@ class WikiDataManager(MiscEventSourceMixin):
         self.wikiData = WikiDataSynchronizedProxy(self.baseWikiData)
         self.wikiPageDict = WeakValueDictionary()
         self.funcPageDict = WeakValueDictionary()
+        # Keeps recently used pages of wikiPageDict alive
+        self.wikiPageLruCache = PageLruCache(getApp().getGlobalConfig()
+                .getint("main", "wikiPage_cache_maxSize", 20) * 1024 * 1024)
         
         self.updateExecutor = SingleThreadExecutor(4)
         self.pageRetrievingLock = TimeoutRLock(Consts.DEADBLOCKTIMEOUT)
@@ -427,6 +438,13 @@ class WikiDataManager(MiscEventSourceMixin):
         self.dbtype = wikidhName
 
         self.whooshIndex = None
+        self.insertionRenderCache = None
+        self.previewRenderCache = None
+        self.imageDimensionCache = None
+        self.pageFileWatchService = None
+        # Serializes the updates after external changes of page files
+        # which stop and restart the update executor
+        self.extFileUpdateLock = TimeoutRLock(Consts.DEADBLOCKTIMEOUT)
 
         self.refCount = 1
 
@@ -440,6 +458,7 @@ class WikiDataManager(MiscEventSourceMixin):
         return self.wikiData.checkDatabaseFormat()
 
 
+    @Instrumentation.instrumented("wiki.connect")
     def connect(self):
         # Connect might be called too often, so check if it was already done
         if self.connected:
@@ -455,6 +474,9 @@ class WikiDataManager(MiscEventSourceMixin):
             traceback.print_exc()
             writeException = e
 
+        # Shared by all spell checker sessions of this wiki
+        self.spellVerdictCache = SpellChecker.SpellVerdictCache()
+
         # TODO: Only initialize on demand
         self.onlineSpellCheckerSession = None
         
@@ -481,7 +503,7 @@ class WikiDataManager(MiscEventSourceMixin):
                 "fileStorage_identity_modDateIsEnough", False))
 
         self.wikiConfiguration.getMiscEvent().addListener(self)
-        GetApp().getMiscEvent().addListener(self)
+        getApp().getMiscEvent().addListener(self)
 
         if not self.recoveryMode:
             self._updateCcWordBlacklist()
@@ -534,6 +556,9 @@ class WikiDataManager(MiscEventSourceMixin):
 
         self.updateExecutor.start()
 
+        if not self.recoveryMode:
+            self._updatePageFileWatch()
+
 
 #         if not self.isReadOnlyEffect():
 #             words = self.getWikiData().getWikiPageNamesForMetaDataState(0)
@@ -599,6 +624,7 @@ class WikiDataManager(MiscEventSourceMixin):
 
         if self.refCount <= 0:
             self.refCount = 0
+            self._stopPageFileWatch()
             self.updateExecutor.end(hardEnd=True)  # TODO Inform user as this may take some time
 
             if self.trashcan is not None:
@@ -615,7 +641,11 @@ class WikiDataManager(MiscEventSourceMixin):
                 page.invalidate()
             for page in self.funcPageDict.values():
                 page.invalidate()
+            self.wikiPageLruCache.clear()
             
+            if self.imageDimensionCache is not None:
+                self.imageDimensionCache.save()
+
             wikiTempDir = self.getWikiTempDir()
 
             if self.wikiData is not None:
@@ -627,7 +657,7 @@ class WikiDataManager(MiscEventSourceMixin):
                 self.whooshIndex.close()
                 self.whooshIndex = None
 
-            GetApp().getMiscEvent().removeListener(self)
+            getApp().getMiscEvent().removeListener(self)
 
             del _openDocuments[self.getWikiConfig().getConfigPath()]
 
@@ -665,7 +695,7 @@ class WikiDataManager(MiscEventSourceMixin):
         return self.dataDir
         
     def getCollator(self):
-        return GetApp().getCollator()
+        return getApp().getCollator()
         
     def getTrashcan(self):
         return self.trashcan
@@ -690,7 +720,7 @@ class WikiDataManager(MiscEventSourceMixin):
                 "wikiPageTitle_headingLevel", 0)
         
         if level > 0:
-            langHelper = GetApp().createWikiLanguageHelper(
+            langHelper = getApp().createWikiLanguageHelper(
                     self.getWikiDefaultWikiLanguage())
     
             info = langHelper.formatSelectedText(rawTitle,
@@ -717,7 +747,7 @@ class WikiDataManager(MiscEventSourceMixin):
                 "main", "wikiPageTitlePrefix", u"++"))
 
     def getWikiTempDir(self):
-#         if GetApp().getGlobalConfig().getboolean("main", "tempFiles_inWikiDir",
+#         if getApp().getGlobalConfig().getboolean("main", "tempFiles_inWikiDir",
 #                 False) and not self.isReadOnlyEffect():
 #             return os.path.join(os.path.dirname(self.getWikiConfigPath()),
 #                     "temp")
@@ -741,9 +771,88 @@ class WikiDataManager(MiscEventSourceMixin):
                 self.setReadAccessFailed(True)
 
 
+    def getInsertionRenderCache(self):
+        """
+        Return the RenderCache for files created by insertion handlers
+        calling external applications. It is placed in the wiki temp
+        directory or, if there is none, in the default temp directory.
+        """
+        if self.insertionRenderCache is None:
+            tempDir = self.getWikiTempDir()
+            if tempDir is not None:
+                cacheDir = os.path.join(tempDir, u"renderCache")
+            else:
+                tempDir = getDefaultTempFilePath()
+                if not tempDir:
+                    tempDir = pathDec(tempfile.gettempdir())
+                cacheDir = os.path.join(tempDir, u"WikidPad_renderCache")
+
+            maxSize = getApp().getGlobalConfig().getint("main",
+                    "insertionRenderCache_maxSize", 20) * 1024 * 1024
+
+            self.insertionRenderCache = RenderCache(cacheDir, maxSize)
+
+        return self.insertionRenderCache
+
+
+    def getPreviewRenderCache(self):
+        """
+        Return the PreviewRenderCache for HTML previews of wiki pages.
+        It is placed in the wiki temp directory or, if there is none, in
+        the default temp directory.
+        """
+        if self.previewRenderCache is None:
+            tempDir = self.getWikiTempDir()
+            if tempDir is not None:
+                cacheDir = os.path.join(tempDir, u"previewCache")
+            else:
+                tempDir = getDefaultTempFilePath()
+                if not tempDir:
+                    tempDir = pathDec(tempfile.gettempdir())
+                # Cached files refer to files of the wiki, so each wiki
+                # gets its own directory
+                cacheDir = os.path.join(tempDir,
+                        u"WikidPad_previewCache_%s" % hashlib.sha1(
+                        utf8Enc(self.getWikiConfigPath())[0]).hexdigest()[:16])
+
+            maxSize = getApp().getGlobalConfig().getint("main",
+                    "html_preview_renderCache_maxSize", 10) * 1024 * 1024
+
+            self.previewRenderCache = PreviewRenderCache(cacheDir, maxSize)
+
+        return self.previewRenderCache
+
+
+    def getImageDimensionCache(self):
+        """
+        Return the ImageDimensionCache for images referenced by wiki pages.
+        Its file is placed in the wiki temp directory or, if there is none,
+        in the default temp directory.
+        """
+        if self.imageDimensionCache is None:
+            tempDir = self.getWikiTempDir()
+            if tempDir is not None:
+                cachePath = os.path.join(tempDir, u"imageDims.dat")
+            else:
+                tempDir = getDefaultTempFilePath()
+                if not tempDir:
+                    tempDir = pathDec(tempfile.gettempdir())
+                # Each wiki gets its own file
+                cachePath = os.path.join(tempDir, u"WikidPad_imageDims_%s.dat" %
+                        hashlib.sha1(utf8Enc(self.getWikiConfigPath())[0])
+                        .hexdigest()[:16])
+
+            self.imageDimensionCache = ImageDimensionCache(cachePath)
+
+        return self.imageDimensionCache
+
+
     def getOnlineSpellCheckerSession(self):
         return self.onlineSpellCheckerSession
 
+    def getSpellVerdictCache(self):
+        return self.spellVerdictCache
+
 
     def createOnlineSpellCheckerSessionClone(self):
         if self.onlineSpellCheckerSession is None:
@@ -908,6 +1017,7 @@ class WikiDataManager(MiscEventSourceMixin):
         return self.updateExecutor
         
         
+    @Instrumentation.instrumented("wiki.pushDirtyMetaDataUpdate")
     def pushDirtyMetaDataUpdate(self):
         """
         Push all words for which meta-data is set dirty into the queue
@@ -1079,9 +1189,12 @@ class WikiDataManager(MiscEventSourceMixin):
 #                     value = AliasWikiPage(self, wikiWord, realpage)
 
 
+            cachedValue = self.wikiPageDict.get(wikiWord)
             value = self._getWikiPageNoErrorNoCache(wikiWord)
+            self.wikiPageLruCache.recordLookup(value is cachedValue)
             
             self.wikiPageDict[wikiWord] = value
+            self.wikiPageLruCache.put(wikiWord, value)
 
             if not value.getMiscEvent().hasListener(self):
                 value.getMiscEvent().addListener(self)
@@ -1089,6 +1202,21 @@ class WikiDataManager(MiscEventSourceMixin):
         return value
 
 
+    def updateWikiPageCacheSize(self, wikiPage):
+        """
+        Called by wikiPage after its estimated memory size changed.
+        """
+        self.wikiPageLruCache.updatePageSize(wikiPage.getWikiWord(), wikiPage)
+
+
+    def getWikiPageCacheStatistics(self):
+        """
+        Return dictionary with hit rate and size of the cache of wiki page
+        objects, see PageCache.PageLruCache.getStatistics()
+        """
+        return self.wikiPageLruCache.getStatistics()
+
+
     def _getWikiPageNoErrorNoCache(self, wikiWord):
         """
         Similar to getWikiPageNoError, but does not save retrieved
@@ -1213,6 +1341,14 @@ class WikiDataManager(MiscEventSourceMixin):
         """
         return self.wikiData.retrieveDataBlock(unifName, default=default)
 
+    def retrieveDataBlocks(self, unifNames, default=""):
+        """
+        Retrieve multiple data blocks as binary strings with one database
+        query (where supported). Returns dictionary {unifName: data}, data
+        is None for non-existing blocks.
+        """
+        return self.wikiData.retrieveDataBlocks(unifNames, default=default)
+
     def retrieveDataBlockAsText(self, unifName, default=""):
         """
         Retrieve data block as unicode string (assuming it was encoded properly)
@@ -1271,7 +1407,6 @@ class WikiDataManager(MiscEventSourceMixin):
 
 
 
-    # TODO Remove if not needed
     def checkFileSignatureForWikiPageNameAndMarkDirty(self, word):
         """
         First checks if file signature is valid, if not, the
@@ -1385,15 +1520,127 @@ class WikiDataManager(MiscEventSourceMixin):
             # Nothing to do
             return
             
-        self.updateExecutor.end(hardEnd=True)
-        try:
-            self.getWikiData().refreshWikiPageLinkTerms(deleteFully=True)
-            self.checkFileSignatureForAllWikiPageNamesAndMarkDirty()
-            self.pushDirtyMetaDataUpdate()
-        finally:
-            self.updateExecutor.start()
+        with self.extFileUpdateLock:
+            self.updateExecutor.end(hardEnd=True)
+            try:
+                self.getWikiData().refreshWikiPageLinkTerms(deleteFully=True)
+                self.checkFileSignatureForAllWikiPageNamesAndMarkDirty()
+                self.pushDirtyMetaDataUpdate()
+            finally:
+                self.updateExecutor.start()
+
+
+    def updateExtWikiFiles(self, progresshandler):
+        """
+        Like initiateExtWikiFileUpdate() but updates the meta-data of the
+        changed pages in foreground instead of the update executor.
+        Intended for batch mode.
 
+        progresshandler -- Object, fulfilling the
+            PersonalWikiFrame.GuiProgressHandler protocol
+        """
+        if self.getWikiData().checkCapability("filePerPage") != 1:
+            # Nothing to do
+            return
 
+        with self.extFileUpdateLock:
+            self.updateExecutor.end(hardEnd=True)
+            try:
+                self.getWikiData().refreshWikiPageLinkTerms(deleteFully=True)
+                self.checkFileSignatureForAllWikiPageNamesAndMarkDirty()
+            finally:
+                self.updateExecutor.start()
+
+        self.rebuildWiki(progresshandler, onlyDirty=True)
+
+
+    def _updatePageFileWatch(self):
+        """
+        Start or stop watching the page files for external changes according
+        to wiki option "wikiPageFiles_watchMode".
+        """
+        self._stopPageFileWatch()
+
+        wikiData = self.getWikiData()
+        if wikiData.checkCapability("fileWatch") is None or \
+                self.isReadOnlyEffect():
+            return
+
+        watchMode = self.getWikiConfig().getint("main",
+                "wikiPageFiles_watchMode", 1)
+        if watchMode == 0:
+            return
+
+        dataDir, suffix = wikiData.getPageFileDirAndSuffix()
+        watcher = createWatcher(dataDir, suffix, watchMode == 2)
+        if watcher is None:
+            return
+
+        self.pageFileWatchService = PageFileWatchService(watcher,
+                self._handleWatchedPageFileChanges)
+        self.pageFileWatchService.start()
+
+
+    def _stopPageFileWatch(self):
+        if self.pageFileWatchService is not None:
+            self.pageFileWatchService.stop()
+            self.pageFileWatchService = None
+
+
+    def _handleWatchedPageFileChanges(self, fileNames, rescan):
+        """
+        Called in main thread by the page file watch service with the names
+        of page files changed, added or removed outside of WikidPad.
+        Files whose signature still matches the database (e.g. written
+        by WikidPad itself) are ignored. Pages of really changed or new
+        files are marked dirty and queued into the running update executor,
+        the executor itself isn't stopped for this.
+        """
+        if self.wikiData is None or self.isReadOnlyEffect():
+            return
+
+        if rescan:
+            # Watcher lost track of changes
+            self.initiateExtWikiFileUpdate()
+            return
+
+        wikiData = self.getWikiData()
+        dirtyWords = []
+
+        with self.extFileUpdateLock:
+            proxyAccessLock = getattr(wikiData, "proxyAccessLock", None)
+            if proxyAccessLock is not None:
+                proxyAccessLock.acquire()
+            try:
+                knownWords = set(wikiData.getWikiPageNamesForFileNames(
+                        fileNames))
+
+                # Only added or removed files change the link terms
+                wikiData.refreshWikiPageLinkTermsForFiles(fileNames,
+                        deleteFully=True)
+
+                for word in wikiData.getWikiPageNamesForFileNames(fileNames):
+                    if word not in knownWords:
+                        # Entry for new file was created as dirty
+                        dirtyWords.append(word)
+                    elif not self.checkFileSignatureForWikiPageNameAndMarkDirty(
+                            word):
+                        dirtyWords.append(word)
+            finally:
+                if proxyAccessLock is not None:
+                    proxyAccessLock.release()
+
+        if len(dirtyWords) == 0 or self.recoveryMode:
+            return
+
+        with self.updateExecutor.getDequeCondition():
+            for word in dirtyWords:
+                self.updateExecutor.executeAsyncWithThreadStop(1,
+                        self._runDatabaseUpdate, word,
+                        Consts.WIKIWORDMETADATA_STATE_DIRTY)
+
+
+    @batched
     def rebuildWiki(self, progresshandler, onlyDirty):
         """
         Rebuild  the wiki
@@ -1551,7 +1798,7 @@ class WikiDataManager(MiscEventSourceMixin):
         It is (or will become) important that the renaming is processed
         in the order given by the returned sequence.
         """
-        langHelper = GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 self.getWikiDefaultWikiLanguage())
 
         errMsg = langHelper.checkForInvalidWikiWord(toWikiWord, self)
@@ -1600,6 +1847,7 @@ class WikiDataManager(MiscEventSourceMixin):
         return renameDict.items()
 
 
+    @batched
     def renameWikiWord(self, wikiWord, toWikiWord, modifyText):
         """
         modifyText -- Should the text of links to the renamed page be
@@ -1607,7 +1855,7 @@ class WikiDataManager(MiscEventSourceMixin):
         """
         global _openDocuments
         
-        langHelper = GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 self.getWikiDefaultWikiLanguage())
 
         errMsg = langHelper.checkForInvalidWikiWord(toWikiWord, self)
@@ -1670,6 +1918,7 @@ class WikiDataManager(MiscEventSourceMixin):
         oldWikiPage.queueRemoveFromSearchIndex()
         oldWikiPage.informRenamedWikiPage(toWikiWord)
         del self.wikiPageDict[wikiWord]
+        self.wikiPageLruCache.remove(wikiWord)
 
         if modifyText:
             # now we have to search the wiki files and replace the old word with the new
@@ -1733,7 +1982,7 @@ class WikiDataManager(MiscEventSourceMixin):
         "relax" mode
         """
         if self.autoLinkRelaxInfo is None:
-            langHelper = GetApp().createWikiLanguageHelper(
+            langHelper = getApp().createWikiLanguageHelper(
                     self.getWikiDefaultWikiLanguage())
 
             self.autoLinkRelaxInfo = langHelper.buildAutoLinkRelaxInfo(self)
@@ -1933,49 +2182,63 @@ class WikiDataManager(MiscEventSourceMixin):
         return self.whooshIndex
 
 
-#     def rebuildSearchIndex(self, progresshandler, onlyDirty=False):
-#         """
-#         progresshandler -- Object, fulfilling the
-#             PersonalWikiFrame.GuiProgressHandler protocol
-#         """
-#         if not self.isSearchIndexEnabled():
-#             return
-# 
-#         self.updateExecutor.pause()
-#         self.getWikiData().refreshWikiPageLinkTerms()
-# 
-#         # get all of the wikiWords
-#         wikiWords = self.getWikiData().getAllDefinedWikiPageNames()
-# 
-#         progresshandler.open(len(wikiWords))
-#         
-#         searchIdx = self.getSearchIndex(clear=True)
-#         writer = searchIdx.writer()
-# 
-#         try:
-#             step = 1
-#             
-#             for wikiWord in wikiWords:
-# # Disabled to remove from .pot                progresshandler.update(step, _(u"Update rev. index"))
-#                 wikiPage = self._getWikiPageNoErrorNoCache(wikiWord)
-#                 if isinstance(wikiPage, AliasWikiPage):
-#                     # This should never be an alias page, so fetch the
-#                     # real underlying page
-#                     # This can only happen if there is a real page with
-#                     # the same name as an alias
-#                     wikiPage = WikiPage(self, wikiWord)
-# 
-#                 content = wikiPage.getLiveText()
-#                 
-#                 writer.add_document(unifName="wikipage/"+wikiWord,
-#                         modTimestamp=wikiPage.getTimestamps()[0],
-#                         content=content)
-#                 
-#                 step += 1
-#         finally:
-#             writer.commit()
-#             progresshandler.close()
-#             self.updateExecutor.start()
+    def rebuildSearchIndex(self, progresshandler):
+        """
+        Remove the search index and index all pages again in foreground.
+        Pages whose meta-data aren't processed far enough yet are indexed
+        later by the update executor. Does nothing if search index is
+        disabled.
+
+        progresshandler -- Object, fulfilling the
+            PersonalWikiFrame.GuiProgressHandler protocol
+        """
+        if not self.isSearchIndexEnabled() or self.isReadOnlyEffect():
+            return
+
+        wikiData = self.getWikiData()
+
+        # Lower meta data state of indexed pages so they are indexed again
+        finalState = Consts.WIKIWORDMETADATA_STATE_SYNTAXPROCESSED
+        for wikiWord in wikiData.getWikiPageNamesForMetaDataState(
+                finalState, "<"):
+            wikiData.setMetaDataState(wikiWord, finalState)
+
+        wikiData.commit()
+        self.removeSearchIndex()
+
+        self.updateExecutor.end(hardEnd=True)
+
+        wikiWords = wikiData.getWikiPageNamesForMetaDataState(finalState)
+        progresshandler.open(len(wikiWords) + 1)
+
+        self.fireMiscEventKeys(("begin foreground update", "begin update"))
+        try:
+            self.getSearchIndex(clear=True)
+            step = 1
+
+            for wikiWord in wikiWords:
+                progresshandler.update(step, _(u"Update index of %s") % wikiWord)
+                try:
+                    wikiPage = self._getWikiPageNoErrorNoCache(wikiWord)
+                    if isinstance(wikiPage, AliasWikiPage):
+                        # This should never be an alias page, so fetch the
+                        # real underlying page
+                        # This can only happen if there is a real page with
+                        # the same name as an alias
+                        wikiPage = WikiPage(self, wikiWord)
+
+                    wikiPage.putIntoSearchIndex()
+                except:
+                    traceback.print_exc()
+
+                step += 1
+
+            self.pushDirtyMetaDataUpdate()
+
+        finally:
+            progresshandler.close()
+            self.fireMiscEventKeys(("end foreground update",))
+            self.updateExecutor.start()
 
 
 #     def removeFromSearchIndex(self, unifName):
@@ -2014,7 +2277,7 @@ class WikiDataManager(MiscEventSourceMixin):
         paragraphMode = strToBool(self.getGlobalAttributeValue(
                 u"paragraph_mode", False))
 
-        langHelper = GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 self.getWikiDefaultWikiLanguage())
 
         wikiLanguageDetails = langHelper.createWikiLanguageDetails(
@@ -2127,7 +2390,7 @@ class WikiDataManager(MiscEventSourceMixin):
         """
         basePage = self.getWikiPageNoError(basePageName)
 
-        langHelper = GetApp().createWikiLanguageHelper(
+        langHelper = getApp().createWikiLanguageHelper(
                 basePage.getWikiLanguageName())
 
         # Convert possible relative path (if subpages used) to page name
@@ -2248,6 +2511,74 @@ class WikiDataManager(MiscEventSourceMixin):
         self.fireMiscEventProps(attrs)
 
 
+    def canReconnectInChildProcess(self):
+        """
+        Return True if the database backend supports the read-only
+        connection reconnectInChildProcess() needs.
+        """
+        return hasattr(self.baseWikiData, "connectReadOnly")
+
+
+    def pauseBackgroundThreads(self):
+        """
+        Pause the threads working on the wiki in the background (update
+        executor and page file watch) and wait until they stopped, e.g.
+        before this process is forked. Returns an object to pass to
+        resumeBackgroundThreads().
+        """
+        executorPaused = self.updateExecutor.pause(wait=True)
+
+        watchService = self.pageFileWatchService
+        if watchService is not None:
+            watchService.pause()
+
+        return executorPaused, watchService
+
+
+    def resumeBackgroundThreads(self, state):
+        executorPaused, watchService = state
+
+        if watchService is not None and \
+                watchService is self.pageFileWatchService:
+            watchService.start()
+
+        if executorPaused:
+            self.updateExecutor.start()
+
+
+    def reconnectInChildProcess(self):
+        """
+        Must be called in a child process created by os.fork() (e.g. a
+        worker of the multiprocessing module) before the wiki is accessed.
+        The background threads should be paused while forking
+        (see pauseBackgroundThreads()).
+        Opens an own database connection which can only read and creates
+        new locks instead of using those inherited from the parent process
+        which may be in use there. Neither database nor configuration are
+        written.
+        """
+        # The inherited connection belongs to the parent process, so it is
+        # kept referenced to prevent closing it here
+        self.inheritedWikiData = (self.baseWikiData, self.wikiData)
+
+        self.writeAccessDenied = True
+
+        wikiDataFactory, createWikiDbFunc = DbBackendUtils.getHandler(self.dbtype)
+        if wikiDataFactory is None:
+            raise NoDbHandlerException(
+                    _(u"Data handler %s not available") % self.dbtype)
+
+        self.baseWikiData = wikiDataFactory(self, self.dataDir,
+                self.getWikiTempDir())
+        self.wikiData = WikiDataSynchronizedProxy(self.baseWikiData)
+        self.wikiData.connectReadOnly()
+
+        self.pageRetrievingLock = TimeoutRLock(Consts.DEADBLOCKTIMEOUT)
+        self.wikiPageDict = WeakValueDictionary()
+        self.funcPageDict = WeakValueDictionary()
+        self.wikiPageLruCache.clear()
+
+
 
     def _handleWikiConfigurationChanged(self, miscevt):
         wikiData = self.getWikiData()
@@ -2278,6 +2609,11 @@ class WikiDataManager(MiscEventSourceMixin):
             wikiData.setEditorTextMode(self.getWikiConfig().getboolean("main",
                     "editor_text_mode", False))
 
+        if miscevt.get("old config settings").get("wikiPageFiles_watchMode",
+                u"1") != self.getWikiConfig().get("main",
+                "wikiPageFiles_watchMode", u"1"):
+            self._updatePageFileWatch()
+
 
     def getFileSignatureBlock(self, filename):
         """
@@ -2315,7 +2651,7 @@ class WikiDataManager(MiscEventSourceMixin):
                 attrs["changed wiki configuration"] = True
                 self._handleWikiConfigurationChanged(miscevt)
                 self.fireMiscEventProps(attrs)
-        elif miscevt.getSource() is GetApp():
+        elif miscevt.getSource() is getApp():
             if miscevt.has_key("reread cc blacklist needed"):
                 self._updateCcWordBlacklist()
             elif miscevt.has_key("reread ncc blacklist needed"):
@@ -2331,6 +2667,7 @@ class WikiDataManager(MiscEventSourceMixin):
             if miscevt.has_key_in(("deleted wiki page", "renamed wiki page",
                     "pseudo-deleted wiki page")):
                 self.autoLinkRelaxInfo = None
+                self.wikiPageLruCache.remove(miscevt.getSource().getWikiWord())
                 attrs = miscevt.getProps().copy()
                 attrs["wikiPage"] = miscevt.getSource()
                 self.fireMiscEventProps(attrs)
@@ -2371,7 +2708,7 @@ class WikiDataManager(MiscEventSourceMixin):
 
                 self.fireMiscEventProps(attrs)
 
-#         elif miscevt.getSource() is GetApp().getGlobalConfig():
+#         elif miscevt.getSource() is getApp().getGlobalConfig():
 #             if miscevt.has_key("changed configuration"):
 #                 # TODO: On demand
 #                 if SpellChecker.isSpellCheckSupported():
@@ -5,7 +5,7 @@ DB formats to the current one
 """
 
 
-import string, codecs, types, threading, traceback
+import string, codecs, types, threading, traceback, hashlib
 
 from os import mkdir, unlink, rename
 from os.path import exists, join
@@ -15,6 +15,7 @@ from pwiki.WikiExceptions import *
 from pwiki.StringOps import mbcsDec, mbcsEnc, utf8Enc, utf8Dec, applyBinCompact, \
         removeBracketsFilename, pathEnc
 from pwiki.SearchAndReplace import SearchReplaceOperation
+from pwiki import Instrumentation
 
 import pwiki.sqlite3api as sqlite
 
@@ -50,20 +51,22 @@ class ConnectWrapBase:
 
     def execSql(self, sql, params=None):
         "utility method, executes the sql"
-        if params:
-            self.dbCursor.execute(sql, params)
-        else:
-            self.dbCursor.execute(sql)
+        with Instrumentation.span("db.execSql", sql):
+            if params:
+                self.dbCursor.execute(sql, params)
+            else:
+                self.dbCursor.execute(sql)
 
 
     def execSqlQuery(self, sql, params=None):
         "utility method, executes the sql, returns query result"
-        if params:
-            self.dbCursor.execute(sql, params, typeDetect=sqlite.TYPEDET_FIRST)
-        else:
-            self.dbCursor.execute(sql, typeDetect=sqlite.TYPEDET_FIRST)
+        with Instrumentation.span("db.execSqlQuery", sql):
+            if params:
+                self.dbCursor.execute(sql, params, typeDetect=sqlite.TYPEDET_FIRST)
+            else:
+                self.dbCursor.execute(sql, typeDetect=sqlite.TYPEDET_FIRST)
 
-        return self.dbCursor.fetchall()
+            return self.dbCursor.fetchall()
 
 
     def execSqlQueryIter(self, sql, params=None):
@@ -71,13 +74,14 @@ class ConnectWrapBase:
         utility method, executes the sql, returns an iterator
         over the query results. Has problems, only intended for recovery mode
         """
-        ## print "execSqlQuery sql", sql, repr(params)
-        if params:
-            self.dbCursor.execute(sql, params, typeDetect=sqlite.TYPEDET_FIRST)
-        else:
-            self.dbCursor.execute(sql, typeDetect=sqlite.TYPEDET_FIRST)
+        with Instrumentation.span("db.execSqlQueryIter", sql):
+            ## print "execSqlQuery sql", sql, repr(params)
+            if params:
+                self.dbCursor.execute(sql, params, typeDetect=sqlite.TYPEDET_FIRST)
+            else:
+                self.dbCursor.execute(sql, typeDetect=sqlite.TYPEDET_FIRST)
 
-        return iter(self.dbCursor)
+            return iter(self.dbCursor)
 
 
     def execSqlQuerySingleColumn(self, sql, params=None):
@@ -92,26 +96,28 @@ class ConnectWrapBase:
         one column and returns result. If query results
         to 0 rows, default is returned (defaults to None)
         """
-        if params:
-            self.dbCursor.execute(sql, params)
-        else:
-            self.dbCursor.execute(sql)
-
-        row = self.fetchone()
-        if row is None:
-            return default
+        with Instrumentation.span("db.execSqlQuerySingleItem", sql):
+            if params:
+                self.dbCursor.execute(sql, params)
+            else:
+                self.dbCursor.execute(sql)
+
+            row = self.fetchone()
+            if row is None:
+                return default
             
-        return row[0]
+            return row[0]
 
         
     def execSqlNoError(self, sql):
         """
         Ignore sqlite errors on execution
         """
-        try:
-            self.dbCursor.execute(sql)
-        except sqlite.Error:
-            pass
+        with Instrumentation.span("db.execSqlNoError", sql):
+            try:
+                self.dbCursor.execute(sql)
+            except sqlite.Error:
+                pass
 
 
     def getLastRowid(self):
@@ -352,8 +358,8 @@ class ConnectWrapAsyncCommit(ConnectWrapBase):
 
 
 
-VERSION_DB = 9
-VERSION_WRITECOMPAT = 9
+VERSION_DB = 10
+VERSION_WRITECOMPAT = 10
 VERSION_READCOMPAT = 9
 
 
@@ -404,6 +410,29 @@ TABLE_DEFINITIONS = {
         ),
 
 
+    "snapshots": (     # Essential if snapshot versioning used
+        ("id", t.pi),
+        ("description", t.t),
+        ("created", t.r)
+        ),
+
+
+    "snapshotpages": (     # Essential if snapshot versioning used
+        ("word", t.t),
+        ("contenthash", t.t),  # Key into snapshotcontent
+        ("created", t.r),
+        ("modified", t.r),
+        ("firstsnapshot", t.i),  # Id of first snapshot containing this state
+        ("lastsnapshot", t.imo)  # Id of last snapshot or -1 if still current
+        ),
+
+
+    "snapshotcontent": (     # Essential if snapshot versioning used
+        ("contenthash", t.t),  # SHA-1 hex digest of content
+        ("content", t.b)
+        ),
+
+
     "wikiwordcontent": (     # Essential
         ("word", t.t),
         ("content", t.b),
@@ -509,22 +538,159 @@ def hasVersioningData(connwrap):
     connwrap -- a ConnectWrap object
     Returns true if version information was already stored in the underlying database
     """
+    return hasSnapshotData(connwrap) or hasLegacyVersioningData(connwrap)
+
 
+def hasLegacyVersioningData(connwrap):
+    """
+    connwrap -- a ConnectWrap object
+    Returns true if version information in the old changelog format
+    is stored in the database
+    """
     t1 = connwrap.execSqlQuerySingleItem("select name from sqlite_master "+\
             "where name='changelog'", default=None)
     return not t1 is None
 
 
+def hasSnapshotData(connwrap):
+    """
+    connwrap -- a ConnectWrap object
+    Returns true if the snapshot tables exist
+    """
+    t1 = connwrap.execSqlQuerySingleItem("select name from sqlite_master "+\
+            "where name='snapshots'", default=None)
+    return not t1 is None
+
+
 def createVersioningTables(connwrap):
-    for tn in ("changelog", "headversion", "versions"):
+    for tn in ("snapshots", "snapshotpages", "snapshotcontent"):
         changeTableSchema(connwrap, tn, TABLE_DEFINITIONS[tn])
 
+    connwrap.execSqlNoError("create unique index snapshotpages_pkey on "
+            "snapshotpages(word, lastsnapshot)")
+    connwrap.execSqlNoError("create index snapshotpages_range on "
+            "snapshotpages(lastsnapshot, firstsnapshot)")
+    connwrap.execSqlNoError("create unique index snapshotcontent_pkey on "
+            "snapshotcontent(contenthash)")
 
-def deleteVersioningTables(connwrap):
+
+def deleteLegacyVersioningTables(connwrap):
     for tn in ("changelog", "headversion", "versions"):
         connwrap.execSqlNoError("drop table %s" % tn)
 
 
+def deleteVersioningTables(connwrap):
+    deleteLegacyVersioningTables(connwrap)
+    for tn in ("snapshots", "snapshotpages", "snapshotcontent"):
+        connwrap.execSqlNoError("drop table %s" % tn)
+
+
+def storeSnapshotContent(connwrap, content):
+    """
+    Store raw content in table "snapshotcontent" if not yet present and
+    return its hash
+    """
+    contentHash = hashlib.sha1(content).hexdigest()
+    connwrap.execSql("insert or ignore into snapshotcontent"
+            "(contenthash, content) values (?, ?)",
+            (contentHash, sqlite.Binary(content)))
+
+    return contentHash
+
+
+def migrateLegacyVersioningData(connwrap):
+    """
+    Convert versions from tables "versions", "headversion" and
+    "changelog" to snapshots and delete the old tables.
+
+    Changelog ops: 0 set content, 1 modify (content is a binary compact
+    diff to apply to the newer content), 2 create page, 3 delete page.
+    """
+    if not hasSnapshotData(connwrap):
+        createVersioningTables(connwrap)
+
+    # Dictionary {word: [content, modified, created]}, starts with
+    # newest version, changes are applied backwards
+    state = {}
+    for word, content, modified, created in connwrap.execSqlQuery(
+            "select word, content, modified, created from headversion"):
+        state[word] = [str(content), modified, created]
+
+    versions = connwrap.execSqlQuery("select id, description, "
+            "firstchangeid, created from versions where id == 0")
+    versions += connwrap.execSqlQuery("select id, description, "
+            "firstchangeid, created from versions where id != 0 "
+            "order by id desc")
+
+    changes = connwrap.execSqlQuery("select id, word, op, content, "
+            "moddate from changelog order by id desc")
+    changePos = 0
+
+    # List of tuples (description, created, manifest) from newest to
+    # oldest with manifest a dictionary {word: (hash, modified, created)}
+    snapshots = []
+    for verId, description, firstChangeId, created in versions:
+        if verId != 0 and firstChangeId != -1:
+            while changePos < len(changes) and \
+                    changes[changePos][0] >= firstChangeId:
+                chId, word, op, content, moddate = changes[changePos]
+                changePos += 1
+                content = str(content)
+
+                if op == 1:
+                    if word in state:
+                        state[word][0] = applyBinCompact(state[word][0],
+                                content)
+                        state[word][1] = moddate
+                elif op == 3:
+                    state.pop(word, None)
+                else:
+                    pageCreated = state.get(word,
+                            (None, None, moddate))[2]
+                    state[word] = [content, moddate, pageCreated]
+
+        manifest = {}
+        for word, (content, modified, pageCreated) in state.iteritems():
+            manifest[word] = (storeSnapshotContent(connwrap, content),
+                    modified, pageCreated)
+
+        snapshots.append((description, created, manifest))
+
+    snapshots.reverse()
+
+    prevSnapId = connwrap.execSqlQuerySingleItem(
+            "select max(id) from snapshots", default=None) or 0
+
+    # Dictionary {word: (hash, modified, created, firstsnapshot)}
+    openStates = {}
+    for description, created, manifest in snapshots:
+        connwrap.execSql("insert into snapshots(description, created) "
+                "values (?, ?)", (description, created))
+        snapId = connwrap.getLastRowid()
+
+        for word, pageState in openStates.items():
+            if manifest.get(word) != pageState[:3]:
+                connwrap.execSql("insert into snapshotpages(word, "
+                        "contenthash, modified, created, firstsnapshot, "
+                        "lastsnapshot) values (?, ?, ?, ?, ?, ?)",
+                        (word,) + pageState + (prevSnapId,))
+                del openStates[word]
+
+        for word, pageState in manifest.iteritems():
+            if word not in openStates:
+                openStates[word] = pageState + (snapId,)
+
+        prevSnapId = snapId
+
+    for word, pageState in openStates.iteritems():
+        connwrap.execSql("insert into snapshotpages(word, "
+                "contenthash, modified, created, firstsnapshot, "
+                "lastsnapshot) values (?, ?, ?, ?, ?, -1)",
+                (word,) + pageState)
+
+    deleteLegacyVersioningTables(connwrap)
+
+
 def rebuildIndices(connwrap):
     """
     Delete and recreate all necessary indices of the database
@@ -545,6 +711,9 @@ def rebuildIndices(connwrap):
     connwrap.execSqlNoError("drop index wikiwordattrs_keyvalue")
     connwrap.execSqlNoError("drop index changelog_word")
     connwrap.execSqlNoError("drop index headversion_pkey")
+    connwrap.execSqlNoError("drop index snapshotpages_pkey")
+    connwrap.execSqlNoError("drop index snapshotpages_range")
+    connwrap.execSqlNoError("drop index snapshotcontent_pkey")
     connwrap.execSqlNoError("drop index datablocks_unifiedname")
 
     connwrap.execSqlNoError("create unique index wikiwordcontent_pkey on wikiwordcontent(word)")
@@ -559,6 +728,9 @@ def rebuildIndices(connwrap):
     connwrap.execSqlNoError("create index wikiwordattrs_keyvalue on wikiwordattrs(key, value)")
     connwrap.execSqlNoError("create index changelog_word on changelog(word)")
     connwrap.execSqlNoError("create unique index headversion_pkey on headversion(word)")
+    connwrap.execSqlNoError("create unique index snapshotpages_pkey on snapshotpages(word, lastsnapshot)")
+    connwrap.execSqlNoError("create index snapshotpages_range on snapshotpages(lastsnapshot, firstsnapshot)")
+    connwrap.execSqlNoError("create unique index snapshotcontent_pkey on snapshotcontent(contenthash)")
     connwrap.execSqlNoError("create unique index datablocks_unifiedname on datablocks(unifiedname)")
 
 
@@ -794,7 +966,7 @@ def sqlite_testMatch(context, values):
     """
     nakedword = utf8Dec(values[0].value_blob(), "replace")[0]
     fileContents = utf8Dec(values[1].value_blob(), "replace")[0]
-    sarOp = sqlite.getTransObject(values[2].value_int())
+    sarOp = sqlite.getTransObject(values[2].value_int64())
     if sarOp.testWikiPage(nakedword, fileContents) == True:
         context.result_int(1)
     else:
@@ -1268,6 +1440,16 @@ def updateDatabase(connwrap, dataDir):
     # --- WikiPad 2.1alpha.1 reached (formatver=9, writecompatver=9,
     #         readcompatver=9) ---
 
+    if formatver == 9:
+        # Convert versions stored in the changelog format to snapshots
+        if hasLegacyVersioningData(connwrap):
+            migrateLegacyVersioningData(connwrap)
+
+        formatver = 10
+
+    # --- Snapshot versioning reached (formatver=10, writecompatver=10,
+    #         readcompatver=9) ---
+
 
     # Write format information
 
@@ -20,7 +20,7 @@ from time import time, localtime
 import datetime
 import string, glob, traceback
 
-from wx import GetApp
+from pwiki.AppAccess import getApp
 
 from pwiki.WikiExceptions import *   # TODO make normal import
 from pwiki import SearchAndReplace
@@ -78,8 +78,8 @@ class WikiData:
             raise DbReadAccessError(e)
 
         # Set temporary directory if this is first sqlite use after prog. start
-        if not GetApp().sqliteInitFlag:
-            globalConfig = GetApp().getGlobalConfig()
+        if not getApp().sqliteInitFlag:
+            globalConfig = getApp().getGlobalConfig()
             if globalConfig.getboolean("main", "tempHandling_preferMemory",
                     False):
                 tempMode = u"memory"
@@ -88,7 +88,7 @@ class WikiData:
                         u"system")
 
             if tempMode == u"auto":
-                if GetApp().isInPortableMode():
+                if getApp().isInPortableMode():
                     tempMode = u"config"
                 else:
                     tempMode = u"system"
@@ -106,13 +106,13 @@ class WikiData:
                 self.connWrap.execSql("pragma temp_store = 1")
             elif tempMode == u"config":
                 self.connWrap.execSql("pragma temp_store_directory = '%s'" %
-                        utf8Enc(GetApp().getGlobalConfigSubDir())[0])
+                        utf8Enc(getApp().getGlobalConfigSubDir())[0])
                 self.connWrap.execSql("pragma temp_store = 1")
             else:   # tempMode == u"system"
                 self.connWrap.execSql("pragma temp_store_directory = ''")
                 self.connWrap.execSql("pragma temp_store = 1")
 
-            GetApp().sqliteInitFlag = True
+            getApp().sqliteInitFlag = True
 
         DbStructure.registerSqliteFunctions(self.connWrap)
 
@@ -197,6 +197,39 @@ class WikiData:
             raise lastException
 
 
+    def connectReadOnly(self):
+        """
+        Connect without updating the database structure and without writing
+        anything to the database or the wiki configuration. The connection
+        refuses all writes afterwards. Used by processes which only read from
+        a wiki opened (and updated) by another process, e.g. the workers
+        of a parallel HTML export.
+        """
+        formatcheck, formatmsg = self.checkDatabaseFormat()
+        if formatcheck != 0:
+            # Database must be updated by a normal connect() first
+            raise WikiDataException, formatmsg
+
+        try:
+            self.connWrap.execSql("pragma query_only = 1")
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        DbStructure.registerUtf8Support(self.connWrap)
+
+        self.contentDbToOutput = lambda c: utf8Dec(c, "replace")[0]
+        self.contentUniInputToDb = lambda u: utf8Enc(u, "replace")[0]
+
+        try:
+            self.cachedWikiPageLinkTermDict = None
+            self.cachedGlobalAttrs = None
+            self.getGlobalAttributes()
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def _reinit(self):
         """
         Actual initialization or reinitialization after rebuildWiki()
@@ -699,6 +732,46 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def getChildRelationshipTargetsForWords(self, words):
+        """
+        get the child relations of a whole batch of words with a single
+        query per chunk of words.
+        Function must work for read-only wiki.
+        words -- sequence of page names
+
+        Returns dictionary {word: list of (relation, pageName)} where pageName
+        is the real page name the relation resolves to or None if the
+        relation isn't defined (neither as page name nor as alias). Each
+        word of words is a key of the dictionary, words without children
+        map to an empty list.
+        """
+        result = dict((word, []) for word in words)
+        words = list(result.iterkeys())
+
+        try:
+            for start in xrange(0, len(words), 500):
+                chunk = words[start:start + 500]
+                sql = ("select word, relation, ifnull((select word from wikiwordcontent "
+                        "where wikiwordcontent.word = relation), (select word "
+                        "from wikiwordmatchterms where "
+                        "wikiwordmatchterms.matchterm = relation and "
+                        "(wikiwordmatchterms.type & 2) != 0 limit 1)) "
+                        "from wikirelations where word in (%s)") % \
+                        ", ".join(["?"] * len(chunk))
+                # Consts.WIKIWORDMATCHTERMS_TYPE_ASLINK == 2
+
+                for word, relation, pageName in self.connWrap.execSqlQuery(
+                        sql, chunk):
+                    # The column type is taken from the rows, so NULL may
+                    # come back as empty string
+                    result[word].append((relation, pageName or None))
+
+            return result
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def getParentRelationships(self, wikiWord):
         """
         get the parent relations to this word
@@ -1662,6 +1735,27 @@ class WikiData:
             raise DbReadAccessError(e)
 
 
+    def retrieveDataBlocks(self, unifNames, default=""):
+        """
+        Retrieve multiple data blocks as binary strings at once. Returns
+        dictionary {unifName: data}. Data is None for non-existing blocks.
+        """
+        unifNames = list(unifNames)
+        result = dict.fromkeys(unifNames)
+        try:
+            for i in xrange(0, len(unifNames), 500):
+                part = unifNames[i:i + 500]
+                result.update(self.connWrap.execSqlQuery(
+                        "select unifiedname, data from datablocks where "
+                        "unifiedname in (" + ", ".join(["?"] * len(part)) +
+                        ")", part))
+
+            return result
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def retrieveDataBlockAsText(self, unifName, default=""):
         """
         Retrieve data block as unicode string (assuming it was encoded properly)
@@ -1888,30 +1982,18 @@ class WikiData:
     # ---------- Versioning (optional) ----------
     # Must be implemented if checkCapability returns a version number
     #     for "versioning".
-        
-    def storeModification(self, word):
-        """ Store the modification for a single word (wikicontent and headversion for the word must exist)
-        between wikicontents and headversion in the changelog.
-        Does not modify headversion. It is recommended to not call this directly
-
-        Values for the op-column in the changelog:
-        0 set content: set content as it is in content column
-        1 modify: content is a binary compact diff as defined in StringOps,
-            apply it to new revision to get the old one.
-        2 create page: content contains data of the page
-        3 delete page: content is undefined
-        """
-
-        content, moddate = self._getContentAndInfo(word)[:2]
-
-        headcontent, headmoddate = self.connWrap.execSqlQuery("select content, modified from headversion "+\
-                "where word=?", (word,))[0]
-
-        bindiff = getBinCompactForDiff(content, headcontent)
-        self.connWrap.execSql("insert into changelog (word, op, content, moddate) values (?, ?, ?, ?)",
-                (word, 1, sqlite.Binary(bindiff), headmoddate))  # Modify  # TODO: Support overwrite
-        return self.connWrap.lastrowid
-
+    #
+    # Versions are snapshots of all wiki pages. Page contents are stored once
+    # per distinct content in table "snapshotcontent" under their SHA-1 hash.
+    # Table "snapshotpages" holds one row per page state with the range
+    # of snapshot ids (firstsnapshot to lastsnapshot, -1 for an open end)
+    # the state is part of. Storing a snapshot therefore only touches
+    # the pages changed since the previous one and any snapshot can be
+    # read or compared without replaying changes.
+
+    # SQL condition for page states in snapshot with id given as two parameters
+    _SNAPSHOT_RANGE_COND = "firstsnapshot <= ? and (lastsnapshot = -1 or " \
+            "lastsnapshot >= ?)"
 
     def hasVersioningData(self):
         """
@@ -1922,74 +2004,63 @@ class WikiData:
 
     def storeVersion(self, description):
         """
-        Store the current version of a wiki in the changelog
-
-        Values for the op-column in the changelog:
-        0 set content: set content as it is in content column
-        1 modify: content is a binary compact diff as defined in StringOps,
-            apply it to new revision to get the old one.
-        2 create page: content contains data of the page
-        3 delete page: content is undefined
-
-        Renaming is not supported directly.
+        Store the current content of all wiki pages as new snapshot.
+        Only pages created, modified or deleted since the previous snapshot
+        (as detected by their modification date) cause new rows.
         """
-        # Test if tables were created already
-
-        if not DbStructure.hasVersioningData(self.connWrap):
+        if not DbStructure.hasSnapshotData(self.connWrap):
             # Create the tables
             self.connWrap.syncCommit()
             try:
                 DbStructure.createVersioningTables(self.connWrap)
-                # self.connWrap.commit()
+                self.connWrap.commit()
             except:
                 self.connWrap.rollback()
                 raise
 
         self.connWrap.syncCommit()
         try:
-            # First move head version to normal versions
-            headversion = self.connWrap.execSqlQuery("select description, "+\
-                    "created from versions where id=0") # id 0 is the special head version
-            if len(headversion) == 1:
-                firstchangeid = self.connWrap.execSqlQuerySingleItem("select id from changelog order by id desc limit 1 ",
-                        default = -1) + 1
-
-                # Find modified words
-                modwords = self.connWrap.execSqlQuerySingleColumn("select headversion.word from headversion inner join "+\
-                        "wikiwordcontent on headversion.word = wikiwordcontent.word where "+\
-                        "headversion.modified != wikiwordcontent.modified")
-
-                for w in modwords:
-                    self.storeModification(w)
-
-
-                # Store changes for deleted words
-                self.connWrap.execSql("insert into changelog (word, op, content, moddate) "+\
-                        "select word, 2, content, modified from headversion where "+\
-                        "word not in (select word from wikiwordcontent)")
-
-                # Store changes for inserted words
-                self.connWrap.execSql("insert into changelog (word, op, content, moddate) "+\
-                        "select word, 3, x'', modified from wikiwordcontent where "+\
-                        "word not in (select word from headversion)")
-
-                if firstchangeid == (self.connWrap.execSqlQuerySingleItem("select id from changelog order by id desc limit 1 ",
-                        default = -1) + 1):
-
-                    firstchangeid = -1 # No changes recorded in changelog
-
-                headversion = headversion[0]
-                self.connWrap.execSql("insert into versions(description, firstchangeid, created) "+\
-                        "values(?, ?, ?)", (headversion[0], firstchangeid, headversion[1]))
-
-            self.connWrap.execSql("insert or replace into versions(id, description, firstchangeid, created) "+\
-                    "values(?, ?, ?, ?)", (0, description, -1, time()))
-
-            # Copy from wikiwordcontent everything to headversion
-            self.connWrap.execSql("delete from headversion")
-            self.connWrap.execSql("insert into headversion select * from wikiwordcontent")
+            self.connWrap.execSql("insert into snapshots(description, created) "
+                    "values (?, ?)", (description, time()))
+            snapId = self.connWrap.getLastRowid()
+            # Ids need not be contiguous
+            prevSnapId = self.connWrap.execSqlQuerySingleItem(
+                    "select max(id) from snapshots where id < ?", (snapId,),
+                    default=None)
+
+            # Pages which are new or modified since last snapshot
+            changed = self.connWrap.execSqlQuery("select wikiwordcontent.word, "
+                    "wikiwordcontent.content, wikiwordcontent.modified, "
+                    "wikiwordcontent.created from wikiwordcontent "
+                    "left join snapshotpages on "
+                    "snapshotpages.word = wikiwordcontent.word and "
+                    "snapshotpages.lastsnapshot = -1 "
+                    "where snapshotpages.word is null or "
+                    "snapshotpages.modified != wikiwordcontent.modified")
+
+            # Close states of deleted pages
+            self.connWrap.execSql("update snapshotpages set lastsnapshot = ? "
+                    "where lastsnapshot = -1 and "
+                    "word not in (select word from wikiwordcontent)",
+                    (prevSnapId,))
+
+            for word, content, modified, created in changed:
+                contentHash = DbStructure.storeSnapshotContent(self.connWrap,
+                        str(content))
+
+                self.connWrap.execSql("update snapshotpages set "
+                        "lastsnapshot = ? where lastsnapshot = -1 and word = ?",
+                        (prevSnapId, word))
+                self.connWrap.execSql("insert into snapshotpages(word, "
+                        "contenthash, modified, created, firstsnapshot, "
+                        "lastsnapshot) values (?, ?, ?, ?, ?, -1)",
+                        (word, contentHash, modified, created, snapId))
 
             self.connWrap.commit()
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            self.connWrap.rollback()
+            raise DbWriteAccessError(e)
         except:
             self.connWrap.rollback()
             raise
@@ -2000,65 +2071,99 @@ class WikiData:
         Return a list of tuples for each stored version with (<id>, <description>, <creation date>).
         Newest versions at first
         """
-        # Head version first
-        result = self.connWrap.execSqlQuery("select id, description, created "+\
-                    "from versions where id == 0")
-
-        result += self.connWrap.execSqlQuery("select id, description, created "+\
-                    "from versions where id != 0 order by id desc")
-        return result
-
+        if not DbStructure.hasSnapshotData(self.connWrap):
+            return []
 
-    # TODO: Wrong moddate?
-    def applyChange(self, word, op, content, moddate):
-        """
-        Apply a single change to wikiwordcontent. word, op, content and modified have the
-        same meaning as in the changelog table
-        """
-        if op == 0:
-            self.setContentRaw(word, content, moddate)
-        elif op == 1:
-            self.setContentRaw(word, applyBinCompact(self.getContent(word), content), moddate)
-        elif op == 2:
-            self.setContentRaw(word, content, moddate)
-        elif op == 3:
-            self._deleteContent(word)
+        return self.connWrap.execSqlQuery("select id, description, created "
+                "from snapshots order by id desc")
 
 
-    # TODO: Wrong date?, more efficient
     def applyStoredVersion(self, id):
         """
         Set the content back to the version identified by id (retrieved by getStoredVersions).
         Only wikiwordcontent is modified, the cache information must be updated separately
         """
+        if not DbStructure.hasSnapshotData(self.connWrap) or \
+                self.connWrap.execSqlQuerySingleItem("select id from snapshots "
+                "where id = ?", (id,), default=None) is None:
+            raise WikiFileNotFoundException(
+                    u"Stored version not found: %s" % id)
 
         self.connWrap.syncCommit()
         try:
-            # Start with head version
-            self.connWrap.execSql("delete from wikiwordcontent") #delete all rows
-            self.connWrap.execSql("insert into wikiwordcontent select * from headversion") # copy from headversion
-
-            if id != 0:
-                lowestchangeid = self.connWrap.execSqlQuerySingleColumn("select firstchangeid from versions where id == ?",
-                        (id,))
-                if len(lowestchangeid) == 0:
-                    raise WikiFileNotFoundException()  # TODO: Better exception
-
-                lowestchangeid = lowestchangeid[0]
+            self.connWrap.execSql("delete from wikiwordcontent where word not in "
+                    "(select word from snapshotpages where " +
+                    self._SNAPSHOT_RANGE_COND + ")", (id, id))
 
-                changes = self.connWrap.execSqlQuery("select word, op, content, moddate from changelog "+\
-                        "where id >= ? order by id desc", (lowestchangeid,))
-
-                for c in changes:
-                    self.applyChange(*c)
+            pages = self.connWrap.execSqlQuery("select snapshotpages.word, "
+                    "snapshotcontent.content, snapshotpages.modified, "
+                    "snapshotpages.created from snapshotpages inner join "
+                    "snapshotcontent on snapshotpages.contenthash = "
+                    "snapshotcontent.contenthash where " +
+                    self._SNAPSHOT_RANGE_COND, (id, id))
 
+            for word, content, modified, created in pages:
+                self.setContentRaw(word, str(content), modified, created)
 
+            self.cachedWikiPageLinkTermDict = None
             self.connWrap.commit()
         except:
             self.connWrap.rollback()
             raise
 
 
+    def getStoredVersionDifferences(self, fromId, toId):
+        """
+        Return a list of tuples (word, fromContent, toContent) for all pages
+        whose content differs between the stored versions fromId and toId.
+        A content is None if the page doesn't exist in that version.
+        """
+        if fromId == toId or not DbStructure.hasSnapshotData(self.connWrap):
+            return []
+
+        lowId, highId = min(fromId, toId), max(fromId, toId)
+
+        try:
+            # States which are in the older but not in the newer snapshot
+            lowStates = dict(self.connWrap.execSqlQuery("select word, "
+                    "contenthash from snapshotpages where firstsnapshot <= ? "
+                    "and lastsnapshot >= ? and lastsnapshot < ?",
+                    (lowId, lowId, highId)))
+
+            # States which are in the newer but not in the older snapshot
+            highStates = dict(self.connWrap.execSqlQuery("select word, "
+                    "contenthash from snapshotpages where firstsnapshot > ? "
+                    "and firstsnapshot <= ? and (lastsnapshot = -1 or "
+                    "lastsnapshot >= ?)", (lowId, highId, highId)))
+
+            def getContent(contentHash):
+                if contentHash is None:
+                    return None
+                return self.contentDbToOutput(self.connWrap.execSqlQuerySingleItem(
+                        "select content from snapshotcontent where "
+                        "contenthash = ?", (contentHash,)))
+
+            result = []
+            for word in set(lowStates) | set(highStates):
+                lowHash = lowStates.get(word)
+                highHash = highStates.get(word)
+                if lowHash == highHash:
+                    # Only modification date changed
+                    continue
+
+                if fromId == lowId:
+                    result.append((word, getContent(lowHash),
+                            getContent(highHash)))
+                else:
+                    result.append((word, getContent(highHash),
+                            getContent(lowHash)))
+
+            return result
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def deleteVersioningData(self):
         """
         Completely delete all versioning information
@@ -2188,7 +2293,7 @@ class WikiData:
             word = basename(fn).replace('.wiki', '')
 
             content = fileContentToUnicode(loadEntireTxtFile(fn))
-            langHelper = GetApp().createWikiLanguageHelper(
+            langHelper = getApp().createWikiLanguageHelper(
                     self.wikiDocument.getWikiDefaultWikiLanguage())
 
             if not langHelper.checkForInvalidWikiWord(word, self.wikiDocument):
@@ -765,6 +765,29 @@ class WikiData:
 #         return map(lambda c: (c, self._hasChildren(c, existingonly,
 #                 selfreference)), children)
 
+    def getChildRelationshipTargetsForWords(self, words):
+        """
+        get the child relations of a whole batch of words.
+        Function must work for read-only wiki.
+        words -- sequence of page names
+
+        Returns dictionary {word: list of (relation, pageName)} where pageName
+        is the real page name the relation resolves to or None if the
+        relation isn't defined (neither as page name nor as alias). Each
+        word of words is a key of the dictionary, words without children
+        map to an empty list.
+
+        Gadfly doesn't support "in" with a parameter list, so the
+        relations are retrieved word by word.
+        """
+        result = {}
+        for word in words:
+            result[word] = [(c, self.getWikiPageNameForLinkTerm(c))
+                    for c in self.getChildRelationships(word)]
+
+        return result
+
+
     def getParentRelationships(self, wikiWord):
         "get the parent relations to this word"
 
@@ -1997,6 +2020,15 @@ class WikiData:
                 raise DbReadAccessError(e)
 
 
+    def retrieveDataBlocks(self, unifNames, default=""):
+        """
+        Retrieve multiple data blocks as binary strings at once. Returns
+        dictionary {unifName: data}. Data is None for non-existing blocks.
+        """
+        return dict((unifName, self.retrieveDataBlock(unifName, default))
+                for unifName in unifNames)
+
+
     def retrieveDataBlockAsText(self, unifName, default=""):
         """
         Retrieve data block as unicode string (assuming it was encoded properly)
@@ -16,6 +16,7 @@ from pwiki.StringOps import mbcsDec, mbcsEnc, utf8Enc, utf8Dec, applyBinCompact,
         removeBracketsFilename, pathEnc, getFileSignatureBlock, \
         iterCompatibleFilename
 from pwiki.SearchAndReplace import SearchReplaceOperation
+from pwiki import Instrumentation
 
 import pwiki.sqlite3api as sqlite
 
@@ -51,20 +52,22 @@ class ConnectWrapBase:
 
     def execSql(self, sql, params=None):
         "utility method, executes the sql"
-        if params:
-            self.dbCursor.execute(sql, params)
-        else:
-            self.dbCursor.execute(sql)
+        with Instrumentation.span("db.execSql", sql):
+            if params:
+                self.dbCursor.execute(sql, params)
+            else:
+                self.dbCursor.execute(sql)
 
 
     def execSqlQuery(self, sql, params=None):
         "utility method, executes the sql, returns query result"
-        if params:
-            self.dbCursor.execute(sql, params, typeDetect=sqlite.TYPEDET_FIRST)
-        else:
-            self.dbCursor.execute(sql, typeDetect=sqlite.TYPEDET_FIRST)
+        with Instrumentation.span("db.execSqlQuery", sql):
+            if params:
+                self.dbCursor.execute(sql, params, typeDetect=sqlite.TYPEDET_FIRST)
+            else:
+                self.dbCursor.execute(sql, typeDetect=sqlite.TYPEDET_FIRST)
 
-        return self.dbCursor.fetchall()
+            return self.dbCursor.fetchall()
 
 
 #     def execSqlQueryIter(self, sql, params=None):
@@ -93,26 +96,28 @@ class ConnectWrapBase:
         one column and returns result. If query results
         to 0 rows, default is returned (defaults to None)
         """
-        if params:
-            self.dbCursor.execute(sql, params)
-        else:
-            self.dbCursor.execute(sql)
+        with Instrumentation.span("db.execSqlQuerySingleItem", sql):
+            if params:
+                self.dbCursor.execute(sql, params)
+            else:
+                self.dbCursor.execute(sql)
 
-        row = self.fetchone()
-        if row is None:
-            return default
+            row = self.fetchone()
+            if row is None:
+                return default
             
-        return row[0]
+            return row[0]
 
         
     def execSqlNoError(self, sql):
         """
         Ignore sqlite errors on execution
         """
-        try:
-            self.dbCursor.execute(sql)
-        except sqlite.Error:
-            pass
+        with Instrumentation.span("db.execSqlNoError", sql):
+            try:
+                self.dbCursor.execute(sql)
+            except sqlite.Error:
+                pass
 
 
     def getLastRowid(self):
@@ -20,7 +20,7 @@ from time import time, localtime
 import datetime
 import string, glob, traceback
 
-from wx import GetApp
+from pwiki.AppAccess import getApp
 
 from pwiki.WikiExceptions import *   # TODO make normal import
 from pwiki import SearchAndReplace
@@ -43,6 +43,7 @@ from pwiki.StringOps import getBinCompactForDiff, applyBinCompact, longPathEnc,
 from pwiki.StringOps import loadEntireFile, writeEntireFile, \
         iterCompatibleFilename, getFileSignatureBlock, guessBaseNameByFilename, \
         createRandomString, pathDec
+from pwiki.wikidata.PageFileScan import PageFileScanner, PageContentCache
 
 
 import Consts
@@ -53,6 +54,8 @@ class WikiData:
         self.wikiDocument = wikiDocument
         self.dataDir = dataDir
         self.cachedWikiPageLinkTermDict = None
+        # Decoded page contents for searching, created on first search
+        self.pageContentCache = None
         
         dbPath = self.wikiDocument.getWikiConfig().get("wiki_db", "db_filename",
                 u"").strip()
@@ -85,8 +88,8 @@ class WikiData:
         self.editorTextMode = False
         
         # Set temporary directory if this is first sqlite use after prog. start
-        if not GetApp().sqliteInitFlag:
-            globalConfig = GetApp().getGlobalConfig()
+        if not getApp().sqliteInitFlag:
+            globalConfig = getApp().getGlobalConfig()
             if globalConfig.getboolean("main", "tempHandling_preferMemory",
                     False):
                 tempMode = u"memory"
@@ -95,7 +98,7 @@ class WikiData:
                         u"system")
 
             if tempMode == u"auto":
-                if GetApp().isInPortableMode():
+                if getApp().isInPortableMode():
                     tempMode = u"config"
                 else:
                     tempMode = u"system"
@@ -113,13 +116,13 @@ class WikiData:
                 self.connWrap.execSql("pragma temp_store = 1")
             elif tempMode == u"config":
                 self.connWrap.execSql("pragma temp_store_directory = '%s'" %
-                        utf8Enc(GetApp().getGlobalConfigSubDir())[0])
+                        utf8Enc(getApp().getGlobalConfigSubDir())[0])
                 self.connWrap.execSql("pragma temp_store = 1")
             else:   # tempMode == u"system"
                 self.connWrap.execSql("pragma temp_store_directory = ''")
                 self.connWrap.execSql("pragma temp_store = 1")
 
-            GetApp().sqliteInitFlag = True
+            getApp().sqliteInitFlag = True
 
         DbStructure.registerSqliteFunctions(self.connWrap)
 
@@ -207,6 +210,39 @@ class WikiData:
             raise lastException
 
 
+    def connectReadOnly(self):
+        """
+        Connect without updating the database structure and without writing
+        anything to the database or the wiki configuration. The connection
+        refuses all writes afterwards. Used by processes which only read from
+        a wiki opened (and updated) by another process, e.g. the workers
+        of a parallel HTML export.
+        """
+        formatcheck, formatmsg = self.checkDatabaseFormat()
+        if formatcheck != 0:
+            # Database must be updated by a normal connect() first
+            raise WikiDataException, formatmsg
+
+        try:
+            self.connWrap.execSql("pragma query_only = 1")
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        DbStructure.registerUtf8Support(self.connWrap)
+
+        self.contentDbToOutput = lambda c: utf8Dec(c, "replace")[0]
+        self.contentUniInputToDb = lambda u: utf8Enc(u, "replace")[0]
+
+        try:
+            self.cachedWikiPageLinkTermDict = None
+            self.cachedGlobalAttrs = None
+            self.getGlobalAttributes()
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def _reinit(self):
         """
         Actual initialization or reinitialization after rebuildWiki()
@@ -829,6 +865,46 @@ class WikiData:
 #         return self.connWrap.execSqlQuery(outersql, (wikiWord,))
 
 
+    def getChildRelationshipTargetsForWords(self, words):
+        """
+        get the child relations of a whole batch of words with a single
+        query per chunk of words.
+        Function must work for read-only wiki.
+        words -- sequence of page names
+
+        Returns dictionary {word: list of (relation, pageName)} where pageName
+        is the real page name the relation resolves to or None if the
+        relation isn't defined (neither as page name nor as alias). Each
+        word of words is a key of the dictionary, words without children
+        map to an empty list.
+        """
+        result = dict((word, []) for word in words)
+        words = list(result.iterkeys())
+
+        try:
+            for start in xrange(0, len(words), 500):
+                chunk = words[start:start + 500]
+                sql = ("select word, relation, ifnull((select word from wikiwords "
+                        "where wikiwords.word = relation), (select word "
+                        "from wikiwordmatchterms where "
+                        "wikiwordmatchterms.matchterm = relation and "
+                        "(wikiwordmatchterms.type & 2) != 0 limit 1)) "
+                        "from wikirelations where word in (%s)") % \
+                        ", ".join(["?"] * len(chunk))
+                # Consts.WIKIWORDMATCHTERMS_TYPE_ASLINK == 2
+
+                for word, relation, pageName in self.connWrap.execSqlQuery(
+                        sql, chunk):
+                    # The column type is taken from the rows, so NULL may
+                    # come back as empty string
+                    result[word].append((relation, pageName or None))
+
+            return result
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
     def getParentRelationships(self, wikiWord):
         """
         get the parent relations to this word
@@ -1140,53 +1216,133 @@ class WikiData:
         
         self.cachedWikiPageLinkTermDict = None
         try:
-            # Delete words for which no file is present anymore
-            for path in self.connWrap.execSqlQuerySingleColumn(
-                    "select filepath from wikiwords"):
+            # Delete words for which no file is present anymore.
+            # Only files not found by globbing are tested individually
+            diskFilesNormCase = frozenset(os.path.normcase(path)
+                    for path in diskFiles)
+
+            for path in dbFiles:
+                if os.path.normcase(path) in diskFilesNormCase:
+                    continue
 
                 testPath = longPathEnc(os.path.join(self.dataDir, path))
                 if not os.path.exists(testPath) or not os.path.isfile(testPath):
-                    if deleteFully:
-                        words = self.connWrap.execSqlQuerySingleColumn(
-                                "select word from wikiwords "
-                                "where filepath = ?", (path,))
-                        for word in words:
-                            try:
-                                self.deleteWord(word, delContent=False)
-                            except WikiDataException, e:
-                                if e.getTag() != "delete rootPage":
-                                    raise
-
-                    self.connWrap.execSql("delete from wikiwords "
-                            "where filepath = ?", (path,))
+                    self._removeWordsForMissingFile(path, deleteFully)
 
             # Add new words:
             ti = time()
             
             for path in (diskFiles - dbFiles):
-                fullPath = os.path.join(self.dataDir, path)
-                st = os.stat(longPathEnc(fullPath))
-                
-                wikiWord = self._findNewWordForFile(path)
-                
-                if wikiWord is not None:
-                    fileSig = self.wikiDocument.getFileSignatureBlock(fullPath)
-                    
-                    self.connWrap.execSql("insert into wikiwords(word, created, "
-                            "modified, filepath, filenamelowercase, "
-                            "filesignature, metadataprocessed) "
-                            "values (?, ?, ?, ?, ?, ?, 0)",
-                            (wikiWord, ti, st.st_mtime, path, path.lower(),
-                                    sqlite.Binary(fileSig)))
-                                    
-                    page = self.wikiDocument.getWikiPage(wikiWord)
-                    page.refreshSyncUpdateMatchTerms()
-                    
+                self._addWordForNewFile(path, ti)
+
         except (IOError, OSError, sqlite.Error), e:
             traceback.print_exc()
             raise DbWriteAccessError(e)
 
 
+    def refreshWikiPageLinkTermsForFiles(self, fileNames, deleteFully=False):
+        """
+        Same as refreshWikiPageLinkTerms() but only checks the page files
+        with the given names (relative to data directory) which were
+        reported as changed, added or removed by a file watcher.
+        Files which are just modified are left alone.
+        """
+        try:
+            ti = time()
+
+            for path in fileNames:
+                if not path.endswith(self.pagefileSuffix):
+                    continue
+
+                testPath = longPathEnc(os.path.join(self.dataDir, path))
+                inDb = bool(self.connWrap.execSqlQuerySingleItem(
+                        "select 1 from wikiwords where filepath = ?", (path,)))
+
+                if os.path.isfile(testPath):
+                    if not inDb:
+                        self.cachedWikiPageLinkTermDict = None
+                        self._addWordForNewFile(path, ti)
+                elif inDb:
+                    self.cachedWikiPageLinkTermDict = None
+                    self._removeWordsForMissingFile(path, deleteFully)
+
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbWriteAccessError(e)
+
+
+    def _removeWordsForMissingFile(self, path, deleteFully):
+        """
+        Remove the entries for page file path which is no longer present.
+        """
+        if deleteFully:
+            words = self.connWrap.execSqlQuerySingleColumn(
+                    "select word from wikiwords "
+                    "where filepath = ?", (path,))
+            for word in words:
+                try:
+                    self.deleteWord(word, delContent=False)
+                except WikiDataException, e:
+                    if e.getTag() != "delete rootPage":
+                        raise
+
+        self.connWrap.execSql("delete from wikiwords "
+                "where filepath = ?", (path,))
+
+
+    def _addWordForNewFile(self, path, ti):
+        """
+        Create an entry for the new page file path not yet known to the
+        database.
+        """
+        fullPath = os.path.join(self.dataDir, path)
+        st = os.stat(longPathEnc(fullPath))
+        
+        wikiWord = self._findNewWordForFile(path)
+        
+        if wikiWord is not None:
+            fileSig = self.wikiDocument.getFileSignatureBlock(fullPath)
+            
+            self.connWrap.execSql("insert into wikiwords(word, created, "
+                    "modified, filepath, filenamelowercase, "
+                    "filesignature, metadataprocessed) "
+                    "values (?, ?, ?, ?, ?, ?, 0)",
+                    (wikiWord, ti, st.st_mtime, path, path.lower(),
+                            sqlite.Binary(fileSig)))
+                            
+            page = self.wikiDocument.getWikiPage(wikiWord)
+            page.refreshSyncUpdateMatchTerms()
+
+
+    def getWikiPageNamesForFileNames(self, fileNames):
+        """
+        Return names of the wiki pages stored in the page files with the
+        given names (relative to data directory).
+        Function must work for read-only wiki.
+        """
+        try:
+            result = []
+            for path in fileNames:
+                result += self.connWrap.execSqlQuerySingleColumn(
+                        "select word from wikiwords where filepath = ?",
+                        (path,))
+
+            return result
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+
+    def getPageFileDirAndSuffix(self):
+        """
+        Return tuple (dataDir, pagefileSuffix) describing where page files
+        are stored. Must be implemented if checkCapability returns a version
+        number for "fileWatch".
+        Function must work for read-only wiki.
+        """
+        return self.dataDir, self.pagefileSuffix
+
+
     def _getCachedWikiPageLinkTermDict(self):
         """
         Function works for read-only wiki.
@@ -2082,6 +2238,46 @@ class WikiData:
                 raise DbReadAccessError(e)
 
 
+    def retrieveDataBlocks(self, unifNames, default=""):
+        """
+        Retrieve multiple data blocks as binary strings at once. Returns
+        dictionary {unifName: data}. Data is None for non-existing blocks.
+        If option "wikiPageFiles_gracefulOutsideAddAndRemove" is set and
+        a file couldn't be retrieved, its data is default instead.
+        """
+        unifNames = list(unifNames)
+        result = dict.fromkeys(unifNames)
+        filePaths = {}
+        try:
+            for i in xrange(0, len(unifNames), 500):
+                part = unifNames[i:i + 500]
+                inClause = "(" + ", ".join(["?"] * len(part)) + ")"
+                result.update(self.connWrap.execSqlQuery(
+                        "select unifiedname, data from datablocks where "
+                        "unifiedname in " + inClause, part))
+                filePaths.update(self.connWrap.execSqlQuery(
+                        "select unifiedname, filepath from datablocksexternal "
+                        "where unifiedname in " + inClause, part))
+        except (IOError, OSError, sqlite.Error), e:
+            traceback.print_exc()
+            raise DbReadAccessError(e)
+
+        for unifName, filePath in filePaths.iteritems():
+            if result[unifName] is not None:
+                continue
+            try:
+                result[unifName] = loadEntireFile(join(self.dataDir, filePath))
+            except (IOError, OSError), e:
+                if self.wikiDocument.getWikiConfig().getboolean("main",
+                        "wikiPageFiles_gracefulOutsideAddAndRemove", True):
+                    result[unifName] = default
+                else:
+                    traceback.print_exc()
+                    raise DbReadAccessError(e)
+
+        return result
+
+
     def retrieveDataBlockAsText(self, unifName, default=""):
         """
         Retrieve data block as unicode string (assuming it was encoded properly)
@@ -2284,9 +2480,41 @@ class WikiData:
         result = set()
 
         if sarOp.isTextNeededForTest():
-            for word in self.getAllDefinedWikiPageNames():
-                if word in exclusionSet:
-                    continue
+            entries = []
+            missingWords = []
+            try:
+                for word, filePath in self.connWrap.execSqlQuery(
+                        "select word, filepath from wikiwords"):
+                    if word in exclusionSet:
+                        continue
+                    if filePath is None:
+                        missingWords.append(word)
+                    else:
+                        entries.append((word, filePath))
+            except (IOError, OSError, sqlite.Error), e:
+                traceback.print_exc()
+                raise DbReadAccessError(e)
+
+            scanner = PageFileScanner(self.dataDir,
+                    sarOp.getRequiredLiterals(),
+                    getApp().getGlobalConfig().getint("main",
+                    "search_fileScan_threadCount", 4),
+                    self._getPageContentCache())
+
+            try:
+                for word, fileContents in scanner.iterPages(entries):
+                    if fileContents is None:
+                        missingWords.append(word)
+                        continue
+
+                    if sarOp.testWikiPage(word, fileContents) == True:
+                        result.add(word)
+            except (IOError, OSError), e:
+                traceback.print_exc()
+                raise DbReadAccessError(e)
+
+            # Let getContent() handle files moved or deleted outside
+            for word in missingWords:
                 try:
                     fileContents = self.getContent(word)
                 except WikiFileNotFoundException:
@@ -2304,6 +2532,20 @@ class WikiData:
                     result.add(word)
 
         return result
+
+
+    def _getPageContentCache(self):
+        """
+        Not part of public API!
+        Return the PageContentCache for searching.
+        """
+        if self.pageContentCache is None:
+            # Size option is in MB, one character counted as two bytes
+            self.pageContentCache = PageContentCache(
+                    getApp().getGlobalConfig().getint("main",
+                    "search_pageContentCache_maxSize", 16) * 512 * 1024)
+
+        return self.pageContentCache
         
 
     # ---------- Miscellaneous ----------
@@ -2312,6 +2554,7 @@ class WikiData:
         "rebuild": 1,
         "compactify": 1,     # = sqlite vacuum
         "filePerPage": 1,   # Uses a single file per page
+        "fileWatch": 1,   # Page files can be watched for external changes
 #         "versioning": 1,     # (old versioning)
 #         "plain text import":1   # Is already plain text      
         }
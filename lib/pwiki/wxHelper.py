@@ -780,19 +780,26 @@ class wxKeyFunctionSink(wx.EvtHandler, KeyFunctionSink):
     If the wxWindow ifdestroyed receives a destroy message, the sink
     automatically disconnects from evtSource.
     """
-    __slots__ = ("eventSource", "ifdestroyed", "disabledSource")
+    __slots__ = ("eventSource", "ifdestroyed", "disabledSource", "coalesced")
 
 
-    def __init__(self, activationTable, eventSource=None, ifdestroyed=None):
+    def __init__(self, activationTable, eventSource=None, ifdestroyed=None,
+            coalesced=False):
+        """
+        coalesced -- Iff true, listen in coalesced mode, events sent during
+                bulk operations are merged (see MiscEvent.batchScope())
+        """
         wx.EvtHandler.__init__(self)
         KeyFunctionSink.__init__(self, activationTable)
 
         self.eventSource = eventSource
         self.ifdestroyed = ifdestroyed
         self.disabledSource = None
+        self.coalesced = coalesced
         
         if self.eventSource is not None:
-            self.eventSource.addListener(self, self.ifdestroyed is None)
+            self.eventSource.addListener(self, self.ifdestroyed is None,
+                    self.coalesced)
 
         if self.ifdestroyed is not None:
             wx.EVT_WINDOW_DESTROY(self.ifdestroyed, self.OnDestroy)
@@ -815,7 +822,7 @@ class wxKeyFunctionSink(wx.EvtHandler, KeyFunctionSink):
 
             self.eventSource = self.disabledSource
             self.disabledSource = None
-            self.eventSource.addListener(self)
+            self.eventSource.addListener(self, coalesced=self.coalesced)
         else:
             if self.eventSource is None or self.disabledSource is not None:
                 return
@@ -836,7 +843,7 @@ class wxKeyFunctionSink(wx.EvtHandler, KeyFunctionSink):
         self.eventSource = eventSource
         self.disabledSource = None
         if self.eventSource is not None:
-            self.eventSource.addListener(self)
+            self.eventSource.addListener(self, coalesced=self.coalesced)
 
     def disconnect(self):
         """
@@ -0,0 +1,237 @@
+import testenv
+
+import unittest, sys, os, os.path, json, subprocess
+from StringIO import StringIO
+
+from pwiki import BatchCmd
+from pwiki.BatchCmd import BatchCmdError, buildSearchOperation, EXIT_OK, \
+        EXIT_ERROR, EXIT_USAGE, EXIT_NO_MATCH, EXIT_OUT_OF_SYNC
+
+
+class CommandLineTests(unittest.TestCase):
+    def assertUsageError(self, args):
+        try:
+            BatchCmd.BatchCmd(args)
+        except BatchCmdError, e:
+            self.assertEqual(e.exitCode, EXIT_USAGE, args)
+        else:
+            self.fail("No usage error for %r" % (args,))
+
+    def testParse(self):
+        cmd = BatchCmd.BatchCmd(["-w", "a.wiki", "--ignore-lock", "--progress",
+                "export", "--type", "html_multi", "--dest", "out",
+                "--what", "subtree", "-p", "PageA", "--page", "PageB"])
+        self.assertEqual(cmd.wikiPath, u"a.wiki")
+        self.assertTrue(cmd.ignoreLock and cmd.progress)
+        self.assertFalse(cmd.updateDb)
+        self.assertEqual(cmd.command, "export")
+        self.assertEqual(cmd.cmdOpts, {"type": u"html_multi", "dest": u"out",
+                "what": u"subtree", "page": [u"PageA", u"PageB"]})
+
+        # Command options may follow the argument
+        cmd = BatchCmd.BatchCmd(["--wiki=a.wiki", "search", "budget",
+                "--whole-word"])
+        self.assertEqual(cmd.cmdArgs, [u"budget"])
+        self.assertEqual(cmd.cmdOpts, {"type": u"regex", "whole-word": True,
+                "page": []})
+
+        cmd = BatchCmd.BatchCmd(["-w", "a.wiki", "export", "--type", "x",
+                "--dest", "y"])
+        self.assertEqual(cmd.cmdOpts["what"], u"wiki")
+
+        self.assertTrue(BatchCmd.BatchCmd(["--help"]).showHelp)
+
+    def testUsageErrors(self):
+        for args in ([], ["-w", "a.wiki"], ["-w", "a.wiki", "unknown"],
+                ["--unknown", "-w", "a.wiki", "rebuild"],
+                ["rebuild"],
+                ["-w", "a.wiki", "rebuild", "--unknown"],
+                ["-w", "a.wiki", "rebuild", "argument"],
+                ["-w", "a.wiki", "export", "--type", "html_multi"],
+                ["-w", "a.wiki", "export", "--type", "html_multi", "--dest",
+                    "out", "--what", "everything"],
+                ["-w", "a.wiki", "export", "--type", "html_multi", "--dest",
+                    "out", "--what", "page"],
+                ["-w", "a.wiki", "search"],
+                ["-w", "a.wiki", "search", "a", "b"],
+                ["-w", "a.wiki", "search", "--type", "fuzzy", "a"]):
+            self.assertUsageError(args)
+
+    def testMainUsageError(self):
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            exitCode = BatchCmd.main(["-w", "a.wiki", "unknown"])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+        self.assertEqual(exitCode, EXIT_USAGE)
+        self.assertEqual(json.loads(output), {u"command": None,
+                u"wiki": None, u"ok": False, u"exitCode": EXIT_USAGE,
+                u"error": u"Unknown command 'unknown'"})
+
+    def testBuildSearchOperation(self):
+        # stripSearchString() needs the global configuration
+        testenv.getApp()
+        for searchType, wildCard, booleanOp, indexSearch in (
+                (u"asis", 'no', False, 'no'),
+                (u"regex", 'regex', False, 'no'),
+                (u"boolean", 'regex', True, 'no'),
+                (u"index", 'regex', False, 'default')):
+            sarOp = buildSearchOperation(u"budget", searchType, True)
+            self.assertEqual((sarOp.wildCard, sarOp.booleanOp,
+                    sarOp.indexSearch), (wildCard, booleanOp, indexSearch),
+                    searchType)
+            self.assertTrue(sarOp.caseSensitive and sarOp.wikiWide)
+            self.assertFalse(sarOp.wholeWord)
+
+    def testWithoutWx(self):
+        # Entry script started in a process where "import wx" fails
+        script = """
+import sys
+
+class NoWxFinder(object):
+    def find_module(self, name, path=None):
+        if name == "wx" or name.startswith("wx."):
+            return self
+
+    def load_module(self, name):
+        raise ImportError("No module named " + name)
+
+sys.meta_path.insert(0, NoWxFinder())
+sys.argv = [%r, "--help"]
+execfile(sys.argv[0])
+""" % os.path.join(testenv.MAIN_DIR, "WikidPadBatch.py")
+
+        proc = subprocess.Popen([sys.executable, "-c", script],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                cwd=testenv.MAIN_DIR)
+        output = proc.communicate()[0]
+        self.assertEqual(proc.returncode, EXIT_OK, output)
+        self.assertTrue("Exit codes" in output, output)
+
+
+
+class _BatchCmd(BatchCmd.BatchCmd):
+    """
+    Remembers the thread watching the page files of the opened wiki
+    """
+    watchThread = None
+
+    def _openWiki(self, app):
+        wikiDocument = BatchCmd.BatchCmd._openWiki(self, app)
+        watchService = wikiDocument.pageFileWatchService
+        self.watchThread = watchService and watchService.thread
+        return wikiDocument
+
+
+
+class RunTests(testenv.TempDirTestCase):
+    def setUp(self):
+        testenv.TempDirTestCase.setUp(self)
+        self.pages = testenv.generatePages(pages=10, journalPages=0) + \
+                [(u"BudgetPage", u"+ BudgetPage\n\nThe budget report\n")]
+        wikiDocument = testenv.createWiki(self.tempDir, "original_sqlite",
+                self.pages)
+        self.wikiPath = wikiDocument.getWikiConfigPath()
+        self.dataDir, self.suffix = \
+                wikiDocument.getWikiData().getPageFileDirAndSuffix()
+        testenv.closeWiki(wikiDocument)
+
+    def runCmd(self, *args):
+        """
+        Run command args on the wiki and return exit code and result
+        """
+        cmd = _BatchCmd(["-w", self.wikiPath] + list(args))
+        result = {}
+        try:
+            exitCode = cmd.run(testenv.getApp(), result)
+        finally:
+            # Wiki is released, don't let the thread run at interpreter exit
+            if cmd.watchThread is not None:
+                cmd.watchThread.join()
+        return exitCode, result
+
+    def assertError(self, exitCode, *args):
+        try:
+            self.runCmd(*args)
+        except BatchCmdError, e:
+            self.assertEqual(e.exitCode, exitCode, args)
+        else:
+            self.fail("No error for %r" % (args,))
+
+    def testSearch(self):
+        exitCode, result = self.runCmd("search", "budget\\s+report")
+        self.assertEqual(exitCode, EXIT_OK)
+        self.assertTrue(u"BudgetPage" in result["pages"])
+
+        exitCode, result = self.runCmd("search", "--type", "asis",
+                "budget\\s+report")
+        self.assertEqual((exitCode, result["pages"]), (EXIT_NO_MATCH, []))
+
+        self.assertError(EXIT_USAGE, "search", "budget(")
+        # Wiki has no search index
+        self.assertError(EXIT_ERROR, "search", "--type", "index", "budget")
+        self.assertError(EXIT_ERROR, "rebuild-index")
+
+    def testRebuild(self):
+        self.assertEqual(self.runCmd("rebuild"), (EXIT_OK, {"onlyDirty": False}))
+        self.assertEqual(self.runCmd("rebuild", "--only-dirty"),
+                (EXIT_OK, {"onlyDirty": True}))
+
+    def testCheckExt(self):
+        self.assertEqual(self.runCmd("check-ext", "--dry-run"),
+                (EXIT_OK, {"dryRun": True, "modified": []}))
+
+        path = os.path.join(self.dataDir, u"BudgetPage" + self.suffix)
+        with open(path, "ab") as f:
+            f.write("\nChanged externally\n")
+        os.utime(path, (1000000000, 1000000000))
+        with open(os.path.join(self.dataDir, u"NewPage" + self.suffix),
+                "wb") as f:
+            f.write("+ NewPage\n\nNew budget report\n")
+
+        self.assertEqual(self.runCmd("check-ext", "--dry-run"),
+                (EXIT_OUT_OF_SYNC, {"dryRun": True,
+                "modified": [u"BudgetPage"]}))
+        self.assertEqual(self.runCmd("check-ext"), (EXIT_OK, {"dryRun": False,
+                "added": [u"NewPage"], "removed": [],
+                "modified": [u"BudgetPage"]}))
+
+        exitCode, result = self.runCmd("search", "Changed externally|New budget")
+        self.assertEqual(sorted(result["pages"]), [u"BudgetPage", u"NewPage"])
+
+    def testExport(self):
+        exitCode, result = self.runCmd("export", "--list-types")
+        self.assertEqual(exitCode, EXIT_OK)
+        types = [t["type"] for t in result["types"]]
+        self.assertTrue(u"html_multi" in types and u"multipage_text" in types)
+
+        dest = os.path.join(self.tempDir, "export")
+        os.mkdir(dest)
+        exitCode, result = self.runCmd("export", "--type", "html_multi",
+                "--dest", dest, "--what", "page", "-p", "BudgetPage")
+        self.assertEqual((exitCode, result["pageCount"]), (EXIT_OK, 1))
+        # A single page is exported to a file named after the wiki
+        with open(os.path.join(dest, "TestWiki.html"), "rb") as f:
+            self.assertTrue("The budget report" in f.read())
+
+        dest = os.path.join(self.tempDir, "export.mpt")
+        exitCode, result = self.runCmd("export", "--type", "multipage_text",
+                "--dest", dest)
+        self.assertEqual((exitCode, result["pageCount"]),
+                (EXIT_OK, len(self.pages)))
+        with open(dest, "rb") as f:
+            self.assertTrue("The budget report" in f.read())
+
+        self.assertError(EXIT_USAGE, "export", "--type", "unknown", "--dest",
+                dest)
+
+    def testMissingWiki(self):
+        self.wikiPath = os.path.join(self.tempDir, "missing.wiki")
+        self.assertError(EXIT_ERROR, "rebuild")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import testenv
+
+import unittest, random
+
+from pwiki.EnhancedScintillaControl import ByteOffsetTable, StyleCollector, \
+        bytelenSct_utf8
+
+
+def bytelen_utf16(us):
+    return len(us.encode("utf-16-le"))
+
+
+# Characters of different UTF-8 byte lengths and a surrogate pair, written
+# as two code units so pairs are also tested on wide Python builds
+_CHARS = (u"a", u" ", u"\n", u"\xe4", u"\u20ac", u"\ud83d\ude00")
+
+
+def _randomText(rnd, length):
+    return u"".join(rnd.choice(_CHARS) for i in xrange(length))
+
+
+def _isInsideSurrogatePair(text, pos):
+    return 0 < pos < len(text) and u"\ud800" <= text[pos - 1] <= u"\udbff" \
+            and u"\udc00" <= text[pos] <= u"\udfff"
+
+
+class ByteOffsetTableTests(unittest.TestCase):
+    def assertTableCorrect(self, text, bytelenSct):
+        table = ByteOffsetTable(text, bytelenSct)
+        self.assertEqual(table.getByteLength(), bytelenSct(text))
+        for pos in xrange(len(text) + 1):
+            if _isInsideSurrogatePair(text, pos):
+                continue
+            self.assertEqual(table.charToByte(pos), bytelenSct(text[:pos]),
+                    "position %i of %r" % (pos, text))
+
+    def testSingleByte(self):
+        table = ByteOffsetTable(u"abc\ndef" * 20, bytelenSct_utf8)
+        self.assertTrue(table.isSingleByte())
+        self.assertEqual(table.charToByte(0), 0)
+        self.assertEqual(table.charToByte(140), 140)
+
+        self.assertTableCorrect(u"", bytelenSct_utf8)
+        self.assertTableCorrect(u"abc", bytelenSct_utf8)
+
+    def testMultiByte(self):
+        dist = ByteOffsetTable.CHECKPOINT_DISTANCE
+        table = ByteOffsetTable(u"\xe4" * (dist * 3), bytelenSct_utf8)
+        self.assertFalse(table.isSingleByte())
+        self.assertEqual(table.charToByte(dist), dist * 2)
+
+        for length in (1, dist - 1, dist, dist + 1, dist * 4 + 3):
+            self.assertTableCorrect(u"\u20ac" * length, bytelenSct_utf8)
+            self.assertTableCorrect(u"a" * (length - 1) + u"\xe4",
+                    bytelenSct_utf8)
+
+    def testSurrogatePairAtCheckpoint(self):
+        dist = ByteOffsetTable.CHECKPOINT_DISTANCE
+        for prefix in (dist - 2, dist - 1, dist, dist * 2 - 1):
+            text = u"a" * prefix + u"\ud83d\ude00" * 3 + u"\xe4" * dist
+            self.assertTableCorrect(text, bytelenSct_utf8)
+            self.assertTableCorrect(text, bytelen_utf16)
+
+    def testRandom(self):
+        rnd = random.Random(42)
+        for i in xrange(100):
+            text = _randomText(rnd, rnd.randint(0, 150))
+            self.assertTableCorrect(text, bytelenSct_utf8)
+            self.assertTableCorrect(text, bytelen_utf16)
+
+
+class StyleCollectorTests(unittest.TestCase):
+    DEFAULT_STYLE = 0
+
+    @staticmethod
+    def _expectedBytes(text, styles, startCharPos, endCharPos):
+        """
+        Return style bytes for the characters of text[startCharPos:endCharPos]
+        with styles, a list of one style number per character.
+        """
+        return "".join(chr(styles[i]) * bytelenSct_utf8(text[i])
+                for i in xrange(startCharPos, endCharPos))
+
+    def testSingleAndMultiByteTexts(self):
+        for text in (u"plain ascii text\nwith lines" * 5,
+                u"gr\xfc\xdfe \u20ac and more\n" * 5):
+            collector = StyleCollector(self.DEFAULT_STYLE, text,
+                    bytelenSct_utf8)
+            collector.bindStyle(2, 5, 3)
+            collector.bindStyle(10, 20, 4)
+            collector.orStyle(12, 4, 0x20)
+
+            styles = [0] * len(text)
+            styles[2:7] = [3] * 5
+            styles[10:30] = [4] * 20
+            styles[12:16] = [4 | 0x20] * 4
+
+            self.assertEqual(collector.value(),
+                    self._expectedBytes(text, styles, 0, len(text)))
+
+    def testOverlappingStyles(self):
+        text = u"\xe4bc def ghi"
+        collector = StyleCollector(self.DEFAULT_STYLE, text, bytelenSct_utf8)
+        collector.bindStyle(0, 8, 1)
+        # Overlapping style removes the rest of the previous one
+        collector.bindStyle(2, 3, 2)
+
+        styles = [1, 1, 2, 2, 2, 0, 0, 0, 0, 0, 0]
+        self.assertEqual(collector.value(),
+                self._expectedBytes(text, styles, 0, len(text)))
+
+    def testRandomRanges(self):
+        rnd = random.Random(7)
+        for k in xrange(100):
+            text = u"".join(rnd.choice(_CHARS[:5])
+                    for i in xrange(rnd.randint(1, 200)))
+            startCharPos = rnd.randint(0, len(text))
+            endCharPos = rnd.randint(startCharPos, len(text))
+
+            collector = StyleCollector(self.DEFAULT_STYLE, text,
+                    bytelenSct_utf8, startCharPos=startCharPos,
+                    endCharPos=endCharPos)
+            styles = [self.DEFAULT_STYLE] * len(text)
+
+            # Ascending styles as created by the wiki parser, may reach
+            # outside of the collected range
+            pos = 0
+            while pos < len(text):
+                pos += rnd.randint(0, 10)
+                length = rnd.randint(0, 10)
+                styleNo = rnd.randint(1, 30)
+                collector.bindStyle(pos, length, styleNo)
+                styles[pos:pos + length] = [styleNo] * \
+                        len(styles[pos:pos + length])
+                pos += length
+
+            self.assertEqual(collector.value(), self._expectedBytes(text,
+                    styles, startCharPos, endCharPos))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,244 @@
+import testenv
+
+import unittest, os, os.path, threading, time, Queue
+
+from pwiki.wikidata.FileWatch import InotifyWatcher, PollingWatcher, \
+        PageFileWatchService
+
+
+def _writeFile(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+class _WatcherTestMixin(object):
+    """
+    Common tests of the watchers, the test case must define createWatcher()
+    """
+    def setUp(self):
+        testenv.TempDirTestCase.setUp(self)
+        _writeFile(os.path.join(self.tempDir, "Existing.wiki"), "text")
+        _writeFile(os.path.join(self.tempDir, "Deleted.wiki"), "text")
+        self.watcher = self.createWatcher()
+
+    def tearDown(self):
+        self.watcher.close()
+        testenv.TempDirTestCase.tearDown(self)
+
+    def collectChanges(self, expectedNames):
+        """
+        Collect reported file names until expectedNames are found or
+        a timeout is reached.
+        """
+        result = set()
+        endTime = time.time() + 5
+        while not expectedNames <= result and time.time() < endTime:
+            fileNames, rescan = self.watcher.waitForChanges(0.1)
+            self.assertFalse(rescan)
+            result |= fileNames
+
+        return result
+
+    def testReportsChangedFiles(self):
+        _writeFile(os.path.join(self.tempDir, "Existing.wiki"), "changed")
+        _writeFile(os.path.join(self.tempDir, "New.wiki"), "text")
+        _writeFile(os.path.join(self.tempDir, "Other.txt"), "text")
+        os.remove(os.path.join(self.tempDir, "Deleted.wiki"))
+
+        expected = set([u"Existing.wiki", u"New.wiki", u"Deleted.wiki"])
+        self.assertEqual(self.collectChanges(expected), expected)
+
+    def testNoChanges(self):
+        self.assertEqual(self.collectChanges(set()), set())
+        self.assertEqual(self.watcher.waitForChanges(0.05), (set(), False))
+
+
+class InotifyWatcherTests(_WatcherTestMixin, testenv.TempDirTestCase):
+    def createWatcher(self):
+        try:
+            return InotifyWatcher(self.tempDir, u".wiki")
+        except OSError:
+            self.skipTest("inotify not available")
+
+
+class PollingWatcherTests(_WatcherTestMixin, testenv.TempDirTestCase):
+    def createWatcher(self):
+        watcher = PollingWatcher(self.tempDir, u".wiki", pollInterval=0)
+        # Take base state before the files are changed
+        watcher.waitForChanges(0)
+        # Make sure changes are seen even with coarse modification times
+        time.sleep(1.1)
+        return watcher
+
+
+
+class _QueueWatcher(object):
+    """
+    Watcher reporting the changes put into its queue
+    """
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.closed = False
+
+    def waitForChanges(self, timeout):
+        try:
+            return self.queue.get(True, timeout)
+        except Queue.Empty:
+            return set(), False
+
+    def close(self):
+        self.closed = True
+
+
+class _FastWatchService(PageFileWatchService):
+    SETTLE_TIME = 0.1
+    MAX_DELAY = 1.0
+    IDLE_TIMEOUT = 0.05
+
+
+class PageFileWatchServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.watcher = _QueueWatcher()
+        self.calls = Queue.Queue()
+        self.service = _FastWatchService(self.watcher, self._callback)
+        self.callbackStarted = threading.Event()
+        self.callbackDelay = 0
+
+    def tearDown(self):
+        self.service.stop()
+
+    def _callback(self, fileNames, rescan):
+        self.callbackStarted.set()
+        time.sleep(self.callbackDelay)
+        self.calls.put((fileNames, rescan))
+
+    def testBatchesChanges(self):
+        self.service.start()
+        self.watcher.queue.put((set([u"A.wiki"]), False))
+        self.watcher.queue.put((set([u"B.wiki"]), False))
+        self.watcher.queue.put((set([u"A.wiki"]), False))
+
+        self.assertEqual(self.calls.get(True, 5),
+                (frozenset([u"A.wiki", u"B.wiki"]), False))
+
+        self.watcher.queue.put((set(), True))
+        self.assertEqual(self.calls.get(True, 5), (frozenset(), True))
+
+    def testStopWaitsForCallback(self):
+        self.callbackDelay = 0.3
+        self.service.start()
+        self.watcher.queue.put((set([u"A.wiki"]), False))
+        self.assertTrue(self.callbackStarted.wait(5))
+
+        # Without main loop the callback runs in the watch thread, stop()
+        # must not return before it finished
+        thread = self.service.thread
+        self.service.stop()
+        self.assertFalse(self.calls.empty())
+
+        thread.join(5)
+        self.assertFalse(thread.isAlive())
+        self.assertTrue(self.watcher.closed)
+
+    def testPauseKeepsChanges(self):
+        self.service.start()
+        self.service.pause()
+        self.assertEqual(self.service.thread, None)
+        self.assertFalse(self.watcher.closed)
+
+        self.watcher.queue.put((set([u"A.wiki"]), False))
+        self.assertTrue(self.calls.empty())
+
+        self.service.start()
+        self.assertEqual(self.calls.get(True, 5),
+                (frozenset([u"A.wiki"]), False))
+
+
+
+class WatchedPageFileChangesTests(testenv.WikiTestCase):
+    """
+    External changes of page files of an Original Sqlite wiki
+    """
+    DB_TYPE = "original_sqlite"
+
+    def getPages(self):
+        return [(u"FirstPage", u"Text\n"), (u"SecondPage", u"FirstPage\n")]
+
+    def testChangedPageFileIsUpdated(self):
+        wikiDocument = self.wikiDocument
+        wikiData = wikiDocument.getWikiData()
+        dataDir, suffix = wikiData.getPageFileDirAndSuffix()
+
+        fileName = u"FirstPage" + suffix
+        self.assertEqual(wikiData.getWikiPageNamesForFileNames([fileName]),
+                [u"FirstPage"])
+
+        with open(os.path.join(dataDir, fileName), "ab") as f:
+            f.write("\n[newattr: hello]\n")
+
+        wikiDocument._handleWatchedPageFileChanges([fileName], False)
+        testenv.waitForBackgroundJobs(wikiDocument)
+
+        page = wikiDocument.getWikiPage(u"FirstPage")
+        self.assertEqual(page.getAttributes().get(u"newattr"), [u"hello"])
+        self.assertTrue(page.getLiveText().endswith(u"[newattr: hello]\n"))
+
+    def handleChanges(self, fileNames):
+        """
+        Report fileNames as changed and return the words of the update jobs
+        queued for them. Fails if the update executor is ended meanwhile.
+        """
+        executor = self.wikiDocument.getUpdateExecutor()
+        jobWords = []
+        origExecute = executor.executeAsyncWithThreadStop
+
+        def execute(queue, fct, *args, **kwargs):
+            if args:
+                jobWords.append(args[0])
+            return origExecute(queue, fct, *args, **kwargs)
+
+        def end(*args, **kwargs):
+            self.fail("Update executor ended")
+
+        executor.executeAsyncWithThreadStop = execute
+        executor.end = end
+        try:
+            self.wikiDocument._handleWatchedPageFileChanges(fileNames, False)
+        finally:
+            del executor.executeAsyncWithThreadStop
+            del executor.end
+
+        return jobWords
+
+    def testOwnSaveIsIgnored(self):
+        wikiDocument = self.wikiDocument
+        dataDir, suffix = wikiDocument.getWikiData().getPageFileDirAndSuffix()
+
+        page = wikiDocument.getWikiPage(u"SecondPage")
+        page.replaceLiveText(u"FirstPage\nMore\n")
+        testenv.waitForBackgroundJobs(wikiDocument)
+        with open(os.path.join(dataDir, u"SecondPage" + suffix), "rb") as f:
+            self.assertTrue("More" in f.read())
+
+        self.assertEqual(self.handleChanges([u"SecondPage" + suffix]), [])
+
+    def testOnlyChangedPagesAreQueued(self):
+        wikiDocument = self.wikiDocument
+        dataDir, suffix = wikiDocument.getWikiData().getPageFileDirAndSuffix()
+
+        with open(os.path.join(dataDir, u"FirstPage" + suffix), "ab") as f:
+            f.write("More text\n")
+        with open(os.path.join(dataDir, u"ThirdPage" + suffix), "wb") as f:
+            f.write("[newattr: third]\n")
+
+        jobWords = self.handleChanges([u"FirstPage" + suffix,
+                u"SecondPage" + suffix, u"ThirdPage" + suffix])
+        self.assertEqual(sorted(jobWords), [u"FirstPage", u"ThirdPage"])
+
+        testenv.waitForBackgroundJobs(wikiDocument)
+        page = wikiDocument.getWikiPage(u"ThirdPage")
+        self.assertEqual(page.getAttributes().get(u"newattr"), [u"third"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import testenv
+
+import unittest, os, os.path, re
+
+from pwiki import GrammarCache, WikiPyparsing
+
+
+_PATTERNS = ((u"(?P<word>[A-Z][a-z]+[A-Z]\\w*)|\\[(?P<title>[^\\]]+)\\]", 0),
+        (u"^\\+{1,15}(?!\\+) ?", re.MULTILINE),
+        (u"\\w+(?=\\s)", re.UNICODE),
+        ("(a|b)*c", re.IGNORECASE))
+
+_TEXTS = (u"Some WikiWord and [title \xe4\u20ac] text\n++ Heading\nabc ",
+        u"+ first\n+++ third\n\xe4\xf6\xfc x", "ABABc bac")
+
+
+class RegexCompilerTests(unittest.TestCase):
+    def tearDown(self):
+        WikiPyparsing.setRegexCompiler(None)
+
+    def testSetRegexCompiler(self):
+        compiled = []
+        def compiler(pattern, flags=0):
+            compiled.append((pattern, flags))
+            return re.compile(pattern, flags)
+
+        self.assertTrue(WikiPyparsing.setRegexCompiler(compiler) is re.compile)
+        WikiPyparsing.compileRegex(u"a+", re.UNICODE)
+        self.assertEqual(compiled, [(u"a+", re.UNICODE)])
+
+        self.assertTrue(WikiPyparsing.setRegexCompiler(None) is compiler)
+        WikiPyparsing.compileRegex(u"b+")
+        self.assertEqual(len(compiled), 1)
+
+    def testReplaceRegexCompiler(self):
+        def compilerA(pattern, flags=0):
+            return re.compile(pattern, flags)
+        def compilerB(pattern, flags=0):
+            return re.compile(pattern, flags)
+
+        WikiPyparsing.setRegexCompiler(compilerA)
+        self.assertFalse(WikiPyparsing.replaceRegexCompiler(compilerB, None))
+        self.assertTrue(WikiPyparsing.setRegexCompiler(compilerA) is
+                compilerA)
+        self.assertTrue(WikiPyparsing.replaceRegexCompiler(compilerA,
+                compilerB))
+        self.assertTrue(WikiPyparsing.replaceRegexCompiler(compilerB, None))
+        self.assertTrue(WikiPyparsing.setRegexCompiler(None) is re.compile)
+
+
+
+class GrammarCacheTests(testenv.TempDirTestCase):
+    def setUp(self):
+        testenv.TempDirTestCase.setUp(self)
+        self.cachePath = os.path.join(self.tempDir, "grammarCache_Test.dat")
+        self.assertTrue(GrammarCache._isCodeCompileSupported())
+
+    def assertSameRegex(self, regex, pattern, flags):
+        expected = re.compile(pattern, flags)
+        self.assertEqual(regex.pattern, expected.pattern)
+        self.assertEqual(regex.flags, expected.flags)
+        self.assertEqual(regex.groups, expected.groups)
+        self.assertEqual(regex.groupindex, expected.groupindex)
+        for text in _TEXTS:
+            self.assertEqual([m.groups() + (m.span(),)
+                    for m in regex.finditer(text)],
+                    [m.groups() + (m.span(),)
+                    for m in expected.finditer(text)], (pattern, text))
+
+    def testCompile(self):
+        cache = GrammarCache.GrammarCache(self.cachePath, "key")
+        for i in xrange(2):
+            for pattern, flags in _PATTERNS:
+                self.assertSameRegex(cache.compile(pattern, flags), pattern,
+                        flags)
+        self.assertEqual(len(cache.entries), len(_PATTERNS))
+
+        # Not cached, error reported as by re.compile()
+        self.assertRaises(re.error, cache.compile, u"(a")
+        self.assertEqual(len(cache.entries), len(_PATTERNS))
+
+    def testSaveAndLoad(self):
+        cache = GrammarCache.GrammarCache(self.cachePath, "key")
+        for pattern, flags in _PATTERNS:
+            cache.compile(pattern, flags)
+        cache.save()
+        self.assertTrue(os.path.exists(self.cachePath))
+
+        cache = GrammarCache.GrammarCache(self.cachePath, "key")
+        self.assertEqual(len(cache.entries), len(_PATTERNS))
+        self.assertFalse(cache.dirty)
+        for pattern, flags in _PATTERNS:
+            self.assertSameRegex(cache.compile(pattern, flags), pattern,
+                    flags)
+
+        # Not dirty, not written again
+        os.remove(self.cachePath)
+        cache.save()
+        self.assertFalse(os.path.exists(self.cachePath))
+
+    def testOtherSourceKey(self):
+        cache = GrammarCache.GrammarCache(self.cachePath, "key")
+        cache.compile(u"a+")
+        cache.save()
+
+        cache = GrammarCache.GrammarCache(self.cachePath, "otherKey")
+        self.assertEqual(cache.entries, {})
+        # Written anew with new key even if nothing was compiled
+        cache.save()
+        self.assertEqual(len(GrammarCache.GrammarCache(self.cachePath,
+                "otherKey").entries), 0)
+        self.assertEqual(len(GrammarCache.GrammarCache(self.cachePath,
+                "key").entries), 0)
+
+    def testDamagedCacheFile(self):
+        with open(self.cachePath, "wb") as f:
+            f.write("damaged")
+        cache = GrammarCache.GrammarCache(self.cachePath, "key")
+        self.assertEqual(cache.entries, {})
+        self.assertSameRegex(cache.compile(u"a+"), u"a+", 0)
+
+    def testSourceKey(self):
+        sourcePath = os.path.join(self.tempDir, "parser.py")
+        with open(sourcePath, "wb") as f:
+            f.write("# Version 1\n")
+        key = GrammarCache._getSourceKey((sourcePath,))
+        self.assertEqual(GrammarCache._getSourceKey((sourcePath + "c",)), key)
+
+        with open(sourcePath, "wb") as f:
+            f.write("# Version 2\n")
+        self.assertNotEqual(GrammarCache._getSourceKey((sourcePath,)), key)
+        self.assertEqual(GrammarCache._getSourceKey((sourcePath,
+                os.path.join(self.tempDir, "missing.py"))), None)
+
+
+
+class GrammarBuildTests(testenv.TempDirTestCase):
+    def setUp(self):
+        testenv.TempDirTestCase.setUp(self)
+        self.parserFile = os.path.join(self.tempDir, "TestParser.py")
+        with open(self.parserFile, "wb") as f:
+            f.write("# Parser\n")
+
+        self.origGetCacheDir = GrammarCache._getCacheDir
+        GrammarCache._getCacheDir = lambda: self.tempDir
+
+    def tearDown(self):
+        GrammarCache._getCacheDir = self.origGetCacheDir
+        WikiPyparsing.setRegexCompiler(None)
+        testenv.TempDirTestCase.tearDown(self)
+
+    def testBuild(self):
+        cache = GrammarCache.beginGrammarBuild(u"Test", self.parserFile)
+        self.assertTrue(cache is not None)
+        WikiPyparsing.compileRegex(u"a+b")
+        GrammarCache.endGrammarBuild(cache)
+
+        self.assertTrue(WikiPyparsing.setRegexCompiler(None) is re.compile)
+        self.assertEqual(cache.cachePath,
+                os.path.join(self.tempDir, u"grammarCache_Test.dat"))
+        self.assertEqual(GrammarCache.GrammarCache(cache.cachePath,
+                cache.sourceKey).entries.keys(), [(True, u"a+b", 0)])
+
+        # Parser changed
+        with open(self.parserFile, "ab") as f:
+            f.write("# Changed\n")
+        cache = GrammarCache.beginGrammarBuild(u"Test", self.parserFile)
+        self.assertEqual(cache.entries, {})
+        GrammarCache.endGrammarBuild(cache)
+
+    def testNestedBuilds(self):
+        outer = GrammarCache.beginGrammarBuild(u"Outer", self.parserFile)
+        inner = GrammarCache.beginGrammarBuild(u"Inner", self.parserFile)
+        WikiPyparsing.compileRegex(u"inner")
+        GrammarCache.endGrammarBuild(inner)
+        WikiPyparsing.compileRegex(u"outer")
+        GrammarCache.endGrammarBuild(outer)
+
+        self.assertEqual(inner.entries.keys(), [(True, u"inner", 0)])
+        self.assertEqual(outer.entries.keys(), [(True, u"outer", 0)])
+        self.assertTrue(WikiPyparsing.setRegexCompiler(None) is re.compile)
+
+    def testOverlappingBuilds(self):
+        first = GrammarCache.beginGrammarBuild(u"First", self.parserFile)
+        second = GrammarCache.beginGrammarBuild(u"Second", self.parserFile)
+        # Ending first must not remove the compiler of second
+        GrammarCache.endGrammarBuild(first)
+        WikiPyparsing.compileRegex(u"second")
+        GrammarCache.endGrammarBuild(second)
+
+        self.assertEqual(first.entries, {})
+        self.assertEqual(second.entries.keys(), [(True, u"second", 0)])
+
+    def testNoCacheDir(self):
+        GrammarCache._getCacheDir = lambda: None
+        cache = GrammarCache.beginGrammarBuild(u"Test", self.parserFile)
+        self.assertTrue(cache is None)
+        self.assertTrue(WikiPyparsing.setRegexCompiler(None) is re.compile)
+        GrammarCache.endGrammarBuild(cache)
+        self.assertEqual(os.listdir(self.tempDir), ["TestParser.py"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,388 @@
+import testenv
+
+import unittest, sys, os, os.path
+
+
+def _importHtmlExporter():
+    extensionsDir = os.path.join(testenv.MAIN_DIR, "extensions")
+    if extensionsDir not in sys.path:
+        sys.path.append(extensionsDir)
+
+    import HtmlExporter
+    return HtmlExporter
+
+HtmlExporter = _importHtmlExporter()
+
+from pwiki import SearchAndReplace as Sar
+
+
+def _readOutputs(directory):
+    """
+    Return dictionary {file name: content} of the exported files in
+    directory
+    """
+    result = {}
+    for name in os.listdir(directory):
+        if name == HtmlExporter.ExportDependencyGraph.MANIFEST_NAME:
+            continue
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                result[name] = f.read()
+
+    return result
+
+
+class _RecordingHtmlExporter(HtmlExporter.HtmlExporter):
+    """
+    Records the names of the outputs which were rendered
+    """
+    def __init__(self, mainControl):
+        HtmlExporter.HtmlExporter.__init__(self, mainControl)
+        self.rendered = []
+
+    def _storeOutputFile(self, dir, outputName, *args):
+        self.rendered.append(outputName)
+        return HtmlExporter.HtmlExporter._storeOutputFile(self, dir,
+                outputName, *args)
+
+
+
+class ExportDependencyGraphTests(testenv.TempDirTestCase):
+
+    def createGraph(self):
+        graph = HtmlExporter.ExportDependencyGraph(self.tempDir)
+        graph.load("settings")
+        self.assertTrue(graph.isEmpty())
+
+        graph.setRecord(u"A.html", HtmlExporter.ExportOutputRecord(
+                u"wikipage/A", "hashA", {(u"page", u"A"): "fpA",
+                (u"wordlist",): "fpList", (u"volatile",): None},
+                [u"volatile/img\xe4.png"]))
+        graph.setRecord(u"index.html", HtmlExporter.ExportOutputRecord(
+                u"index", "hashIndex", {(u"wordlist",): "fpList",
+                (u"children", u"A", u"existingonly"): "fpChildren"}, []))
+        return graph
+
+    def testIndex(self):
+        graph = self.createGraph()
+        self.assertEqual(sorted(graph.getDependentOutputs((u"wordlist",))),
+                [u"A.html", u"index.html"])
+        self.assertEqual(sorted(graph.getDependenciesForKey(u"A")),
+                [(u"children", u"A", u"existingonly"), (u"page", u"A")])
+        self.assertEqual(sorted(graph.getDependenciesForKey(None)),
+                [(u"volatile",), (u"wordlist",)])
+        self.assertTrue(graph.hasDependencyKind(u"children"))
+
+        graph.setRecord(u"A.html", HtmlExporter.ExportOutputRecord(
+                u"wikipage/A", "hashA", {(u"page", u"A"): "fpA"}, []))
+        self.assertEqual(sorted(graph.getDependentOutputs((u"wordlist",))),
+                [u"index.html"])
+
+        graph.removeRecord(u"index.html")
+        self.assertEqual(list(graph.getDependentOutputs((u"wordlist",))), [])
+        self.assertEqual(sorted(graph.iterDependencies()),
+                [(u"page", u"A")])
+        self.assertEqual(list(graph.getDependenciesForKey(u"A")),
+                [(u"page", u"A")])
+        self.assertEqual(list(graph.getDependenciesForKey(None)), [])
+        self.assertFalse(graph.hasDependencyKind(u"children"))
+
+    def testManifest(self):
+        graph = self.createGraph()
+        graph.save()
+
+        loaded = HtmlExporter.ExportDependencyGraph(self.tempDir)
+        loaded.load("settings")
+        self.assertEqual(sorted(loaded.getOutputNames()),
+                [u"A.html", u"index.html"])
+        for outputName in graph.getOutputNames():
+            expected = graph.getRecord(outputName)
+            record = loaded.getRecord(outputName)
+            for attr in expected.__slots__:
+                self.assertEqual(getattr(record, attr),
+                        getattr(expected, attr), attr)
+        self.assertEqual(sorted(loaded.iterDependencies()),
+                sorted(graph.iterDependencies()))
+
+        # Other settings: dependencies are unknown, content hashes are kept
+        loaded.load("other settings")
+        self.assertEqual(loaded.getRecord(u"A.html").dependencies, None)
+        self.assertEqual(loaded.getRecord(u"A.html").contentHash, "hashA")
+        self.assertEqual(list(loaded.iterDependencies()), [])
+
+    def testDamagedManifest(self):
+        self.createGraph().save()
+        path = os.path.join(self.tempDir,
+                HtmlExporter.ExportDependencyGraph.MANIFEST_NAME)
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(data[:len(data) // 2])
+
+        graph = HtmlExporter.ExportDependencyGraph(self.tempDir)
+        graph.load("settings")
+        self.assertTrue(graph.isEmpty())
+
+
+
+class IncrementalExportTests(testenv.WikiTestCase):
+    def getPages(self):
+        return testenv.generatePages(pages=12, journalPages=0)
+
+    def setUp(self):
+        testenv.WikiTestCase.setUp(self)
+        self.mainControl = testenv.createMainControl(self.wikiDocument)
+        self.exportCount = 0
+
+    def createExporter(self):
+        return _RecordingHtmlExporter(self.mainControl)
+
+    def export(self, exportDest=None, incremental=True):
+        """
+        Export all pages as set of HTML pages, return exporter
+        """
+        if exportDest is None:
+            self.exportCount += 1
+            exportDest = os.path.join(self.tempDir, "full%i" %
+                    self.exportCount)
+        if not os.path.exists(exportDest):
+            os.mkdir(exportDest)
+
+        exporter = self.createExporter()
+        exporter.export(self.wikiDocument, self.getWords(), u"html_single",
+                exportDest, False, exporter.getAddOpt(None), None,
+                incremental=incremental)
+        return exporter
+
+    def getWords(self):
+        return sorted(self.wikiDocument.getWikiData()
+                .getAllDefinedWikiPageNames())
+
+    def modifyPages(self):
+        """
+        Change text of a page, move a link between pages and add a new page
+        """
+        wikiDocument = self.wikiDocument
+        page = wikiDocument.getWikiPage(u"TopicFPage")
+        page.replaceLiveText(page.getLiveText() + u"\nSome new text\n")
+
+        page = wikiDocument.getWikiPage(u"TopicAPage")
+        page.replaceLiveText(page.getLiveText().replace(u"TopicLPage",
+                u"TopicJPage") + u"\n[author: dave]\n")
+
+        page = wikiDocument.createWikiPage(u"NewPage")
+        page.replaceLiveText(u"+ NewPage\n\nLinks to TopicIPage\n")
+        page = wikiDocument.getWikiPage(u"BenchWiki")
+        page.replaceLiveText(page.getLiveText() + u"    * NewPage\n")
+
+        testenv.waitForBackgroundJobs(wikiDocument)
+
+    def assertSameOutputs(self, exportDest):
+        """
+        Compare the files in exportDest with those of a full
+        (non-incremental) export
+        """
+        expected = _readOutputs(self.export(incremental=False).exportDest)
+        outputs = _readOutputs(exportDest)
+        self.assertEqual(sorted(outputs), sorted(expected))
+        for name in expected:
+            self.assertEqual(outputs[name], expected[name], name)
+
+    def testIncremental(self):
+        exportDest = os.path.join(self.tempDir, "incremental")
+        exporter = self.export(exportDest)
+        outputCount = len(exporter.rendered)
+        self.assertSameOutputs(exportDest)
+
+        # Nothing changed, nothing rendered
+        exporter = self.export(exportDest)
+        self.assertEqual(exporter.rendered, [])
+
+        # Only text of a single page changed
+        page = self.wikiDocument.getWikiPage(u"topic h notes")
+        page.replaceLiveText(page.getLiveText() + u"\nAppended\n")
+        testenv.waitForBackgroundJobs(self.wikiDocument)
+        exporter = self.export(exportDest)
+        self.assertTrue(u"topic h notes.html" in exporter.rendered)
+        self.assertTrue(len(exporter.rendered) < outputCount)
+        self.assertSameOutputs(exportDest)
+
+        self.modifyPages()
+        self.export(exportDest)
+        self.assertSameOutputs(exportDest)
+
+    def testUnchangedFilesNotRewritten(self):
+        exportDest = os.path.join(self.tempDir, "incremental")
+        self.export(exportDest)
+        path = os.path.join(exportDest, u"topic h notes.html")
+        os.utime(path, (1000, 1000))
+
+        # All outputs are rendered again with other settings, but the
+        # content of the page doesn't depend on this one
+        config = self.mainControl.getConfig()
+        allowEval = config.get("main", "insertions_allow_eval")
+        config.set("main", "insertions_allow_eval", unicode(not
+                config.getboolean("main", "insertions_allow_eval")))
+        try:
+            exporter = self.export(exportDest)
+        finally:
+            config.set("main", "insertions_allow_eval", allowEval)
+
+        self.assertTrue(u"topic h notes.html" in exporter.rendered)
+        self.assertEqual(os.path.getmtime(path), 1000)
+
+    def testContinuous(self):
+        exportDest = os.path.join(self.tempDir, "continuous")
+        os.mkdir(exportDest)
+
+        lpOp = Sar.ListWikiPagesOperation()
+        lpOp.setSearchOpTree(Sar.AllWikiPagesNode(lpOp))
+        sarOp = Sar.SearchReplaceOperation()
+        sarOp.listWikiPagesOp = lpOp
+
+        exporter = self.createExporter()
+        exporter.startContinuousExport(self.wikiDocument, sarOp, u"html_single",
+                exportDest, False, exporter.getAddOpt(None), None)
+        try:
+            self.assertSameOutputs(exportDest)
+            del exporter.rendered[:]
+
+            self.modifyPages()
+            self.assertTrue(u"NewPage.html" in exporter.rendered)
+            # Parents of TopicJPage and TopicLPage changed
+            self.assertTrue(u"TopicJPage.html" in exporter.rendered)
+            self.assertTrue(u"TopicLPage.html" in exporter.rendered)
+            self.assertSameOutputs(exportDest)
+        finally:
+            exporter.stopContinuousExport()
+
+    def testContinuousChecksOnlyAffectedDependencies(self):
+        exportDest = os.path.join(self.tempDir, "continuous")
+        os.mkdir(exportDest)
+
+        lpOp = Sar.ListWikiPagesOperation()
+        lpOp.setSearchOpTree(Sar.AllWikiPagesNode(lpOp))
+        sarOp = Sar.SearchReplaceOperation()
+        sarOp.listWikiPagesOp = lpOp
+
+        exporter = self.createExporter()
+        exporter.startContinuousExport(self.wikiDocument, sarOp, u"html_single",
+                exportDest, False, exporter.getAddOpt(None), None)
+        try:
+            checked = []
+            getFingerprint = exporter._getDependencyFingerprint
+            def recordingGetFingerprint(dependency):
+                checked.append(dependency)
+                return getFingerprint(dependency)
+            exporter._getDependencyFingerprint = recordingGetFingerprint
+            del exporter.rendered[:]
+
+            # Text changes, relations stay the same
+            page = self.wikiDocument.getWikiPage(u"TopicFPage")
+            page.replaceLiveText(page.getLiveText() + u"\nSome new text\n")
+            testenv.waitForBackgroundJobs(self.wikiDocument)
+
+            self.assertEqual(exporter.rendered, [u"TopicFPage.html"])
+            self.assertTrue(len(checked) > 0)
+            for dep in checked:
+                self.assertTrue(dep[0] not in (u"parents", u"children",
+                        u"parentless", u"undefined") or
+                        dep[1:2] == (u"TopicFPage",), dep)
+        finally:
+            exporter.stopContinuousExport()
+
+
+
+class _ParallelHtmlExporter(_RecordingHtmlExporter):
+    PARALLEL_MIN_PAGES_PER_PROCESS = 2
+    PARALLEL_PAGES_PER_BATCH = 3
+
+
+class ParallelExportTests(testenv.WikiTestCase):
+    def getPages(self):
+        return testenv.generatePages(pages=12, journalPages=0)
+
+    def setUp(self):
+        testenv.WikiTestCase.setUp(self)
+        self.mainControl = testenv.createMainControl(self.wikiDocument)
+        self.config = self.mainControl.getConfig()
+        self.words = sorted(self.wikiDocument.getWikiData()
+                .getAllDefinedWikiPageNames())
+
+        # Independent of the processors of the test machine
+        self.origCpuCount = HtmlExporter.multiprocessing.cpu_count
+        HtmlExporter.multiprocessing.cpu_count = lambda: 4
+
+    def tearDown(self):
+        HtmlExporter.multiprocessing.cpu_count = self.origCpuCount
+        self.config.set("main", "html_export_processCount", u"0")
+        testenv.WikiTestCase.tearDown(self)
+
+    def export(self, exportType, processCount):
+        exportDest = os.path.join(self.tempDir, "%s_%i" % (exportType,
+                processCount))
+        os.mkdir(exportDest)
+        self.config.set("main", "html_export_processCount",
+                unicode(processCount))
+
+        exporter = _ParallelHtmlExporter(self.mainControl)
+        exporter.export(self.wikiDocument, self.words, exportType,
+                exportDest, False, exporter.getAddOpt(None), None,
+                incremental=True)
+        return exporter
+
+    def assertSameExport(self, exporter, expectedExporter):
+        self.assertEqual(_readOutputs(exporter.exportDest),
+                _readOutputs(expectedExporter.exportDest))
+
+        graph = HtmlExporter.ExportDependencyGraph(exporter.exportDest)
+        graph.load(exporter._getExportSettingsFingerprint())
+        expectedGraph = HtmlExporter.ExportDependencyGraph(
+                expectedExporter.exportDest)
+        expectedGraph.load(expectedExporter._getExportSettingsFingerprint())
+        self.assertEqual(sorted(graph.getOutputNames()),
+                sorted(expectedGraph.getOutputNames()))
+        for outputName in expectedGraph.getOutputNames():
+            self.assertEqual(graph.getRecord(outputName).dependencies,
+                    expectedGraph.getRecord(outputName).dependencies,
+                    outputName)
+
+    def testProcessCount(self):
+        exporter = _ParallelHtmlExporter(self.mainControl)
+        exporter.setWikiDocument(self.wikiDocument)
+        for processCount, pageCount, expected in ((0, 100, 0), (3, 100, 3),
+                (8, 100, 4), (-1, 100, 4), (4, 5, 2), (4, 3, 0)):
+            self.config.set("main", "html_export_processCount",
+                    unicode(processCount))
+            self.assertEqual(exporter._getExportProcessCount(pageCount),
+                    expected, (processCount, pageCount))
+
+    def testSameAsSerial(self):
+        for exportType in (u"html_single", u"html_multi"):
+            serial = self.export(exportType, 0)
+            parallel = self.export(exportType, 3)
+            self.assertSameExport(parallel, serial)
+
+        # The database was only read by the workers
+        self.assertEqual(sorted(self.wikiDocument.getWikiData()
+                .getAllDefinedWikiPageNames()), self.words)
+
+    def testWorkerFailure(self):
+        def failingReconnect():
+            raise IOError("Test")
+
+        serial = self.export(u"html_single", 0)
+
+        # Pages are rendered in this process instead
+        self.wikiDocument.reconnectInChildProcess = failingReconnect
+        try:
+            parallel = self.export(u"html_single", 2)
+        finally:
+            del self.wikiDocument.reconnectInChildProcess
+
+        self.assertSameExport(parallel, serial)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,242 @@
+import testenv
+
+import unittest, os, os.path, struct, zlib
+from cStringIO import StringIO
+
+from pwiki.ImageDimensions import getImageDimsFromStream, \
+        getImageDimsFromFile, ImageDimensionCache
+from pwiki.Serialization import SerializeStream
+
+
+def _png(width, height):
+    ihdr = "IHDR" + struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return "\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + ihdr + \
+            struct.pack(">I", zlib.crc32(ihdr) & 0xffffffff)
+
+def _jpeg(width, height):
+    return "\xff\xd8" + \
+            "\xff\xe0" + struct.pack(">H", 16) + "JFIF\0" + "\0" * 9 + \
+            "\xff\xc4" + struct.pack(">H", 5) + "\0" * 3 + \
+            "\xff\xff\xc2" + struct.pack(">HBHHB", 11, 8, height, width, 1) + \
+            "\x01\x11\x00" + "\xff\xda"
+
+def _gif(width, height):
+    return "GIF89a" + struct.pack("<HHBBB", width, height, 0, 0, 0)
+
+def _bmp(width, height):
+    return "BM" + struct.pack("<IHHI", 0, 0, 0, 54) + \
+            struct.pack("<IiiHH", 40, width, -height, 1, 24) + "\0" * 24
+
+def _bmpOs2(width, height):
+    return "BM" + struct.pack("<IHHI", 0, 0, 0, 26) + \
+            struct.pack("<IHHHH", 12, width, height, 1, 24) + "\0" * 10
+
+def _webp(chunkType, chunkData):
+    chunk = chunkType + struct.pack("<I", len(chunkData)) + chunkData
+    return "RIFF" + struct.pack("<I", len(chunk) + 4) + "WEBP" + chunk
+
+def _webpLossy(width, height):
+    return _webp("VP8 ", "\x10\x02\x00\x9d\x01\x2a" +
+            struct.pack("<HH", width, height) + "\0" * 10)
+
+def _webpLossless(width, height):
+    return _webp("VP8L", "\x2f" + struct.pack("<I", (width - 1) |
+            ((height - 1) << 14)) + "\0" * 10)
+
+def _webpExtended(width, height):
+    return _webp("VP8X", "\0" * 4 + struct.pack("<I", width - 1)[:3] +
+            struct.pack("<I", height - 1)[:3])
+
+
+_IMAGE_BUILDERS = (_png, _jpeg, _gif, _bmp, _bmpOs2, _webpLossy,
+        _webpLossless, _webpExtended)
+
+
+class ProbeTests(testenv.TempDirTestCase):
+    def testFormats(self):
+        for builder in _IMAGE_BUILDERS:
+            for width, height in ((1, 1), (640, 480), (3, 12000)):
+                self.assertEqual(getImageDimsFromStream(StringIO(
+                        builder(width, height))), (width, height),
+                        builder.__name__)
+
+    def testLargeDimensions(self):
+        self.assertEqual(getImageDimsFromStream(StringIO(_png(100000, 70000))),
+                (100000, 70000))
+        self.assertEqual(getImageDimsFromStream(StringIO(
+                _webpExtended(0x1000000, 20000))), (0x1000000, 20000))
+
+    def testUnknownOrDamaged(self):
+        for data in ("", "GIF8", "Not an image at all, just some text",
+                _png(10, 10)[:20], _bmp(10, 10)[:20],
+                # SOS before SOF
+                "\xff\xd8\xff\xda" + "\0" * 40,
+                # Missing marker
+                "\xff\xd8\x00" + "\0" * 40):
+            self.assertEqual(getImageDimsFromStream(StringIO(data)),
+                    (None, None), repr(data))
+
+    def testTruncatedFile(self):
+        path = os.path.join(self.tempDir, "image.jpg")
+        data = _jpeg(20, 10)
+        # Dimensions end at byte 37
+        for length in (len(data), 37, 36, 30, 5):
+            with open(path, "wb") as f:
+                f.write(data[:length])
+            expected = (20, 10) if length >= 37 else (None, None)
+            self.assertEqual(getImageDimsFromFile(path), expected, length)
+
+        self.assertRaises(IOError, getImageDimsFromFile,
+                os.path.join(self.tempDir, "missing.png"))
+
+
+
+class _SmallImageDimensionCache(ImageDimensionCache):
+    MAX_SAVED_FILES = 2
+
+
+class ImageDimensionCacheTests(testenv.TempDirTestCase):
+    def setUp(self):
+        testenv.TempDirTestCase.setUp(self)
+        self.cachePath = os.path.join(self.tempDir, "imageDims.dat")
+        self.probed = []
+
+    def probe(self, path):
+        self.probed.append(path)
+        return getImageDimsFromFile(path)
+
+    def writeImage(self, name, data, mtime=1000000000.5):
+        path = os.path.join(self.tempDir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def testFileDims(self):
+        path = self.writeImage("a.png", _png(10, 20))
+        cache = ImageDimensionCache(self.cachePath)
+        self.assertEqual(cache.getFileDims(path, self.probe), (10, 20))
+        self.assertEqual(cache.getFileDims(path, self.probe), (10, 20))
+        self.assertEqual(self.probed, [path])
+
+        # Same size, different modification time
+        path = self.writeImage("a.png", _png(30, 40), 1000000000.75)
+        self.assertEqual(cache.getFileDims(path, self.probe), (30, 40))
+        self.assertEqual(len(self.probed), 2)
+
+        self.assertRaises(OSError, cache.getFileDims,
+                os.path.join(self.tempDir, "missing.png"), self.probe)
+
+    def testSaveAndLoad(self):
+        paths = [self.writeImage(u"a.png", _png(10, 20)),
+                self.writeImage(u"b.gif", _gif(5, 6)),
+                self.writeImage(u"unknown.dat", "unknown")]
+        cache = ImageDimensionCache(self.cachePath)
+        dims = [cache.getFileDims(path, self.probe) for path in paths]
+        self.assertEqual(dims, [(10, 20), (5, 6), (None, None)])
+        cache.save()
+
+        del self.probed[:]
+        cache = ImageDimensionCache(self.cachePath)
+        self.assertEqual([cache.getFileDims(path, self.probe)
+                for path in paths], dims)
+        self.assertEqual(self.probed, [])
+
+        # Not dirty, not written again
+        os.remove(self.cachePath)
+        cache.save()
+        self.assertFalse(os.path.exists(self.cachePath))
+
+    def testOldOrDamagedCacheFile(self):
+        path = self.writeImage("a.png", _png(10, 20))
+
+        stream = SerializeStream(stringBuf="", readMode=False)
+        stream.writeBytes(ImageDimensionCache.CACHE_MAGIC)
+        stream.serUint8(0)
+        stream.serUint32(1)
+        stream.serUniUtf8(path)
+        stream.serUint32(1000000000)
+        stream.serUint32(os.path.getsize(path))
+        stream.serBool(True)
+        stream.serUint32(1)
+        stream.serUint32(1)
+
+        for data in (stream.getBytes(), "damaged",
+                ImageDimensionCache.CACHE_MAGIC + "\x01\0\0"):
+            with open(self.cachePath, "wb") as f:
+                f.write(data)
+            cache = ImageDimensionCache(self.cachePath)
+            self.assertEqual(cache.getFileDims(path, self.probe), (10, 20))
+
+        self.assertEqual(len(self.probed), 3)
+
+    def testOnlyUsedFilesSavedIfTooMany(self):
+        paths = [self.writeImage("%i.gif" % i, _gif(i + 1, 1))
+                for i in xrange(3)]
+        cache = _SmallImageDimensionCache(self.cachePath)
+        for path in paths:
+            cache.getFileDims(path, self.probe)
+        cache.save()
+
+        # All were used in the first session, only 2.gif is unused now
+        cache = _SmallImageDimensionCache(self.cachePath)
+        cache.getFileDims(paths[0], self.probe)
+        cache.getFileDims(paths[1], self.probe)
+        self.assertEqual(len(self.probed), 3)
+        cache.getFileDims(self.writeImage("3.gif", _gif(4, 1)), self.probe)
+        cache.save()
+
+        del self.probed[:]
+        cache = _SmallImageDimensionCache(self.cachePath)
+        for path in paths:
+            cache.getFileDims(path, self.probe)
+        self.assertEqual(self.probed, [paths[2]])
+
+    def testUrlDims(self):
+        urls = []
+        def probeUrl(url):
+            urls.append(url)
+            if url.endswith("missing.png"):
+                raise IOError("Not found")
+            return (1, 2)
+
+        cache = ImageDimensionCache(self.cachePath)
+        for i in xrange(2):
+            self.assertEqual(cache.getUrlDims(u"http://example.com/a.png",
+                    probeUrl), (1, 2))
+            self.assertRaises(IOError, cache.getUrlDims,
+                    u"http://example.com/missing.png", probeUrl)
+
+        # Failed downloads are tried again
+        self.assertEqual(urls, [u"http://example.com/a.png",
+                u"http://example.com/missing.png",
+                u"http://example.com/missing.png"])
+
+        # Only held in memory
+        cache.save()
+        self.assertFalse(os.path.exists(self.cachePath))
+
+
+
+class WikiImageDimensionCacheTests(testenv.TempDirTestCase):
+    def testSavedOnRelease(self):
+        wikiDocument = testenv.createWiki(self.tempDir, "compact_sqlite")
+        try:
+            path = os.path.join(self.tempDir, "a.png")
+            with open(path, "wb") as f:
+                f.write(_png(7, 8))
+
+            cache = wikiDocument.getImageDimensionCache()
+            self.assertTrue(wikiDocument.getImageDimensionCache() is cache)
+            self.assertEqual(cache.getFileDims(path, getImageDimsFromFile),
+                    (7, 8))
+        finally:
+            testenv.closeWiki(wikiDocument)
+
+        self.assertTrue(os.path.exists(cache.cachePath))
+        self.assertEqual(ImageDimensionCache(cache.cachePath).getFileDims(
+                path, None), (7, 8))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+import testenv
+
+import unittest, os, os.path, json, random
+
+from pwiki import Instrumentation
+from pwiki.Instrumentation import Histogram, Recorder
+
+
+class HistogramTests(unittest.TestCase):
+    def testEmpty(self):
+        hist = Histogram()
+        self.assertEqual(hist.getMean(), None)
+        self.assertEqual(hist.getPercentile(0.5), None)
+
+    def testPercentiles(self):
+        rnd = random.Random(47)
+        values = [rnd.lognormvariate(0, 3) for i in xrange(2000)]
+        hist = Histogram()
+        for value in values:
+            hist.add(value)
+
+        self.assertEqual(hist.count, len(values))
+        self.assertAlmostEqual(hist.getMean(), sum(values) / len(values))
+        self.assertEqual((hist.min, hist.max), (min(values), max(values)))
+
+        values.sort()
+        for fraction in (0.01, 0.5, 0.95, 0.99):
+            exact = values[int(fraction * len(values)) - 1]
+            estimate = hist.getPercentile(fraction)
+            self.assertTrue(exact <= estimate <= exact * 1.19,
+                    (fraction, exact, estimate))
+        self.assertEqual(hist.getPercentile(1), values[-1])
+
+    def testNotPositive(self):
+        hist = Histogram()
+        for value in (0, -2, 0, 4):
+            hist.add(value)
+
+        self.assertEqual(hist.getPercentile(0.25), 0)
+        self.assertEqual(hist.getPercentile(0.75), 0)
+        self.assertEqual(hist.getPercentile(1), 4)
+        self.assertEqual(hist.getMean(), 0.5)
+
+        hist = Histogram()
+        hist.add(-3)
+        self.assertEqual(hist.getPercentile(0.5), -3)
+
+
+
+class RecorderTests(unittest.TestCase):
+    def testSpans(self):
+        recorder = Recorder()
+        recorder.addSpan("db.execSql", 1.0, 1.5, "SELECT 1")
+        recorder.addSpan("db.execSql", 2.0, 2.25)
+        recorder.addSpan("parse.page", 1.25, 1.375, {"word": 1})
+        recorder.count("events")
+        recorder.count("events", 2)
+        recorder.record("listeners", 3)
+
+        self.assertEqual(recorder.spans["db.execSql"].count, 2)
+        self.assertEqual(recorder.spans["db.execSql"].total, 0.75)
+        self.assertEqual(recorder.counters["events"], 3)
+        self.assertEqual(recorder.histograms["listeners"].max, 3)
+
+        trace = json.loads(json.dumps(recorder.getChromeTrace()))
+        events = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+        self.assertEqual([(e["name"], e["cat"], e.get("args"))
+                for e in events],
+                [(u"db.execSql", u"db", {u"detail": u"SELECT 1"}),
+                (u"db.execSql", u"db", None),
+                (u"parse.page", u"parse", {u"detail": u"word"})])
+        self.assertEqual(events[0]["dur"], 500000.0)
+        self.assertEqual(len([e for e in trace["traceEvents"]
+                if e["ph"] == "M"]), 1)
+        self.assertEqual(trace["otherData"]["counters"], {u"events": 3})
+
+        summary = recorder.getSummary().split(u"\n")
+        # Longest total time first
+        self.assertTrue(summary[1].startswith(u"db.execSql "))
+        self.assertTrue(summary[2].startswith(u"parse.page "))
+        self.assertTrue(u"events" in recorder.getSummary())
+
+    def testMaxTraceEvents(self):
+        recorder = Recorder(maxTraceEvents=3)
+        for i in xrange(5):
+            recorder.addSpan("a.b", i, i + 1)
+
+        self.assertEqual(len(recorder.traceEvents), 3)
+        self.assertEqual(recorder.droppedTraceEvents, 2)
+        self.assertEqual(recorder.spans["a.b"].count, 5)
+        self.assertTrue(u"2 spans were not stored" in recorder.getSummary())
+
+    def testWithoutTrace(self):
+        recorder = Recorder(keepTrace=False)
+        recorder.addSpan("a.b", 0, 1, object())
+        self.assertEqual(recorder.traceEvents, None)
+        self.assertEqual(recorder.spans["a.b"].count, 1)
+        self.assertEqual(recorder.getChromeTrace()["traceEvents"], [])
+
+    def testDetails(self):
+        toString = Recorder._detailToString
+
+        # Not split in the middle of a UTF-8 sequence
+        detail = u"\xe4\u20ac" * 150
+        self.assertEqual(toString(detail.encode("utf-8")), detail[:200])
+        self.assertEqual(toString(detail), detail[:200])
+        self.assertEqual(toString("invalid \xff"), u"invalid \ufffd")
+        self.assertEqual(toString({"b\xc3\xa4": 1, u"a": 2}), u"a, b\xe4")
+        self.assertEqual(toString(RecorderTests), u"RecorderTests")
+        self.assertEqual(toString(3), u"3")
+
+        class Unprintable(object):
+            def __unicode__(self):
+                raise ValueError()
+        self.assertTrue(toString(Unprintable()).startswith(u"<"))
+
+        recorder = Recorder()
+        recorder.addSpan("a.b", 0, 1, "SELECT '" + "\xe4" * 300 + "'")
+        json.dumps(recorder.getChromeTrace())
+
+
+
+class RecordingTests(testenv.TempDirTestCase):
+    def setUp(self):
+        testenv.TempDirTestCase.setUp(self)
+        self.tracePath = os.path.join(self.tempDir, "trace.json")
+        self.summaryPath = os.path.join(self.tempDir, "summary.txt")
+
+    def tearDown(self):
+        Instrumentation.stop()
+        testenv.TempDirTestCase.tearDown(self)
+
+    def testDisabled(self):
+        self.assertFalse(Instrumentation.isEnabled())
+        self.assertTrue(Instrumentation.span("a.b") is
+                Instrumentation.span("c.d"))
+        with Instrumentation.span("a.b"):
+            pass
+        Instrumentation.count("a")
+        Instrumentation.record("a", 1)
+        Instrumentation.addSpan("a.b", 0)
+        self.assertEqual(Instrumentation.getRecorder(), None)
+        self.assertEqual(Instrumentation.stop(), None)
+
+    def testStartAndStop(self):
+        @Instrumentation.instrumented("test.function")
+        def function(fail):
+            if fail:
+                raise ValueError()
+            return 5
+
+        recorder = Instrumentation.start(self.tracePath, self.summaryPath)
+        self.assertTrue(Instrumentation.start() is recorder)
+        self.assertTrue(Instrumentation.isEnabled())
+
+        with Instrumentation.span("test.block", "detail"):
+            pass
+        self.assertEqual(function(False), 5)
+        self.assertRaises(ValueError, function, True)
+        Instrumentation.addSpan("test.added", Instrumentation.getTime())
+        Instrumentation.count("test.counter")
+        Instrumentation.record("test.histogram", 2)
+
+        self.assertTrue(Instrumentation.stop() is recorder)
+        self.assertFalse(Instrumentation.isEnabled())
+        self.assertEqual(function.__name__, "function")
+
+        self.assertEqual(recorder.spans["test.function"].count, 2)
+        with open(self.tracePath, "rb") as f:
+            trace = json.load(f)
+        self.assertEqual(sorted(e["name"] for e in trace["traceEvents"]
+                if e["ph"] == "X"), [u"test.added", u"test.block",
+                u"test.function", u"test.function"])
+
+        with open(self.summaryPath, "rb") as f:
+            summary = f.read()
+        for name in ("test.block", "test.function", "test.counter",
+                "test.histogram"):
+            self.assertTrue(name in summary, name)
+
+    def testWikiInstrumented(self):
+        recorder = Instrumentation.start(summaryFile=self.summaryPath)
+        wikiDocument = testenv.createWiki(self.tempDir, "compact_sqlite",
+                testenv.generatePages(pages=3, journalPages=0))
+        try:
+            wikiDocument.getWikiPage(u"TopicAPage").getLivePageAst()
+        finally:
+            testenv.closeWiki(wikiDocument)
+        Instrumentation.stop()
+
+        for name in ("wiki.connect", "db.execSql", "db.execSqlQuery",
+                "parse.page"):
+            self.assertTrue(name in recorder.spans, name)
+        self.assertEqual(recorder.traceEvents, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import testenv
+
+import unittest, random, locale
+
+from pwiki import Localization
+
+
+def _sign(value):
+    return cmp(value, 0)
+
+
+class CollatorSortKeyTests(unittest.TestCase):
+    """
+    Keys of sortKey() must order strings like strcoll() does. The "C"
+    locale is used so results don't depend on the system.
+    """
+    def setUp(self):
+        self.prevLocale = locale.setlocale(locale.LC_ALL)
+        self.collators = [Localization.getCCollator(),
+                Localization._PythonCollator("C"),
+                Localization._PythonCollatorUppercaseFirst("C")]
+
+        rnd = random.Random(27)
+        self.words = [u"", u"a", u"A", u"ab", u"aB", u"Ab", u"abc", u"b",
+                u"B", u"a b", u"a1", u"_a"]
+        for i in xrange(200):
+            self.words.append(u"".join(rnd.choice(u"aAbBzZ 1_")
+                    for j in xrange(rnd.randint(0, 6))))
+
+    def tearDown(self):
+        locale.setlocale(locale.LC_ALL, self.prevLocale)
+
+    def testKeysCompareLikeStrcoll(self):
+        for coll in self.collators:
+            keys = dict((w, coll.sortKey(w)) for w in self.words)
+            for left in self.words:
+                for right in self.words:
+                    self.assertEqual(_sign(cmp(keys[left], keys[right])),
+                            _sign(coll.strcoll(left, right)),
+                            "%s: %r, %r" % (coll.__class__.__name__,
+                            left, right))
+
+    def testUppercaseFirst(self):
+        coll = Localization._PythonCollatorUppercaseFirst("C")
+        lst = [u"b", u"ab", u"B", u"a", u"Ab", u"A"]
+        coll.sort(lst)
+        # As in strcoll() a string is sorted after longer ones starting
+        # with it
+        self.assertEqual(lst, [u"Ab", u"A", u"B", u"ab", u"a", u"b"])
+
+    def assertSortedLikeStrcoll(self, coll, lst, keyFunc, ascend):
+        expected = list(lst)
+        expected.sort(lambda l, r: coll.strcoll(keyFunc(l), keyFunc(r)),
+                reverse=not ascend)
+
+        coll.sortByKeyFunc(lst, keyFunc, ascend)
+        self.assertEqual([keyFunc(item) for item in lst],
+                [keyFunc(item) for item in expected])
+
+    def testSortByKeyFunc(self):
+        for coll in self.collators:
+            for ascend in (True, False):
+                self.assertSortedLikeStrcoll(coll, list(self.words),
+                        lambda w: w.lower(), ascend)
+
+                items = [(w, i) for i, w in enumerate(self.words)]
+                coll.sortByFirst(items, ascend)
+                self.assertEqual([w for w, i in items], sorted(
+                        self.words, coll.strcoll, reverse=not ascend))
+
+    def testSortIsStable(self):
+        coll = Localization._PythonCollator("C")
+        items = [(u"b", 1), (u"a", 2), (u"b", 3), (u"a", 4)]
+        coll.sortByFirst(items)
+        self.assertEqual(items, [(u"a", 2), (u"a", 4), (u"b", 1), (u"b", 3)])
+
+    def testFallbackToStrcoll(self):
+        # Characters not encodable in the locale's encoding have no key
+        coll = Localization._PythonCollator("C")
+        lst = [u"\xe4b", u"b", u"a\u20ac", u"a"]
+        try:
+            coll.sortKey(lst[0])
+        except UnicodeError:
+            pass
+        else:
+            self.skipTest("Locale encoding can encode non-ASCII characters")
+
+        self.assertSortedLikeStrcoll(coll, lst, lambda w: w, True)
+
+
+if __name__ == "__main__":
+    unittest.main()
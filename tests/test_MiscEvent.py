@@ -0,0 +1,237 @@
+import testenv
+
+import unittest, weakref, gc
+
+from pwiki import MiscEvent
+from pwiki.MiscEvent import MiscEventSourceMixin
+from pwiki.WikiExceptions import WikiWordNotFoundException
+
+
+class _Document(MiscEventSourceMixin):
+    """
+    Stands in for a wiki document, only knows the pages in self.pages
+    """
+    def __init__(self):
+        MiscEventSourceMixin.__init__(self)
+        self.pages = {}
+
+    def getWikiPage(self, wikiWord):
+        page = self.pages.get(wikiWord)
+        if page is None:
+            raise WikiWordNotFoundException(wikiWord)
+        return page
+
+
+class _Page(object):
+    def __init__(self, wikiDocument, wikiWord):
+        self.wikiDocument = wikiDocument
+        self.wikiWord = wikiWord
+        wikiDocument.pages[wikiWord] = self
+
+    def getWikiWord(self):
+        return self.wikiWord
+
+    def getWikiDocument(self):
+        return self.wikiDocument
+
+
+class _Listener(object):
+    def __init__(self):
+        self.events = []
+
+    def miscEventHappened(self, miscevt):
+        self.events.append(miscevt)
+
+    def getSummary(self):
+        """
+        Return list of tuples (keys, affected pages, coalesced count)
+        of the received events
+        """
+        return [(sorted(k for k in evt.getProps() if k not in
+                ("affected pages", "coalesced events", "wikiPage",
+                "newWord")), evt.getAffectedPages(),
+                evt.get("coalesced events")) for evt in self.events]
+
+
+
+class CoalescingTests(unittest.TestCase):
+    def setUp(self):
+        self.doc = _Document()
+        self.pageA = _Page(self.doc, u"PageA")
+        self.pageB = _Page(self.doc, u"PageB")
+        self.direct = _Listener()
+        self.coalesced = _Listener()
+        self.doc.getMiscEvent().addListener(self.direct)
+        self.doc.getMiscEvent().addListener(self.coalesced, coalesced=True)
+
+    def tearDown(self):
+        MiscEvent.flushCoalescedEvents()
+
+    def updated(self, page):
+        self.doc.fireMiscEventProps({"updated wiki page": True,
+                "wikiPage": page})
+
+    def deleted(self, page):
+        self.doc.fireMiscEventProps({"deleted wiki page": True,
+                "wikiPage": page})
+
+    def renamed(self, page, newWord):
+        self.doc.fireMiscEventProps({"renamed wiki page": True,
+                "wikiPage": page, "newWord": newWord})
+
+    def testWithoutBatch(self):
+        # Without a main loop pending events are delivered after the send
+        self.updated(self.pageA)
+        self.assertEqual(len(self.direct.events), 1)
+        self.assertEqual(self.coalesced.getSummary(), [(["updated wiki page"],
+                {u"PageA": self.pageA}, 1)])
+
+    def testBatchScope(self):
+        with MiscEvent.batchScope():
+            self.updated(self.pageA)
+            self.updated(self.pageB)
+            self.updated(self.pageA)
+            self.deleted(self.pageB)
+            self.assertEqual(len(self.direct.events), 4)
+            self.assertEqual(self.coalesced.events, [])
+
+        self.assertEqual(self.coalesced.getSummary(), [
+                (["updated wiki page"],
+                    {u"PageA": self.pageA, u"PageB": self.pageB}, 3),
+                (["deleted wiki page"], {u"PageB": self.pageB}, 1)])
+
+    def testNestedScopes(self):
+        @MiscEvent.batched
+        def updateAll():
+            self.updated(self.pageA)
+            self.updated(self.pageB)
+
+        with MiscEvent.batchScope():
+            updateAll()
+            self.assertEqual(self.coalesced.events, [])
+            MiscEvent.beginBatch()
+            self.updated(self.pageA)
+            MiscEvent.endBatch()
+            self.assertEqual(self.coalesced.events, [])
+
+        self.assertEqual([count for keys, pages, count
+                in self.coalesced.getSummary()], [3])
+
+        # Unbalanced end is ignored
+        MiscEvent.endBatch()
+        updateAll()
+        self.assertEqual(len(self.coalesced.events), 2)
+
+    def testRenameOrder(self):
+        pageC = _Page(self.doc, u"PageC")
+        with MiscEvent.batchScope():
+            self.updated(self.pageA)
+            self.renamed(self.pageA, u"PageC")
+            self.updated(pageC)
+            self.renamed(self.pageB, u"PageD")
+            self.updated(pageC)
+            self.updated(self.pageA)
+
+        self.assertEqual(self.coalesced.getSummary(), [
+                (["updated wiki page"], {u"PageA": self.pageA}, 1),
+                (["renamed wiki page"],
+                    {u"PageA": self.pageA, u"PageC": pageC}, 1),
+                (["updated wiki page"], {u"PageC": pageC}, 1),
+                (["renamed wiki page"],
+                    {u"PageB": self.pageB, u"PageD": None}, 1),
+                (["updated wiki page"],
+                    {u"PageA": self.pageA, u"PageC": pageC}, 2)])
+
+    def testPagesLookedUpOnDelivery(self):
+        pageC = _Page(self.doc, u"PageC")
+        pageRef = weakref.ref(pageC)
+        with MiscEvent.batchScope():
+            self.updated(pageC)
+            self.deleted(pageC)
+            del self.doc.pages[u"PageC"]
+            del pageC
+            self.direct.events = []
+            gc.collect()
+            # Pending events don't hold the page
+            self.assertTrue(pageRef() is None)
+
+        self.assertEqual(self.coalesced.getSummary(), [
+                (["updated wiki page"], {u"PageC": None}, 1),
+                (["deleted wiki page"], {u"PageC": None}, 1)])
+        self.assertFalse(self.coalesced.events[0].has_key("wikiPage"))
+
+    def testRemovedListener(self):
+        with MiscEvent.batchScope():
+            self.updated(self.pageA)
+            self.doc.getMiscEvent().removeListener(self.coalesced)
+
+        self.assertEqual(self.coalesced.events, [])
+
+    def testAffectedPagesOfSingleEvent(self):
+        self.renamed(self.pageA, u"PageC")
+        self.assertEqual(self.direct.events[0].getAffectedPages(),
+                {u"PageA": self.pageA, u"PageC": None})
+
+        # Source is the page
+        source = _PageSource(self.doc, u"PageE")
+        source.getMiscEvent().addListener(self.direct)
+        source.fireMiscEventKeys(("updated wiki page",))
+        self.assertEqual(self.direct.events[-1].getAffectedPages(),
+                {u"PageE": source})
+
+
+
+class _PageSource(_Page, MiscEventSourceMixin):
+    def __init__(self, wikiDocument, wikiWord):
+        _Page.__init__(self, wikiDocument, wikiWord)
+        MiscEventSourceMixin.__init__(self)
+
+
+
+class WikiEventsTests(testenv.WikiTestCase):
+    def getPages(self):
+        return testenv.generatePages(pages=5, journalPages=0)
+
+    def setUp(self):
+        testenv.WikiTestCase.setUp(self)
+        self.direct = _Listener()
+        self.coalesced = _Listener()
+        self.wikiDocument.getMiscEvent().addListener(self.direct)
+        self.wikiDocument.getMiscEvent().addListener(self.coalesced,
+                coalesced=True)
+
+    def getPageEvents(self, listener):
+        return [(keys, sorted(pages), count) for keys, pages, count
+                in listener.getSummary() if "updated wiki page" in keys or
+                "renamed wiki page" in keys]
+
+    def testUpdatesInBatch(self):
+        with MiscEvent.batchScope():
+            for word in (u"TopicAPage", u"TopicDPage", u"TopicAPage"):
+                page = self.wikiDocument.getWikiPage(word)
+                page.replaceLiveText(page.getLiveText() + u"\nMore text\n")
+                testenv.waitForBackgroundJobs(self.wikiDocument)
+
+            self.assertEqual(self.getPageEvents(self.coalesced), [])
+
+        self.assertEqual(len(self.getPageEvents(self.direct)), 3)
+        self.assertEqual(self.getPageEvents(self.coalesced), [
+                (["updated page", "updated wiki page"],
+                [u"TopicAPage", u"TopicDPage"], 3)])
+
+    def testRename(self):
+        self.wikiDocument.renameWikiWord(u"TopicEPage", u"RenamedPage", False)
+        testenv.waitForBackgroundJobs(self.wikiDocument)
+
+        self.assertEqual(self.getPageEvents(self.coalesced), [
+                (["renamed page", "renamed wiki page"],
+                [u"RenamedPage", u"TopicEPage"], 1),
+                (["updated page", "updated wiki page"], [u"RenamedPage"], 1)])
+        renameEvent = self.coalesced.events[0]
+        self.assertEqual(renameEvent.get("newWord"), u"RenamedPage")
+        # Looked up after the rename
+        self.assertEqual(renameEvent.getAffectedPages()[u"TopicEPage"], None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,302 @@
+import testenv
+
+import unittest, os.path, tempfile
+
+from pwiki.StringOps import utf8Dec
+from pwiki.Exporters import _MptStreamWriter, MultiPageTextExporter
+from pwiki.Importers import _MptEntryReader, MultiPageTextImporter
+from pwiki.WikiExceptions import ImportException
+from pwiki import Importers
+
+
+def _readEntries(data):
+    """
+    Return separator and list of entries of multipage text bytestring data
+    as read by the importer
+    """
+    reader = _MptEntryReader(data, utf8Dec, 3)
+    header = reader.readline()
+    assert header.startswith(u"Multipage text format ")
+    separator = reader.readline()[11:-1]
+    reader.setSeparator(separator)
+
+    entries = []
+    while reader.getPos() < reader.getSize():
+        entries.append(reader.collectContent())
+
+    return separator, entries
+
+
+class _SeparatorSequence(object):
+    """
+    Replaces _MptStreamWriter._createSeparator() to return given separators
+    """
+    def __init__(self, separators):
+        self.separators = list(separators)
+        self.origCreate = _MptStreamWriter.__dict__["_createSeparator"]
+        _MptStreamWriter._createSeparator = staticmethod(self.create)
+
+    def create(self):
+        if self.separators:
+            return self.separators.pop(0)
+        return self.origCreate.__func__()
+
+    def close(self):
+        _MptStreamWriter._createSeparator = self.origCreate
+
+
+_SEP_A = u"-----%s-----" % (u"a" * 25)
+_SEP_B = u"-----%s-----" % (u"b" * 25)
+_SEP_C = u"-----%s-----" % (u"c" * 25)
+
+
+class _SmallChunkWriter(_MptStreamWriter):
+    PATCH_CHUNK_SIZE = 7
+
+
+class MptStreamWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.stream = tempfile.TemporaryFile()
+
+    def tearDown(self):
+        self.stream.close()
+
+    def write(self, writerClass, entries, lineSep="\n"):
+        self.stream.seek(0)
+        self.stream.truncate()
+        writer = writerClass(self.stream, "strict", lineSep)
+        writer.writeHeader(1)
+        writer.writeEntries(entries)
+        writer.finish()
+
+        self.stream.seek(0)
+        return writer, self.stream.read()
+
+    def testEntries(self):
+        entries = [u"", u"first\nentry\n", u"\n\n", u"\xe4\u20ac\n", u"last"]
+        for lineSep in ("\n", "\r\n"):
+            writer, data = self.write(_MptStreamWriter, entries, lineSep)
+            self.assertEqual(_readEntries(data),
+                    (writer.getSeparator(), entries))
+            self.assertEqual(data.count("\r\n"), data.count("\n") *
+                    (lineSep == "\r\n"))
+
+    def testChangesSeparator(self):
+        entries = [u"before\n" * 5,
+                # Not a separator line
+                u"x%s\n%sx\n" % (_SEP_A, _SEP_A),
+                u"text\n%s\nmore text\n" % _SEP_A,
+                u"text\n" + _SEP_C,
+                u"between\n",
+                _SEP_B + u"\n" + _SEP_A]
+
+        for writerClass in (_MptStreamWriter, _SmallChunkWriter):
+            for lineSep in ("\n", "\r\n"):
+                seps = _SeparatorSequence([_SEP_A, _SEP_C, _SEP_B, _SEP_C])
+                try:
+                    writer, data = self.write(writerClass, entries, lineSep)
+                finally:
+                    seps.close()
+
+                separator, readEntries = _readEntries(data)
+                self.assertEqual(readEntries, entries)
+                # _SEP_C is in the pending entry, _SEP_B is found in the
+                # written part when patching
+                self.assertEqual(separator, writer.getSeparator())
+                self.assertTrue(separator not in (_SEP_A, _SEP_B, _SEP_C))
+
+
+
+class MptEntryReaderTests(unittest.TestCase):
+    def testLineEnds(self):
+        sep = _SEP_A.encode("ascii")
+        data = "Multipage text format 1\r\nSeparator: %s\r\n" \
+                "word\r\na\rb\nc%s\r\n%s\n" \
+                "second\n\n%s\r" \
+                "third%s\n" \
+                "%s" % (sep, sep, sep, sep, sep, sep)
+
+        reader = _MptEntryReader(data, utf8Dec)
+        self.assertEqual(reader.readline(), u"Multipage text format 1\n")
+        reader.setSeparator(reader.readline()[11:-1])
+        self.assertEqual(reader.readline(), u"word\n")
+        self.assertEqual(reader.collectContent(), u"a\nb\nc%s" % _SEP_A)
+        self.assertEqual(reader.readline(), u"second\n")
+        reader.skipContent()
+        self.assertEqual(reader.readline(), u"third%s\n" % _SEP_A)
+        self.assertEqual(reader.collectContent(), u"")
+        self.assertEqual(reader.collectContent(), u"")
+        self.assertEqual(reader.getPos(), reader.getSize())
+        self.assertEqual(reader.readline(), u"")
+
+
+
+class _RecordingImporter(MultiPageTextImporter):
+    COMMIT_BATCH_SIZE = 500
+
+    def __init__(self, mainControl):
+        MultiPageTextImporter.__init__(self, mainControl)
+        self.tempDbPaths = []
+        self.commitCount = 0
+
+    def _openTempDb(self):
+        path = MultiPageTextImporter._openTempDb(self)
+        self.tempDbPaths.append(path)
+        return path
+
+    def _entryDone(self, contentSize):
+        if self.commitBatches and \
+                self.uncommittedSize + contentSize >= self.COMMIT_BATCH_SIZE:
+            self.commitCount += 1
+        MultiPageTextImporter._entryDone(self, contentSize)
+
+
+class _RecordingProgressHandler(object):
+    def __init__(self):
+        self.maxima = []
+        self.opened = 0
+
+    def open(self, maxval):
+        self.maxima.append(maxval)
+        self.opened += 1
+
+    def update(self, step, msg):
+        return True
+
+    def close(self):
+        pass
+
+
+class MultiPageTextExportImportTests(testenv.TempDirTestCase):
+    def setUp(self):
+        testenv.TempDirTestCase.setUp(self)
+        self.pages = testenv.generatePages(pages=25, journalPages=2)
+        self.pages.append((u"SeparatorPage",
+                u"++ Separator\n\n%s\ntext\n" % _SEP_A))
+        self.source = testenv.createWiki(self.tempDir, "compact_sqlite",
+                self.pages, wikiName=u"Source")
+
+        self.versionContents = []
+        page = self.source.getWikiPage(self.pages[0][0])
+        overview = page.getVersionOverview()
+        from pwiki.timeView.Versioning import VersionEntry
+        for i in xrange(3):
+            content = self.pages[0][1] + u"version %i\n" % i
+            overview.addVersion(content, VersionEntry(u"", u"Version %i" % i))
+            self.versionContents.append(content)
+        overview.writeOverview()
+
+        self.exportPath = os.path.join(self.tempDir, "export.mpt")
+
+    def tearDown(self):
+        testenv.getApp().getGlobalConfig().set("main",
+                "export_multiPageText_threadCount", u"0")
+        testenv.closeWiki(self.source)
+        testenv.TempDirTestCase.tearDown(self)
+
+    def export(self, path, threadCount=0):
+        testenv.getApp().getGlobalConfig().set("main",
+                "export_multiPageText_threadCount", unicode(threadCount))
+        exporter = MultiPageTextExporter(testenv.createMainControl(
+                self.source))
+        exporter.export(self.source, [name for name, text in self.pages],
+                u"multipage_text", path, False, (1, 1, 1, 1), None)
+
+        with open(path, "rb") as f:
+            return f.read()
+
+    def testChangesSeparator(self):
+        seps = _SeparatorSequence([_SEP_A])
+        try:
+            data = self.export(self.exportPath)
+        finally:
+            seps.close()
+
+        separator, entries = _readEntries(data)
+        self.assertNotEqual(separator, _SEP_A)
+        # Page entries start with name and timestamps lines
+        pageTexts = dict(entry.split(u"\n", 2)[::2] for entry in entries
+                if entry.startswith(u"wikipage/"))
+        self.assertEqual(pageTexts, dict((u"wikipage/" + name, text)
+                for name, text in self.pages))
+
+    def importInto(self, importer, **kwargs):
+        target = testenv.createWiki(self.tempDir, "compact_sqlite",
+                wikiName=u"Target")
+        try:
+            self.assertTrue(importer.doImport(target, u"multipage_text",
+                    self.exportPath, False, importer.getAddOpt(None),
+                    **kwargs))
+
+            for name, text in self.pages:
+                self.assertEqual(target.getWikiPage(name).getLiveText(),
+                        text, name)
+
+            overview = target.getWikiPage(self.pages[0][0]) \
+                    .getVersionOverview()
+            entries = overview.getVersionEntries()
+            self.assertEqual([entry.description for entry in entries],
+                    [u"Version %i" % i for i in xrange(3)])
+            self.assertEqual([overview.getVersionContent(entry.versionNumber)
+                    for entry in entries], self.versionContents)
+        finally:
+            testenv.closeWiki(target)
+
+    def testImport(self):
+        self.export(self.exportPath)
+        importer = _RecordingImporter(None)
+        self.importInto(importer)
+
+        # Temporary database of pass 1 was a file and is deleted
+        self.assertEqual(len(importer.tempDbPaths), 1)
+        self.assertFalse(os.path.exists(importer.tempDbPaths[0]))
+        # Imported content is committed in batches
+        self.assertTrue(importer.commitCount > 1)
+
+    def testImportData(self):
+        data = self.export(self.exportPath)
+        os.remove(self.exportPath)
+        self.importInto(MultiPageTextImporter(None), importData=data)
+
+    def testReaderErrorIsReported(self):
+        self.export(self.exportPath)
+
+        def failingReader(*args):
+            raise ValueError("bad reader")
+
+        origReader = Importers._MptEntryReader
+        Importers._MptEntryReader = failingReader
+        try:
+            importer = MultiPageTextImporter(None)
+            self.assertRaises(ImportException, importer.doImport, self.source,
+                    u"multipage_text", self.exportPath, False,
+                    importer.getAddOpt(None))
+        finally:
+            Importers._MptEntryReader = origReader
+
+        self.assertEqual(importer.importFile, None)
+
+    def testProgress(self):
+        self.export(self.exportPath)
+        progressHandler = _RecordingProgressHandler()
+        self.importInto(MultiPageTextImporter(None),
+                progressHandler=progressHandler)
+
+        self.assertTrue(progressHandler.opened)
+        self.assertEqual(progressHandler.maxima[0],
+                os.path.getsize(self.exportPath) // 1024)
+
+    def testParallelExportIsEqual(self):
+        sequential = self.export(self.exportPath)
+        sequentialSep, sequentialEntries = _readEntries(sequential)
+
+        parallel = self.export(self.exportPath, 3)
+        parallelSep, parallelEntries = _readEntries(parallel)
+
+        self.assertEqual(parallelEntries, sequentialEntries)
+        self.assertEqual(parallel.replace(parallelSep.encode("ascii"),
+                sequentialSep.encode("ascii")), sequential)
+
+
+if __name__ == "__main__":
+    unittest.main()
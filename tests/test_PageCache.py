@@ -0,0 +1,109 @@
+import testenv
+
+import unittest, gc, weakref
+
+import wx
+
+from pwiki.PageCache import PageLruCache
+
+
+class _Page(object):
+    def __init__(self, size):
+        self.size = size
+
+    def getLastEstimatedMemorySize(self):
+        return self.size
+
+
+class PageLruCacheTests(unittest.TestCase):
+    def testEvictsLeastRecentlyUsed(self):
+        cache = PageLruCache(1000)
+        pages = dict((name, _Page(300)) for name in ("A", "B", "C"))
+        for name in ("A", "B", "C"):
+            cache.put(name, pages[name])
+        # Using A makes B the least recently used page
+        cache.put("A", pages["A"])
+        cache.put("D", _Page(300))
+
+        # Evicted down to the low water mark
+        self.assertEqual(sorted(cache.pages.entries), ["A", "D"])
+        self.assertEqual(cache.getStatistics()["size"], 600)
+
+    def testUpdatePageSize(self):
+        cache = PageLruCache(1000)
+        first = _Page(100)
+        second = _Page(100)
+        cache.put("First", first)
+        cache.put("Second", second)
+
+        second.size = 950
+        cache.updatePageSize("Second", second)
+        self.assertEqual(sorted(cache.pages.entries), ["Second"])
+        self.assertEqual(cache.getStatistics()["size"], 950)
+
+        # Other page object under the same key is ignored
+        cache.updatePageSize("Second", _Page(10))
+        self.assertEqual(cache.getStatistics()["size"], 950)
+        cache.updatePageSize("Missing", _Page(10))
+        self.assertEqual(cache.getStatistics()["pageCount"], 1)
+
+    def testDisabled(self):
+        cache = PageLruCache(0)
+        cache.put("A", _Page(10))
+        self.assertEqual(cache.getStatistics()["pageCount"], 0)
+
+    def testStatistics(self):
+        cache = PageLruCache(1000)
+        self.assertEqual(cache.getStatistics()["hitRate"], None)
+        cache.recordLookup(True)
+        cache.recordLookup(True)
+        cache.recordLookup(False)
+        statistics = cache.getStatistics()
+        self.assertEqual((statistics["hits"], statistics["misses"]), (2, 1))
+        self.assertAlmostEqual(statistics["hitRate"], 2.0 / 3)
+
+
+
+class WikiPageCacheTests(testenv.WikiTestCase):
+    def getPages(self):
+        return testenv.generatePages(pages=10, journalPages=1)
+
+    def getCachedSize(self, word):
+        return self.wikiDocument.wikiPageLruCache.pages.entries[word][1]
+
+    def testPageKeptAlive(self):
+        word = self.getPages()[0][0]
+        ref = weakref.ref(self.wikiDocument.getWikiPage(word))
+        gc.collect()
+        self.assertTrue(ref() is not None)
+        self.assertTrue(self.wikiDocument.getWikiPage(word) is ref())
+
+        statistics = self.wikiDocument.getWikiPageCacheStatistics()
+        self.assertTrue(statistics["hits"] >= 1)
+
+    def testSizeUpdatedWhenAstIsBuilt(self):
+        word = self.getPages()[0][0]
+        page = self.wikiDocument.getWikiPage(word)
+        page.livePageAst = None
+        page.updateEstimatedMemorySize()
+        self.assertEqual(self.getCachedSize(word), page.PAGE_MEMORY_ESTIMATE)
+
+        page.getLivePageAst()
+        self.assertTrue(self.getCachedSize(word) > page.PAGE_MEMORY_ESTIMATE)
+        self.assertEqual(self.getCachedSize(word),
+                page.getEstimatedMemorySize())
+
+    def testRemovedOnDelete(self):
+        word = self.getPages()[0][0]
+        origCallAfter = wx.CallAfter
+        wx.CallAfter = lambda fct, *args: fct(*args)
+        try:
+            self.wikiDocument.getWikiPage(word).deletePage()
+        finally:
+            wx.CallAfter = origCallAfter
+        testenv.waitForBackgroundJobs(self.wikiDocument)
+        self.assertFalse(word in self.wikiDocument.wikiPageLruCache.pages)
+
+
+if __name__ == "__main__":
+    unittest.main()
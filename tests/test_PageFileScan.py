@@ -0,0 +1,291 @@
+import testenv
+
+import unittest, os, os.path, re, random, time
+from codecs import BOM_UTF8, BOM_UTF16_LE
+
+from pwiki.StringOps import mbcsEnc, getFileSignatureBlock, \
+        fileContentToUnicode, loadEntireTxtFile
+from pwiki.SearchAndReplace import SearchReplaceOperation, SimpleStrNode, \
+        AndSearchNode, OrSearchNode, AbstractAndOrSearchNode
+from pwiki.wikidata.PageFileScan import BytesPrefilter, PageContentCache, \
+        PageFileScanner
+
+
+def _matches(desc, text):
+    """
+    Reference evaluation of a required literals description on unicode text
+    """
+    if desc is None:
+        return True
+    if desc[0] == "literal":
+        flags = re.UNICODE
+        if desc[2]:
+            flags |= re.IGNORECASE
+        return re.search(re.escape(desc[1]), text, flags) is not None
+    elif desc[0] == "and":
+        return _matches(desc[1], text) and _matches(desc[2], text)
+    else:
+        return _matches(desc[1], text) or _matches(desc[2], text)
+
+
+def _encodings(text):
+    """
+    Return list of possible page file contents for unicode text
+    """
+    result = [BOM_UTF8 + text.encode("utf-8"),
+            BOM_UTF16_LE + text.encode("utf-16-le")]
+    try:
+        result.append(mbcsEnc(text, "strict")[0])
+    except UnicodeError:
+        pass
+
+    return result
+
+
+def _writeFile(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+class BytesPrefilterTests(testenv.TempDirTestCase):
+    # Includes characters with case variants of different encoded length
+    # and a surrogate pair
+    CHARS = [u"a", u"A", u"b", u"B", u"s", u"S", u"k", u"K", u" ", u"\xe4",
+            u"\xc4", u"\xdf", u"\u0130", u"i", u"\u0131", u"I", u"\u212a",
+            u"\u017f", u"\u03a3", u"\u03c3", u"\u03c2", u"\ud83d\ude00"]
+
+    def testNoneMatchesAll(self):
+        self.assertTrue(BytesPrefilter(None).mightMatch(""))
+        self.assertTrue(BytesPrefilter(None).mightMatch("anything"))
+
+    def testRejects(self):
+        desc = ("and", ("literal", u"budget", True),
+                ("or", ("literal", u"report", False),
+                ("literal", u"summary", False)))
+        prefilter = BytesPrefilter(desc)
+
+        for text, expected in ((u"Budget report", True),
+                (u"BUDGET summary", True), (u"budget Report", False),
+                (u"report", False), (u"", False)):
+            self.assertEqual(prefilter.mightMatch(BOM_UTF8 +
+                    text.encode("utf-8")), expected, text)
+            self.assertEqual(prefilter.mightMatch(mbcsEnc(text)[0]), expected,
+                    text)
+
+    def testNeverRejectsMatchingContent(self):
+        rnd = random.Random(30)
+
+        def randomText(maxLen):
+            return u"".join(rnd.choice(self.CHARS)
+                    for i in xrange(rnd.randint(1, maxLen)))
+
+        def randomDesc(depth):
+            if depth == 0 or rnd.random() < 0.5:
+                return ("literal", randomText(3), rnd.random() < 0.7)
+            return (rnd.choice(("and", "or")), randomDesc(depth - 1),
+                    randomDesc(depth - 1))
+
+        for i in xrange(300):
+            desc = randomDesc(2)
+            prefilter = BytesPrefilter(desc)
+            for j in xrange(10):
+                text = randomText(12)
+                if not _matches(desc, text):
+                    continue
+                for content in _encodings(text):
+                    self.assertTrue(prefilter.mightMatch(content),
+                            "%r, %r, %r" % (desc, text, content))
+
+    def testMmap(self):
+        import mmap
+
+        path = os.path.join(self.tempDir, "page.wiki")
+        _writeFile(path, BOM_UTF8 + "x" * 5000 + "needle")
+        prefilter = BytesPrefilter(("literal", u"NEEDLE", True))
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.assertTrue(prefilter.mightMatch(mm))
+            finally:
+                mm.close()
+
+
+
+class PageContentCacheTests(unittest.TestCase):
+    def testSignatureMustMatch(self):
+        cache = PageContentCache(1000)
+        self.assertTrue(cache.isEnabled())
+        cache.put("a.wiki", "sig1", u"content")
+        self.assertEqual(cache.get("a.wiki", "sig1"), u"content")
+        self.assertEqual(cache.get("a.wiki", "sig2"), None)
+        # Entry with outdated signature was removed
+        self.assertEqual(cache.get("a.wiki", "sig1"), None)
+
+    def testSizeLimit(self):
+        cache = PageContentCache(100)
+        # Larger than a quarter of the maximum size
+        cache.put("large.wiki", "sig", u"x" * 26)
+        self.assertEqual(cache.get("large.wiki", "sig"), None)
+
+        for i in xrange(5):
+            cache.put("%i.wiki" % i, "sig", u"x" * 25)
+        self.assertEqual(cache.get("0.wiki", "sig"), None)
+        self.assertEqual(cache.get("4.wiki", "sig"), u"x" * 25)
+
+        cache.clear()
+        self.assertEqual(cache.get("4.wiki", "sig"), None)
+        self.assertFalse(PageContentCache(0).isEnabled())
+
+
+
+class _SmallMmapScanner(PageFileScanner):
+    MMAP_MIN_SIZE = 100
+
+
+class PageFileScannerTests(testenv.TempDirTestCase):
+    def setUp(self):
+        testenv.TempDirTestCase.setUp(self)
+        rnd = random.Random(30)
+        words = [u"budget", u"report", u"Budget", u"summary", u"\xe4rger",
+                u"text", u"\r\n", u"\n", u"\r"]
+        self.texts = {}
+        self.entries = []
+        for i in xrange(60):
+            text = u" ".join(rnd.choice(words)
+                    for j in xrange(rnd.randint(0, 200)))
+            word = u"Page%i" % i
+            fileName = "page%i.wiki" % i
+            encodings = _encodings(text)
+            encoded = encodings[i % len(encodings)]
+            path = os.path.join(self.tempDir, fileName)
+            _writeFile(path, encoded)
+            # Content as WikiData.getContent() reads it
+            self.texts[word] = fileContentToUnicode(loadEntireTxtFile(path))
+            self.entries.append((word, fileName))
+
+        self.entries.append((u"Missing", "missing.wiki"))
+
+    def _expected(self, desc):
+        result = dict((word, text) for word, text in self.texts.iteritems()
+                if _matches(desc, text))
+        result[u"Missing"] = None
+        return result
+
+    def testResultsIndependentOfThreads(self):
+        for desc in (None, ("literal", u"BUDGET", True),
+                ("and", ("literal", u"budget report", False),
+                ("literal", u"\xc4rger", True))):
+            expected = self._expected(desc)
+            for scannerClass in (PageFileScanner, _SmallMmapScanner):
+                for threadCount in (0, 1, 4):
+                    scanner = scannerClass(self.tempDir, desc, threadCount)
+                    result = dict(scanner.iterPages(self.entries))
+                    # Prefilter may let non-matching pages through but
+                    # must deliver every matching one
+                    for word in result.keys():
+                        if word not in expected:
+                            self.assertFalse(_matches(desc, result[word]))
+                            del result[word]
+                    self.assertEqual(result, expected,
+                            "%r, %s" % (desc, threadCount))
+
+    def testEarlyClose(self):
+        scanner = PageFileScanner(self.tempDir, None, 4)
+        it = scanner.iterPages(self.entries)
+        it.next()
+        it.close()
+
+    def testContentCache(self):
+        cache = PageContentCache(100000)
+        scanner = PageFileScanner(self.tempDir, None, 4, cache)
+        dict(scanner.iterPages(self.entries))
+
+        path = os.path.join(self.tempDir, "page0.wiki")
+        self.assertEqual(cache.get("page0.wiki", getFileSignatureBlock(path)),
+                self.texts[u"Page0"])
+
+        # Changed files are read again
+        _writeFile(path, "changed")
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        result = dict(scanner.iterPages(self.entries))
+        self.assertEqual(result[u"Page0"], u"changed")
+
+        # Disabled cache is not used
+        scanner = PageFileScanner(self.tempDir, None, 4, PageContentCache(0))
+        self.assertEqual(scanner.contentCache, None)
+
+
+
+class RequiredLiteralsTests(unittest.TestCase):
+    def setUp(self):
+        self.sarOp = SearchReplaceOperation()
+        self.budget = SimpleStrNode(self.sarOp, u"budget")
+        self.report = SimpleStrNode(self.sarOp, u"report")
+        self.empty = SimpleStrNode(self.sarOp, u"")
+
+    def testAndOr(self):
+        budget = ("literal", u"budget", False)
+        report = ("literal", u"report", False)
+        self.assertEqual(AndSearchNode(self.sarOp, self.budget,
+                self.report).getRequiredLiterals(), ("and", budget, report))
+        self.assertEqual(AndSearchNode(self.sarOp, self.empty,
+                self.report).getRequiredLiterals(), report)
+        self.assertEqual(OrSearchNode(self.sarOp, self.budget,
+                self.report).getRequiredLiterals(), ("or", budget, report))
+        self.assertEqual(OrSearchNode(self.sarOp, self.budget,
+                self.empty).getRequiredLiterals(), None)
+
+    def testOtherConnectionIsConservative(self):
+        class XorSearchNode(AbstractAndOrSearchNode):
+            def testWikiPage(self, word, text):
+                return self.left.testWikiPage(word, text) != \
+                        self.right.testWikiPage(word, text)
+
+        node = XorSearchNode(self.sarOp, self.budget, self.report)
+        self.assertEqual(node.getRequiredLiterals(), None)
+        self.assertTrue(BytesPrefilter(node.getRequiredLiterals())
+                .mightMatch(BOM_UTF8 + "nothing"))
+
+
+
+class WikiSearchTests(testenv.WikiTestCase):
+    """
+    Wiki-wide search of an Original Sqlite wiki compared to testing each
+    page on its own
+    """
+    SEARCHES = ((u"budget\\s+(report|summary)", u"regex"),
+            (u"budget\\s+report and not customer\\s+review", u"boolean"),
+            (u"Budget", u"asis"))
+
+    DB_TYPE = "original_sqlite"
+
+    def getPages(self):
+        return testenv.generatePages(pages=40, journalPages=2)
+
+    def testSearchWiki(self):
+        wikiDocument = self.wikiDocument
+        for searchStr, searchType in self.SEARCHES:
+            for caseSensitive in (False, True):
+                sarOp = SearchReplaceOperation()
+                sarOp.searchStr = searchStr
+                sarOp.booleanOp = searchType == u"boolean"
+                sarOp.caseSensitive = caseSensitive
+                sarOp.wildCard = 'no' if searchType == u"asis" else 'regex'
+                sarOp.wikiWide = True
+                found = wikiDocument.searchWiki(sarOp.clone(), True)
+
+                sarOp.beginWikiSearch(wikiDocument)
+                try:
+                    expected = [word for word in
+                            wikiDocument.getWikiData().getAllDefinedWikiPageNames()
+                            if sarOp.testWikiPage(word, wikiDocument.getWikiPage(
+                            word).getLiveText()) == True]
+                finally:
+                    sarOp.endWikiSearch()
+
+                self.assertEqual(sorted(found), sorted(expected),
+                        "%s, %s" % (searchStr, caseSensitive))
+
+
+if __name__ == "__main__":
+    unittest.main()
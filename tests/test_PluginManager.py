@@ -0,0 +1,219 @@
+import testenv
+
+import unittest, sys, os, os.path, imp
+
+import Consts
+import pwiki.PluginManager
+from pwiki.PluginManager import PluginManager, PluginManifestCache, \
+        LazyPluginModule, LazyPluginReference
+
+
+_PLUGIN_SOURCE = '''
+import pluginTestLog
+pluginTestLog.imports.append(%(name)r)
+
+WIKIDPAD_PLUGIN = (("TestDescribe", 1), ("TestWrapped", 1))
+
+class Described(object):
+    title = u"Title of %(name)s"
+
+def describe():
+    return ((u"%(name)s", Described, None, 1.5),)
+
+def call(value):
+    return value * %(factor)i
+
+def wrapped():
+    return u"wrapped %(name)s"
+'''
+
+_HELPER_SOURCE = '''
+import pluginTestLog
+pluginTestLog.imports.append("helper")
+
+def helperFunction():
+    pass
+'''
+
+
+class PluginManifestTests(testenv.TempDirTestCase):
+    def setUp(self):
+        testenv.TempDirTestCase.setUp(self)
+        self.pluginDir = os.path.join(self.tempDir, "extensions")
+        os.mkdir(self.pluginDir)
+        self.manifestPath = os.path.join(self.tempDir, "pluginManifest.dat")
+
+        self.writePlugin("PluginA.py", _PLUGIN_SOURCE %
+                {"name": "PluginA", "factor": 2})
+        self.writePlugin("PluginB.py", _PLUGIN_SOURCE %
+                {"name": "PluginB", "factor": 3})
+        self.writePlugin("helper.py", _HELPER_SOURCE)
+
+        self.log = imp.new_module("pluginTestLog")
+        self.log.imports = []
+        sys.modules["pluginTestLog"] = self.log
+
+        self.origGetGuiLocale = pwiki.PluginManager.getGuiLocale
+
+    def tearDown(self):
+        pwiki.PluginManager.getGuiLocale = self.origGetGuiLocale
+        pwiki.PluginManager._manifestCaches.clear()
+        del sys.modules["pluginTestLog"]
+        testenv.TempDirTestCase.tearDown(self)
+
+    def writePlugin(self, name, source, mtime=1000000000):
+        path = os.path.join(self.pluginDir, name)
+        with open(path, "w") as f:
+            f.write(source)
+        os.utime(path, (mtime, mtime))
+
+    def loadPlugins(self, manifestPath=True):
+        """
+        Load plugins as a newly started application would
+        """
+        # Manifest cache is read from file again
+        pwiki.PluginManager._manifestCaches.clear()
+        if manifestPath is True:
+            manifestPath = self.manifestPath
+
+        pm = PluginManager([self.pluginDir], manifestPath=manifestPath)
+        self.describeApi = pm.registerSimplePluginAPI(("TestDescribe", 1),
+                ("describe", "call"), staticFunctions=("describe",))
+        self.wrappedApi = pm.registerWrappedPluginAPI(("TestWrapped", 1),
+                wrapped=None, wrappedName=lambda module: module.__name__.split(".")[-1],
+                wrappedCall=lambda module: module.wrapped())
+        pm.loadPlugins([])
+        return pm
+
+    def describe(self):
+        return sorted(sum(self.describeApi.describe(), ()),
+                key=lambda d: d[0])
+
+    def testWithoutManifest(self):
+        pm = self.loadPlugins(None)
+        self.assertEqual(sorted(self.log.imports),
+                ["PluginA", "PluginB", "helper"])
+        self.assertFalse(os.path.exists(self.manifestPath))
+        self.assertEqual(sorted(self.describeApi.call(5)), [10, 15])
+
+    def testLazyLoading(self):
+        self.loadPlugins()
+        self.assertEqual(sorted(self.log.imports),
+                ["PluginA", "PluginB", "helper"])
+        self.assertTrue(os.path.exists(self.manifestPath))
+        described = self.describe()
+        self.assertEqual(described[0][3], 1.5)
+
+        del self.log.imports[:]
+        pm = self.loadPlugins()
+        self.assertEqual(self.log.imports, [])
+        self.assertEqual(len(pm.plugins), 2)
+        for module in pm.plugins.itervalues():
+            self.assertTrue(isinstance(module, LazyPluginModule))
+            self.assertFalse(module.isLoaded())
+
+        # Static results come from the manifest
+        lazyDescribed = self.describe()
+        self.assertEqual(self.log.imports, [])
+        self.assertEqual([(n, t, r) for n, c, t, r in lazyDescribed],
+                [(n, t, r) for n, c, t, r in described])
+        self.assertTrue(isinstance(lazyDescribed[0], tuple))
+        self.assertTrue(isinstance(lazyDescribed[0][1], LazyPluginReference))
+
+        # Using a referenced class imports its module only
+        self.assertEqual(lazyDescribed[0][1].title, u"Title of PluginA")
+        self.assertEqual(self.log.imports, ["PluginA"])
+        self.assertEqual(lazyDescribed[1][1]().title, u"Title of PluginB")
+        self.assertEqual(self.log.imports, ["PluginA", "PluginB"])
+        moduleA, = [module for name, module in pm.plugins.iteritems()
+                if name.endswith(".PluginA")]
+        self.assertTrue(lazyDescribed[0][1].getObject() is
+                moduleA.getPluginModule().Described)
+
+        # Imported once
+        self.describe()
+        self.assertEqual(sorted(self.describeApi.call(5)), [10, 15])
+        self.assertEqual(self.log.imports, ["PluginA", "PluginB"])
+
+    def testFunctionImportsModule(self):
+        self.loadPlugins()
+        del self.log.imports[:]
+
+        self.loadPlugins()
+        self.assertEqual(sorted(self.wrappedApi.wrappedName()),
+                ["PluginA", "PluginB"])
+        self.assertEqual(self.log.imports, [])
+
+        self.assertEqual(sorted(self.describeApi.call(5)), [10, 15])
+        self.assertEqual(sorted(self.log.imports), ["PluginA", "PluginB"])
+
+        del self.log.imports[:]
+        self.loadPlugins()
+        self.assertEqual(sorted(self.wrappedApi.wrappedCall()),
+                [u"wrapped PluginA", u"wrapped PluginB"])
+        self.assertEqual(sorted(self.wrappedApi.wrapped()),
+                [u"wrapped PluginA", u"wrapped PluginB"])
+        self.assertEqual(sorted(self.log.imports), ["PluginA", "PluginB"])
+
+    def testChangedFile(self):
+        self.loadPlugins()
+        self.describe()
+
+        self.writePlugin("PluginB.py", _PLUGIN_SOURCE %
+                {"name": "PluginB", "factor": 4}, 1000000001)
+        del self.log.imports[:]
+        self.loadPlugins()
+        self.assertEqual(self.log.imports, ["PluginB"])
+        self.assertEqual(sorted(self.describeApi.call(5)), [10, 20])
+
+        # New manifest is stored
+        del self.log.imports[:]
+        self.loadPlugins()
+        self.assertEqual(self.log.imports, [])
+
+    def testRemovedFile(self):
+        self.loadPlugins()
+        os.remove(os.path.join(self.pluginDir, "PluginB.py"))
+        self.loadPlugins()
+
+        self.assertEqual(sorted(PluginManifestCache(self.manifestPath)
+                .entries.keys()), [os.path.join(self.pluginDir, name)
+                for name in ("PluginA.py", "helper.py")])
+
+    def testGuiLanguageOrVersionChanged(self):
+        self.loadPlugins()
+        self.describe()
+        path = os.path.join(self.pluginDir, "PluginA.py")
+        fileKey = PluginManifestCache.getFileKey(path)
+        self.assertTrue(PluginManifestCache(self.manifestPath).getManifest(
+                path, fileKey) is not None)
+
+        pwiki.PluginManager.getGuiLocale = lambda: "xx_XX"
+        self.assertNotEqual(PluginManifestCache.getFileKey(path), fileKey)
+        del self.log.imports[:]
+        self.loadPlugins()
+        self.assertEqual(sorted(self.log.imports),
+                ["PluginA", "PluginB", "helper"])
+
+        pwiki.PluginManager.getGuiLocale = self.origGetGuiLocale
+        origVersion = Consts.VERSION_STRING
+        Consts.VERSION_STRING = origVersion + "_test"
+        try:
+            self.assertNotEqual(PluginManifestCache.getFileKey(path), fileKey)
+        finally:
+            Consts.VERSION_STRING = origVersion
+
+        self.assertEqual(PluginManifestCache.getFileKey(
+                os.path.join(self.pluginDir, "missing.py")), None)
+
+    def testDamagedManifest(self):
+        with open(self.manifestPath, "wb") as f:
+            f.write("damaged")
+        self.loadPlugins()
+        self.assertEqual(sorted(self.log.imports),
+                ["PluginA", "PluginB", "helper"])
+        self.assertEqual(sorted(self.describeApi.call(5)), [10, 15])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import testenv
+
+import unittest, sys, os, os.path
+
+from pwiki.TempFileSet import TempFileSet
+from pwiki.PreviewRenderCache import PreviewRenderCache
+
+
+def _importHtmlExporter():
+    extensionsDir = os.path.join(testenv.MAIN_DIR, "extensions")
+    if extensionsDir not in sys.path:
+        sys.path.append(extensionsDir)
+
+    import HtmlExporter
+    return HtmlExporter
+
+HtmlExporter = _importHtmlExporter()
+
+
+class _RecordingPreviewExporter(HtmlExporter.HtmlExporter):
+    """
+    Exporter set up as by WikiHtmlView2, records the rendered pages
+    """
+    def __init__(self, mainControl, wikiDocument):
+        HtmlExporter.HtmlExporter.__init__(self, mainControl)
+        self.exportType = u"html_previewWK"
+        self.tempFileSet = TempFileSet()
+        self.setWikiDocument(wikiDocument)
+        self.setLinkConverter(
+                HtmlExporter.LinkConverterForHtmlSingleFilesExport(
+                wikiDocument, self))
+        self.rendered = []
+
+    def exportWikiPageToHtmlStringRecording(self, wikiPage, *args, **kwargs):
+        self.rendered.append(wikiPage.getWikiWord())
+        return HtmlExporter.HtmlExporter.exportWikiPageToHtmlStringRecording(
+                self, wikiPage, *args, **kwargs)
+
+
+class PreviewRenderCacheTests(testenv.WikiTestCase):
+    def getPages(self):
+        return testenv.generatePages(pages=10, journalPages=0) + [
+                (u"SearchPage", u"+ SearchPage\n\n[:search:\"budget\"]\n")]
+
+    def setUp(self):
+        testenv.WikiTestCase.setUp(self)
+        self.mainControl = testenv.createMainControl(self.wikiDocument)
+        self.exporter = _RecordingPreviewExporter(self.mainControl,
+                self.wikiDocument)
+        self.cacheDir = os.path.join(self.tempDir, "previewCache")
+        self.cache = PreviewRenderCache(self.cacheDir, 10 * 1024 * 1024)
+
+    def getHtml(self, word):
+        return self.cache.getHtml(self.exporter,
+                self.wikiDocument.getWikiPage(word))
+
+    def appendText(self, word, text):
+        page = self.wikiDocument.getWikiPage(word)
+        page.replaceLiveText(page.getLiveText() + text)
+        testenv.waitForBackgroundJobs(self.wikiDocument)
+
+    def testCachedUntilChanged(self):
+        html = self.getHtml(u"TopicAPage")
+        self.assertEqual(self.getHtml(u"TopicAPage"), html)
+        self.assertEqual(self.exporter.rendered, [u"TopicAPage"])
+
+        # Text of the page
+        self.appendText(u"TopicAPage", u"\nAppended text\n")
+        html = self.getHtml(u"TopicAPage")
+        self.assertTrue("Appended text" in html)
+        self.assertEqual(self.getHtml(u"TopicAPage"), html)
+        self.assertEqual(len(self.exporter.rendered), 2)
+
+        # Attribute of a linked page
+        self.appendText(u"TopicDPage", u"\n[short_hint: Hint of D]\n")
+        html = self.getHtml(u"TopicAPage")
+        self.assertTrue("Hint of D" in html)
+        self.assertEqual(len(self.exporter.rendered), 3)
+
+        # Page not linked
+        self.appendText(u"topic c notes", u"\nAppended text\n")
+        self.assertEqual(self.getHtml(u"TopicAPage"), html)
+        self.assertEqual(len(self.exporter.rendered), 3)
+
+    def testPreviewSettings(self):
+        config = self.mainControl.getConfig()
+        html = self.getHtml(u"TopicAPage")
+
+        bodyText = config.get("main", "html_body_text")
+        config.set("main", "html_body_text", u"#123456")
+        try:
+            self.assertNotEqual(self.getHtml(u"TopicAPage"), html)
+            self.assertEqual(len(self.exporter.rendered), 2)
+        finally:
+            config.set("main", "html_body_text", bodyText)
+
+        # Previous rendering is still cached for previous settings
+        self.assertEqual(self.getHtml(u"TopicAPage"), html)
+        self.assertEqual(len(self.exporter.rendered), 2)
+
+    def testVolatileNotCached(self):
+        self.getHtml(u"SearchPage")
+        self.getHtml(u"SearchPage")
+        self.assertEqual(self.exporter.rendered, [u"SearchPage"] * 2)
+        self.assertFalse(os.path.exists(self.cacheDir) and
+                os.listdir(self.cacheDir))
+
+    def testPrerender(self):
+        page = self.wikiDocument.getWikiPage(u"TopicAPage")
+        self.cache.prerender(self.exporter, page)
+        self.cache.prerender(self.exporter, page)
+        self.assertEqual(self.exporter.rendered, [u"TopicAPage"])
+
+        self.getHtml(u"TopicAPage")
+        self.assertEqual(self.exporter.rendered, [u"TopicAPage"])
+
+    def testDisabled(self):
+        self.cache = PreviewRenderCache(self.cacheDir, 0)
+        self.assertFalse(self.cache.isEnabled())
+
+        html = self.getHtml(u"TopicAPage")
+        self.assertEqual(self.getHtml(u"TopicAPage"), html)
+        self.cache.prerender(self.exporter,
+                self.wikiDocument.getWikiPage(u"TopicAPage"))
+        self.assertEqual(self.exporter.rendered, [u"TopicAPage"] * 2)
+
+    def testWikiPreviewRenderCache(self):
+        cache = self.wikiDocument.getPreviewRenderCache()
+        self.assertTrue(self.wikiDocument.getPreviewRenderCache() is cache)
+        self.assertTrue(cache.isEnabled())
+
+        self.cache = cache
+        html = self.getHtml(u"TopicAPage")
+        self.assertEqual(self.getHtml(u"TopicAPage"), html)
+        self.assertEqual(self.exporter.rendered, [u"TopicAPage"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import testenv
+
+import unittest, os, os.path, time
+
+from pwiki.RenderCache import RenderCache
+
+
+class _Renderer(object):
+    """
+    Render function writing content to the given path and returning
+    errResponse, counts its calls
+    """
+    def __init__(self, content, errResponse=""):
+        self.content = content
+        self.errResponse = errResponse
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        with open(path, "wb") as f:
+            f.write(self.content)
+        return self.errResponse
+
+
+class RenderCacheTests(testenv.TempDirTestCase):
+    def setUp(self):
+        testenv.TempDirTestCase.setUp(self)
+        self.cacheDir = os.path.join(self.tempDir, "cache")
+        self.dstPath = os.path.join(self.tempDir, "out.png")
+
+    def _readDst(self):
+        with open(self.dstPath, "rb") as f:
+            return f.read()
+
+    def _cachedFiles(self):
+        return sorted(os.listdir(self.cacheDir))
+
+    def testMakeKey(self):
+        makeKey = RenderCache.makeKey
+        self.assertEqual(makeKey(u"dot", "-Tpng", True),
+                makeKey(u"dot", "-Tpng", True))
+        self.assertNotEqual(makeKey("ab", "c"), makeKey("a", "bc"))
+        self.assertNotEqual(makeKey(u"\xe4"), makeKey(u"a"))
+        self.assertNotEqual(makeKey(True), makeKey(False))
+
+    def testProvideRendersOnce(self):
+        cache = RenderCache(self.cacheDir, 10000)
+        renderer = _Renderer("image")
+        key = cache.makeKey("test", 1)
+
+        for i in xrange(3):
+            self.assertEqual(cache.provide(key, self.dstPath, renderer), "")
+            self.assertEqual(self._readDst(), "image")
+            os.remove(self.dstPath)
+
+        self.assertEqual(renderer.calls, 1)
+        self.assertEqual(self._cachedFiles(), [key + ".png"])
+
+    def testPrefetch(self):
+        cache = RenderCache(self.cacheDir, 10000)
+        renderer = _Renderer("image")
+        key = cache.makeKey("test", 2)
+
+        cache.prefetch(key, ".png", renderer)
+        cache.prefetch(key, ".png", renderer)
+        self.assertEqual(cache.getCachedPath(key, ".png"),
+                os.path.join(self.cacheDir, key + ".png"))
+        self.assertEqual(cache.provide(key, self.dstPath, renderer), "")
+        self.assertEqual(self._readDst(), "image")
+        self.assertEqual(renderer.calls, 1)
+
+    def testFailedPrefetchIsHandedOver(self):
+        cache = RenderCache(self.cacheDir, 10000)
+        renderer = _Renderer("", "error message")
+        key = cache.makeKey("test", 3)
+
+        cache.prefetch(key, ".png", renderer)
+        self.assertEqual(cache.provide(key, self.dstPath, renderer),
+                "error message")
+        self.assertEqual(renderer.calls, 1)
+
+        # Errors aren't cached beyond that
+        self.assertEqual(cache.provide(key, self.dstPath, renderer),
+                "error message")
+        self.assertEqual(renderer.calls, 2)
+        self.assertEqual(cache.getCachedPath(key, ".png"), None)
+
+    def testEmptyResult(self):
+        cache = RenderCache(self.cacheDir, 10000)
+        renderer = _Renderer("")
+        key = cache.makeKey("test", 4)
+
+        cache.prefetch(key, ".png", renderer)
+        self.assertEqual(cache.provide(key, self.dstPath, renderer), "")
+        self.assertEqual(self._readDst(), "")
+        self.assertEqual(renderer.calls, 1)
+
+        os.remove(self.dstPath)
+        self.assertEqual(cache.provide(key, self.dstPath, renderer), "")
+        self.assertEqual(self._readDst(), "")
+        self.assertEqual(renderer.calls, 2)
+        self.assertEqual(self._cachedFiles(), [])
+
+    def testBypass(self):
+        renderer = _Renderer("image")
+        for cache, key in ((RenderCache(self.cacheDir, 10000), None),
+                (RenderCache(self.cacheDir, 0), "somekey")):
+            cache.prefetch(key, ".png", renderer)
+            self.assertEqual(cache.provide(key, self.dstPath, renderer), "")
+            self.assertEqual(self._readDst(), "image")
+
+        self.assertEqual(renderer.calls, 2)
+        self.assertFalse(os.path.exists(self.cacheDir))
+
+    def testEviction(self):
+        cache = RenderCache(self.cacheDir, 100)
+        keys = [cache.makeKey("test", i) for i in xrange(5)]
+        for key in keys[:4]:
+            cache.prefetch(key, ".png", _Renderer("x" * 30))
+        # Evicted down to three quarters of maximum size
+        self.assertEqual(self._cachedFiles(),
+                sorted(key + ".png" for key in keys[2:4]))
+
+        # Too large for the whole cache
+        renderer = _Renderer("x" * 101)
+        self.assertEqual(cache.provide(keys[4], self.dstPath, renderer), "")
+        self.assertEqual(len(self._readDst()), 101)
+        self.assertEqual(cache.getCachedPath(keys[4], ".png"), None)
+
+    def testReadsDirectoryInLruOrder(self):
+        cache = RenderCache(self.cacheDir, 100)
+        keys = [cache.makeKey("test", i) for i in xrange(3)]
+        for i, key in enumerate(keys):
+            cache.prefetch(key, ".png", _Renderer("x" * 30))
+            path = os.path.join(self.cacheDir, key + ".png")
+            os.utime(path, (1000 + i, 1000 + i))
+
+        # Leftovers of interrupted renderings are removed if old enough
+        stale = os.path.join(self.cacheDir, RenderCache.RENDER_PREFIX + "a")
+        fresh = os.path.join(self.cacheDir, RenderCache.RENDER_PREFIX + "b")
+        for path in (stale, fresh):
+            open(path, "wb").close()
+        os.utime(stale, (1000, 1000))
+
+        # Using the oldest file makes it the most recently used one
+        cache = RenderCache(self.cacheDir, 100)
+        self.assertNotEqual(cache.getCachedPath(keys[0], ".png"), None)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertTrue(os.path.getmtime(os.path.join(self.cacheDir,
+                keys[0] + ".png")) > time.time() - 3600)
+
+        cache.prefetch(cache.makeKey("test", 3), ".png", _Renderer("x" * 30))
+        self.assertEqual(cache.getCachedPath(keys[1], ".png"), None)
+        self.assertNotEqual(cache.getCachedPath(keys[0], ".png"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import testenv
+
+import unittest, sys, os.path, random
+
+import pwiki.sqlite3api as sqlite
+from pwiki.wikidata.compact_sqlite import DbStructure
+
+
+def _importBenchSnapshots():
+    benchmarksDir = os.path.join(testenv.MAIN_DIR, "benchmarks")
+    if benchmarksDir not in sys.path:
+        sys.path.append(benchmarksDir)
+
+    import bench_snapshots
+    return bench_snapshots
+
+
+class SnapshotTests(testenv.WikiTestCase):
+    """
+    Whole-wiki versions of Compact Sqlite compared to a model of the page
+    contents at the time each version was stored.
+    """
+    def getPages(self):
+        return testenv.generatePages(pages=20, journalPages=0)
+
+    def setUp(self):
+        testenv.WikiTestCase.setUp(self)
+        self.wikiData = self.wikiDocument.getWikiData()
+        self.connWrap = self.wikiData.wikiData.connWrap
+        self.rnd = random.Random(34)
+        self.modTime = 1000
+
+    def getCurrentState(self):
+        return dict((word, str(content)) for word, content in
+                self.connWrap.execSqlQuery("select word, content "
+                "from wikiwordcontent"))
+
+    def changePages(self):
+        """
+        Create, modify, touch (modification date only) and delete random
+        pages directly in the database
+        """
+        connWrap = self.connWrap
+        words = sorted(self.getCurrentState())
+        self.modTime += 1
+
+        for word in self.rnd.sample(words, 4):
+            op = self.rnd.randint(0, 3)
+            if op == 0:
+                connWrap.execSql("delete from wikiwordcontent where word = ?",
+                        (word,))
+            elif op == 1:
+                connWrap.execSql("update wikiwordcontent set modified = ? "
+                        "where word = ?", (self.modTime, word))
+            else:
+                # Also some contents of other pages or versions
+                content = self.rnd.choice(["", "same content\n",
+                        "text %i\n" % self.rnd.randint(0, 10000)])
+                connWrap.execSql("update wikiwordcontent set content = ?, "
+                        "modified = ? where word = ?",
+                        (sqlite.Binary(content), self.modTime, word))
+
+        word = u"NewPage%i" % self.rnd.randint(0, 5)
+        connWrap.execSql("insert or replace into wikiwordcontent(word, "
+                "content, modified, created) values (?, ?, ?, ?)",
+                (word, sqlite.Binary("same content\n"), self.modTime,
+                self.modTime))
+        connWrap.commit()
+
+    def getSnapshotIds(self):
+        return sorted(id for id, description, created in
+                self.wikiData.getStoredVersions())
+
+    def checkVersions(self, expected):
+        """
+        expected -- list of states (dictionaries {word: content}) of the
+                versions, oldest first
+        """
+        ids = self.getSnapshotIds()
+        self.assertEqual(len(ids), len(expected))
+        states = dict(zip(ids, expected))
+
+        for id in ids:
+            self.wikiData.applyStoredVersion(id)
+            self.assertEqual(self.getCurrentState(), states[id])
+
+        for fromId in ids:
+            for toId in ids:
+                fromState = states[fromId]
+                toState = states[toId]
+                expectedDiff = sorted((word, fromState.get(word),
+                        toState.get(word)) for word in
+                        set(fromState) | set(toState)
+                        if fromState.get(word) != toState.get(word))
+                diff = sorted((word, fromContent and fromContent.encode(
+                        "utf-8"), toContent and toContent.encode("utf-8"))
+                        for word, fromContent, toContent in
+                        self.wikiData.getStoredVersionDifferences(fromId,
+                        toId))
+                self.assertEqual(diff, expectedDiff, (fromId, toId))
+
+    def testStoreAndApply(self):
+        expected = []
+        for i in xrange(8):
+            if i > 0:
+                self.changePages()
+            self.wikiData.storeVersion(u"Version %i" % i)
+            expected.append(self.getCurrentState())
+
+        self.assertEqual([description for id, description, created in
+                self.wikiData.getStoredVersions()],
+                [u"Version %i" % i for i in xrange(7, -1, -1)])
+
+        # Each distinct content is stored once
+        contents = set()
+        for state in expected:
+            contents.update(state.itervalues())
+        self.assertEqual(self.connWrap.execSqlQuerySingleItem(
+                "select count(*) from snapshotcontent"), len(contents))
+
+        self.checkVersions(expected)
+
+        self.wikiData.deleteVersioningData()
+        self.assertFalse(self.wikiData.hasVersioningData())
+        self.assertEqual(self.wikiData.getStoredVersions(), [])
+
+    def testMigrateChangelog(self):
+        bench = _importBenchSnapshots()
+
+        expected = []
+        for i in xrange(6):
+            if i > 0:
+                self.changePages()
+            bench.storeVersionChangelog(self.connWrap, u"Version %i" % i)
+            expected.append(self.getCurrentState())
+
+        self.assertTrue(self.wikiData.hasVersioningData())
+        self.connWrap.syncCommit()
+        DbStructure.migrateLegacyVersioningData(self.connWrap)
+        self.connWrap.commit()
+        self.assertFalse(DbStructure.hasLegacyVersioningData(self.connWrap))
+
+        # Continue with snapshots
+        self.changePages()
+        self.wikiData.storeVersion(u"Version 6")
+        expected.append(self.getCurrentState())
+
+        self.assertEqual([description for id, description, created in
+                self.wikiData.getStoredVersions()],
+                [u"Version %i" % i for i in xrange(6, -1, -1)])
+        self.checkVersions(expected)
+
+    def testNonContiguousIds(self):
+        expected = []
+        for i in xrange(2):
+            if i > 0:
+                self.changePages()
+            self.wikiData.storeVersion(u"Version %i" % i)
+            expected.append(self.getCurrentState())
+
+        # Gap in ids, the second version gets id 10
+        self.assertEqual(self.getSnapshotIds(), [1, 2])
+        self.connWrap.execSql("update snapshots set id = 10 where id = 2")
+        self.connWrap.execSql("update snapshotpages set firstsnapshot = 10 "
+                "where firstsnapshot = 2")
+        self.connWrap.execSql("update snapshotpages set lastsnapshot = 10 "
+                "where lastsnapshot = 2")
+        self.connWrap.commit()
+
+        self.changePages()
+        self.wikiData.storeVersion(u"Version 2")
+        expected.append(self.getCurrentState())
+
+        self.assertEqual(self.getSnapshotIds(), [1, 10, 11])
+        self.checkVersions(expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
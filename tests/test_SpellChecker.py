@@ -0,0 +1,122 @@
+import testenv
+
+import sys, os.path, unittest, random
+
+sys.path.insert(0, os.path.join(testenv.MAIN_DIR, "extensions",
+        "wikidPadParser"))
+
+from pwiki import SpellChecker
+import WikidPadParser
+
+
+class _App(object):
+    def createWikiLanguageHelper(self, wikiLanguageName):
+        return WikidPadParser._TheHelper
+
+
+class _DocPage(object):
+    def getWikiLanguageName(self):
+        return "wikidpad_default_2_0"
+
+
+class _SpellCheckerSession(SpellChecker.SpellCheckerSession):
+    """
+    Session which knows a fixed set of words instead of using an
+    enchant dictionary
+    """
+    def __init__(self, knownWords):
+        self.currentDocPage = _DocPage()
+        self.knownWords = knownWords
+
+    def hasEnchantDict(self):
+        return True
+
+    def checkWord(self, spWord):
+        return spWord in self.knownWords
+
+
+_KNOWN_WORDS = (u"the", u"wiki", u"page", u"notes", u"meeting", u"done")
+_UNKNOWN_WORDS = (u"teh", u"wikki", u"paeg", u"nots", u"metting")
+
+
+def _nodeTuples(unknownWords):
+    return [(node.pos, node.getText()) for node in unknownWords.getChildren()]
+
+
+class BuildUnknownWordListTests(unittest.TestCase):
+    def setUp(self):
+        self.origGetApp = SpellChecker.getApp
+        SpellChecker.getApp = _App
+        self.session = _SpellCheckerSession(frozenset(_KNOWN_WORDS))
+
+    def tearDown(self):
+        SpellChecker.getApp = self.origGetApp
+
+    def assertIncrementalEqualsFull(self, baseText, text):
+        baseUnknownWords = self.session.buildUnknownWordList(baseText)
+        baseTuples = _nodeTuples(baseUnknownWords)
+
+        full = self.session.buildUnknownWordList(text)
+        incremental = self.session.buildUnknownWordList(text,
+                baseText=baseText, baseUnknownWords=baseUnknownWords)
+
+        self.assertEqual(_nodeTuples(incremental), _nodeTuples(full))
+        # Nodes of the base result are shared, so they must stay unchanged
+        self.assertEqual(_nodeTuples(baseUnknownWords), baseTuples)
+
+    def testFindsUnknownWords(self):
+        self.assertEqual(_nodeTuples(self.session.buildUnknownWordList(
+                u"the paeg\nwiki teh")), [(4, u"paeg"), (14, u"teh")])
+
+    def testInsert(self):
+        self.assertIncrementalEqualsFull(u"the wiki\nteh page\nnots",
+                u"the wiki\nteh wikki page\nnots")
+        self.assertIncrementalEqualsFull(u"teh", u"metting teh")
+        self.assertIncrementalEqualsFull(u"", u"teh paeg")
+
+    def testDelete(self):
+        self.assertIncrementalEqualsFull(u"the wiki\nteh wikki page\nnots",
+                u"the wiki\nteh page\nnots")
+        self.assertIncrementalEqualsFull(u"teh\nwikki\npaeg", u"teh\npaeg")
+        self.assertIncrementalEqualsFull(u"teh paeg", u"")
+
+    def testEditInsideWord(self):
+        # Known word becomes unknown and vice versa
+        self.assertIncrementalEqualsFull(u"nots page teh", u"notes page teh")
+        self.assertIncrementalEqualsFull(u"nots page teh", u"nots pag teh")
+
+    def testNewlineEdits(self):
+        # Split a word and join two words by newline edits
+        self.assertIncrementalEqualsFull(u"teh notes\npaeg",
+                u"teh no\ntes\npaeg")
+        self.assertIncrementalEqualsFull(u"teh no\ntes\npaeg",
+                u"teh notes\npaeg")
+        self.assertIncrementalEqualsFull(u"teh\npaeg", u"teh\n\n\npaeg")
+        self.assertIncrementalEqualsFull(u"teh\n\n\npaeg", u"teh\npaeg")
+        self.assertIncrementalEqualsFull(u"teh\npaeg\n", u"teh\npaeg")
+
+    def testRandomEdits(self):
+        rnd = random.Random(815)
+        words = _KNOWN_WORDS + _UNKNOWN_WORDS
+        pieces = words + (u" ", u"\n", u"e", u"t")
+
+        text = u" ".join(rnd.choice(words) for i in xrange(60))
+        for i in xrange(300):
+            pos = rnd.randint(0, len(text))
+            end = min(len(text), pos + rnd.randint(0, 15))
+            insert = u"".join(rnd.choice(pieces)
+                    for j in xrange(rnd.randint(0, 3)))
+            action = rnd.random()
+            if action < 0.33:
+                newText = text[:pos] + insert + text[pos:]
+            elif action < 0.66:
+                newText = text[:pos] + text[end:]
+            else:
+                newText = text[:pos] + insert + text[end:]
+
+            self.assertIncrementalEqualsFull(text, newText)
+            text = newText
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+import testenv
+
+import unittest, random
+
+from pwiki.StringOps import findChangedRegion, COMPACT_DIFF_ENGINES, \
+        getBinCompactForDiff, applyBinCompact, applyCompact, \
+        getCompactForDiffLines, _histogramMatchingBlocks
+
+
+def _randomEdit(rnd, text, alphabet):
+    """
+    Return text with a random insertion, deletion or replacement
+    """
+    pos = rnd.randint(0, len(text))
+    end = min(len(text), pos + rnd.randint(0, 12))
+    insert = u"".join(rnd.choice(alphabet) for i in xrange(rnd.randint(0, 12)))
+    action = rnd.random()
+    if action < 0.33:
+        return text[:pos] + insert + text[pos:]
+    elif action < 0.66:
+        return text[:pos] + text[end:]
+    else:
+        return text[:pos] + insert + text[end:]
+
+
+class FindChangedRegionTests(unittest.TestCase):
+    def assertRegion(self, a, b, expected):
+        self.assertEqual(findChangedRegion(a, b), expected)
+
+    def testEqual(self):
+        self.assertRegion(u"", u"", (0, 0, 0))
+        self.assertRegion(u"abc", u"abc", (3, 3, 3))
+
+    def testInsert(self):
+        self.assertRegion(u"abcdef", u"abcXYdef", (3, 3, 5))
+        self.assertRegion(u"abc", u"Xabc", (0, 0, 1))
+        self.assertRegion(u"abc", u"abcX", (3, 3, 4))
+        self.assertRegion(u"", u"abc", (0, 0, 3))
+
+    def testDelete(self):
+        self.assertRegion(u"abcXYdef", u"abcdef", (3, 5, 3))
+        self.assertRegion(u"abc", u"", (0, 3, 0))
+
+    def testReplace(self):
+        self.assertRegion(u"abcXdef", u"abcYZdef", (3, 4, 5))
+
+    def testNewlineEdits(self):
+        self.assertRegion(u"one two\nthree", u"one\n two\nthree", (3, 3, 4))
+        self.assertRegion(u"one\ntwo\nthree", u"one two\nthree", (3, 4, 4))
+        self.assertRegion(u"a\n\nb", u"a\nb", (2, 3, 2))
+
+    def testRepeatedCharacters(self):
+        # Prefix and suffix must not overlap
+        self.assertRegion(u"aaaa", u"aaaaa", (4, 4, 5))
+        self.assertRegion(u"aaaaa", u"aaa", (3, 5, 3))
+        self.assertRegion(u"abab", u"ab", (2, 4, 2))
+
+    def testBytestrings(self):
+        self.assertRegion("abc\x00def", "abc\x00\x00def", (4, 4, 5))
+
+    def testRandomEdits(self):
+        rnd = random.Random(4711)
+        alphabet = u"ab \n"
+        for i in xrange(2000):
+            a = u"".join(rnd.choice(alphabet)
+                    for j in xrange(rnd.randint(0, 40)))
+            b = _randomEdit(rnd, a, alphabet)
+            start, aEnd, bEnd = findChangedRegion(a, b)
+
+            self.assertTrue(0 <= start <= aEnd <= len(a))
+            self.assertTrue(start <= bEnd <= len(b))
+            self.assertEqual(a[:start] + b[start:bEnd] + a[aEnd:], b)
+
+            # Longest common prefix, then longest non-overlapping suffix
+            if start < min(len(a), len(b)):
+                self.assertNotEqual(a[start], b[start])
+            if aEnd > start and bEnd > start:
+                self.assertNotEqual(a[aEnd - 1], b[bEnd - 1])
+
+
+
+def _randomLines(rnd, count):
+    words = ["wiki", "page", "todo:", "[link]", "WikiWord", "the", "a",
+            "notes", "*bold*", "    *", "\t", "\xc3\xa4"]
+    return [" ".join(rnd.choice(words) for i in xrange(rnd.randint(0, 6)))
+            + rnd.choice(("\n", "\n", "\n", "\r\n"))
+            for j in xrange(count)]
+
+
+class HistogramMatchingBlocksTests(unittest.TestCase):
+    def assertValidBlocks(self, a, b, blocks):
+        prevI = prevJ = 0
+        for i, j, length in blocks:
+            self.assertTrue(length > 0)
+            self.assertTrue(i >= prevI and j >= prevJ)
+            self.assertEqual(a[i:i + length], b[j:j + length])
+            prevI = i + length
+            prevJ = j + length
+
+        self.assertTrue(prevI <= len(a) and prevJ <= len(b))
+
+    def testSimple(self):
+        self.assertEqual(_histogramMatchingBlocks([], []), [])
+        self.assertEqual(_histogramMatchingBlocks([1, 2], []), [])
+        self.assertEqual(_histogramMatchingBlocks([1, 2, 3], [1, 2, 3]),
+                [(0, 0, 3)])
+        self.assertEqual(_histogramMatchingBlocks([1, 2, 3, 4, 5],
+                [1, 2, 9, 4, 5]), [(0, 0, 2), (3, 3, 2)])
+        self.assertEqual(_histogramMatchingBlocks([1, 2, 3], [4, 5]), [])
+
+    def testPrefersRareLines(self):
+        # The frequent line 0 must not hide the match of unique line 7
+        a = [0, 0, 7, 0, 0, 1]
+        b = [2, 7, 0, 0, 0, 0, 0]
+        blocks = _histogramMatchingBlocks(a, b)
+        self.assertValidBlocks(a, b, blocks)
+        self.assertEqual(blocks, [(2, 1, 3)])
+
+    def testRandom(self):
+        rnd = random.Random(31)
+        for k in xrange(300):
+            a = [rnd.randint(0, 8) for i in xrange(rnd.randint(0, 40))]
+            b = list(a)
+            for e in xrange(rnd.randint(0, 5)):
+                pos = rnd.randint(0, len(b))
+                b[pos:pos + rnd.randint(0, 4)] = \
+                        [rnd.randint(0, 12) for i in xrange(rnd.randint(0, 4))]
+
+            self.assertValidBlocks(a, b, _histogramMatchingBlocks(a, b))
+
+
+class CompactDiffTests(unittest.TestCase):
+    def assertRoundTrip(self, a, b):
+        for engine in COMPACT_DIFF_ENGINES:
+            self.assertEqual(applyBinCompact(a,
+                    getBinCompactForDiff(a, b, engine)), b, engine)
+
+    def testEdgeCases(self):
+        self.assertRoundTrip("", "")
+        self.assertRoundTrip("", "abc\n")
+        self.assertRoundTrip("abc\n", "")
+        self.assertRoundTrip("abc", "abc")
+        self.assertRoundTrip("abc", "abc\n")
+        self.assertRoundTrip("a\r\nb\r\n", "a\nb\r\n")
+        self.assertRoundTrip("line\nline\nline\n", "line\nline\n")
+        self.assertRoundTrip("\x00\xff\n", "\xff\x00\n")
+
+    def testNoOpsForEqualStrings(self):
+        self.assertEqual(getCompactForDiffLines("a\nb\n", "a\nb\n"), [])
+
+    def testSmallChangeGivesSmallDiff(self):
+        lines = ["line %i\n" % i for i in xrange(1000)]
+        a = "".join(lines)
+        lines[500] = "line 500 changed\n"
+        b = "".join(lines)
+
+        ops = getCompactForDiffLines(a, b)
+        self.assertEqual(applyCompact(a, ops), b)
+        self.assertTrue(len(getBinCompactForDiff(a, b)) < 50)
+
+    def testLargeChangedRegion(self):
+        # Regions too large for byte-level refinement are replaced
+        rnd = random.Random(1)
+        a = "head\n" + "".join(_randomLines(rnd, 2000)) + "tail\n"
+        b = "head\n" + "".join(_randomLines(rnd, 2000)) + "tail\n"
+        self.assertRoundTrip(a, b)
+
+    def testRandomEdits(self):
+        rnd = random.Random(42)
+        for k in xrange(200):
+            lines = _randomLines(rnd, rnd.randint(0, 60))
+            a = "".join(lines)
+            for e in xrange(rnd.randint(0, 6)):
+                pos = rnd.randint(0, len(lines))
+                lines[pos:pos + rnd.randint(0, 5)] = \
+                        _randomLines(rnd, rnd.randint(0, 5))
+            b = "".join(lines)
+            if rnd.random() < 0.3:
+                # Change inside a line, maybe removing the last newline
+                pos = rnd.randint(0, len(b))
+                b = b[:pos] + "x" + b[pos + rnd.randint(0, 3):]
+
+            self.assertRoundTrip(a, b)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import testenv
+
+import unittest
+
+from pwiki.Utilities import LruCache
+
+
+class LruCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.evicted = []
+        self.cache = LruCache(4, lambda key, value:
+                self.evicted.append((key, value)))
+
+    def testPutGetPop(self):
+        cache = self.cache
+        self.assertTrue(cache.put("a", 1))
+        self.assertTrue(cache.put("b", 2))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("x", "default"), "default")
+        self.assertTrue("b" in cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.getSize(), 2)
+
+        self.assertEqual(cache.pop("b"), 2)
+        self.assertEqual(cache.pop("b", "default"), "default")
+        self.assertEqual(cache.getSize(), 1)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.getSize(), 0)
+        self.assertEqual(self.evicted, [])
+
+    def testReplaceValue(self):
+        self.cache.put("a", 1, 3)
+        self.cache.put("a", 2, 2)
+        self.assertEqual(self.cache.get("a"), 2)
+        self.assertEqual(self.cache.getSize(), 2)
+        self.assertEqual(self.evicted, [])
+
+    def testEvictsLeastRecentlyUsedDownToLowWater(self):
+        cache = self.cache
+        for key in "abcd":
+            cache.put(key, key.upper())
+        # Mark "a" as recently used
+        cache.get("a")
+
+        # Size 5 exceeds 4, evict down to int(4 * 0.75) == 3
+        cache.put("e", "E")
+        self.assertEqual(self.evicted, [("b", "B"), ("c", "C")])
+        self.assertEqual(sorted(cache.entries), ["a", "d", "e"])
+        self.assertEqual(cache.getSize(), 3)
+
+    def testSizes(self):
+        cache = self.cache
+        cache.put("a", "A", 2)
+        cache.put("b", "B", 2)
+        self.assertEqual(self.evicted, [])
+
+        # Entry put last is kept even if it alone exceeds low water
+        cache.put("c", "C", 4)
+        self.assertEqual(self.evicted, [("a", "A"), ("b", "B")])
+        self.assertEqual(list(cache.entries), ["c"])
+
+        # Larger than the whole cache
+        self.assertFalse(cache.put("d", "D", 5))
+        self.assertFalse("d" in cache)
+
+    def testSetSize(self):
+        cache = self.cache
+        value = ["grows"]
+        cache.put("a", "A")
+        cache.put("b", value)
+
+        # Ignored if the entry holds another object
+        cache.setSize("b", 3, ["other"])
+        self.assertEqual(cache.getSize(), 2)
+        cache.setSize("missing", 3)
+        self.assertEqual(cache.getSize(), 2)
+
+        cache.setSize("b", 3, value)
+        self.assertEqual(cache.getSize(), 4)
+        cache.setSize("b", 4)
+        self.assertEqual(self.evicted, [("a", "A")])
+        self.assertEqual(cache.getSize(), 4)
+
+    def testDisabled(self):
+        cache = LruCache(0)
+        self.assertFalse(cache.isEnabled())
+        self.assertFalse(cache.put("a", 1))
+        self.assertEqual(cache.get("a"), None)
+        self.assertTrue(LruCache(1).isEnabled())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,399 @@
+import testenv
+
+import unittest, random
+from struct import pack
+
+from pwiki.WikiExceptions import InternalError
+from pwiki.timeView import Versioning
+from pwiki.timeView.Versioning import VersionOverview, VersionEntry
+
+
+def _editedLines(rnd, lines):
+    """
+    Return copy of list lines with a few random lines changed, inserted
+    or deleted
+    """
+    lines = list(lines)
+    for i in xrange(rnd.randint(1, 4)):
+        pos = rnd.randint(0, len(lines))
+        op = rnd.randint(0, 2)
+        if op == 0 or not lines:
+            lines.insert(pos, u"inserted %i\n" % rnd.randint(0, 10000))
+        elif op == 1:
+            lines[min(pos, len(lines) - 1)] = u"changed %i\n" % \
+                    rnd.randint(0, 10000)
+        else:
+            del lines[min(pos, len(lines) - 1)]
+
+    return lines
+
+
+class _VersioningTestBase(testenv.WikiTestCase):
+    def getPages(self):
+        return [(u"VersionedPage", u"Text\n")]
+
+    def setUp(self):
+        testenv.WikiTestCase.setUp(self)
+        self.page = self.wikiDocument.getWikiPage(u"VersionedPage")
+        self.rnd = random.Random(32)
+
+    def setCompleteSteps(self, steps):
+        self.wikiDocument.getWikiConfig().set("main",
+                "versioning_completeSteps", unicode(steps))
+
+    def addVersions(self, overview, count, lines=None):
+        """
+        Add count versions of random edits to overview, returns dictionary
+        {versionNumber: content}
+        """
+        if lines is None:
+            lines = [u"line %i\n" % i for i in xrange(200)]
+
+        contents = {}
+        for i in xrange(count):
+            lines = _editedLines(self.rnd, lines)
+            content = u"".join(lines)
+            entry = VersionEntry(u"", u"Version %i" % i)
+            overview.addVersion(content, entry)
+            contents[entry.versionNumber] = content
+
+        overview.writeOverview()
+        return contents
+
+    def reopen(self, overview):
+        result = VersionOverview(self.wikiDocument,
+                unifiedBasePageName=overview.unifiedBasePageName)
+        result.readOverview()
+        return result
+
+
+
+class VersionReconstructionTests(_VersioningTestBase):
+    def testRandomAccess(self):
+        overview = self.page.getVersionOverview()
+        contents = self.addVersions(overview, 120)
+
+        overview = self.reopen(overview)
+        versionNumbers = contents.keys()
+        self.rnd.shuffle(versionNumbers)
+        for versionNumber in versionNumbers:
+            self.assertEqual(overview.getVersionContent(versionNumber),
+                    contents[versionNumber])
+
+        self.assertEqual(overview.getVersionContent(-1),
+                contents[max(contents)])
+
+    def testAdjacentVersionNeedsOnePacket(self):
+        overview = self.page.getVersionOverview()
+        contents = self.addVersions(overview, 60)
+        overview = self.reopen(overview)
+
+        queries = []
+        retrieveDataBlocks = self.wikiDocument.retrieveDataBlocks
+        def recordingRetrieve(unifNames, default=""):
+            queries.append(list(unifNames))
+            return retrieveDataBlocks(unifNames, default=default)
+
+        self.wikiDocument.retrieveDataBlocks = recordingRetrieve
+        try:
+            versionNumbers = sorted(contents)
+            overview.getVersionContent(versionNumbers[40])
+            # All packets are fetched with one query
+            self.assertEqual(len(queries), 1)
+            del queries[:]
+
+            for versionNumber in reversed(versionNumbers[:40]):
+                self.assertEqual(overview.getVersionContent(versionNumber),
+                        contents[versionNumber])
+            self.assertTrue(all(len(names) <= 1 for names in queries))
+        finally:
+            del self.wikiDocument.retrieveDataBlocks
+
+    def testCompleteStepsIsUpperBound(self):
+        self.setCompleteSteps(5)
+        overview = self.page.getVersionOverview()
+        self.addVersions(overview, 40)
+
+        run = 0
+        for entry in overview.getVersionEntries():
+            if entry.contentDifferencing == u"complete":
+                run = 0
+            else:
+                run += 1
+                self.assertTrue(run < 5)
+
+    def testKeyframesForLargeChanges(self):
+        self.setCompleteSteps(0)
+        overview = self.page.getVersionOverview()
+        contents = {}
+        lines = [u"line %i\n" % i for i in xrange(100)]
+        for i in xrange(30):
+            # Each reverse diff is smaller than the content but a few of
+            # them together are larger
+            for j in self.rnd.sample(xrange(len(lines)), 30):
+                lines[j] = u"changed %i %i\n" % (i, j)
+            content = u"".join(lines)
+            entry = VersionEntry(u"", None)
+            overview.addVersion(content, entry)
+            contents[entry.versionNumber] = content
+
+        entries = overview.getVersionEntries()
+        self.assertTrue(sum(entry.contentDifferencing == u"complete"
+                for entry in entries) > 2)
+
+        for entry in entries:
+            if entry.contentDifferencing == u"revdiff":
+                self.assertTrue(entry.packetSize > 0)
+            else:
+                self.assertEqual(entry.packetSize, None)
+
+        overview.writeOverview()
+        overview = self.reopen(overview)
+        for versionNumber, content in contents.iteritems():
+            self.assertEqual(overview.getVersionContent(versionNumber),
+                    content)
+
+    def testDeleteVersions(self):
+        overview = self.page.getVersionOverview()
+        contents = self.addVersions(overview, 30)
+        versionNumbers = sorted(contents)
+
+        overview.deleteVersion(versionNumbers[0])
+        overview.deleteVersion(-1)
+        overview.deleteVersion(-1)
+        overview.writeOverview()
+
+        overview = self.reopen(overview)
+        self.assertEqual([entry.versionNumber for entry in
+                overview.getVersionEntries()], versionNumbers[1:-2])
+        for versionNumber in versionNumbers[1:-2]:
+            self.assertEqual(overview.getVersionContent(versionNumber),
+                    contents[versionNumber])
+
+    def testMissingPacket(self):
+        overview = self.page.getVersionOverview()
+        contents = self.addVersions(overview, 5)
+        versionNumber = min(contents)
+        self.wikiDocument.deleteDataBlock(
+                overview._getPacketUnifName(versionNumber))
+
+        overview = self.reopen(overview)
+        self.assertRaises(InternalError, overview.getVersionContent,
+                versionNumber)
+
+
+
+class OriginalSqliteVersionReconstructionTests(VersionReconstructionTests):
+    DB_TYPE = "original_sqlite"
+
+
+
+class _RecordingStore(object):
+    """
+    Replaces storeDataBlock() and deleteDataBlock() of a wiki document
+    to record the names of written and deleted datablocks
+    """
+    def __init__(self, wikiDocument):
+        self.wikiDocument = wikiDocument
+        self.stored = []
+        self.deleted = []
+        self.origStore = wikiDocument.storeDataBlock
+        self.origDelete = wikiDocument.deleteDataBlock
+        wikiDocument.storeDataBlock = self.storeDataBlock
+        wikiDocument.deleteDataBlock = self.deleteDataBlock
+
+    def storeDataBlock(self, unifName, newdata, storeHint=None):
+        self.stored.append(unifName)
+        return self.origStore(unifName, newdata, storeHint=storeHint)
+
+    def deleteDataBlock(self, unifName):
+        self.deleted.append(unifName)
+        return self.origDelete(unifName)
+
+    def clear(self):
+        del self.stored[:]
+        del self.deleted[:]
+
+    def close(self):
+        del self.wikiDocument.storeDataBlock
+        del self.wikiDocument.deleteDataBlock
+
+
+
+class OverviewStorageTests(_VersioningTestBase):
+    def getOverviewBlockNames(self):
+        return sorted(self.wikiDocument.getDataBlockUnifNamesStartingWith(
+                u"versioning/overview"))
+
+    def assertSameEntries(self, left, right):
+        def entryData(overview):
+            return [(e.versionNumber, e.creationTimeStamp, e.description,
+                    e.contentDifferencing, e.contentEncoding, e.packetSize)
+                    for e in overview.getVersionEntries()]
+
+        self.assertEqual(entryData(left), entryData(right))
+
+    def testRoundTrip(self):
+        overview = self.page.getVersionOverview()
+        self.addVersions(overview, 150)
+        overview.getVersionEntries()[3].description = u"\xe4\u20ac desc"
+        overview.getVersionEntries()[4].description = None
+        overview._markChunkChanged(0)
+        overview.writeOverview()
+
+        self.assertSameEntries(self.reopen(overview), overview)
+        self.assertEqual(self.getOverviewBlockNames(), [
+                u"versioning/overview/wikipage/VersionedPage",
+                u"versioning/overviewchunk/0/wikipage/VersionedPage",
+                u"versioning/overviewchunk/1/wikipage/VersionedPage",
+                u"versioning/overviewchunk/2/wikipage/VersionedPage"])
+
+    def testAddVersionWritesLastChunks(self):
+        overview = self.page.getVersionOverview()
+        self.addVersions(overview, Versioning.OVERVIEW_CHUNK_SIZE * 2 - 1)
+
+        recorder = _RecordingStore(self.wikiDocument)
+        try:
+            # First version of a new chunk, the previous head becomes
+            # differential
+            content = overview.getVersionContent(-1) + u"Text 1\n"
+            overview.addVersion(content, VersionEntry(u""))
+            self.assertEqual(overview.getVersionEntries()[-2]
+                    .contentDifferencing, u"revdiff")
+            recorder.clear()
+            overview.writeOverview()
+            self.assertEqual(sorted(recorder.stored), [
+                    u"versioning/overview/wikipage/VersionedPage",
+                    u"versioning/overviewchunk/1/wikipage/VersionedPage",
+                    u"versioning/overviewchunk/2/wikipage/VersionedPage"])
+
+            # New head and previous head are in the same chunk
+            overview.addVersion(content + u"Text 2\n", VersionEntry(u""))
+            recorder.clear()
+            overview.writeOverview()
+            self.assertEqual(recorder.stored,
+                    [u"versioning/overviewchunk/2/wikipage/VersionedPage"])
+
+            # Nothing changed
+            recorder.clear()
+            overview.writeOverview()
+            self.assertEqual(recorder.stored, [])
+        finally:
+            recorder.close()
+
+        self.assertSameEntries(self.reopen(overview), overview)
+
+    def testDeletingRemovesEmptyChunks(self):
+        overview = self.page.getVersionOverview()
+        self.addVersions(overview, Versioning.OVERVIEW_CHUNK_SIZE + 2)
+
+        for i in xrange(Versioning.OVERVIEW_CHUNK_SIZE - 1):
+            overview.deleteVersion(overview.getVersionEntries()[0]
+                    .versionNumber)
+        overview.writeOverview()
+
+        self.assertEqual(self.getOverviewBlockNames(), [
+                u"versioning/overview/wikipage/VersionedPage",
+                u"versioning/overviewchunk/1/wikipage/VersionedPage"])
+        self.assertSameEntries(self.reopen(overview), overview)
+
+    def testReadsOldFormats(self):
+        overview = self.page.getVersionOverview()
+        contents = self.addVersions(overview, 70)
+        unifName = overview.getUnifiedName()
+
+        def oldBinFormat(overview):
+            # Binary format version 0 with records in main block
+            return Versioning.OVERVIEW_BIN_MAGIC + pack(">BBB", 0, 0, 0) + \
+                    "".join(entry.serializeOverviewToBin()
+                    for entry in overview.getVersionEntries())
+
+        def xmlFormat(overview):
+            return VersionOverview.overviewBytesToXmlBytes(self.wikiDocument,
+                    self.wikiDocument.retrieveDataBlock(unifName),
+                    overview.unifiedBasePageName)
+
+        for formatFct in (oldBinFormat, xmlFormat):
+            overview = self.reopen(overview)
+            self.wikiDocument.storeDataBlock(unifName, formatFct(overview))
+
+            oldOverview = self.reopen(overview)
+            entries = oldOverview.getVersionEntries()
+            self.assertEqual(len(entries), 70)
+            for entry in (entries[0], entries[34], entries[-1]):
+                self.assertEqual(oldOverview.getVersionContent(
+                        entry.versionNumber), contents[entry.versionNumber])
+
+            # Converted to chunks on next write, unused chunks are removed
+            oldOverview.deleteVersion(-1)
+            oldOverview.deleteVersion(-1)
+            oldOverview.writeOverview()
+            self.assertTrue(self.wikiDocument.retrieveDataBlock(unifName)
+                    .startswith(Versioning.OVERVIEW_BIN_HEADER))
+            self.assertEqual(self.getOverviewBlockNames(), [
+                    u"versioning/overview/wikipage/VersionedPage",
+                    u"versioning/overviewchunk/0/wikipage/VersionedPage",
+                    u"versioning/overviewchunk/1/wikipage/VersionedPage"])
+            self.assertSameEntries(self.reopen(overview), oldOverview)
+
+            # Back to 70 versions for the next format
+            for i in xrange(2):
+                entry = VersionEntry(u"")
+                oldOverview.addVersion(u"Text %i\n" % i, entry)
+                contents[entry.versionNumber] = u"Text %i\n" % i
+            oldOverview.writeOverview()
+
+        # XML keeps only whole seconds
+        overview = self.reopen(overview)
+        for entry in overview.getVersionEntries():
+            entry.creationTimeStamp = int(entry.creationTimeStamp)
+        xmlOverview = VersionOverview(self.wikiDocument,
+                unifiedBasePageName=overview.unifiedBasePageName)
+        xmlOverview.readOverviewFromBytes(overview.serializeToXmlBytes())
+        self.assertSameEntries(xmlOverview, overview)
+
+    def testRenameAndDelete(self):
+        overview = self.page.getVersionOverview()
+        contents = self.addVersions(overview, 70)
+
+        overview.renameTo(u"wikipage/Renamed")
+        self.assertEqual(self.getOverviewBlockNames(), [
+                u"versioning/overview/wikipage/Renamed",
+                u"versioning/overviewchunk/0/wikipage/Renamed",
+                u"versioning/overviewchunk/1/wikipage/Renamed"])
+
+        overview = VersionOverview(self.wikiDocument,
+                unifiedBasePageName=u"wikipage/Renamed")
+        overview.readOverview()
+        self.assertEqual(overview.getVersionContent(70), contents[70])
+
+        overview.delete()
+        self.assertEqual(self.getOverviewBlockNames(), [])
+        self.assertEqual(self.wikiDocument.getDataBlockUnifNamesStartingWith(
+                u"versioning/packet/"), [])
+
+
+
+class RetrieveDataBlocksTests(testenv.WikiTestCase):
+    def testRetrieveDataBlocks(self):
+        wikiDocument = self.wikiDocument
+        names = [u"test/block%i" % i for i in xrange(1200)]
+        for i, name in enumerate(names):
+            if i % 3:
+                wikiDocument.storeDataBlock(name, "data %i" % i)
+
+        result = wikiDocument.retrieveDataBlocks(names + [u"test/missing"])
+        expected = dict((name, wikiDocument.retrieveDataBlock(name, None))
+                for name in names)
+        expected[u"test/missing"] = None
+        self.assertEqual(result, expected)
+        self.assertEqual(result[names[1]], "data 1")
+
+
+
+class OriginalSqliteRetrieveDataBlocksTests(RetrieveDataBlocksTests):
+    DB_TYPE = "original_sqlite"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import testenv
+
+import unittest
+
+from pwiki.WikiTreeCtrl import WikiTreeDataProvider
+
+
+class _WikiData(object):
+    """
+    Answers getChildRelationshipTargetsForWords() from a dictionary
+    {word: list of (relation, pageName)} and records the queried words
+    """
+    def __init__(self, relations):
+        self.relations = relations
+        self.queries = []
+
+    def getChildRelationshipTargetsForWords(self, words):
+        self.queries.append(sorted(words))
+        return dict((word, self.relations.get(word, [])) for word in words)
+
+
+class _MainControl(object):
+    def __init__(self, wikiData):
+        self.wikiData = wikiData
+
+    def getWikiData(self):
+        return self.wikiData
+
+
+class _TreeCtrl(object):
+    def __init__(self, wikiData):
+        self.pWiki = _MainControl(wikiData)
+
+
+class WikiTreeDataProviderTests(unittest.TestCase):
+    def setUp(self):
+        self.wikiData = _WikiData({
+                u"Root": [(u"A", u"A"), (u"B", u"B"), (u"Undefined", None)],
+                u"A": [(u"A", u"A"), (u"AliasOfB", u"B")],
+                u"B": [(u"Undefined", None)],
+                u"C": [(u"Root", u"Root")],
+            })
+        self.provider = WikiTreeDataProvider(_TreeCtrl(self.wikiData))
+
+    def testPrefetchQueriesBatchOnce(self):
+        provider = self.provider
+        provider.prefetchChildrenOf(u"Root", [u"A", u"B", u"Undefined"])
+        self.assertEqual(self.wikiData.queries, [[u"Root"], [u"A", u"B"]])
+
+        self.assertEqual(provider.getChildRelationTargets(u"A"),
+                ((u"A", u"A"), (u"AliasOfB", u"B")))
+        provider.prefetch([u"A", u"B", u"Root"])
+        self.assertEqual(len(self.wikiData.queries), 2)
+
+        # Page without children is cached, too
+        self.assertEqual(provider.getChildRelationTargets(u"Leaf"), ())
+        self.assertEqual(provider.getChildRelationTargets(u"Leaf"), ())
+        self.assertEqual(self.wikiData.queries[2:], [[u"Leaf"]])
+
+    def testHasValidChildren(self):
+        provider = self.provider
+        self.assertTrue(provider.hasValidChildren(u"Root"))
+        self.assertTrue(provider.hasValidChildren(u"B"))
+        self.assertFalse(provider.hasValidChildren(u"B", existingonly=True))
+        self.assertFalse(provider.hasValidChildren(u"Leaf"))
+
+        # Self-reference doesn't count
+        self.assertTrue(provider.hasValidChildren(u"A"))
+        self.assertFalse(provider.hasValidChildren(u"A",
+                excludeSet=frozenset((u"AliasOfB",))))
+        self.assertFalse(provider.hasValidChildren(u"C",
+                excludeSet=frozenset((u"Root",))))
+
+    def testInvalidateWord(self):
+        provider = self.provider
+        provider.prefetch([u"Root", u"A", u"B", u"C"])
+        del self.wikiData.queries[:]
+
+        # Parents referring to B by name or alias and B itself are forgotten
+        provider.invalidateWord(u"B")
+        self.assertEqual(sorted(provider.childRelations), [u"C"])
+
+        provider.prefetch([u"Root", u"A", u"B", u"C"])
+        self.assertEqual(self.wikiData.queries, [[u"A", u"B", u"Root"]])
+
+        # Page which didn't exist yet, referred to by a link term only
+        provider.invalidateWord(u"Undefined")
+        self.assertEqual(sorted(provider.childRelations), [u"A", u"C"])
+
+        provider.invalidateWord(u"NewPage", aliases=(u"AliasOfB",))
+        self.assertEqual(sorted(provider.childRelations), [u"C"])
+        self.assertEqual(provider.relationParents, {u"Root": set([u"C"])})
+        self.assertEqual(provider.targetParents, {u"Root": set([u"C"])})
+
+    def testClear(self):
+        self.provider.prefetch([u"Root"])
+        self.provider.clear()
+        self.assertEqual(self.provider.childRelations, {})
+        self.provider.prefetch([u"Root"])
+        self.assertEqual(len(self.wikiData.queries), 2)
+
+
+
+_EXTRA_PAGES = [
+    (u"AliasedPage", u"++ Aliased page\n\n[alias: OtherName]\n"),
+    (u"LinkingPage", u"++ Linking page\n\n[OtherName] [Not defined yet] "
+            u"LinkingPage AliasedPage\n"),
+]
+
+
+class ChildRelationshipTargetsTests(testenv.WikiTestCase):
+    """
+    Compares WikiData.getChildRelationshipTargetsForWords() with the
+    relations and link resolution of single pages.
+    """
+    def getPages(self):
+        return testenv.generatePages(pages=30, journalPages=2) + \
+                _EXTRA_PAGES
+
+    def testChildRelationshipTargets(self):
+        wikiDocument = self.wikiDocument
+        wikiData = wikiDocument.getWikiData()
+        words = [name for name, text in self.getPages()] + \
+                [u"Not defined yet"]
+        result = wikiData.getChildRelationshipTargetsForWords(words)
+
+        self.assertEqual(sorted(result), sorted(words))
+        self.assertEqual(result[u"Not defined yet"], [])
+        self.assertEqual(sorted(result[u"LinkingPage"]), [
+                (u"AliasedPage", u"AliasedPage"),
+                (u"LinkingPage", u"LinkingPage"),
+                (u"Not defined yet", None),
+                (u"OtherName", u"AliasedPage")])
+
+        for word in words:
+            expected = sorted((relation,
+                    wikiDocument.getWikiPageNameForLinkTerm(relation))
+                    for relation in wikiData.getChildRelationships(word))
+            self.assertEqual(sorted(result[word]), expected, word)
+
+
+
+class OriginalSqliteChildRelationshipTargetsTests(
+        ChildRelationshipTargetsTests):
+    DB_TYPE = "original_sqlite"
+
+
+if __name__ == "__main__":
+    unittest.main()
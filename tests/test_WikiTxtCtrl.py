@@ -0,0 +1,132 @@
+import testenv
+
+import unittest, random
+
+import wx
+
+from pwiki.Utilities import DUMBTHREADSTOP
+from pwiki.EnhancedScintillaControl import bytelenSct_utf8
+from pwiki.WikiTxtCtrl import WikiTxtCtrl
+
+
+class _Presenter(object):
+    def __init__(self, wikiDocument):
+        self.wikiDocument = wikiDocument
+
+    def getWikiDocument(self):
+        return self.wikiDocument
+
+
+class _StylingTxtCtrl(WikiTxtCtrl):
+    """
+    Editor without window which only provides what styling needs and
+    records the chunks sent to the main thread
+    """
+    STYLING_CHUNK_SIZE = 100
+
+    def __init__(self, wikiDocument, docPage):
+        # WikiTxtCtrl.__init__() isn't called, it would create the window
+        self.presenter = _Presenter(wikiDocument)
+        self.bytelenSct = bytelenSct_utf8
+        self.wikiLanguageHelper = docPage.createWikiLanguageHelper()
+        self.optionColorizeSearchFragments = False
+        self.stylingPriorityBytePos = 0
+        self.clearStylingCache()
+        self.appliedChunks = []
+
+    def _applyStylingChunk(self, thread, startBytePos, stylebytes):
+        self.appliedChunks.append((startBytePos, stylebytes))
+
+
+def _createPageText(rnd):
+    parts = []
+    for i in xrange(60):
+        parts.append(rnd.choice((u"+ Heading \xe4\u20ac %i\n" % i,
+                u"Text with *bold \u20ac words* and TopicAPage links\n",
+                u"todo: something \xe4 to do\n",
+                u"[:toc:]\n",
+                u"\n",
+                u"Long paragraph " + u"plain \xe4 text " * rnd.randint(1, 30) +
+                u"\n",
+                u"[attribute: value]\n",
+                u"_italics over\nlines_ and [topic b notes]\n")))
+    return u"".join(parts)
+
+
+class ChunkedStylingTests(testenv.WikiTestCase):
+    def getPages(self):
+        return testenv.generatePages(pages=5, journalPages=0) + \
+                [(u"HugePage", self.text)]
+
+    def setUp(self):
+        self.rnd = random.Random(43)
+        self.text = _createPageText(self.rnd)
+        testenv.WikiTestCase.setUp(self)
+        self.docPage = self.wikiDocument.getWikiPage(u"HugePage")
+        self.pageAst = self.docPage.getLivePageAst()
+        self.ctrl = _StylingTxtCtrl(self.wikiDocument, self.docPage)
+
+        self.origCallAfter = wx.CallAfter
+        wx.CallAfter = lambda fct, *args: fct(*args)
+
+    def tearDown(self):
+        wx.CallAfter = self.origCallAfter
+        testenv.WikiTestCase.tearDown(self)
+
+    def testRangeIsPartOfWholeStyling(self):
+        text = self.text
+        full = self.ctrl.processTokens(text, self.pageAst, DUMBTHREADSTOP)
+        self.assertEqual(len(full), bytelenSct_utf8(text))
+
+        for i in xrange(50):
+            start = self.rnd.randint(0, len(text))
+            end = self.rnd.randint(start, len(text))
+            startByte = bytelenSct_utf8(text[:start])
+            endByte = startByte + bytelenSct_utf8(text[start:end])
+            self.assertEqual(self.ctrl.processTokens(text, self.pageAst,
+                    DUMBTHREADSTOP, start, end), full[startByte:endByte],
+                    (start, end))
+
+    def testChunksEqualWholeStyling(self):
+        text = self.text
+        full = self.ctrl.processTokens(text, self.pageAst, DUMBTHREADSTOP)
+        chunkSize = self.ctrl.STYLING_CHUNK_SIZE
+        chunkCount = (len(text) + chunkSize - 1) // chunkSize
+        self.assertTrue(chunkCount > 10)
+
+        for priorityChunk in (0, 3, chunkCount - 1):
+            self.ctrl.appliedChunks = []
+            self.ctrl.stylingPriorityBytePos = bytelenSct_utf8(
+                    text[:priorityChunk * chunkSize]) + 1
+
+            self.assertEqual(self.ctrl.processTokensInChunks(text,
+                    self.pageAst, DUMBTHREADSTOP), full)
+
+            # Chunk with visible part first, then the ones after it, then
+            # those before it
+            expectedOrder = range(priorityChunk, chunkCount) + \
+                    range(priorityChunk)
+            expected = []
+            for chunk in expectedOrder:
+                startByte = bytelenSct_utf8(text[:chunk * chunkSize])
+                endByte = bytelenSct_utf8(text[:(chunk + 1) * chunkSize])
+                expected.append((startByte, full[startByte:endByte]))
+            self.assertEqual(self.ctrl.appliedChunks, expected)
+
+    def testEmptyText(self):
+        pageAst = self.docPage.parseTextInContext(u"")
+        self.assertEqual(self.ctrl.processTokensInChunks(u"", pageAst,
+                DUMBTHREADSTOP), "")
+        self.assertEqual(self.ctrl.appliedChunks, [(0, "")])
+
+    def testIsByteRangeStyled(self):
+        self.ctrl.styledByteRanges = [(50, 80), (0, 20), (20, 30), (70, 100)]
+        for start, end, expected in ((0, 30, True), (5, 25, True),
+                (25, 35, False), (50, 100, True), (60, 90, True),
+                (29, 51, False), (95, 101, False), (40, 40, True)):
+            self.assertEqual(self.ctrl._isByteRangeStyled(start, end),
+                    expected, (start, end))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import testenv
+
+import unittest
+
+from pwiki.timeView import WikiWideHistory
+
+
+class WikiWideHistoryTests(testenv.WikiTestCase):
+    def getPages(self):
+        return [(u"FirstPage", u"Text\n"), (u"SecondPage", u"Text\n")]
+
+    def setUp(self):
+        testenv.WikiTestCase.setUp(self)
+        self.history = self.wikiDocument.getWikiWideHistory()
+
+        self.stored = []
+        storeDataBlock = self.wikiDocument.storeDataBlock
+        def recordingStore(unifName, newdata, storeHint=None):
+            self.stored.append(unifName)
+            return storeDataBlock(unifName, newdata, storeHint=storeHint)
+        self.wikiDocument.storeDataBlock = recordingStore
+
+    def tearDown(self):
+        del self.wikiDocument.storeDataBlock
+        testenv.WikiTestCase.tearDown(self)
+
+    def visit(self, *words):
+        for word in words:
+            self.wikiDocument.getWikiPage(word).informVisited()
+
+    def getPageNames(self, history):
+        return [entry.getUnifiedPageName()
+                for entry in history.getHistoryEntries()]
+
+    def getLogNames(self):
+        return sorted(self.wikiDocument.getDataBlockUnifNamesStartingWith(
+                WikiWideHistory.HISTORY_LOG_PREFIX))
+
+    def reread(self):
+        history = WikiWideHistory.WikiWideHistory(self.wikiDocument)
+        try:
+            history.readOverview()
+        finally:
+            history.close()
+        return history
+
+    def testWritesOnlyIfModified(self):
+        self.visit(u"FirstPage", u"SecondPage", u"FirstPage")
+        self.assertEqual(self.getPageNames(self.history), [
+                u"wikipage/FirstPage", u"wikipage/SecondPage",
+                u"wikipage/FirstPage"])
+
+        self.history.writeOverview()
+        self.assertEqual(self.stored, [u"wikiwidehistory/log/0"])
+        self.history.writeOverview()
+        self.assertEqual(self.stored, [u"wikiwidehistory/log/0"])
+
+        reread = self.reread()
+        self.assertEqual(self.getPageNames(reread),
+                self.getPageNames(self.history))
+        self.assertEqual([e.visitedTimeStamp for e in
+                reread.getHistoryEntries()], [e.visitedTimeStamp for e in
+                self.history.getHistoryEntries()])
+        self.assertFalse(reread.modified)
+
+    def testAppendsNewEntries(self):
+        self.visit(u"FirstPage")
+        self.history.writeOverview()
+        self.visit(u"SecondPage", u"FirstPage")
+        self.history.writeOverview()
+        self.assertEqual(self.stored, [u"wikiwidehistory/log/0",
+                u"wikiwidehistory/log/1"])
+
+        # Second log datablock only contains the new entries
+        self.assertEqual(self.wikiDocument.retrieveDataBlock(
+                u"wikiwidehistory/log/1"), WikiWideHistory.HISTORY_BIN_HEADER +
+                "".join(entry.serializeToBin() for entry in
+                self.history.getHistoryEntries()[1:]))
+
+        # History read again appends to the existing log
+        history = WikiWideHistory.WikiWideHistory(self.wikiDocument)
+        self.addCleanup(history.close)
+        history.readOverview()
+        self.visit(u"SecondPage")
+        history.writeOverview()
+        self.assertEqual(self.stored[-1], u"wikiwidehistory/log/2")
+        self.assertEqual(self.getPageNames(self.reread()), [
+                u"wikipage/FirstPage", u"wikipage/SecondPage",
+                u"wikipage/FirstPage", u"wikipage/SecondPage"])
+
+    def testCompaction(self):
+        origCount = WikiWideHistory.HISTORY_LOG_COMPACT_COUNT
+        WikiWideHistory.HISTORY_LOG_COMPACT_COUNT = 3
+        try:
+            for i in xrange(4):
+                self.visit(u"FirstPage")
+                self.history.writeOverview()
+        finally:
+            WikiWideHistory.HISTORY_LOG_COMPACT_COUNT = origCount
+
+        self.assertEqual(self.stored[-1], u"wikiwidehistory")
+        self.assertEqual(self.getLogNames(), [])
+        self.assertEqual(self.getPageNames(self.reread()),
+                [u"wikipage/FirstPage"] * 4)
+
+    def testRename(self):
+        self.visit(u"FirstPage", u"SecondPage")
+        self.history.writeOverview()
+
+        self.wikiDocument.renameWikiWord(u"FirstPage", u"Renamed", False)
+        testenv.waitForBackgroundJobs(self.wikiDocument)
+
+        self.assertTrue(self.history.modified)
+        self.history.writeOverview()
+        self.assertEqual(self.getLogNames(), [])
+        self.assertEqual(self.getPageNames(self.reread()), [
+                u"wikipage/Renamed", u"wikipage/SecondPage"])
+
+    def testLimit(self):
+        self.wikiDocument.getWikiConfig().set("main",
+                "wikiWideHistory_maxEntries", u"3")
+        self.visit(u"FirstPage", u"SecondPage", u"FirstPage", u"SecondPage")
+        self.assertEqual(len(self.history.getHistoryEntries()), 3)
+        self.history.writeOverview()
+        self.assertEqual(self.getPageNames(self.reread()), [
+                u"wikipage/SecondPage", u"wikipage/FirstPage",
+                u"wikipage/SecondPage"])
+
+        self.history.clearAll()
+        self.history.writeOverview()
+        self.assertEqual(self.wikiDocument.retrieveDataBlock(
+                u"wikiwidehistory", None), None)
+        self.assertEqual(self.getLogNames(), [])
+
+    def testReadsXml(self):
+        self.visit(u"FirstPage", u"SecondPage")
+        for entry in self.history.getHistoryEntries():
+            entry.visitedTimeStamp = int(entry.visitedTimeStamp)
+
+        from pwiki.rtlibRepl import minidom
+        xmlDoc = minidom.getDOMImplementation().createDocument(None, None,
+                None)
+        xmlDoc.appendChild(self.history.serializeToXmlProd(xmlDoc))
+        self.wikiDocument.storeDataBlock(u"wikiwidehistory",
+                xmlDoc.toxml("utf-8"))
+
+        reread = self.reread()
+        self.assertEqual(self.getPageNames(reread),
+                self.getPageNames(self.history))
+        self.assertEqual([e.visitedTimeStamp for e in
+                reread.getHistoryEntries()], [e.visitedTimeStamp for e in
+                self.history.getHistoryEntries()])
+
+        # Converted to binary format on next write
+        self.assertTrue(reread.modified)
+        reread.writeOverview()
+        self.assertTrue(self.wikiDocument.retrieveDataBlock(u"wikiwidehistory")
+                .startswith(WikiWideHistory.HISTORY_BIN_HEADER))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+"""
+Common setup for the unit tests. Import it before any module of the
+application: it makes "lib" and the main directory importable and installs
+the localization dummies which WikidPadStarter.py normally provides.
+
+Run all tests from the main directory with
+
+    python -m unittest discover -s tests
+
+or a single test module with e.g. "python tests/test_StringOps.py".
+
+Tests needing a wiki derive from WikiTestCase or create one with
+createWiki(), it is filled with pages of the synthetic wiki generator of the
+benchmarks (benchmarks/wikigen.py). TempDirTestCase provides a temporary
+directory only. Tests needing the application object or the wiki generator
+are skipped if these are not available.
+"""
+
+import sys, os, os.path, tempfile, shutil, atexit, unittest
+
+MAIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for _path in (MAIN_DIR, os.path.join(MAIN_DIR, "lib")):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+import __builtin__
+
+# Dummies for localization
+def N_(s):
+    return s
+
+if not hasattr(__builtin__, "N_"):
+    __builtin__.N_ = N_
+if not hasattr(__builtin__, "_"):
+    __builtin__._ = N_
+
+del __builtin__
+
+
+_app = None
+_appConfigDir = None
+
+def getApp():
+    """
+    Return the HeadlessApp of the test process. It is created on first call
+    with the global configuration in a temporary directory.
+    """
+    global _app, _appConfigDir
+
+    if _app is None:
+        if not os.path.exists(os.path.join(MAIN_DIR, "lib", "pwiki",
+                "HeadlessApp.py")):
+            raise unittest.SkipTest("No application object without GUI")
+
+        from pwiki.HeadlessApp import HeadlessApp
+
+        _appConfigDir = tempfile.mkdtemp(prefix="wikidpad_test_")
+        _app = HeadlessApp(MAIN_DIR, _appConfigDir)
+        atexit.register(_closeApp)
+
+    return _app
+
+
+def _closeApp():
+    _app.close()
+    shutil.rmtree(_appConfigDir, True)
+
+
+def _importWikigen():
+    benchmarksDir = os.path.join(MAIN_DIR, "benchmarks")
+    if not os.path.exists(os.path.join(benchmarksDir, "wikigen.py")):
+        raise unittest.SkipTest("No synthetic wiki generator")
+    if benchmarksDir not in sys.path:
+        sys.path.append(benchmarksDir)
+
+    import wikigen
+    return wikigen
+
+
+def generatePages(**kwargs):
+    """
+    Return list of tuples (name, text) of a synthetic wiki, see
+    wikigen.getParams() for kwargs.
+    """
+    return _importWikigen().generatePages(**kwargs)
+
+
+def createWiki(parentDir, dbType, pages=(), wikiName=u"TestWiki"):
+    """
+    Create a wiki with database type dbType in parentDir, store pages
+    (sequence of tuples (name, text)) in it, build the meta-data and
+    return the opened WikiDataManager. Close it with closeWiki().
+    """
+    from pwiki.wikidata import WikiDataManager
+    from pwiki.HeadlessApp import StreamProgressHandler
+
+    configPath = _importWikigen().createWiki(getApp(), parentDir, wikiName,
+            dbType)
+    wikiDocument = WikiDataManager.openWikiDocument(configPath, None, None,
+            True, False)
+    wikiDocument.connect()
+
+    if pages:
+        _importWikigen().fillWiki(wikiDocument, pages)
+        wikiDocument.rebuildWiki(StreamProgressHandler(), False)
+        waitForBackgroundJobs(wikiDocument)
+
+    return wikiDocument
+
+
+def createMainControl(wikiDocument):
+    """
+    Return a HeadlessMainControl for wikiDocument, e.g. for exporters.
+    """
+    from pwiki.HeadlessApp import HeadlessMainControl
+
+    return HeadlessMainControl(getApp(), wikiDocument)
+
+
+def waitForBackgroundJobs(wikiDocument):
+    """
+    Wait until the update executor of wikiDocument processed all queued
+    jobs, it is running again afterwards.
+    """
+    from pwiki import HeadlessApp
+
+    HeadlessApp.waitForBackgroundJobs(wikiDocument, 0.02)
+    wikiDocument.getUpdateExecutor().start()
+
+
+def closeWiki(wikiDocument):
+    """
+    Wait for background jobs and release wikiDocument. Also waits for the
+    thread watching the page files, so it doesn't run at interpreter exit.
+    """
+    from pwiki import HeadlessApp
+
+    HeadlessApp.waitForBackgroundJobs(wikiDocument, 0.02)
+
+    watchService = wikiDocument.pageFileWatchService
+    watchThread = watchService and watchService.thread
+    wikiDocument.release()
+    if watchThread is not None:
+        watchThread.join()
+
+
+
+class TempDirTestCase(unittest.TestCase):
+    """
+    Test case with a temporary directory self.tempDir which is removed
+    after each test.
+    """
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp(prefix="wikidpad_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir, True)
+
+
+
+class WikiTestCase(TempDirTestCase):
+    """
+    Test case with a wiki self.wikiDocument in the temporary directory. It
+    has the database type DB_TYPE and the pages returned by getPages() and
+    is closed after each test.
+    """
+    DB_TYPE = "compact_sqlite"
+
+    def getPages(self):
+        return ()
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.wikiDocument = createWiki(self.tempDir, self.DB_TYPE,
+                self.getPages())
+
+    def tearDown(self):
+        closeWiki(self.wikiDocument)
+        TempDirTestCase.tearDown(self)